@@ -16,16 +16,24 @@ Agent 循环核心模块
 """
 
 import asyncio
-import base64
 import threading
-from typing import Callable, Optional
+import time
+from typing import Callable, Optional, Sequence
 
 from loguru import logger
 from pynput import keyboard
 
-from providers.base import LLM提供者基类, 工具调用
-from tools.screen import 截取屏幕
+from history import 对话历史管理器, 格式化工具调用
+from pipeline import 动作时钟, 观测预取
+from providers.base import LLM提供者基类, LLM响应, 工具调用
+from providers.image_cost import 分辨率策略
+from tools.encoder import 编码器表, 默认格式顺序
+from tools.image_hash import 屏幕状态索引, 汉明距离
+from tools.observation import 观测执行器, 观测结果, 全局观测执行器, 生成观测, 屏幕哈希位数
+from tools.settle import 屏幕稳定检测器
 from tools.computer import 执行鼠标操作, 执行键盘操作
+from tools.action_executor import 动作执行器, 全局动作执行器
+from tools.pacing import 操作节奏, 默认节奏, 合并分组
 
 # ============================================
 # 全局停止信号（用于紧急停止）
@@ -87,7 +95,21 @@ class AgentLoop:
         self,
         提供者: LLM提供者基类,
         广播函数: Optional[Callable] = None,
-        最大循环次数: int = 50
+        最大循环次数: int = 50,
+        观测执行器: Optional[观测执行器] = None,
+        无变化重试次数: int = 2,
+        无变化重试间隔: float = 0.3,
+        图片格式顺序: Sequence[str] = 默认格式顺序,
+        图片令牌预算: Optional[int] = None,
+        最小文字像素: Optional[float] = None,
+        历史管理器: Optional[对话历史管理器] = None,
+        流式: bool = True,
+        稳定检测器: Optional[屏幕稳定检测器] = None,
+        流水线: bool = True,
+        动作队列上限: int = 8,
+        动作执行器: Optional[动作执行器] = None,
+        节奏: Optional[操作节奏] = None,
+        合并操作: bool = True
     ):
         """
         初始化 Agent 循环
@@ -96,14 +118,62 @@ class AgentLoop:
             提供者: LLM 提供者实例（OpenAI/Gemini/Anthropic）
             广播函数: 用于向前端推送日志的函数
             最大循环次数: 防止无限循环的保护措施
+            观测执行器: 运行截图流水线的执行器，默认使用全局观测执行器
+            无变化重试次数: 操作后屏幕没有变化时，最多再观察几次才去调用 LLM
+            无变化重试间隔: 每次重新观察前等待的秒数
+            图片格式顺序: 截图编码格式的优先级（会过滤掉提供者不支持的格式）
+            图片令牌预算: 每步截图最多花多少令牌（按提供者的成本模型选择最大的分辨率）
+            最小文字像素: 截图里文字至少多高（像素），选择能看清文字的最小分辨率
+            历史管理器: 管理多轮对话历史（裁剪旧截图、限制请求大小），默认保留最近 2 张截图
+            流式: 是否使用流式响应（工具调用的参数一完整就开始执行，不等整段回复生成完）
+            稳定检测器: 操作之后等待界面画完再截图（代替固定的 0.5 秒等待）
+            流水线: 执行完操作就开始准备下一步的观测，不等 LLM 把这一步的回复说完（见 pipeline.py）
+            动作队列上限: 流式模式下等待执行的工具调用最多排几个（排满时暂停接收）
+            动作执行器: 执行键鼠操作的专用线程，默认使用全局动作执行器
+            节奏: 键鼠操作的快慢（human / default / turbo，见 tools/pacing.py），默认和以前一样
+            合并操作: 执行前把相邻的冗余操作合并成一次（移动后在同一位置点击、连续滚动等）
         """
         self.提供者 = 提供者
         self.广播 = 广播函数 or (lambda msg, typ: None)
         self.最大循环次数 = 最大循环次数
+        self.观测执行器 = 观测执行器 or 全局观测执行器
+        self.无变化重试次数 = 无变化重试次数
+        self.无变化重试间隔 = 无变化重试间隔
+        self.图片格式顺序 = tuple(
+            格式 for 格式 in 图片格式顺序
+            if 格式 in 编码器表 and 编码器表[格式].媒体类型 in 提供者.支持的媒体类型
+        ) or ("PNG",)
+        self.分辨率策略 = 分辨率策略(
+            成本模型=提供者.图片成本模型,
+            令牌预算=图片令牌预算,
+            最小文字像素=最小文字像素
+        )
         
         self.正在运行 = False
         self.当前任务: Optional[str] = None
-        self.对话历史: list = []
+        self.历史 = 历史管理器 or 对话历史管理器()
+        self.流式 = 流式
+        self.稳定检测器 = 稳定检测器 or 屏幕稳定检测器()
+        self.流水线 = 流水线
+        self.动作队列上限 = 动作队列上限
+        self.动作执行器 = 动作执行器 or 全局动作执行器
+        self.节奏 = 节奏 or 默认节奏
+        self.合并操作 = 合并操作
+        self.动作时钟 = 动作时钟()
+        self.预取 = 观测预取(self.动作时钟, self._准备下一观测)
+        self._基准任务: Optional[asyncio.Task] = None
+        self._基准帧 = None
+        self.首个动作耗时: list[float] = []  # 每步从发出请求到开始执行第一个操作的秒数
+        self.跳过调用次数 = 0  # 因为屏幕没变化而省掉的 LLM 调用次数
+        # 本次任务见过的屏幕状态；半径 8/256 位（约 3%），比 64 位哈希的 4 位（约 6%）更严格
+        self.屏幕状态 = 屏幕状态索引(哈希位数=屏幕哈希位数, 半径=8)
+        self.重复状态次数 = 0  # 回到之前见过的屏幕状态的次数
+        self._上一屏幕哈希: Optional[int] = None
+        self.令牌统计 = {"预测图片令牌": 0, "实际输入令牌": 0, "缓存读取令牌": 0, "缓存写入令牌": 0}
+        self.步骤耗时: list[float] = []      # 每一步从截图到界面稳定的总秒数
+        self.稳定等待耗时: list[float] = []  # 每一步操作之后等待界面稳定的秒数
+        self.浪费步数 = 0  # LLM 看到的屏幕和上一步操作前一样（操作没生效或截图太早）的步数
+        self.合并操作次数 = 0  # 合并掉的冗余操作个数（移动后在同一位置点击、连续滚动等）
     
     async def 执行任务(self, 用户指令: str):
         """
@@ -120,7 +190,18 @@ class AgentLoop:
         logger.info(f"开始执行任务: {用户指令}")
         
         # 初始化对话（加入用户指令）
-        self.对话历史 = [{"role": "user", "content": 用户指令}]
+        self.历史.开始(用户指令)
+        self.屏幕状态.清空()
+        self._上一屏幕哈希 = None
+        self.令牌统计 = {"预测图片令牌": 0, "实际输入令牌": 0, "缓存读取令牌": 0, "缓存写入令牌": 0}
+        self.首个动作耗时 = []
+        self.步骤耗时 = []
+        self.稳定等待耗时 = []
+        self.浪费步数 = 0
+        self.合并操作次数 = 0
+        self.预取 = 观测预取(self.动作时钟, self._准备下一观测)
+        self._基准任务 = None
+        self._基准帧 = None
         
         循环次数 = 0
         try:
@@ -131,23 +212,57 @@ class AgentLoop:
                     break
                 
                 循环次数 += 1
+                步骤开始 = time.perf_counter()
                 await self._广播("info", f"🔄 循环 {循环次数}/{self.最大循环次数}")
                 
-                # Step 1: 截图
+                # Step 1: 截图（流水线模式下多半已经在上一步准备好了）
                 await self._广播("action", "📸 正在截图...")
-                截图数据 = await self._获取截图()
-                if not 截图数据:
+                观测 = await self._取得观测(循环次数)
+                if not 观测:
                     await self._广播("error", "❌ 截图失败")
                     break
                 
+                # 检查上一步操作后屏幕有没有变化
+                附加提示 = None
+                if 循环次数 > 1 and 观测.差异 is not None:
+                    观测 = await self._等待屏幕变化(观测)
+                    if not 观测:
+                        await self._广播("error", "❌ 截图失败")
+                        break
+                    if 观测.差异.无变化:
+                        self.浪费步数 += 1
+                        await self._广播("warning", "⏸️ 操作后屏幕没有可见变化")
+                        附加提示 = "注意：上一步操作之后屏幕没有任何可见变化，操作可能没有生效。"
+                    else:
+                        await self._广播("info", f"🔍 屏幕{观测.差异.摘要()}")
+                
+                # 检查是否回到了之前见过的屏幕状态（可能在原地绕圈）
+                重复步骤 = self._记录屏幕状态(观测, 循环次数)
+                if 重复步骤 is not None:
+                    await self._广播("warning", f"🔁 当前屏幕和第 {重复步骤} 步几乎相同")
+                    附加提示 = "\n".join(filter(None, [
+                        附加提示,
+                        f"注意：当前屏幕和第 {重复步骤} 步时几乎相同，之前的操作可能在原地绕圈，请换一种方法。"
+                    ]))
+                
+                # 记下操作之前的画面（低分辨率），操作之后用来判断界面有没有响应；
+                # 和 LLM 调用同时进行，第一个操作执行前取结果
+                self._基准任务 = asyncio.create_task(asyncio.to_thread(self.稳定检测器.采样))
+                
                 # Step 2: 发送给 LLM
+                # 流式模式下，工具调用在生成过程中就已经开始执行（Step 4 提前进行）
                 await self._广播("action", "🤔 正在思考...")
-                响应 = await self._调用LLM(截图数据)
+                if self.流式:
+                    响应, 已执行调用, 执行结果列表 = await self._流式调用LLM(循环次数, 观测, 附加提示)
+                else:
+                    响应, 已执行调用, 执行结果列表 = await self._调用LLM(观测, 附加提示), [], None
                 
                 if not 响应:
                     await self._广播("error", "❌ LLM 调用失败")
                     break
                 
+                self._记录令牌用量(循环次数, 观测, 响应)
+                
                 # Step 3: 处理 LLM 响应
                 if 响应.文本内容:
                     await self._广播("info", f"💬 AI: {响应.文本内容}")
@@ -159,16 +274,22 @@ class AgentLoop:
                     break
                 
                 # Step 4: 执行工具调用
-                for 工具调用 in 响应.工具调用列表:
-                    if 全局停止信号.is_set():
-                        break
-                    
-                    结果 = await self._执行工具(工具调用)
-                    await self._广播("action", f"🔧 执行: {工具调用.工具名称} → {结果}")
+                if 执行结果列表 is None:
+                    执行结果列表 = []
+                    for 工具调用, 来源 in self._合并(响应.工具调用列表):
+                        if 全局停止信号.is_set():
+                            break
+                        已执行调用.append(工具调用)
+                        执行结果列表.append(await self._执行并广播(工具调用, 来源))
+                
+                # 开始准备下一步的观测（流式模式下执行阶段一空闲就已经开始了）
+                self._启动预取(循环次数)
                 
-                # 给系统一点喘息时间
-                await asyncio.sleep(0.5)
+                # 把这一步写入对话历史（旧截图会在构建请求时被裁剪）
+                self._记录步骤(循环次数, 观测, 响应, 已执行调用, 执行结果列表)
+                self.步骤耗时.append(time.perf_counter() - 步骤开始)
             
+            self._报告步骤统计()
             if 循环次数 >= self.最大循环次数:
                 await self._广播("warning", f"⚠️ 达到最大循环次数 ({self.最大循环次数})")
         
@@ -177,49 +298,241 @@ class AgentLoop:
             logger.exception("Agent 执行出错")
         
         finally:
+            await self.预取.关闭()
             self.正在运行 = False
             self.当前任务 = None
             # 发送状态更新，告诉前端已停止
             await self._广播("status", {"is_running": False})
             logger.info("任务执行结束")
     
-    async def _获取截图(self) -> Optional[str]:
+    async def _获取截图(self) -> Optional[观测结果]:
         """
-        截取当前屏幕，返回 Base64 编码的图片数据
+        截取当前屏幕，返回观测结果（Base64 图片 + 和上一帧的差异）
+
+        截图、差异检测、缩放和编码都在观测执行器里完成，不会阻塞事件循环。
         """
         try:
-            # 截图（返回 PIL Image）
-            # 使用新优化的截图函数，启用缓存和快速缩放
-            图片 = 截取屏幕(
-                最大宽度=1024,        # 为LLM优化的尺寸
-                最大高度=1024,
-                使用缓存=True,         # 启用缓存以避免频繁截图
-                快速缩放=True          # 快速缩放以提高性能
+            结果 = await self.观测执行器.提交(
+                生成观测,
+                1024,   # 最大宽度：为LLM优化的尺寸
+                1024,   # 最大高度
+                True,   # 快速缩放：提高性能
+                True,   # 检测变化：和上一帧做瓦片对比
+                self.提供者.图片字节预算,
+                self.图片格式顺序,
+                self.分辨率策略  # 按提供者的图片成本模型选择分辨率
             )
 
-            if not 图片:
+            if not 结果:
                 return None
 
-            # 转换为 Base64
-            import io
-            缓冲区 = io.BytesIO()
-            图片.save(缓冲区, format="PNG")
-            base64数据 = base64.b64encode(缓冲区.getvalue()).decode("utf-8")
-
-            return base64数据
+            logger.debug(
+                f"📸 观测完成: {结果.宽}x{结果.高} {结果.媒体类型}，"
+                f"{len(结果.base64数据) / 1024:.0f}KB，耗时 {结果.耗时 * 1000:.0f}ms"
+            )
+            return 结果
 
         except Exception as e:
             logger.error(f"截图失败: {e}")
             return None
     
-    async def _调用LLM(self, 截图base64: str):
+    async def _等待屏幕变化(self, 观测: 观测结果) -> Optional[观测结果]:
+        """
+        屏幕没有变化时稍等片刻再观察
+
+        界面还没来得及响应时，把同样的画面再发给 LLM 只会浪费一次调用。
+        最多重试 `无变化重试次数` 次；仍然没有变化就原样返回最后一次观测。
+        """
+        for _ in range(self.无变化重试次数):
+            if 观测.差异 is None or not 观测.差异.无变化 or 全局停止信号.is_set():
+                break
+            
+            self.跳过调用次数 += 1
+            await asyncio.sleep(self.无变化重试间隔)
+            观测 = await self._获取截图()
+            if not 观测:
+                return None
+        
+        return 观测
+    
+    async def _取得观测(self, 循环次数: int) -> Optional[观测结果]:
+        """
+        取这一步的观测：预取的观测还新鲜就直接用，否则等界面稳定后现在截图
+
+        作废的预取观测也推进过差异检测器的"上一帧"，
+        把它们的差异合并进来，"有没有变化"仍然是相对于 LLM 上一次看到的画面。
+        """
+        预取结果 = await self.预取.取用()
+        过期观测 = [观测 for 观测, _ in await self.预取.取出过期结果()]
+        
+        if 预取结果 is not None:
+            观测, 等待 = 预取结果
+            self.稳定等待耗时.append(等待)
+        else:
+            if 循环次数 > 1:
+                self.稳定等待耗时.append(await self._等待界面稳定(循环次数, 全局停止信号))
+            观测 = await self._获取截图()
+        
+        if 观测 is not None and 观测.差异 is not None:
+            for 旧观测 in reversed(过期观测):
+                if 旧观测.差异 is not None:
+                    观测.差异 = 旧观测.差异.合并(观测.差异)
+        return 观测
+    
+    def _启动预取(self, 循环次数: int):
+        """执行阶段空闲时开始准备下一步的观测（最后一步和停止之后不再准备）"""
+        if self.流水线 and 循环次数 < self.最大循环次数 and not 全局停止信号.is_set():
+            self.预取.启动()
+    
+    async def _准备下一观测(self, 作废信号: threading.Event):
+        """预取的内容：等界面稳定 → 截图编码。返回 (观测, 等待秒数)，作废或截图失败时返回 None"""
+        等待 = await self._等待界面稳定(None, 作废信号)
+        if 作废信号.is_set():
+            return None
+        观测 = await self._获取截图()
+        return (观测, 等待) if 观测 is not None else None
+    
+    async def _取基准帧(self):
+        """等操作前的基准帧采样完成（第一个操作执行前调用）"""
+        if self._基准任务 is not None:
+            任务, self._基准任务 = self._基准任务, None
+            self._基准帧 = await 任务
+        return self._基准帧
+    
+    async def _等待界面稳定(self, 循环次数: Optional[int], 停止信号: threading.Event) -> float:
+        """
+        操作之后等待界面稳定：快的界面几十毫秒就继续，慢的界面（启动应用、加载网页）多等一会儿
+
+        采样失败（例如没有可用的显示服务）时退回到固定等待。返回等待的秒数。
+        """
+        基准帧 = await self._取基准帧()
+        结果 = await asyncio.to_thread(self.稳定检测器.等待稳定, 基准帧, 停止信号)
+        if 结果.采样次数 == 0:
+            await asyncio.sleep(self.稳定检测器.等待变化超时)
+            return self.稳定检测器.等待变化超时
+        
+        状态 = "已稳定" if 结果.稳定 else "仍在变化"
+        logger.debug(
+            f"⏱️ {'预取：' if 循环次数 is None else f'第 {循环次数} 步'}操作后等待 {结果.耗时 * 1000:.0f}ms"
+            f"（{结果.采样次数} 次采样，{'有' if 结果.有变化 else '无'}变化，{状态}）"
+        )
+        return 结果.耗时
+    
+    def 获取步骤统计(self) -> dict:
+        """本次任务每一步的耗时和浪费步骤比例"""
+        步数 = len(self.步骤耗时)
+        等待 = self.稳定等待耗时
+        return {
+            "步数": 步数,
+            "平均步骤耗时": round(sum(self.步骤耗时) / 步数, 3) if 步数 else 0.0,
+            "平均稳定等待": round(sum(等待) / len(等待), 3) if 等待 else 0.0,
+            "浪费步数": self.浪费步数,
+            "浪费步骤比例": round(self.浪费步数 / 步数, 3) if 步数 else 0.0,
+            "合并操作次数": self.合并操作次数,
+            **{f"预取{键}": 值 for 键, 值 in self.预取.获取统计().items()}
+        }
+    
+    def _报告步骤统计(self):
+        统计 = self.获取步骤统计()
+        if 统计["步数"]:
+            logger.info(
+                f"📈 共 {统计['步数']} 步，平均每步 {统计['平均步骤耗时']:.2f}s"
+                f"（其中等待界面稳定 {统计['平均稳定等待']:.2f}s），"
+                f"浪费步数 {统计['浪费步数']}（{统计['浪费步骤比例']:.0%}）"
+            )
+    
+    def _记录屏幕状态(self, 观测: 观测结果, 循环次数: int) -> Optional[int]:
+        """
+        把本步的屏幕哈希加入索引，返回之前见过的相同状态所在的步骤
+
+        只有屏幕先明显变化、又变回之前的样子才算"回到旧状态"；
+        和上一步几乎一样（比如只是输入框多了几个字）不算。
+        """
+        哈希 = 观测.屏幕哈希
+        if 哈希 is None:
+            return None
+        
+        重复步骤 = None
+        if self._上一屏幕哈希 is None or 汉明距离(哈希, self._上一屏幕哈希) > self.屏幕状态.半径:
+            命中 = self.屏幕状态.最近(哈希)
+            if 命中:
+                重复步骤 = min(命中[2])
+                self.重复状态次数 += 1
+        
+        self.屏幕状态.添加(哈希, 循环次数)
+        self._上一屏幕哈希 = 哈希
+        return 重复步骤
+    
+    @property
+    def 对话历史(self) -> list[dict]:
+        """发给 LLM 的对话历史（已裁剪）"""
+        return self.历史.构建消息()
+    
+    def _记录步骤(
+        self,
+        循环次数: int,
+        观测: 观测结果,
+        响应: LLM响应,
+        已执行调用: Sequence[工具调用],
+        执行结果列表: list[str]
+    ):
+        """
+        把一步的截图、AI 回复（工具调用写成文字）和执行结果记入历史
+
+        AI 回复保留 LLM 原本发出的工具调用；动作摘要和执行结果按实际执行的（合并后的）操作记录，
+        两者一一对应，合并过的操作在执行结果里注明由哪几个调用合并而来。
+        """
+        回复 = "\n".join(filter(None, [
+            响应.文本内容,
+            *(f"[调用工具] {格式化工具调用(调用.工具名称, 调用.参数)}" for 调用 in 响应.工具调用列表)
+        ]))
+        动作列表 = [格式化工具调用(调用.工具名称, 调用.参数) for 调用 in 已执行调用]
+        self.历史.记录步骤(
+            步数=循环次数,
+            屏幕摘要=观测.差异.摘要() if 观测.差异 is not None else "未检测",
+            截图base64=观测.base64数据,
+            媒体类型=观测.媒体类型,
+            回复=回复,
+            动作摘要="；".join(动作列表) or "无",
+            执行结果="\n".join(执行结果列表) or "（已停止，未执行）",
+            图片令牌数=观测.预测令牌数
+        )
+    
+    def _记录令牌用量(self, 循环次数: int, 观测: 观测结果, 响应):
+        """记录这一步预测的图片令牌数和 API 报告的输入令牌数"""
+        if 观测.预测令牌数 is not None:
+            self.令牌统计["预测图片令牌"] += 观测.预测令牌数
+        用量 = 响应.用量 or {}
+        for 键 in ("缓存读取令牌", "缓存写入令牌"):
+            self.令牌统计[键] += 用量.get(键, 0)
+        if 用量:
+            self.令牌统计["实际输入令牌"] += 用量["输入令牌"]
+
+        实际 = 用量.get("输入令牌", "未知")
+        缓存 = f"，命中缓存 {用量['缓存读取令牌']}" if "缓存读取令牌" in 用量 else ""
+        if 用量.get("缓存写入令牌"):
+            缓存 += f"，写入缓存 {用量['缓存写入令牌']}"
+        logger.info(
+            f"🧮 第 {循环次数} 步令牌: 截图 {观测.宽}x{观测.高} 预测 {观测.预测令牌数}，"
+            f"实际输入 {实际}（含文字和历史）{缓存}"
+        )
+    
+    async def _调用LLM(self, 观测: 观测结果, 附加提示: Optional[str] = None):
         """
         调用 LLM 提供者，传入截图和对话历史
+        
+        附加提示只在这一次调用中追加到历史末尾，不会写入对话历史。
         """
         try:
+            # 当前截图另外附带，但要和历史一起算进字节 / 令牌上限
+            对话历史 = self.历史.构建消息(观测.base64数据, 观测.预测令牌数)
+            if 附加提示:
+                对话历史 = 对话历史 + [{"role": "user", "content": 附加提示}]
+            
             响应 = await self.提供者.发送消息(
-                对话历史=self.对话历史,
-                截图base64=截图base64
+                对话历史=对话历史,
+                截图base64=观测.base64数据,
+                截图媒体类型=观测.媒体类型
             )
             return 响应
         
@@ -227,19 +540,145 @@ class AgentLoop:
             logger.error(f"LLM 调用失败: {e}")
             return None
     
+    async def _流式调用LLM(
+        self,
+        循环次数: int,
+        观测: 观测结果,
+        附加提示: Optional[str] = None
+    ) -> tuple[Optional[LLM响应], list[工具调用], list[str]]:
+        """
+        以流式方式调用 LLM，每个工具调用的参数一完整就立刻执行
+
+        工具调用按到达顺序在一个单独的任务里依次执行，和接收剩余的回复同时进行。
+
+        返回:
+            (完整响应, 实际执行的（合并后的）工具调用, 执行结果列表)；调用失败时响应为 None
+        """
+        # 思考阶段 → 执行阶段的有界队列：执行跟不上时暂停接收，不会无限堆积
+        待执行: asyncio.Queue = asyncio.Queue(maxsize=self.动作队列上限)
+        已执行调用: list[工具调用] = []
+        执行结果列表: list[str] = []
+        开始时间 = time.perf_counter()
+        
+        async def 依次执行():
+            挂起: list[工具调用] = []   # 暂缓执行的鼠标移动（原始调用）
+            结束 = False
+            while not 结束:
+                # 执行上一批期间到达的工具调用一起取出，合并后再执行
+                批次 = 挂起 + [await 待执行.get()]
+                while not 待执行.empty():
+                    批次.append(待执行.get_nowait())
+                if None in 批次:
+                    结束 = True
+                    批次 = 批次[:批次.index(None)]
+                分组 = self._合并(批次)
+                # 最后一个是鼠标移动时先不执行：后面多半紧跟着同一位置的点击
+                挂起 = 分组.pop()[1] if not 结束 and 分组 and 分组[-1][0].工具名称.lower() == "mouse_move" else []
+                
+                for 调用, 来源 in 分组:
+                    if 全局停止信号.is_set():
+                        break
+                    if len(执行结果列表) == 0:
+                        耗时 = time.perf_counter() - 开始时间
+                        self.首个动作耗时.append(耗时)
+                        logger.info(f"⚡ 第 {循环次数} 步首个操作在 {耗时 * 1000:.0f}ms 时开始执行")
+                    已执行调用.append(调用)
+                    执行结果列表.append(await self._执行并广播(调用, 来源))
+                if not 结束 and not 挂起 and 待执行.empty():
+                    # 执行阶段空下来了：LLM 可能还在输出，先开始准备下一步的观测
+                    self._启动预取(循环次数)
+        
+        执行任务 = asyncio.create_task(依次执行())
+        
+        async def 放入(项) -> bool:
+            """放进队列；执行任务已经结束（出错）时放弃——没人取的队列满了会一直等下去"""
+            if 执行任务.done():
+                return False
+            放入任务 = asyncio.ensure_future(待执行.put(项))
+            await asyncio.wait({放入任务, 执行任务}, return_when=asyncio.FIRST_COMPLETED)
+            if not 放入任务.done():
+                放入任务.cancel()
+                return False
+            return True
+        
+        响应: Optional[LLM响应] = None
+        try:
+            # 当前截图另外附带，但要和历史一起算进字节 / 令牌上限
+            对话历史 = self.历史.构建消息(观测.base64数据, 观测.预测令牌数)
+            if 附加提示:
+                对话历史 = 对话历史 + [{"role": "user", "content": 附加提示}]
+            
+            async for 事件 in self.提供者.流式发送消息(
+                对话历史=对话历史,
+                截图base64=观测.base64数据,
+                截图媒体类型=观测.媒体类型
+            ):
+                if 事件.类型 == "工具调用":
+                    await 放入(事件.工具调用)
+                elif 事件.类型 == "完成":
+                    响应 = 事件.响应
+        
+        except Exception as e:
+            logger.error(f"LLM 调用失败: {e}")
+        
+        finally:
+            # 等已经收到的工具调用执行完；执行出错时记下错误，这一步照常结束
+            await 放入(None)
+            try:
+                await 执行任务
+            except Exception as e:
+                logger.opt(exception=e).error(f"第 {循环次数} 步执行工具调用时出错: {e}")
+                执行结果列表.append(f"执行失败: {e}")
+        
+        logger.debug(f"💬 第 {循环次数} 步生成完成，用时 {(time.perf_counter() - 开始时间) * 1000:.0f}ms")
+        return 响应, 已执行调用, 执行结果列表
+    
+    def _合并(self, 调用列表: Sequence[工具调用]) -> list[tuple[工具调用, list[工具调用]]]:
+        """执行前合并相邻的冗余操作（见 tools/pacing.py），返回 [(要执行的调用, 合并前的原始调用), ...]"""
+        if not self.合并操作:
+            return [(调用, [调用]) for 调用 in 调用列表]
+        分组 = 合并分组(调用列表)
+        if len(分组) < len(调用列表):
+            self.合并操作次数 += len(调用列表) - len(分组)
+            logger.debug(f"🔗 {len(调用列表)} 个操作合并成 {len(分组)} 个")
+        return 分组
+    
+    async def _执行并广播(self, 工具调用: 工具调用, 来源: Optional[Sequence[工具调用]] = None) -> str:
+        """
+        执行一个工具调用并广播结果，返回写入历史的一行记录
+
+        参数:
+            来源: 合并成这个调用的原始调用（多于一个时在记录里注明）
+        """
+        await self._取基准帧()
+        # 新鲜度守卫：操作一开始，之前预取的观测就过期了
+        self.预取.作废()
+        self.动作时钟.开始动作()
+        try:
+            结果 = await self._执行工具(工具调用)
+        finally:
+            self.动作时钟.结束动作()
+        await self._广播("action", f"🔧 执行: {工具调用.工具名称} → {结果}")
+        if 来源 is not None and len(来源) > 1:
+            return f"{工具调用.工具名称}（由 {' + '.join(调用.工具名称 for 调用 in 来源)} 合并） → {结果}"
+        return f"{工具调用.工具名称} → {结果}"
+    
     async def _执行工具(self, 工具: 工具调用) -> str:
         """
         根据工具调用执行对应的操作
+
+        键鼠操作在动作执行器的线程里运行，不阻塞事件循环；
+        停止信号传给操作本身，长时间的输入可以在中途被 /api/stop 打断。
         """
         工具名 = 工具.工具名称.lower()
         参数 = 工具.参数
         
         try:
             if 工具名 in ["mouse_move", "left_click", "right_click", "double_click", "scroll"]:
-                return 执行鼠标操作(工具名, 参数)
+                return await self.动作执行器.执行(执行鼠标操作, 工具名, 参数, 全局停止信号, self.节奏)
             
             elif 工具名 in ["type", "key", "hotkey"]:
-                return 执行键盘操作(工具名, 参数)
+                return await self.动作执行器.执行(执行键盘操作, 工具名, 参数, 全局停止信号, self.节奏)
             
             else:
                 return f"未知工具: {工具名}"
@@ -0,0 +1,290 @@
+"""
+============================================
+对话历史管理器
+============================================
+这个文件负责管理 Agent 的多轮对话历史。
+
+Agent 每走一步，历史里就多一张截图（Base64 之后几百 KB、上千令牌）。
+如果原样保留，第 50 步的请求会比第 5 步大 10 倍，又慢又贵。
+
+这里的做法（类比：相册只保留最近几张照片，旧照片换成一行文字说明）：
+1. 只保留最近 N 步的截图，更早的截图换成文字占位符（第几步、做了什么、屏幕哪里变了）
+2. 只保留最近几步的完整对话，更早的步骤压缩成一行一步的摘要
+3. 整个请求（历史 + 本次附带的当前截图）超过字节/令牌上限时，继续丢掉最旧的截图和步骤，直到放得下
+
+这样第 50 步和第 5 步的请求大小基本相同。
+
+消息格式（各 Provider 自己负责转换）：
+    {"role": "user" / "assistant", "content": "文字"}
+    {"role": "user", "content": [文本部分("..."), 图片部分(base64, "image/png")]}
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from loguru import logger
+
+
+# 没有预测令牌数时，按一张截图大约 1600 令牌估算（各家 Provider 缩放后的上限附近）
+_未知图片令牌 = 1600
+
+# 默认上限：令牌按最小的常见上下文窗口（128k）留出系统提示词、工具定义和回复的余量；
+# 字节远低于各家的请求体上限（Anthropic 32MB），也避免单次上传过大拖慢首个令牌
+默认字节上限 = 8 * 1024 * 1024
+默认令牌上限 = 100_000
+
+
+def 文本部分(文本: str) -> dict:
+    """消息内容里的一段文字"""
+    return {"type": "text", "text": 文本}
+
+
+def 图片部分(base64数据: str, 媒体类型: str = "image/png") -> dict:
+    """消息内容里的一张图片（Base64）"""
+    return {"type": "image", "data": base64数据, "media_type": 媒体类型}
+
+
+def 格式化工具调用(工具名称: str, 参数: dict[str, Any]) -> str:
+    """把工具调用写成一行文字，如 left_click(x=500, y=300)"""
+    参数文本 = ", ".join(f"{键}={值!r}" for 键, 值 in 参数.items())
+    return f"{工具名称}({参数文本})"
+
+
+@dataclass
+class 历史步骤:
+    """一步操作的记录：看到的屏幕、AI 的回复和执行结果"""
+    步数: int
+    屏幕摘要: str                     # 和上一步相比屏幕哪里变了
+    回复: str                         # AI 的文字回复 + 工具调用
+    动作摘要: str                     # 本步执行的操作（一行）
+    执行结果: str
+    图片: Optional[dict] = None       # 图片部分（可能被省略）
+    图片令牌数: Optional[int] = None  # 按成本模型预测的图片令牌数
+    # 带图 / 不带图 → 这一步的三条消息。每次构建历史都复用同一组对象，
+    # Provider 可以按对象缓存转换结果（见 providers/templates.py）
+    _消息: dict = field(default_factory=dict, repr=False, compare=False)
+
+    def 消息(self, 带图: bool) -> tuple[dict, dict, dict]:
+        """这一步在历史里的三条消息：屏幕、AI 回复、执行结果（不要原地修改）"""
+        已有 = self._消息.get(带图)
+        if 已有 is None:
+            if 带图:
+                内容: Any = [文本部分(f"第 {self.步数} 步的屏幕（{self.屏幕摘要}）"), self.图片]
+            else:
+                内容 = self.占位符()
+            # AI 回复和执行结果两种情况共用同一组对象，截图被省略时只有屏幕消息换新
+            另一组 = self._消息.get(not 带图)
+            已有 = ({"role": "user", "content": 内容}, *(另一组[1:] if 另一组 else (
+                {"role": "assistant", "content": self.回复},
+                {"role": "user", "content": f"[执行结果]\n{self.执行结果}"},
+            )))
+            self._消息[带图] = 已有
+        return 已有
+
+    def 占位符(self) -> str:
+        """截图被省略后的文字说明"""
+        return f"[第 {self.步数} 步截图已省略] 屏幕: {self.屏幕摘要}；随后操作: {self.动作摘要}"
+
+    def 摘要行(self) -> str:
+        """整步被压缩后的一行摘要"""
+        return f"第 {self.步数} 步: {self.动作摘要}（屏幕: {self.屏幕摘要}）"
+
+
+class 对话历史管理器:
+    """
+    管理 Agent 的对话历史，并在每次请求前裁剪
+
+    用法：
+        历史 = 对话历史管理器(保留图片数=2)
+        历史.开始("帮我打开计算器")
+        历史.记录步骤(1, 屏幕摘要, 截图base64, 媒体类型, 回复, 动作摘要, 执行结果)
+        消息 = 历史.构建消息()   # 发给 Provider 的对话历史
+    """
+
+    def __init__(
+        self,
+        保留图片数: int = 2,
+        保留步骤数: int = 8,
+        最多摘要步骤: int = 30,
+        摘要步长: int = 4,
+        字节上限: Optional[int] = 默认字节上限,
+        令牌上限: Optional[int] = 默认令牌上限
+    ):
+        """
+        参数:
+            保留图片数: 历史里最多保留几张截图（不含本次请求附带的当前截图）
+            保留步骤数: 最近几步保留完整对话，更早的步骤压缩成摘要
+            最多摘要步骤: 摘要里最多列出几步，更早的只记一个数量
+            摘要步长: 旧步骤每攒够几步才一起压缩进摘要。摘要消息排在历史前面，
+                它一变，后面的消息就都命中不了提示词缓存（见 providers/prompt_cache.py）；
+                攒几步再压缩，摘要就不会每一步都变。代价是完整对话最多会多保留 摘要步长-1 步
+            字节上限: 整个请求（历史文字 + Base64 图片 + 当前截图）的字节数上限，None 表示不限制
+            令牌上限: 整个请求的估算令牌数上限（同样包括当前截图），None 表示不限制
+        """
+        if 保留图片数 < 0 or 保留步骤数 < 0:
+            raise ValueError("保留图片数和保留步骤数不能为负数")
+        if 摘要步长 < 1:
+            raise ValueError("摘要步长必须 >= 1")
+
+        self.保留图片数 = 保留图片数
+        self.保留步骤数 = 保留步骤数
+        self.最多摘要步骤 = 最多摘要步骤
+        self.摘要步长 = 摘要步长
+        self.字节上限 = 字节上限
+        self.令牌上限 = 令牌上限
+
+        self.用户指令 = ""
+        self.步骤列表: list[历史步骤] = []
+        # 指令和摘要消息也尽量复用同一个对象（内容变了才换新的）
+        self._指令消息 = {"role": "user", "content": ""}
+        self._摘要消息: Optional[dict] = None
+
+    def 开始(self, 用户指令: str):
+        """开始一个新任务（清空之前的历史）"""
+        self.用户指令 = 用户指令
+        self.步骤列表 = []
+        self._摘要消息 = None
+
+    def 记录步骤(
+        self,
+        步数: int,
+        屏幕摘要: str,
+        截图base64: Optional[str],
+        媒体类型: str,
+        回复: str,
+        动作摘要: str,
+        执行结果: str,
+        图片令牌数: Optional[int] = None
+    ):
+        """记录完成的一步（截图、AI 回复、执行结果）"""
+        self.步骤列表.append(历史步骤(
+            步数=步数,
+            屏幕摘要=屏幕摘要,
+            回复=回复,
+            动作摘要=动作摘要,
+            执行结果=执行结果,
+            图片=图片部分(截图base64, 媒体类型) if 截图base64 else None,
+            图片令牌数=图片令牌数
+        ))
+
+    # ============================================
+    # 构建请求
+    # ============================================
+
+    def 构建消息(
+        self,
+        当前截图base64: Optional[str] = None,
+        当前图片令牌数: Optional[int] = None
+    ) -> list[dict]:
+        """
+        生成发给 Provider 的对话历史（已经按图片数、步骤数和上限裁剪）
+
+        参数:
+            当前截图base64: 本次请求另外附带的当前截图，它不在返回的历史里，但要算进上限
+            当前图片令牌数: 当前截图按成本模型预测的令牌数（None 时按估算值）
+        """
+        图片数 = self.保留图片数
+        步骤数 = self.保留步骤数
+        消息 = self._组装(图片数, 步骤数)
+        当前字节, 当前令牌 = 0, 0
+        if 当前截图base64:
+            当前字节 = len(当前截图base64)
+            当前令牌 = 当前图片令牌数 or _未知图片令牌
+
+        # 超过上限：先丢最旧的截图，再把最旧的完整步骤压缩成摘要
+        while self._超出上限(消息, 当前字节, 当前令牌) and (图片数 > 0 or 步骤数 > 0):
+            if 图片数 > 0:
+                图片数 -= 1
+            else:
+                步骤数 -= 1
+            消息 = self._组装(图片数, 步骤数)
+
+        if 图片数 < self.保留图片数 or 步骤数 < self.保留步骤数:
+            logger.debug(
+                f"✂️ 对话历史超出上限，裁剪为 {图片数} 张截图 / "
+                f"{min(步骤数, len(self.步骤列表))} 步完整对话"
+            )
+        return 消息
+
+    def _组装(self, 图片数: int, 步骤数: int) -> list[dict]:
+        if self._指令消息["content"] != self.用户指令:
+            self._指令消息 = {"role": "user", "content": self.用户指令}
+        消息: list[dict] = [self._指令消息]
+
+        # 超出的步骤按 摘要步长 整批压缩（向下取整：完整对话至少保留 步骤数 步）；
+        # 超出字节 / 令牌上限、正在逐步裁剪时不取整
+        超出 = max(0, len(self.步骤列表) - 步骤数)
+        分界 = 超出 - 超出 % self.摘要步长 if 步骤数 == self.保留步骤数 else 超出
+        旧步骤, 近期步骤 = self.步骤列表[:分界], self.步骤列表[分界:]
+
+        if 旧步骤:
+            列出 = 旧步骤[-self.最多摘要步骤:] if self.最多摘要步骤 > 0 else []
+            行 = [步骤.摘要行() for 步骤 in 列出]
+            if len(旧步骤) > len(列出):
+                行.insert(0, f"（更早的 {len(旧步骤) - len(列出)} 步已省略）")
+            摘要 = "之前的步骤摘要：\n" + "\n".join(行)
+            if self._摘要消息 is None or self._摘要消息["content"] != 摘要:
+                self._摘要消息 = {"role": "user", "content": 摘要}
+            消息.append(self._摘要消息)
+
+        # 只有最近的几步保留截图
+        带图步骤 = {
+            id(步骤) for 步骤 in [步骤 for 步骤 in 近期步骤 if 步骤.图片][-图片数:]
+        } if 图片数 > 0 else set()
+
+        for 步骤 in 近期步骤:
+            消息.extend(步骤.消息(id(步骤) in 带图步骤))
+
+        return 消息
+
+    # ============================================
+    # 大小估算
+    # ============================================
+
+    def _超出上限(self, 消息: list[dict], 额外字节: int = 0, 额外令牌: int = 0) -> bool:
+        if self.字节上限 is not None and 估算字节数(消息) + 额外字节 > self.字节上限:
+            return True
+        if self.令牌上限 is not None and self._估算令牌数(消息) + 额外令牌 > self.令牌上限:
+            return True
+        return False
+
+    def _估算令牌数(self, 消息: list[dict]) -> int:
+        图片令牌 = {id(步骤.图片): 步骤.图片令牌数 for 步骤 in self.步骤列表 if 步骤.图片}
+        return 估算令牌数(消息, 图片令牌)
+
+
+def 估算字节数(消息: list[dict]) -> int:
+    """估算一组消息的请求体大小（文字按 UTF-8，图片按 Base64 长度）"""
+    总数 = 0
+    for 单条 in 消息:
+        for 部分 in 展开内容(单条["content"]):
+            if 部分["type"] == "image":
+                总数 += len(部分["data"])
+            else:
+                总数 += len(部分["text"].encode("utf-8"))
+    return 总数
+
+
+def 估算令牌数(消息: list[dict], 图片令牌: Optional[dict[int, Optional[int]]] = None) -> int:
+    """
+    粗略估算一组消息的令牌数
+
+    文字按一个字符一个令牌估算（中文接近，英文偏高，宁可高估）；
+    图片优先用成本模型预测的令牌数。
+    """
+    图片令牌 = 图片令牌 or {}
+    总数 = 0
+    for 单条 in 消息:
+        for 部分 in 展开内容(单条["content"]):
+            if 部分["type"] == "image":
+                总数 += 图片令牌.get(id(部分)) or _未知图片令牌
+            else:
+                总数 += len(部分["text"])
+    return 总数
+
+
+def 展开内容(内容: Any) -> list[dict]:
+    """把消息内容统一成部分列表（纯文字消息变成一个文本部分）"""
+    if isinstance(内容, str):
+        return [文本部分(内容)]
+    return list(内容)
@@ -14,6 +14,8 @@ openCowork 后端主入口
 """
 
 import asyncio
+import gc
+import os
 from contextlib import asynccontextmanager
 from typing import Optional
 from datetime import datetime
@@ -25,10 +27,13 @@ from loguru import logger
 
 # 导入我们自己的模块
 from agent_loop import AgentLoop, 全局停止信号
-from providers.openai_provider import OpenAI提供者
-from providers.gemini_provider import Gemini提供者
-from providers.anthropic_provider import Anthropic提供者
+from providers.registry import 全局提供者注册表
 from security import 全局安全配置, 验证提供者名称
+from tools.encode_pool import 共享内存编码池
+from tools.observation import 全局观测执行器
+from tools.action_executor import 全局动作执行器
+from tools.pacing import 获取节奏
+from tools.screen import 设置编码后端
 
 # ============================================
 # 数据模型（用于定义 API 请求/响应的格式）
@@ -37,8 +42,8 @@ from security import 全局安全配置, 验证提供者名称
 class 配置请求(BaseModel):
     """
     用户在前端填写的配置信息。
-    provider: 选择的 LLM 提供商 ("openai" / "gemini" / "anthropic")
-    api_key:  对应的 API 密钥
+    provider: 选择的 LLM 提供商 ("openai" / "gemini" / "anthropic" / "local")
+    api_key:  对应的 API 密钥（local 一般不校验，随便填；地址和模型见环境变量 LOCAL_LLM_*）
     """
     provider: str
     api_key: str
@@ -47,8 +52,17 @@ class 聊天请求(BaseModel):
     """
     用户发送的聊天消息。
     message: 用户输入的文字指令，比如 "帮我打开计算器"
+    image_token_budget: 可选，每步截图最多花多少令牌（自动选择分辨率）
+    min_text_px: 可选，截图里文字至少多高（像素），选择能看清文字的最小分辨率
+    routing: 可选，在多个 Provider 之间路由的策略（fastest / cheapest / sticky），
+             除了已配置的 Provider，还会用上环境变量里的 OPENAI_API_KEY / GEMINI_API_KEY / ANTHROPIC_API_KEY
+    pacing: 可选，键鼠操作的节奏（human / default / turbo），默认 default
     """
     message: str
+    image_token_budget: Optional[int] = None
+    min_text_px: Optional[float] = None
+    routing: Optional[str] = None
+    pacing: Optional[str] = None
 
 class 状态响应(BaseModel):
     """
@@ -76,14 +90,45 @@ websocket连接池: list[WebSocket] = []
 async def 生命周期(app: FastAPI):
     """
     应用启动和关闭时的钩子。
-    - 启动时：输出欢迎日志
-    - 关闭时：清理资源
+    - 启动时：输出欢迎日志；设置了 ENCODE_WORKERS 时启动截图编码进程池
+    - 关闭时：清理资源（包括注册表里缓存的 Provider 客户端）
     """
     logger.info("🚀 openCowork 后端启动中...")
+
+    编码池: Optional[共享内存编码池] = None
+    编码进程数 = int(os.environ.get("ENCODE_WORKERS", "0"))
+    if 编码进程数 > 0:
+        if 全局观测执行器.模式 == "thread":
+            编码池 = 共享内存编码池(工作进程数=编码进程数)
+            设置编码后端(编码池)
+        else:
+            # 观测本身已经在子进程里运行，不再嵌套一层进程池
+            logger.warning("⚠️ 观测执行器为进程模式，忽略 ENCODE_WORKERS")
+
+    # 启动时导入的模块和 SDK 有二十多万个 GC 跟踪的对象，一次全量（第 2 代）回收要扫描全部，
+    # 约 170ms，而且是在事件循环线程里同步执行的（触发回收的分配多半发生在这里），
+    # 正在进行的 WebSocket 推送和截图流水线都会停顿。这些对象会一直存在，
+    # 冻结到永久代后全量回收只扫描启动之后创建的对象。
+    gc.collect()
+    gc.freeze()
+    logger.debug(f"🧊 已冻结 {gc.get_freeze_count()} 个启动对象，全量 GC 不再扫描它们")
+
     yield  # 应用运行期间
     logger.info("👋 openCowork 后端关闭")
     # 停止正在运行的 Agent
     全局停止信号.set()
+    # 关闭观测执行器（截图线程/进程）
+    全局观测执行器.关闭(等待=False)
+    # 关闭动作执行器（键鼠操作线程）
+    全局动作执行器.关闭(等待=False)
+    # 关闭编码进程池并释放共享内存
+    if 编码池 is not None:
+        设置编码后端(None)
+        编码池.关闭(等待=False)
+    # 关闭所有缓存的 Provider 客户端（HTTP 连接池）
+    await 全局提供者注册表.关闭全部()
+    # 同一进程里再次启动（例如测试）时重新冻结
+    gc.unfreeze()
 
 # ============================================
 # 创建 FastAPI 应用
@@ -129,7 +174,7 @@ async def 设置配置(配置: 配置请求):
     if not 验证提供者名称(配置.provider):
         raise HTTPException(
             status_code=400,
-            detail="无效的 Provider，可选值: openai, gemini, anthropic"
+            detail="无效的 Provider，可选值: openai, gemini, anthropic, local"
         )
 
     # 使用安全配置管理器保存配置
@@ -154,6 +199,23 @@ async def 清除配置():
     return {"success": True, "message": "配置已清除"}
 
 
+# 路由时额外使用的 API Key（环境变量名 → Provider 名称）
+路由密钥环境变量 = {
+    "OPENAI_API_KEY": "openai",
+    "GEMINI_API_KEY": "gemini",
+    "ANTHROPIC_API_KEY": "anthropic",
+}
+
+
+def 收集路由密钥(配置: dict) -> dict[str, str]:
+    """已配置的 Provider 排在最前，再加上环境变量里有 Key 的其他 Provider"""
+    密钥表 = {配置["provider"]: 配置["api_key"]}
+    for 变量名, 名称 in 路由密钥环境变量.items():
+        if os.environ.get(变量名):
+            密钥表.setdefault(名称, os.environ[变量名])
+    return 密钥表
+
+
 @app.post("/api/chat", summary="发送聊天消息")
 async def 发送消息(请求: 聊天请求):
     """
@@ -169,24 +231,40 @@ async def 发送消息(请求: 聊天请求):
     if 当前Agent and 当前Agent.正在运行:
         raise HTTPException(status_code=400, detail="Agent 正在执行任务，请等待完成或停止")
 
-    # 根据 Provider 创建对应的适配器
-    provider名称 = 配置["provider"]
-    api_key = 配置["api_key"]
+    # 从注册表取出对应的适配器（同一组配置复用已经建立好的连接）
+    try:
+        if 请求.routing:
+            提供者 = 全局提供者注册表.获取路由(请求.routing, 收集路由密钥(配置))
+        else:
+            提供者 = 全局提供者注册表.获取(配置["provider"], 配置["api_key"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"未知的 Provider 或路由策略: {e}")
 
-    if provider名称 == "openai":
-        提供者 = OpenAI提供者(api_key)
-    elif provider名称 == "gemini":
-        提供者 = Gemini提供者(api_key)
-    elif provider名称 == "anthropic":
-        提供者 = Anthropic提供者(api_key)
-    else:
-        raise HTTPException(status_code=400, detail="未知的 Provider")
+    try:
+        节奏 = 获取节奏(请求.pacing)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     # 创建 Agent 循环并在后台运行
-    当前Agent = AgentLoop(提供者=提供者, 广播函数=广播日志)
+    当前Agent = AgentLoop(
+        提供者=提供者,
+        广播函数=广播日志,
+        图片令牌预算=请求.image_token_budget,
+        最小文字像素=请求.min_text_px,
+        节奏=节奏
+    )
 
     # 使用 asyncio 在后台启动 Agent（不阻塞 API 响应）
-    asyncio.create_task(当前Agent.执行任务(请求.message))
+    # 任务期间占用这个 Provider：它被挤出注册表缓存时，要等任务结束才关闭
+    全局提供者注册表.占用(提供者)
+
+    async def 执行并释放(agent: AgentLoop):
+        try:
+            await agent.执行任务(请求.message)
+        finally:
+            全局提供者注册表.释放(提供者)
+
+    asyncio.create_task(执行并释放(当前Agent))
 
     logger.info(f"📝 收到任务: {请求.message}")
     return {"success": True, "message": "任务已启动"}
@@ -205,27 +283,14 @@ async def 验证配置():
     api_key = 配置["api_key"]
 
     try:
-        # 根据 Provider 创建对应的适配器并尝试验证
-        if provider名称 == "openai":
-            提供者 = OpenAI提供者(api_key)
-            # 尝试进行一个简单的 API 调用
-            import openai
-            client = openai.AsyncOpenAI(api_key=api_key)
-            await client.models.list(limit=1)
-        elif provider名称 == "gemini":
-            import google.generativeai as genai
-            genai.configure(api_key=api_key)
-            # 尝试列出模型
-            genai.list_models()
-        elif provider名称 == "anthropic":
-            from anthropic import AsyncAnthropic
-            client = AsyncAnthropic(api_key=api_key)
-            # 尝试一个简单的 API 调用
-            await client.messages.create(
-                model="claude-3-haiku-20240307",
-                max_tokens=10,
-                messages=[{"role": "user", "content": "test"}]
-            )
+        # 用注册表里的适配器做一次最小的 API 调用
+        # （验证通过后连接已经建立好，下一个任务的第一次调用可以直接复用）
+        提供者 = 全局提供者注册表.获取(provider名称, api_key)
+        全局提供者注册表.占用(提供者)
+        try:
+            await 提供者.验证连接()
+        finally:
+            全局提供者注册表.释放(提供者)
 
         logger.info(f"✅ {provider名称} 配置验证成功")
         return {"success": True, "message": f"{provider名称} 配置验证成功"}
@@ -270,7 +335,7 @@ async def 获取系统信息():
     return 系统信息响应(
         os_info=f"{platform.system()} {platform.release()}",
         python_version=sys.version,
-        available_providers=["openai", "gemini", "anthropic"]
+        available_providers=["openai", "gemini", "anthropic", "local"]
     )
 
 
@@ -0,0 +1,132 @@
+"""
+============================================
+Agent 循环的流水线部件
+============================================
+以前 Agent 的每一步严格串行：
+截图 → 编码 → 调用 LLM → 执行操作 → 等待 → 下一次截图
+
+流水线把这几件事分成几个阶段，阶段之间用有界队列连接，能重叠的部分同时进行：
+1. 观测阶段（等界面稳定 → 截图 → 编码，在观测执行器里运行，见 tools/observation.py）
+2. 思考阶段（LLM 流式生成）
+3. 执行阶段（按到达顺序执行工具调用）
+
+LLM 流式生成时，工具调用一完整就进入执行阶段；执行阶段空下来以后，
+马上开始为下一步准备观测，而这时 LLM 往往还在输出剩下的内容。
+等这一步真正结束，下一步的截图已经准备好了（类比：厨师还在装盘，服务员已经去擦下一张桌子）。
+
+正确性靠"新鲜度守卫"：每个观测都记下截图开始时已经执行了几个操作（`动作时钟`），
+之后只要又执行了新的操作，这个观测就作废，不会被发给 LLM。
+所以 LLM 看到的画面永远不会早于最后一个已执行的操作。
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Optional
+
+from loguru import logger
+
+
+class 动作时钟:
+    """
+    记录已经开始执行的操作数量
+
+    观测在截图开始时读一次 `序号`；之后序号变了（又开始了新的操作），观测就过期了。
+    """
+
+    def __init__(self):
+        self.序号 = 0
+        self.进行中 = 0
+
+    def 开始动作(self):
+        self.序号 += 1
+        self.进行中 += 1
+
+    def 结束动作(self):
+        self.进行中 -= 1
+
+    @property
+    def 空闲(self) -> bool:
+        return self.进行中 == 0
+
+    def 新鲜(self, 标签: int) -> bool:
+        """打着这个标签的观测是否晚于所有已执行的操作"""
+        return 标签 == self.序号 and self.进行中 == 0
+
+
+class 观测预取:
+    """
+    提前准备下一步的观测（带新鲜度守卫）
+
+    用法：
+        预取 = 观测预取(时钟, 准备函数)   # 准备函数(作废信号) -> 结果 或 None
+        预取.启动()                       # 执行阶段空闲时调用
+        ...
+        结果 = await 预取.取用()          # 新鲜的结果，过期或没有启动时返回 None
+
+    作废的预取不会被取消（截图可能已经在观测执行器里进行），
+    而是收集起来：它们的结果可以通过 `取出过期结果()` 拿到（例如合并差异检测结果）。
+    """
+
+    def __init__(
+        self,
+        时钟: 动作时钟,
+        准备函数: Callable[[threading.Event], Awaitable[Optional[Any]]]
+    ):
+        self.时钟 = 时钟
+        self.准备函数 = 准备函数
+        self._任务: Optional[asyncio.Task] = None
+        self._标签 = -1
+        self._作废信号 = threading.Event()
+        self._过期任务: list[asyncio.Task] = []
+        self.命中次数 = 0
+        self.作废次数 = 0
+
+    @property
+    def 进行中(self) -> bool:
+        """有一个仍然新鲜的预取（正在准备或已经准备好）"""
+        return self._任务 is not None and self.时钟.新鲜(self._标签)
+
+    def 启动(self):
+        """为当前时刻准备观测；已经有新鲜的预取时什么都不做"""
+        if not self.时钟.空闲 or self.进行中:
+            return
+        self.作废()
+        self._标签 = self.时钟.序号
+        self._作废信号 = threading.Event()
+        self._任务 = asyncio.create_task(self.准备函数(self._作废信号))
+
+    def 作废(self):
+        """放弃当前的预取（例如又开始执行新的操作）"""
+        if self._任务 is None:
+            return
+        self._作废信号.set()
+        self._过期任务.append(self._任务)
+        self._任务 = None
+        self.作废次数 += 1
+        logger.debug("♻️ 执行了新的操作，提前准备的观测已作废")
+
+    async def 取用(self) -> Optional[Any]:
+        """取出新鲜的预取结果；过期或没有预取时返回 None"""
+        if self._任务 is not None and not self.时钟.新鲜(self._标签):
+            self.作废()
+        任务, self._任务 = self._任务, None
+        if 任务 is None:
+            return None
+        结果 = await 任务
+        if 结果 is not None:
+            self.命中次数 += 1
+        return 结果
+
+    async def 取出过期结果(self) -> list:
+        """等作废的预取结束，返回它们的结果（按启动顺序，跳过 None 和出错的）"""
+        任务列表, self._过期任务 = self._过期任务, []
+        结果列表 = await asyncio.gather(*任务列表, return_exceptions=True)
+        return [结果 for 结果 in 结果列表 if 结果 is not None and not isinstance(结果, BaseException)]
+
+    async def 关闭(self):
+        """任务结束时调用：作废并等待所有进行中的预取"""
+        self.作废()
+        await self.取出过期结果()
+
+    def 获取统计(self) -> dict:
+        return {"命中次数": self.命中次数, "作废次数": self.作废次数}
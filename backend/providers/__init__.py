@@ -2,15 +2,49 @@
 providers 包初始化
 """
 from .base import LLM提供者基类, LLM响应, 工具调用
+from .templates import 请求模板, 消息转换缓存
+from .image_cost import 图片成本模型, OpenAI图片成本, Anthropic图片成本, Gemini图片成本, 分辨率策略
 from .openai_provider import OpenAI提供者
 from .gemini_provider import Gemini提供者
 from .anthropic_provider import Anthropic提供者
+from .local_provider import 本地提供者, 微批调度器
+from .metrics import 延迟直方图, 获取延迟直方图
+from .hedging import 对冲提供者, 对冲策略
+from .router import 路由提供者, 统一工具调用
+from .scheduler import 限流调度器, 调度提供者, 调度配置
+from .replay import 回放提供者, 回放存储, 回放配置, 回放未命中
+from .registry import 提供者注册表, 连接配置, 全局提供者注册表
 
 __all__ = [
     "LLM提供者基类",
     "LLM响应",
     "工具调用",
+    "请求模板",
+    "消息转换缓存",
+    "图片成本模型",
+    "OpenAI图片成本",
+    "Anthropic图片成本",
+    "Gemini图片成本",
+    "分辨率策略",
     "OpenAI提供者",
     "Gemini提供者",
-    "Anthropic提供者"
+    "Anthropic提供者",
+    "本地提供者",
+    "微批调度器",
+    "延迟直方图",
+    "获取延迟直方图",
+    "对冲提供者",
+    "对冲策略",
+    "路由提供者",
+    "统一工具调用",
+    "限流调度器",
+    "调度提供者",
+    "调度配置",
+    "回放提供者",
+    "回放存储",
+    "回放配置",
+    "回放未命中",
+    "提供者注册表",
+    "连接配置",
+    "全局提供者注册表"
 ]
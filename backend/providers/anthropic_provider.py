@@ -10,12 +10,16 @@ Anthropic 专门训练了 Claude 来理解屏幕截图并输出精确的操作
 所以使用 Claude 的体验会比 OpenAI/Gemini 更好（理论上）。
 """
 
-from typing import Optional
+import json
+from typing import Any, AsyncIterator, Optional
 
 import anthropic
 from loguru import logger
 
-from .base import LLM提供者基类, LLM响应, 工具调用, SYSTEM_PROMPT
+from .base import LLM提供者基类, LLM响应, 工具调用, 流式事件, SYSTEM_PROMPT, 整理用量
+from .image_cost import Anthropic图片成本
+from .templates import 请求模板, 消息转换缓存, 参数模式表
+from .prompt_cache import 缓存标记, 稳定前缀长度, 加缓存断点
 
 
 class Anthropic提供者(LLM提供者基类):
@@ -25,23 +29,46 @@ class Anthropic提供者(LLM提供者基类):
     使用 Claude 原生的 Computer Use 能力，不需要自定义工具定义。
     """
     
-    def __init__(self, api_key: str, model: str = "claude-sonnet-4-20250514"):
+    # Claude 单张图片上限 5MB（Base64），留出余量
+    图片字节预算 = int(1.5 * 1024 * 1024)
+    图片成本模型 = Anthropic图片成本()
+    
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "claude-sonnet-4-20250514",
+        http_client: Optional[Any] = None,
+        启用提示缓存: bool = True
+    ):
         """
         初始化 Anthropic 客户端
         
         参数:
             api_key: Anthropic API 密钥
             model: 使用的模型
+            http_client: 可选，自定义 HTTP 客户端（连接池上限、keep-alive，见 providers/registry.py）
+            启用提示缓存: 在工具定义、系统提示词和旧历史之后标记缓存断点（见 providers/prompt_cache.py）
         """
         super().__init__(api_key)
-        self.client = anthropic.AsyncAnthropic(api_key=api_key)
+        self.client = anthropic.AsyncAnthropic(api_key=api_key, http_client=http_client)
         self.model = model
+        self.启用提示缓存 = 启用提示缓存
+        # 系统提示词和工具定义每一步都一样：只编译一次；历史消息的转换结果按消息对象缓存
+        工具定义 = self._定义原生工具()
+        参数模式 = 参数模式表(工具定义, "input_schema")
+        if 启用提示缓存:
+            工具定义[-1] = {**工具定义[-1], "cache_control": 缓存标记()}  # 断点 1：工具定义之后
+        self._模板 = 请求模板.编译(SYSTEM_PROMPT.format(model_name=model), 工具定义, 参数模式)
+        # 断点 2：系统提示词之后
+        self._系统块 = [{"type": "text", "text": self._模板.系统提示词, "cache_control": 缓存标记()}]
+        self._消息缓存 = 消息转换缓存(self._转换消息)
         logger.info(f"✅ Anthropic 提供者已初始化，模型: {model}")
     
     async def 发送消息(
         self,
         对话历史: list[dict],
-        截图base64: Optional[str] = None
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
     ) -> LLM响应:
         """
         发送消息给 Claude
@@ -49,47 +76,9 @@ class Anthropic提供者(LLM提供者基类):
         使用 Computer Use Beta API
         """
         try:
-            # 构建消息列表
-            messages = []
-            
-            # 添加对话历史
-            for 消息 in 对话历史:
-                messages.append({
-                    "role": 消息["role"],
-                    "content": 消息["content"]
-                })
-            
-            # 如果有截图，构建特殊的图片消息
-            if 截图base64:
-                messages.append({
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "这是当前屏幕截图，请根据截图内容和之前的指令决定下一步操作。"
-                        },
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/png",
-                                "data": 截图base64
-                            }
-                        }
-                    ]
-                })
-            
-            # 定义 Computer Use 工具（Claude 原生支持）
-            tools = self._定义原生工具()
-            
             # 调用 API（使用 beta header 启用 Computer Use）
             response = await self.client.beta.messages.create(
-                model=self.model,
-                max_tokens=1024,
-                system=SYSTEM_PROMPT.format(model_name=self.model),
-                messages=messages,
-                tools=tools,
-                betas=["computer-use-2024-10-22"]  # 启用 Computer Use
+                **self._构建请求参数(对话历史, 截图base64, 截图媒体类型)
             )
             
             # 解析响应
@@ -99,6 +88,151 @@ class Anthropic提供者(LLM提供者基类):
             logger.error(f"Anthropic API 调用失败: {e}")
             raise
     
+    async def 流式发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> AsyncIterator[流式事件]:
+        """
+        流式发送消息给 Claude
+        
+        Claude 按内容块下发：tool_use 块的参数以 JSON 片段的形式到达，
+        收到 content_block_stop 时这个工具调用就完整了。
+        """
+        结果 = LLM响应()
+        开始用量 = None   # message_start 里的用量（输入和缓存令牌）
+        输出令牌: Optional[int] = None
+        内容块: dict[int, dict] = {}   # index → {"type", "id", "name", "json"}
+        
+        try:
+            stream = await self.client.beta.messages.create(
+                **self._构建请求参数(对话历史, 截图base64, 截图媒体类型),
+                stream=True
+            )
+            async with stream:   # 提前结束（消费者中止、对冲落败）时也要关闭响应，连接才能回到连接池
+                async for event in stream:
+                    if event.type == "message_start":
+                        开始用量 = event.message.usage
+                    
+                    elif event.type == "content_block_start":
+                        block = event.content_block
+                        内容块[event.index] = {
+                            "type": block.type,
+                            "id": getattr(block, "id", ""),
+                            "name": getattr(block, "name", ""),
+                            "json": ""
+                        }
+                    
+                    elif event.type == "content_block_delta":
+                        delta = event.delta
+                        if delta.type == "text_delta":
+                            结果.文本内容 = (结果.文本内容 or "") + delta.text
+                            yield 流式事件(类型="文本", 文本=delta.text)
+                        elif delta.type == "input_json_delta":
+                            内容块[event.index]["json"] += delta.partial_json
+                    
+                    elif event.type == "content_block_stop":
+                        块 = 内容块.get(event.index)
+                        if 块 and 块["type"] == "tool_use":
+                            try:
+                                参数 = json.loads(块["json"]) if 块["json"] else {}
+                            except json.JSONDecodeError:
+                                参数 = {}
+                            调用 = self._模板.检查(
+                                工具调用(工具名称=块["name"], 参数=参数, 工具调用ID=块["id"]), self.提供者名称
+                            )
+                            结果.工具调用列表.append(调用)
+                            yield 流式事件(类型="工具调用", 工具调用=调用)
+                    
+                    elif event.type == "message_delta":
+                        输出令牌 = event.usage.output_tokens
+        
+        except Exception as e:
+            logger.error(f"Anthropic 流式调用失败: {e}")
+            raise
+        
+        结果.用量 = self._整理用量(开始用量, 输出令牌)
+        yield 流式事件(类型="完成", 响应=结果)
+    
+    async def 验证连接(self):
+        """发一个最小的请求，验证 API 密钥（同时预热连接池）"""
+        await self.client.messages.create(
+            model="claude-3-haiku-20240307",
+            max_tokens=10,
+            messages=[{"role": "user", "content": "test"}]
+        )
+    
+    async def 关闭(self):
+        await self.client.close()
+    
+    def _构建请求参数(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str],
+        截图媒体类型: str
+    ) -> dict:
+        """构建 beta.messages.create 的参数（流式和非流式共用）"""
+        # 历史消息只转换新增的几条，旧消息复用缓存
+        messages = self._消息缓存.转换全部(对话历史)
+        
+        # 断点 3：历史里下一步也不会变的最后一条消息（之后是带截图、很快会被替换的几步）
+        if self.启用提示缓存:
+            稳定条数 = 稳定前缀长度(对话历史)
+            if 稳定条数:
+                messages[稳定条数 - 1] = 加缓存断点(messages[稳定条数 - 1])
+        
+        # 如果有截图，构建特殊的图片消息
+        if 截图base64:
+            messages.append({
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "这是当前屏幕截图，请根据截图内容和之前的指令决定下一步操作。"
+                    },
+                    {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": 截图媒体类型,
+                            "data": 截图base64
+                        }
+                    }
+                ]
+            })
+        
+        return {
+            "model": self.model,
+            "max_tokens": 1024,
+            "system": self._系统块 if self.启用提示缓存 else self._模板.系统提示词,
+            "messages": messages,
+            "tools": self._模板.工具列表(),  # 初始化时定义好的 Computer Use 工具
+            "betas": ["computer-use-2024-10-22"]  # 启用 Computer Use
+        }
+    
+    def _转换消息(self, 消息: dict) -> dict:
+        """把一条通用格式的消息转换为 Claude 格式（结果会被缓存复用）"""
+        return {"role": 消息["role"], "content": self._转换内容(消息["content"])}
+    
+    def _转换内容(self, 内容):
+        """
+        把对话历史里的内容（文字，或文字/图片部分列表）转换为 Claude 格式
+        """
+        if isinstance(内容, str):
+            return 内容
+        return [
+            {
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": 部分["media_type"],
+                    "data": 部分["data"]
+                }
+            } if 部分["type"] == "image" else {"type": "text", "text": 部分["text"]}
+            for 部分 in 内容
+        ]
+    
     def _定义原生工具(self) -> list[dict]:
         """
         定义 Claude 原生的 Computer Use 工具
@@ -209,20 +343,38 @@ class Anthropic提供者(LLM提供者基类):
         """
         结果 = LLM响应(原始响应=response)
         
+        # 提取令牌用量
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            结果.用量 = self._整理用量(usage, getattr(usage, "output_tokens", None))
+        
         # 遍历响应内容
         for block in response.content:
             if block.type == "text":
                 结果.文本内容 = (结果.文本内容 or "") + block.text
             
             elif block.type == "tool_use":
-                结果.工具调用列表.append(工具调用(
+                结果.工具调用列表.append(self._模板.检查(工具调用(
                     工具名称=block.name,
                     参数=block.input or {},
                     工具调用ID=block.id
-                ))
+                ), self.提供者名称))
         
         return 结果
     
+    @staticmethod
+    def _整理用量(usage, 输出令牌) -> Optional[dict[str, int]]:
+        """
+        Claude 的 input_tokens 不含命中缓存和写入缓存的令牌，
+        三者加起来才是整个提示词的令牌数（和 OpenAI 的 prompt_tokens 口径一致）
+        """
+        输入令牌 = getattr(usage, "input_tokens", None)
+        缓存读取 = getattr(usage, "cache_read_input_tokens", None)
+        缓存写入 = getattr(usage, "cache_creation_input_tokens", None)
+        if isinstance(输入令牌, int):
+            输入令牌 += sum(值 for 值 in (缓存读取, 缓存写入) if isinstance(值, int))
+        return 整理用量(输入令牌, 输出令牌, 缓存读取, 缓存写入)
+    
     @property
     def 提供者名称(self) -> str:
         return "Anthropic"
@@ -16,7 +16,9 @@ LLM 提供者抽象基类
 
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
-from typing import Any, Optional
+from typing import Any, AsyncIterator, Optional
+
+from .image_cost import 图片成本模型
 
 
 @dataclass
@@ -46,6 +48,48 @@ class LLM响应:
     文本内容: Optional[str] = None                  # LLM 说的话
     工具调用列表: list[工具调用] = field(default_factory=list)  # 要执行的工具操作
     原始响应: Any = None                             # 保留原始 API 响应（debug 用）
+    用量: Optional[dict[str, int]] = None           # API 报告的令牌用量：{"输入令牌": ..., "输出令牌": ..., "缓存读取令牌": ...}
+
+
+@dataclass
+class 流式事件:
+    """
+    流式响应中的一个事件
+
+    类型:
+    - "文本": 文本增量（文本 字段）
+    - "工具调用": 一个参数已经完整的工具调用（工具调用 字段），可以立刻开始执行
+    - "完成": 生成结束（响应 字段是汇总后的完整 LLM响应）
+    """
+    类型: str
+    文本: Optional[str] = None
+    工具调用: Optional[工具调用] = None
+    响应: Optional[LLM响应] = None
+
+
+def 整理用量(
+    输入令牌: Any,
+    输出令牌: Any,
+    缓存读取令牌: Any = None,
+    缓存写入令牌: Any = None
+) -> Optional[dict[str, int]]:
+    """
+    把 SDK 返回的用量字段整理成统一的字典
+
+    输入令牌是整个提示词的令牌数（包括命中提示词缓存的部分）。
+    缓存读取令牌 / 缓存写入令牌只在 API 报告了的时候才有：
+    Anthropic 两个都报告，OpenAI 和 Gemini 只报告读取（它们的缓存是自动写入的）。
+
+    输入 / 输出令牌缺失或不是整数时返回 None（例如测试里的 Mock 响应）。
+    """
+    if not isinstance(输入令牌, int) or not isinstance(输出令牌, int):
+        return None
+    用量 = {"输入令牌": 输入令牌, "输出令牌": 输出令牌}
+    if isinstance(缓存读取令牌, int):
+        用量["缓存读取令牌"] = 缓存读取令牌
+    if isinstance(缓存写入令牌, int):
+        用量["缓存写入令牌"] = 缓存写入令牌
+    return 用量
 
 
 class LLM提供者基类(ABC):
@@ -56,6 +100,13 @@ class LLM提供者基类(ABC):
     并实现 `发送消息` 方法。
     """
     
+    # 截图编码预算：Base64 之后单张图片的最大字节数（编码器会据此选择格式和质量）
+    图片字节预算: int = 2 * 1024 * 1024
+    # 这个 Provider 接受的图片 MIME 类型
+    支持的媒体类型: frozenset[str] = frozenset({"image/png", "image/jpeg", "image/webp"})
+    # 图片令牌成本模型（用于预测截图令牌数、选择截图分辨率）
+    图片成本模型: 图片成本模型 = 图片成本模型()
+    
     def __init__(self, api_key: str):
         """
         初始化提供者
@@ -69,7 +120,8 @@ class LLM提供者基类(ABC):
     async def 发送消息(
         self,
         对话历史: list[dict],
-        截图base64: Optional[str] = None
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
     ) -> LLM响应:
         """
         发送消息给 LLM，获取响应
@@ -77,20 +129,99 @@ class LLM提供者基类(ABC):
         这是一个"抽象方法"——这里只定义接口，具体实现由子类完成。
         
         参数:
-            对话历史: 之前的对话记录，格式: [{"role": "user/assistant", "content": "..."}]
+            对话历史: 之前的对话记录，格式: [{"role": "user/assistant", "content": "..."}]，
+                      content 也可以是文字/图片部分的列表（见 history.py），由子类转换
             截图base64: 当前屏幕截图的 Base64 编码（可选）
+            截图媒体类型: 截图的 MIME 类型，如 "image/png"、"image/jpeg"、"image/webp"
         
         返回:
             LLM响应 对象，包含文本和工具调用
         """
         pass  # 子类必须实现这个方法
     
+    async def 流式发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> AsyncIterator[流式事件]:
+        """
+        流式发送消息：边生成边产出事件
+
+        每个工具调用的参数一完整就产出一个 "工具调用" 事件，
+        调用方不用等整段回复生成完就能开始执行操作。
+        最后一定产出一个 "完成" 事件，携带完整的 LLM响应。
+
+        默认实现只是包装 `发送消息`（一次性产出所有事件），
+        支持流式的子类应该重写这个方法。
+        """
+        响应 = await self.发送消息(对话历史, 截图base64, 截图媒体类型)
+        if 响应.文本内容:
+            yield 流式事件(类型="文本", 文本=响应.文本内容)
+        for 调用 in 响应.工具调用列表:
+            yield 流式事件(类型="工具调用", 工具调用=调用)
+        yield 流式事件(类型="完成", 响应=响应)
+    
+    async def 验证连接(self):
+        """
+        发一个最小的请求，验证 API 密钥可用（失败时抛出异常）
+
+        顺便把 HTTP 连接池"预热"好，后面第一次真正调用时不用再握手。
+        默认什么都不做，子类按各自的 SDK 实现。
+        """
+    
+    async def 关闭(self):
+        """关闭底层的 HTTP 客户端（应用退出或客户端被淘汰时调用），默认什么都不做"""
+    
     @property
     def 提供者名称(self) -> str:
         """返回提供者的名称，用于日志显示"""
         return self.__class__.__name__
 
 
+class 包装提供者基类(LLM提供者基类):
+    """
+    包在另一个 Provider 外面、给调用加上额外行为（限流、重试……）的提供者
+
+    默认把所有调用原样转发给内部提供者，图片预算、媒体类型、成本模型也沿用内部提供者的，
+    所以 AgentLoop 不需要知道自己拿到的是不是包装过的提供者。
+    """
+
+    def __init__(self, 内部提供者: LLM提供者基类):
+        super().__init__(内部提供者.api_key)
+        self.内部提供者 = 内部提供者
+        self.图片字节预算 = 内部提供者.图片字节预算
+        self.支持的媒体类型 = 内部提供者.支持的媒体类型
+        self.图片成本模型 = 内部提供者.图片成本模型
+
+    async def 发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> LLM响应:
+        return await self.内部提供者.发送消息(对话历史, 截图base64, 截图媒体类型)
+
+    async def 流式发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> AsyncIterator[流式事件]:
+        async for 事件 in self.内部提供者.流式发送消息(对话历史, 截图base64, 截图媒体类型):
+            yield 事件
+
+    async def 验证连接(self):
+        await self.内部提供者.验证连接()
+
+    async def 关闭(self):
+        await self.内部提供者.关闭()
+
+    @property
+    def 提供者名称(self) -> str:
+        return self.内部提供者.提供者名称
+
+
 # ============================================
 # 通用工具定义（所有 Provider 共享）
 # ============================================
@@ -224,3 +355,15 @@ SYSTEM_PROMPT = """你是一个能够控制用户电脑的 AI 助手。
 
 请用中文回复用户。
 """
+
+
+def 模型名称(提供者: LLM提供者基类) -> Optional[str]:
+    """沿着包装层找到真正的 Provider，取出它的模型名称（没有时为 None）"""
+    while isinstance(提供者, 包装提供者基类):
+        提供者 = 提供者.内部提供者
+    # Gemini 的 model 是 GenerativeModel 对象，模型名称在 model_name 里
+    for 属性 in ("model_name", "model"):
+        值 = getattr(提供者, 属性, None)
+        if isinstance(值, str):
+            return 值
+    return None
@@ -9,14 +9,33 @@ Gemini 2.0 Flash 支持：
 2. Function Calling：可以调用自定义函数
 
 和 OpenAI 类似，我们定义工具 Schema，让 Gemini 输出结构化的操作指令。
+
+注意：google-generativeai 的 `generate_content` 和 `list_models` 都是阻塞调用，
+直接在 async 函数里调用会卡住整个事件循环（FastAPI 期间无法响应任何请求）。
+所以这里生成内容一律走 SDK 的异步接口（带超时，可取消），
+没有异步版本的调用放进一个有上限的线程池里执行。
+
+`genai.configure(api_key=...)` 设置的是整个进程的默认密钥，而注册表会同时缓存
+多个不同密钥的 Provider，所以每个实例都用自己的密钥创建底层客户端，不经过全局配置。
 """
 
-from typing import Optional
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Optional
 
 import google.generativeai as genai
+from google.ai import generativelanguage as glm
 from loguru import logger
 
-from .base import LLM提供者基类, LLM响应, 工具调用, COMPUTER_USE_TOOLS, SYSTEM_PROMPT
+from .base import (
+    LLM提供者基类, LLM响应, 工具调用, 流式事件, COMPUTER_USE_TOOLS, SYSTEM_PROMPT, 整理用量
+)
+from .image_cost import Gemini图片成本
+from .templates import 请求模板, 消息转换缓存, 参数模式表
+
+
+# SDK 里没有异步版本的阻塞调用（如 list_models）在这里执行，最多同时 2 个
+_阻塞调用执行器 = ThreadPoolExecutor(max_workers=2, thread_name_prefix="gemini")
 
 
 class Gemini提供者(LLM提供者基类):
@@ -24,25 +43,37 @@ class Gemini提供者(LLM提供者基类):
     Google Gemini 2.0 提供者适配器
     """
     
-    def __init__(self, api_key: str, model: str = "gemini-2.0-flash"):
+    图片成本模型 = Gemini图片成本()
+    
+    def __init__(self, api_key: str, model: str = "gemini-2.0-flash", 超时: float = 60.0):
         """
         初始化 Gemini 客户端
         
         参数:
             api_key: Google AI API 密钥
             model: 使用的模型，默认 gemini-2.0-flash
+            超时: 单次 API 调用的超时时间（秒）
         """
         super().__init__(api_key)
-        genai.configure(api_key=api_key)
+        # 本实例专用的客户端设置（不用 genai.configure，那会改掉进程里其他实例的密钥）
+        self._客户端选项 = {"api_key": api_key}
+        self._模型客户端: Optional[glm.ModelServiceClient] = None
         self.model_name = model
+        self.超时 = 超时
         
         # 创建工具定义（使用字典格式，兼容新版 SDK）
         self._tools = self._创建工具定义()
+        self._模板 = 请求模板.编译(
+            SYSTEM_PROMPT.format(model_name=model), self._tools, 参数模式表(COMPUTER_USE_TOOLS)
+        )
+        # 历史消息的转换结果按消息对象缓存（历史管理器每一步复用同一批对象），每一步只转换新增的几条
+        self._消息缓存 = 消息转换缓存(self._转换消息)
         
-        # 创建模型
+        # 创建模型（系统提示词和工具只在这里设置一次）
+        # 底层的异步客户端在第一次请求时按本实例的密钥创建，见 `_绑定客户端`
         self.model = genai.GenerativeModel(
             model_name=model,
-            system_instruction=SYSTEM_PROMPT.format(model_name=model),
+            system_instruction=self._模板.系统提示词,
             tools=self._tools
         )
         
@@ -51,54 +82,176 @@ class Gemini提供者(LLM提供者基类):
     async def 发送消息(
         self,
         对话历史: list[dict],
-        截图base64: Optional[str] = None
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
     ) -> LLM响应:
         """
         发送消息给 Gemini
         """
         try:
-            # 构建内容列表
-            contents = []
-            
-            # 添加对话历史
-            for 消息 in 对话历史:
-                role = "user" if 消息["role"] == "user" else "model"
-                contents.append({
-                    "role": role,
-                    "parts": [{"text": 消息["content"]}]
-                })
+            contents = self._构建内容(对话历史, 截图base64, 截图媒体类型)
+            self._绑定客户端()
             
-            # 如果有截图，添加到内容中
-            if 截图base64:
-                contents.append({
-                    "role": "user",
-                    "parts": [
-                        {"text": "这是当前屏幕截图，请根据截图内容和之前的指令决定下一步操作。"},
-                        {
-                            "inline_data": {
-                                "mime_type": "image/png",
-                                "data": 截图base64
-                            }
-                        }
-                    ]
-                })
-            
-            # 调用 API
-            response = self.model.generate_content(
-                contents,
-                generation_config={
-                    "max_output_tokens": 1024,
-                    "temperature": 0.7
-                }
+            # 调用 API（异步接口，不阻塞事件循环；超时或任务被取消时请求一起取消）
+            response = await asyncio.wait_for(
+                self.model.generate_content_async(
+                    contents,
+                    generation_config={
+                        "max_output_tokens": 1024,
+                        "temperature": 0.7
+                    },
+                    request_options={"timeout": self.超时}
+                ),
+                timeout=self.超时
             )
             
             # 解析响应
             return self._解析响应(response)
         
+        except asyncio.TimeoutError:
+            logger.error(f"Gemini API 调用超时（{self.超时:.0f}s）")
+            raise TimeoutError(f"Gemini API 调用超时（{self.超时:.0f}s）")
+        
         except Exception as e:
             logger.error(f"Gemini API 调用失败: {e}")
             raise
     
+    async def 流式发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> AsyncIterator[流式事件]:
+        """
+        流式发送消息给 Gemini
+        
+        Gemini 的函数调用总是完整地出现在某一个数据块里，收到就可以执行。
+        """
+        结果 = LLM响应()
+        
+        try:
+            self._绑定客户端()
+            response = await asyncio.wait_for(
+                self.model.generate_content_async(
+                    self._构建内容(对话历史, 截图base64, 截图媒体类型),
+                    generation_config={
+                        "max_output_tokens": 1024,
+                        "temperature": 0.7
+                    },
+                    stream=True,
+                    request_options={"timeout": self.超时}
+                ),
+                timeout=self.超时
+            )
+            async for chunk in response:
+                片段 = self._解析响应(chunk)
+                if 片段.用量:
+                    结果.用量 = 片段.用量  # 最后一个数据块里是累计用量
+                if 片段.文本内容:
+                    结果.文本内容 = (结果.文本内容 or "") + 片段.文本内容
+                    yield 流式事件(类型="文本", 文本=片段.文本内容)
+                for 调用 in 片段.工具调用列表:
+                    结果.工具调用列表.append(调用)
+                    yield 流式事件(类型="工具调用", 工具调用=调用)
+        
+        except Exception as e:
+            logger.error(f"Gemini 流式调用失败: {e}")
+            raise
+        
+        yield 流式事件(类型="完成", 响应=结果)
+    
+    async def 验证连接(self):
+        """
+        验证 API 密钥是否可用（列出第一个模型）
+
+        `genai.list_models()` 是阻塞调用，放进线程池执行并加上超时。
+        """
+        事件循环 = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(
+                事件循环.run_in_executor(
+                    _阻塞调用执行器,
+                    lambda: next(iter(genai.list_models(
+                        client=self._获取模型客户端(), request_options={"timeout": self.超时}
+                    )), None)
+                ),
+                timeout=self.超时
+            )
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Gemini 验证超时（{self.超时:.0f}s）")
+    
+    def _绑定客户端(self):
+        """
+        让模型使用按本实例密钥创建的异步客户端
+
+        `GenerativeModel` 第一次调用时才去取进程默认的客户端，这里抢在它之前放好自己的
+        （gRPC 异步通道要在事件循环里创建，所以不在 __init__ 里做）。
+        """
+        if getattr(self.model, "_async_client", None) is None:
+            self.model._async_client = glm.GenerativeServiceAsyncClient(client_options=self._客户端选项)
+    
+    def _获取模型客户端(self) -> glm.ModelServiceClient:
+        """按本实例密钥创建的模型服务客户端（验证连接时列出模型用）"""
+        if self._模型客户端 is None:
+            self._模型客户端 = glm.ModelServiceClient(client_options=self._客户端选项)
+        return self._模型客户端
+    
+    async def 关闭(self):
+        """关闭本实例创建的 gRPC 通道"""
+        异步客户端 = getattr(self.model, "_async_client", None)
+        if isinstance(异步客户端, glm.GenerativeServiceAsyncClient):
+            self.model._async_client = None
+            await 异步客户端.transport.close()
+        if self._模型客户端 is not None:
+            self._模型客户端.transport.close()
+            self._模型客户端 = None
+    
+    def _构建内容(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str],
+        截图媒体类型: str
+    ) -> list[dict]:
+        """构建 generate_content 的内容列表（流式和非流式共用）"""
+        # 历史消息只转换新增的几条，旧消息复用缓存
+        contents = self._消息缓存.转换全部(对话历史)
+        
+        # 如果有截图，添加到内容中
+        if 截图base64:
+            contents.append({
+                "role": "user",
+                "parts": [
+                    {"text": "这是当前屏幕截图，请根据截图内容和之前的指令决定下一步操作。"},
+                    {
+                        "inline_data": {
+                            "mime_type": 截图媒体类型,
+                            "data": 截图base64
+                        }
+                    }
+                ]
+            })
+        
+        return contents
+    
+    def _转换消息(self, 消息: dict) -> dict:
+        """把一条通用格式的消息转换为 Gemini 格式（结果会被缓存复用）"""
+        return {
+            "role": "user" if 消息["role"] == "user" else "model",
+            "parts": self._转换内容(消息["content"])
+        }
+    
+    def _转换内容(self, 内容) -> list[dict]:
+        """
+        把对话历史里的内容（文字，或文字/图片部分列表）转换为 Gemini 的 parts
+        """
+        if isinstance(内容, str):
+            return [{"text": 内容}]
+        return [
+            {"inline_data": {"mime_type": 部分["media_type"], "data": 部分["data"]}}
+            if 部分["type"] == "image" else {"text": 部分["text"]}
+            for 部分 in 内容
+        ]
+    
     def _创建工具定义(self) -> list:
         """
         将我们的通用工具定义转换为 Gemini 的 Tool 格式
@@ -150,6 +303,15 @@ class Gemini提供者(LLM提供者基类):
         """
         结果 = LLM响应(原始响应=response)
         
+        # 提取令牌用量
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            结果.用量 = 整理用量(
+                getattr(usage, "prompt_token_count", None),
+                getattr(usage, "candidates_token_count", None),
+                getattr(usage, "cached_content_token_count", None)  # 隐式缓存命中的令牌
+            )
+        
         # 检查是否有有效的候选响应
         if not response.candidates:
             return 结果
@@ -167,10 +329,10 @@ class Gemini提供者(LLM提供者基类):
                 fc = part.function_call
                 参数 = dict(fc.args) if fc.args else {}
                 
-                结果.工具调用列表.append(工具调用(
+                结果.工具调用列表.append(self._模板.检查(工具调用(
                     工具名称=fc.name,
                     参数=参数
-                ))
+                ), self.提供者名称))
         
         return 结果
     
@@ -0,0 +1,238 @@
+"""
+============================================
+对冲请求（Hedged Requests）
+============================================
+这个文件负责砍掉 LLM 调用的"长尾"延迟。
+
+大多数 LLM 调用几秒就返回，但偶尔会有一次卡上二三十秒——
+交互式任务的"最慢那一步"几乎全是这种偶发的慢请求造成的。
+
+做法（类比：排队结账时，等得比平时久了，就再去另一个收银台排一次，哪边先轮到就用哪边）：
+1. 正常发出请求
+2. 如果超过"平时第 95% 慢的耗时"还没返回，再发一个相同的请求
+   （发给同一个 Provider，或者配置好的备用 Provider）
+3. 哪个先返回有效的 LLM响应 就用哪个，另一个立刻取消
+
+对冲阈值来自每个 Provider / 模型的延迟直方图（见 metrics.py），所以额外请求只占很小的比例
+（按 p95 设置时大约 5%）。流式调用按"第一个事件到达的时间"对冲。
+
+直方图只统计真正的调用耗时：注册表把对冲包在限流调度里面（见 registry.py），
+在调度器里排队、遇到 429 退避的时间既不计入延迟，也不会触发对冲。
+
+对冲会多花一些请求费用，所以默认关闭：
+    设置环境变量 LLM_HEDGE_PERCENTILE=0.95 开启（见 `对冲策略`）
+"""
+
+import asyncio
+import os
+import time
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+from loguru import logger
+
+from .base import LLM提供者基类, LLM响应, 流式事件, 包装提供者基类, 模型名称
+from .metrics import 延迟直方图, 获取延迟直方图
+
+
+@dataclass(frozen=True)
+class 对冲策略:
+    """
+    什么时候发出对冲请求
+
+    可以用环境变量设置：
+        LLM_HEDGE_PERCENTILE   按哪个分位数的耗时对冲（如 0.95），不设置表示不对冲
+        LLM_HEDGE_MIN_DELAY    对冲延迟的下限（秒）
+    """
+    分位数: float = 0.95
+    最小延迟: float = 1.0     # 再快也至少等这么久才对冲（避免短请求被成倍发送）
+    初始延迟: float = 10.0    # 样本不够时使用的对冲延迟
+    最少样本: int = 20        # 直方图里至少有这么多样本才按分位数计算
+
+    @classmethod
+    def 从环境变量(cls) -> Optional["对冲策略"]:
+        分位数 = os.environ.get("LLM_HEDGE_PERCENTILE")
+        if not 分位数:
+            return None
+        return cls(
+            分位数=float(分位数),
+            最小延迟=float(os.environ.get("LLM_HEDGE_MIN_DELAY", cls.最小延迟))
+        )
+
+    def 延迟(self, 直方图: 延迟直方图) -> float:
+        """根据直方图计算这次调用等多久才对冲"""
+        if 直方图.样本数 < self.最少样本:
+            return max(self.最小延迟, self.初始延迟)
+        return max(self.最小延迟, 直方图.分位数(self.分位数) or self.初始延迟)
+
+
+async def _取消并等待(任务: asyncio.Task):
+    任务.cancel()
+    with suppress(BaseException):
+        await 任务
+
+
+class 对冲提供者(包装提供者基类):
+    """
+    带对冲的 Provider：慢请求超过阈值后再发一份，先到先用
+
+    用法：
+        提供者 = 对冲提供者(OpenAI提供者(key), 备用提供者=None, 策略=对冲策略(分位数=0.95))
+    """
+
+    def __init__(
+        self,
+        内部提供者: LLM提供者基类,
+        备用提供者: Optional[LLM提供者基类] = None,
+        策略: Optional[对冲策略] = None
+    ):
+        """
+        参数:
+            内部提供者: 主 Provider
+            备用提供者: 对冲请求发给谁，None 表示发给主 Provider 自己
+            策略: 对冲策略，默认按 p95 对冲
+        """
+        super().__init__(内部提供者)
+        self.备用提供者 = 备用提供者 or 内部提供者
+        self.策略 = 策略 or 对冲策略()
+        self.对冲次数 = 0
+        self.对冲获胜次数 = 0
+
+    @staticmethod
+    def _直方图(提供者: LLM提供者基类, 流式: bool) -> 延迟直方图:
+        # 流式调用统计的是第一个事件到达的时间，和完整响应的耗时分开统计
+        return 获取延迟直方图(提供者.提供者名称, 模型名称(提供者), "首事件" if 流式 else "响应")
+
+    def 对冲延迟(self, 流式: bool = False) -> float:
+        return self.策略.延迟(self._直方图(self.内部提供者, 流式))
+
+    def _记录对冲(self, 延迟: float):
+        self.对冲次数 += 1
+        logger.info(
+            f"🪁 {self.内部提供者.提供者名称} 超过 {延迟:.1f} 秒未返回，"
+            f"向 {self.备用提供者.提供者名称} 发出对冲请求（第 {self.对冲次数} 次）"
+        )
+
+    def _记录获胜(self, 是对冲: bool):
+        if 是对冲:
+            self.对冲获胜次数 += 1
+            logger.info(f"🏁 对冲请求先返回（已获胜 {self.对冲获胜次数}/{self.对冲次数} 次）")
+
+    async def _计时发送(self, 提供者: LLM提供者基类, *参数) -> LLM响应:
+        开始 = time.perf_counter()
+        响应 = await 提供者.发送消息(*参数)
+        self._直方图(提供者, 流式=False).记录(time.perf_counter() - 开始)
+        return 响应
+
+    async def 发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> LLM响应:
+        参数 = (对话历史, 截图base64, 截图媒体类型)
+        延迟 = self.对冲延迟()
+        主任务 = asyncio.create_task(self._计时发送(self.内部提供者, *参数))
+        任务列表 = [主任务]
+        try:
+            完成, _ = await asyncio.wait(任务列表, timeout=延迟)
+            if 完成:
+                return 主任务.result()
+
+            self._记录对冲(延迟)
+            对冲任务 = asyncio.create_task(self._计时发送(self.备用提供者, *参数))
+            任务列表.append(对冲任务)
+
+            # 第一个有效的响应获胜；一边失败时继续等另一边
+            待定 = set(任务列表)
+            首个异常: Optional[BaseException] = None
+            while 待定:
+                完成, 待定 = await asyncio.wait(待定, return_when=asyncio.FIRST_COMPLETED)
+                for 任务 in sorted(完成, key=任务列表.index):
+                    if 任务.exception() is None and isinstance(任务.result(), LLM响应):
+                        self._记录获胜(任务 is 对冲任务)
+                        return 任务.result()
+                    首个异常 = 首个异常 or 任务.exception()
+            raise 首个异常 or RuntimeError("对冲请求都没有返回有效响应")
+        finally:
+            # 取消输掉的一方（或者调用方自己被取消时的两方）
+            for 任务 in 任务列表:
+                if not 任务.done():
+                    await _取消并等待(任务)
+
+    async def 流式发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> AsyncIterator[流式事件]:
+        参数 = (对话历史, 截图base64, 截图媒体类型)
+        延迟 = self.对冲延迟(流式=True)
+        开始 = time.perf_counter()
+
+        # 任务 → (提供者, 流)：每个任务等待对应流的第一个事件
+        候选: dict[asyncio.Task, tuple[LLM提供者基类, AsyncIterator[流式事件]]] = {}
+
+        def 发起(提供者: LLM提供者基类) -> asyncio.Task:
+            流 = 提供者.流式发送消息(*参数).__aiter__()
+            任务 = asyncio.create_task(流.__anext__())
+            候选[任务] = (提供者, 流)
+            return 任务
+
+        主任务 = 发起(self.内部提供者)
+        对冲任务: Optional[asyncio.Task] = None
+        胜者: Optional[asyncio.Task] = None
+        try:
+            完成, _ = await asyncio.wait({主任务}, timeout=延迟)
+            if not 完成:
+                self._记录对冲(延迟)
+                对冲任务 = 发起(self.备用提供者)
+
+            待定 = set(候选)
+            首个异常: Optional[BaseException] = None
+            while 待定 and 胜者 is None:
+                完成, 待定 = await asyncio.wait(待定, return_when=asyncio.FIRST_COMPLETED)
+                for 任务 in sorted(完成, key=list(候选).index):
+                    if 任务.exception() is None:
+                        胜者 = 任务
+                        break
+                    首个异常 = 首个异常 or 任务.exception()
+
+            if 胜者 is None:
+                if isinstance(首个异常, StopAsyncIteration):
+                    return  # 流里一个事件都没有
+                raise 首个异常
+
+            提供者, 流 = 候选[胜者]
+            self._直方图(提供者, 流式=True).记录(time.perf_counter() - 开始)
+            self._记录获胜(胜者 is 对冲任务)
+
+            # 先收尾输掉的流，再继续转发获胜的流
+            for 任务, (_, 其他流) in 候选.items():
+                if 任务 is not 胜者:
+                    await self._关闭流(任务, 其他流)
+
+            yield 胜者.result()
+            async for 事件 in 流:
+                yield 事件
+        finally:
+            for 任务, (_, 流) in 候选.items():
+                if 任务 is not 胜者:
+                    await self._关闭流(任务, 流)
+
+    @staticmethod
+    async def _关闭流(任务: asyncio.Task, 流: AsyncIterator):
+        if not 任务.done():
+            await _取消并等待(任务)
+        关闭 = getattr(流, "aclose", None)
+        if 关闭 is not None:
+            with suppress(Exception):
+                await 关闭()
+
+    def 获取统计(self) -> dict:
+        return {
+            "对冲次数": self.对冲次数,
+            "对冲获胜次数": self.对冲获胜次数,
+            "对冲延迟毫秒": round(self.对冲延迟() * 1000)
+        }
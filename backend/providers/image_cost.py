@@ -0,0 +1,189 @@
+"""
+============================================
+图片令牌成本模型
+============================================
+这个文件负责回答："一张 宽x高 的截图，发给这个 Provider 要花多少令牌？"
+
+每家 Provider 把图片换算成令牌的规则都不一样：
+- OpenAI：先缩放（长边 ≤ 2048，短边 ≤ 768），再按 512x512 切块，
+  每块 170 令牌 + 固定 85 令牌；detail="low" 时固定 85 令牌
+- Anthropic：约 宽×高/750 令牌；长边超过 1568 或超过约 1600 令牌时先缩小
+- Gemini：两边都 ≤ 384 时固定 258 令牌；更大的图按 768x768 切块，每块 258 令牌
+
+知道了成本，截图流水线就不用再死守 1024x1024：
+- 给定每步的令牌预算 → 选预算内最大的分辨率
+- 给定文字可读性要求 → 选能看清文字的最小分辨率
+- 无论哪种，都不发送比 Provider 内部缩放后还大的图（多出来的像素只浪费上传时间）
+
+类比：寄快递前先查运费表，按"最多花多少钱"或"至少要多大箱子"来选箱子。
+"""
+
+import math
+from dataclasses import dataclass
+from typing import Optional
+
+from loguru import logger
+
+
+# 普通界面文字在原生分辨率下大约的高度（像素），用来把"可读性"换算成缩放比
+默认屏幕文字像素 = 14.0
+
+
+def _按比例缩放(宽: int, 高: int, 缩放比: float) -> tuple[int, int]:
+    return max(1, int(宽 * 缩放比)), max(1, int(高 * 缩放比))
+
+
+@dataclass(frozen=True)
+class 图片成本模型:
+    """
+    成本模型基类：默认不缩放、不收费
+
+    子类实现：
+    - 实际尺寸(): Provider 内部会把图片缩放到多大
+    - 预测令牌数(): 这张图会被计为多少令牌
+    """
+
+    def 实际尺寸(self, 宽: int, 高: int) -> tuple[int, int]:
+        """Provider 内部缩放之后，模型真正"看到"的尺寸"""
+        return 宽, 高
+
+    def 预测令牌数(self, 宽: int, 高: int) -> int:
+        return 0
+
+
+@dataclass(frozen=True)
+class OpenAI图片成本(图片成本模型):
+    """OpenAI（GPT-4o 系列）的切块计费规则"""
+    细节: str = "high"        # "high" / "low" / "auto"（auto 按 high 估算）
+    每块令牌: int = 170
+    基础令牌: int = 85
+
+    def 实际尺寸(self, 宽: int, 高: int) -> tuple[int, int]:
+        if self.细节 == "low":
+            return _按比例缩放(宽, 高, min(1.0, 512 / max(宽, 高)))
+        # 1. 先缩放到 2048x2048 以内
+        宽, 高 = _按比例缩放(宽, 高, min(1.0, 2048 / max(宽, 高)))
+        # 2. 再把短边缩到 768
+        return _按比例缩放(宽, 高, min(1.0, 768 / min(宽, 高)))
+
+    def 预测令牌数(self, 宽: int, 高: int) -> int:
+        if self.细节 == "low":
+            return self.基础令牌
+        宽, 高 = self.实际尺寸(宽, 高)
+        块数 = math.ceil(宽 / 512) * math.ceil(高 / 512)
+        return self.基础令牌 + self.每块令牌 * 块数
+
+
+@dataclass(frozen=True)
+class Anthropic图片成本(图片成本模型):
+    """Anthropic Claude 的按像素计费规则"""
+    每令牌像素: int = 750
+    最长边: int = 1568
+    最多令牌: int = 1600
+
+    def 实际尺寸(self, 宽: int, 高: int) -> tuple[int, int]:
+        缩放比 = min(
+            1.0,
+            self.最长边 / max(宽, 高),
+            math.sqrt(self.最多令牌 * self.每令牌像素 / (宽 * 高))
+        )
+        return _按比例缩放(宽, 高, 缩放比)
+
+    def 预测令牌数(self, 宽: int, 高: int) -> int:
+        宽, 高 = self.实际尺寸(宽, 高)
+        return math.ceil(宽 * 高 / self.每令牌像素)
+
+
+@dataclass(frozen=True)
+class Gemini图片成本(图片成本模型):
+    """Google Gemini 的 768 切块计费规则"""
+    每块令牌: int = 258
+    小图边长: int = 384
+    块边长: int = 768
+
+    def 预测令牌数(self, 宽: int, 高: int) -> int:
+        if 宽 <= self.小图边长 and 高 <= self.小图边长:
+            return self.每块令牌
+        return self.每块令牌 * math.ceil(宽 / self.块边长) * math.ceil(高 / self.块边长)
+
+
+@dataclass(frozen=True)
+class 分辨率策略:
+    """
+    按成本模型为每一帧选择截图尺寸
+
+    两种模式（可以同时使用）：
+    - 令牌预算：选预算内最大的分辨率
+    - 最小文字像素：选文字高度不低于这个值的最小分辨率（仍然受令牌预算限制）
+    两者都不设置时，只按 最大宽度 x 最大高度 限制（和以前的固定 1024 一样）。
+
+    这个对象会被传进观测执行器（可能是子进程），所以必须可以序列化。
+    """
+    成本模型: 图片成本模型
+    令牌预算: Optional[int] = None
+    最小文字像素: Optional[float] = None
+    屏幕文字像素: float = 默认屏幕文字像素
+    最大宽度: int = 1024
+    最大高度: int = 1024
+    最短边长: int = 256
+
+    def __call__(self, 屏幕宽: int, 屏幕高: int) -> tuple[int, int]:
+        """返回 (最大宽度, 最大高度)，交给截图流水线按比例缩放"""
+        return self.选择尺寸(屏幕宽, 屏幕高)
+
+    def 预测令牌数(self, 宽: int, 高: int) -> int:
+        return self.成本模型.预测令牌数(宽, 高)
+
+    def _长边对应尺寸(self, 屏幕宽: int, 屏幕高: int, 长边: int) -> tuple[int, int]:
+        return _按比例缩放(屏幕宽, 屏幕高, 长边 / max(屏幕宽, 屏幕高))
+
+    def 选择尺寸(self, 屏幕宽: int, 屏幕高: int) -> tuple[int, int]:
+        原长边 = max(屏幕宽, 屏幕高)
+
+        # 上限：不放大；没有预算/可读性要求时沿用固定上限；
+        # 也不超过 Provider 内部缩放后的尺寸（多发的像素会被它直接缩掉）
+        上限尺寸 = self.成本模型.实际尺寸(屏幕宽, 屏幕高)
+        if self.令牌预算 is None and self.最小文字像素 is None:
+            上限尺寸 = _按比例缩放(
+                屏幕宽, 屏幕高, min(1.0, self.最大宽度 / 屏幕宽, self.最大高度 / 屏幕高)
+            )
+        上限 = max(上限尺寸)
+
+        if self.令牌预算 is not None:
+            上限 = self._预算内最大长边(屏幕宽, 屏幕高, 上限)
+
+        if self.最小文字像素 is not None:
+            需要长边 = math.ceil(原长边 * self.最小文字像素 / self.屏幕文字像素)
+            if 需要长边 > 上限:
+                logger.debug(
+                    f"🔎 文字可读性需要长边 {需要长边}px，受预算/Provider 限制只能用 {上限}px"
+                )
+            上限 = min(上限, max(需要长边, self.最短边长))
+
+        return self._长边对应尺寸(屏幕宽, 屏幕高, max(1, min(上限, 原长边)))
+
+    def _预算内最大长边(self, 屏幕宽: int, 屏幕高: int, 上限: int) -> int:
+        """二分查找令牌数不超过预算的最大长边（令牌数随尺寸单调不减）"""
+        def 令牌数(长边: int) -> int:
+            return self.预测令牌数(*self._长边对应尺寸(屏幕宽, 屏幕高, 长边))
+
+        if 令牌数(上限) <= self.令牌预算:
+            return 上限
+
+        低, 高 = 1, 上限
+        while 低 < 高:
+            中 = (低 + 高 + 1) // 2
+            if 令牌数(中) <= self.令牌预算:
+                低 = 中
+            else:
+                高 = 中 - 1
+
+        # 预算是硬上限：放不下最短边长时照样按预算缩小，只是提醒一下
+        if 令牌数(低) > self.令牌预算:
+            logger.warning(f"⚠️ 图片令牌预算 {self.令牌预算} 太小，最小的截图也放不下")
+        elif 低 < min(self.最短边长, 上限):
+            logger.warning(
+                f"⚠️ 图片令牌预算 {self.令牌预算} 只放得下长边 {低}px 的截图"
+                f"（低于最短边长 {self.最短边长}px），文字可能看不清"
+            )
+        return 低
@@ -0,0 +1,382 @@
+"""
+============================================
+本地模型 Provider（兼容 OpenAI 协议）
+============================================
+这个文件负责对接跑在本机（或局域网）上的视觉模型服务，
+例如 vLLM、llama.cpp server、Ollama、LM Studio——它们都提供兼容 OpenAI 的
+/v1/chat/completions 接口，所以直接复用 `OpenAI提供者` 的请求构建和响应解析。
+
+和云端 API 不同的地方：
+1. 地址、模型名、并发上限都可以配置（本地显卡能同时处理的请求数有限）
+2. 不少本地模型不走标准的 tool_calls 字段，而是把工具调用直接写在回复文本里，
+   比如 `<tool_call>{"name": "left_click", "arguments": {...}}</tool_call>`，
+   这里会把它们解析出来；参数是对象而不是 JSON 字符串、没有调用 ID 的情况也都能处理。
+   流式调用时这些标记不会作为文字推给前端（见 `文本工具调用过滤器`）
+3. 微批处理：几个 Agent 同时运行时，在很短的窗口内到达的请求凑成一批一起发出
+   （类比：电梯在门口多等几秒，让一起到的人坐同一趟）。
+   本地推理服务会把同时到达的请求放进同一个批次做预填充和解码，
+   比一个接一个地到达更能吃满显卡
+
+用环境变量配置（见 registry.py）：
+    LOCAL_LLM_BASE_URL          服务地址，默认 http://127.0.0.1:8000/v1
+    LOCAL_LLM_MODEL             模型名称
+    LOCAL_LLM_MAX_CONCURRENCY   同时发给服务的最大请求数
+    LOCAL_LLM_BATCH_WINDOW_MS   凑批的等待窗口（毫秒），0 表示不等待
+"""
+
+import asyncio
+import json
+import re
+import uuid
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Optional
+
+from loguru import logger
+
+from .base import LLM响应, 工具调用, 流式事件
+from .openai_provider import OpenAI提供者
+
+
+# ============================================
+# 微批调度
+# ============================================
+
+@dataclass
+class _批处理状态:
+    """一个事件循环里的排队状态"""
+    等待: deque = field(default_factory=deque)      # 等待放行的 Future（先来先放行）
+    占用: int = 0                                    # 正在进行的请求数
+    有空位: asyncio.Event = field(default_factory=asyncio.Event)
+    派发任务: Optional[asyncio.Task] = None
+
+
+class 微批调度器:
+    """
+    限制同时进行的请求数，并把短时间内到达的请求成批放行
+
+    用法：
+        调度器 = 微批调度器(最大并发=4, 批处理窗口=0.01)
+        async with 调度器.槽位():
+            响应 = await client.chat.completions.create(...)
+    """
+
+    def __init__(self, 最大并发: int = 4, 批处理窗口: float = 0.01):
+        """
+        参数:
+            最大并发: 同时进行的最大请求数（也是一批最多放行几个）
+            批处理窗口: 有空位时先等这么多秒，让同时到达的请求凑成一批
+        """
+        if 最大并发 < 1:
+            raise ValueError("最大并发必须 >= 1")
+        self.最大并发 = 最大并发
+        self.批处理窗口 = 批处理窗口
+        # 每个事件循环一份状态（测试和多线程场景下可能有多个事件循环）
+        self._状态表: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _批处理状态]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.批次数 = 0
+        self.请求数 = 0
+        self.最大批量 = 0
+
+    def _状态(self) -> _批处理状态:
+        事件循环 = asyncio.get_running_loop()
+        状态 = self._状态表.get(事件循环)
+        if 状态 is None:
+            状态 = _批处理状态()
+            self._状态表[事件循环] = 状态
+        return 状态
+
+    @asynccontextmanager
+    async def 槽位(self):
+        """排队等待放行，放行后占用一个并发名额直到退出"""
+        状态 = self._状态()
+        放行 = asyncio.get_running_loop().create_future()
+        状态.等待.append(放行)
+        if 状态.派发任务 is None or 状态.派发任务.done():
+            状态.派发任务 = asyncio.create_task(self._派发(状态))
+
+        try:
+            await 放行
+        except asyncio.CancelledError:
+            if 放行.done() and not 放行.cancelled():
+                self._释放(状态)  # 刚被放行就被取消：把名额还回去
+            else:
+                放行.cancel()     # 还在排队：派发时会跳过
+            raise
+
+        try:
+            yield
+        finally:
+            self._释放(状态)
+
+    def _释放(self, 状态: _批处理状态):
+        状态.占用 -= 1
+        状态.有空位.set()
+
+    async def _派发(self, 状态: _批处理状态):
+        while 状态.等待:
+            空位 = self.最大并发 - 状态.占用
+            if 空位 <= 0:
+                状态.有空位.clear()
+                await 状态.有空位.wait()
+                continue
+
+            # 排队的请求还凑不满空位时，稍等一下，让同时到达的请求一起放行
+            if self.批处理窗口 > 0 and len(状态.等待) < 空位:
+                await asyncio.sleep(self.批处理窗口)
+                空位 = self.最大并发 - 状态.占用
+
+            批量 = 0
+            while 状态.等待 and 批量 < 空位:
+                放行 = 状态.等待.popleft()
+                if 放行.done():
+                    continue  # 排队时已经被取消
+                状态.占用 += 1
+                放行.set_result(None)
+                批量 += 1
+
+            if 批量:
+                self.批次数 += 1
+                self.请求数 += 批量
+                self.最大批量 = max(self.最大批量, 批量)
+                if 批量 > 1:
+                    logger.debug(f"📦 本地模型：{批量} 个请求合成一批发出")
+
+    def 获取统计(self) -> dict:
+        return {
+            "批次数": self.批次数,
+            "请求数": self.请求数,
+            "平均批量": round(self.请求数 / self.批次数, 2) if self.批次数 else 0.0,
+            "最大批量": self.最大批量
+        }
+
+
+# ============================================
+# 文本里的工具调用
+# ============================================
+
+# <tool_call>{...}</tool_call>（Qwen / Hermes 风格）或 ```json {...} ``` 代码块
+_工具调用标记 = re.compile(
+    r"<tool_call>\s*(\{.*?\})\s*</tool_call>|```(?:json)?\s*(\{.*?\})\s*```",
+    re.DOTALL
+)
+
+
+def 解析文本工具调用(文本: str) -> tuple[list[工具调用], Optional[str]]:
+    """
+    从回复文本里提取工具调用
+
+    返回:
+        (工具调用列表, 去掉工具调用之后剩下的文本)
+    """
+    调用列表: list[工具调用] = []
+
+    def 提取(片段: str) -> bool:
+        try:
+            数据 = json.loads(片段)
+        except json.JSONDecodeError:
+            return False
+        if not isinstance(数据, dict) or not isinstance(数据.get("name"), str):
+            return False
+        参数 = 数据.get("arguments", 数据.get("parameters", {}))
+        if isinstance(参数, str):
+            try:
+                参数 = json.loads(参数)
+            except json.JSONDecodeError:
+                参数 = {}
+        调用列表.append(工具调用(
+            工具名称=数据["name"],
+            参数=参数 if isinstance(参数, dict) else {},
+            工具调用ID=f"call_{uuid.uuid4().hex[:24]}"
+        ))
+        return True
+
+    def 替换(匹配: re.Match) -> str:
+        return "" if 提取(匹配.group(1) or 匹配.group(2)) else 匹配.group(0)
+
+    剩余 = _工具调用标记.sub(替换, 文本)
+    # 整段回复就是一个 JSON 对象
+    if not 调用列表 and 剩余.strip().startswith("{") and 提取(剩余.strip()):
+        剩余 = ""
+    return 调用列表, 剩余.strip() or None
+
+
+class 文本工具调用过滤器:
+    """
+    流式文本里的工具调用标记先扣住，不当作文字推出去
+
+    看到 <tool_call> 或 ``` 就开始扣留，直到标记闭合：是工具调用就丢掉（调用本身在
+    流结束后作为"工具调用"事件产出），不是就原样放出。回复一开头就是 { 的，可能整段
+    都是一个 JSON 工具调用，要等到流结束才能判断。
+
+    用法：
+        过滤器 = 文本工具调用过滤器()
+        可以推送的文字 = 过滤器.喂入(片段)
+        ...
+        最后剩下的文字 = 过滤器.结束(已解析出工具调用=True)
+    """
+
+    _开始标记 = ("<tool_call>", "```")
+    _结束标记 = {"<tool_call>": "</tool_call>", "```": "```"}
+
+    def __init__(self):
+        self._缓冲 = ""
+        self._已输出 = False    # 已经放出过非空白的文字
+        self._整段 = False      # 回复以 { 开头：整段扣到结束
+
+    def 喂入(self, 文本: str) -> str:
+        """加入一段流式文本，返回现在可以放出的文字"""
+        self._缓冲 += 文本
+        if not self._已输出 and not self._整段 and self._缓冲.strip():
+            self._整段 = self._缓冲.lstrip().startswith("{")
+        if self._整段:
+            return ""
+
+        输出 = ""
+        while self._缓冲:
+            位置, 标记 = min(
+                ((self._缓冲.find(标记), 标记) for 标记 in self._开始标记 if 标记 in self._缓冲),
+                default=(-1, "")
+            )
+            if 位置 < 0:
+                # 末尾可能是半个开始标记（如 "<tool_"），留到下一段再看
+                保留 = max(
+                    (长度 for 标记 in self._开始标记 for 长度 in range(1, len(标记))
+                     if self._缓冲.endswith(标记[:长度])),
+                    default=0
+                )
+                输出 += self._缓冲[:len(self._缓冲) - 保留]
+                self._缓冲 = self._缓冲[len(self._缓冲) - 保留:]
+                break
+
+            结束 = self._缓冲.find(self._结束标记[标记], 位置 + len(标记))
+            if 结束 < 0:
+                输出 += self._缓冲[:位置]
+                self._缓冲 = self._缓冲[位置:]
+                break
+            结束 += len(self._结束标记[标记])
+            片段 = self._缓冲[位置:结束]
+            调用列表, _ = 解析文本工具调用(片段)
+            输出 += self._缓冲[:位置] + ("" if 调用列表 else 片段)
+            self._缓冲 = self._缓冲[结束:]
+
+        self._已输出 = self._已输出 or bool(输出.strip())
+        return 输出
+
+    def 结束(self, 已解析出工具调用: bool) -> str:
+        """
+        流结束：返回还扣着的文字
+
+        参数:
+            已解析出工具调用: 整段文本最终解析出了工具调用（这时扣住的整段 JSON 不再放出）
+        """
+        剩余, self._缓冲 = self._缓冲, ""
+        if self._整段 and 已解析出工具调用:
+            调用列表, _ = 解析文本工具调用(剩余)
+            return "" if 调用列表 else 剩余
+        return 剩余
+
+
+class 本地提供者(OpenAI提供者):
+    """
+    兼容 OpenAI 协议的本地模型提供者
+
+    用法：
+        提供者 = 本地提供者(base_url="http://127.0.0.1:8000/v1", model="qwen2.5-vl-7b", 最大并发=2)
+    """
+
+    默认地址 = "http://127.0.0.1:8000/v1"
+    默认模型 = "local-model"
+    # llama.cpp 等服务不一定能解码 WebP
+    支持的媒体类型 = frozenset({"image/png", "image/jpeg"})
+
+    def __init__(
+        self,
+        api_key: str = "local",
+        model: str = 默认模型,
+        base_url: str = 默认地址,
+        最大并发: int = 4,
+        批处理窗口: float = 0.01,
+        图片细节: str = "auto",
+        http_client: Optional[Any] = None
+    ):
+        """
+        参数:
+            api_key: 大多数本地服务不校验，随便填；设置了 --api-key 的服务填对应的值
+            model: 服务加载的模型名称
+            base_url: 服务地址（含 /v1）
+            最大并发: 同时发给服务的最大请求数
+            批处理窗口: 凑批的等待秒数，0 表示来一个发一个
+            图片细节: 截图的 detail 参数（大多数本地服务会忽略）
+            http_client: 可选，自定义 HTTP 客户端（见 providers/registry.py）
+        """
+        super().__init__(api_key, model=model, 图片细节=图片细节, base_url=base_url, http_client=http_client)
+        self.base_url = base_url
+        self.批处理 = 微批调度器(最大并发, 批处理窗口)
+        logger.info(f"✅ 本地模型提供者已初始化: {base_url}（模型 {model}，最大并发 {最大并发}）")
+
+    async def 发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> LLM响应:
+        async with self.批处理.槽位():
+            响应 = await super().发送消息(对话历史, 截图base64, 截图媒体类型)
+        return self._补充文本工具调用(响应)
+
+    async def 流式发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> AsyncIterator[流式事件]:
+        过滤器 = 文本工具调用过滤器()
+        async with self.批处理.槽位():
+            async for 事件 in super().流式发送消息(对话历史, 截图base64, 截图媒体类型):
+                if 事件.类型 == "文本":
+                    文本 = 过滤器.喂入(事件.文本)
+                    if 文本:
+                        yield 流式事件(类型="文本", 文本=文本)
+                    continue
+                if 事件.类型 != "完成":
+                    yield 事件
+                    continue
+                # 工具调用写在文本里的，要等整段文本生成完才能解析
+                已有 = len(事件.响应.工具调用列表)
+                响应 = self._补充文本工具调用(事件.响应)
+                剩余 = 过滤器.结束(已解析出工具调用=len(响应.工具调用列表) > 已有)
+                if 剩余:
+                    yield 流式事件(类型="文本", 文本=剩余)
+                for 调用 in 响应.工具调用列表[已有:]:
+                    yield 流式事件(类型="工具调用", 工具调用=调用)
+                yield 流式事件(类型="完成", 响应=响应)
+
+    def _补充文本工具调用(self, 响应: LLM响应) -> LLM响应:
+        if 响应.工具调用列表 or not 响应.文本内容:
+            return 响应
+        调用列表, 剩余文本 = 解析文本工具调用(响应.文本内容)
+        if 调用列表:
+            响应.工具调用列表 = 调用列表
+            响应.文本内容 = 剩余文本
+        return 响应
+
+    @staticmethod
+    def _创建工具调用(名称: str, 参数JSON: Any, 调用ID: Optional[str]) -> 工具调用:
+        # 有的服务直接返回参数对象，也有的不给调用 ID
+        if isinstance(参数JSON, dict):
+            调用 = 工具调用(工具名称=名称, 参数=参数JSON, 工具调用ID=调用ID or "")
+        else:
+            调用 = OpenAI提供者._创建工具调用(名称, 参数JSON, 调用ID or "")
+        调用.工具调用ID = 调用.工具调用ID or f"call_{uuid.uuid4().hex[:24]}"
+        return 调用
+
+    def 获取统计(self) -> dict:
+        return {"地址": self.base_url, "模型": self.model, **self.批处理.获取统计()}
+
+    @property
+    def 提供者名称(self) -> str:
+        return "Local"
@@ -0,0 +1,134 @@
+"""
+============================================
+Provider 延迟统计
+============================================
+这个文件负责记录每个 Provider 的调用耗时，并回答"第 95% 慢的调用要多久"。
+
+用的是对数分桶的直方图（类比：按 10ms、12ms、15ms……这样越来越宽的格子计数）：
+- 记录一次耗时只是给一个格子加 1，不保存原始数据
+- 任意分位数都可以从格子计数里插值出来，误差在一个格子宽度以内（约 9%）
+- 可以只统计最近 N 次调用（滚动窗口），Provider 变快变慢时统计会跟着变
+
+同一个 Provider 的不同模型快慢差得很多（gpt-4o 和 gpt-4o-mini），所以按 (Provider, 模型) 分开统计。
+
+用法：
+    直方图 = 获取延迟直方图("OpenAI", "gpt-4o")
+    直方图.记录(1.23)
+    直方图.分位数(0.95)   # → 秒，样本不够时为 None
+"""
+
+import bisect
+import math
+import threading
+from collections import deque
+from typing import Optional
+
+
+class 延迟直方图:
+    """对数分桶的延迟直方图（可选滚动窗口）"""
+
+    def __init__(
+        self,
+        最小秒数: float = 0.01,
+        最大秒数: float = 300.0,
+        每倍桶数: int = 8,
+        窗口大小: Optional[int] = 500
+    ):
+        """
+        参数:
+            最小秒数 / 最大秒数: 直方图覆盖的范围，超出范围的值计入两端的格子
+            每倍桶数: 耗时每翻一倍分几个格子（越多越精确）
+            窗口大小: 只统计最近多少次调用，None 表示统计全部
+        """
+        倍数 = math.log2(最大秒数 / 最小秒数)
+        格子数 = math.ceil(倍数 * 每倍桶数)
+        # 第 i 个格子的上边界
+        self.边界 = [最小秒数 * 2 ** ((序号 + 1) / 每倍桶数) for 序号 in range(格子数)]
+        self.计数 = [0] * (格子数 + 1)   # 最后一个格子放超过最大秒数的值
+        self.每倍桶数 = 每倍桶数
+        self.窗口大小 = 窗口大小
+        self._最近: deque[int] = deque()
+        self._锁 = threading.Lock()
+        self.次数 = 0
+        self.总秒数 = 0.0
+
+    def 记录(self, 秒数: float):
+        序号 = bisect.bisect_left(self.边界, 秒数)
+        with self._锁:
+            self.计数[序号] += 1
+            self.次数 += 1
+            self.总秒数 += 秒数
+            if self.窗口大小 is not None:
+                self._最近.append(序号)
+                if len(self._最近) > self.窗口大小:
+                    self.计数[self._最近.popleft()] -= 1
+
+    @property
+    def 样本数(self) -> int:
+        """当前统计范围内的样本数（有滚动窗口时不超过窗口大小）"""
+        return len(self._最近) if self.窗口大小 is not None else self.次数
+
+    def 分位数(self, 比例: float) -> Optional[float]:
+        """
+        估算分位数（秒），如 分位数(0.95) 是 p95
+
+        在命中的格子内按对数线性插值；没有样本时返回 None。
+        """
+        if not 0 <= 比例 <= 1:
+            raise ValueError("比例必须在 0 到 1 之间")
+        with self._锁:
+            总数 = sum(self.计数)
+            if 总数 == 0:
+                return None
+            目标 = 比例 * 总数
+            累计 = 0
+            for 序号, 数量 in enumerate(self.计数):
+                if 数量 and 累计 + 数量 >= 目标:
+                    下界 = self.边界[序号 - 1] if 序号 > 0 else self.边界[0] / 2 ** (1 / self.每倍桶数)
+                    上界 = self.边界[序号] if 序号 < len(self.边界) else self.边界[-1]
+                    位置 = (目标 - 累计) / 数量
+                    return 下界 * (上界 / 下界) ** 位置
+                累计 += 数量
+            return self.边界[-1]
+
+    def 获取统计(self) -> dict:
+        def 毫秒(值: Optional[float]) -> Optional[int]:
+            return round(值 * 1000) if 值 is not None else None
+
+        return {
+            "次数": self.次数,
+            "平均毫秒": round(self.总秒数 / self.次数 * 1000) if self.次数 else None,
+            "p50毫秒": 毫秒(self.分位数(0.5)),
+            "p95毫秒": 毫秒(self.分位数(0.95)),
+            "p99毫秒": 毫秒(self.分位数(0.99))
+        }
+
+
+# 每个 (Provider, 模型, 指标) 一个直方图
+_直方图表: dict[tuple[str, Optional[str], str], 延迟直方图] = {}
+_表锁 = threading.Lock()
+
+
+def 获取延迟直方图(提供者: str, 模型: Optional[str] = None, 指标: str = "响应") -> 延迟直方图:
+    """
+    取出某个 Provider / 模型的延迟直方图（没有就创建）
+
+    参数:
+        提供者: Provider 名称
+        模型: 模型名称，None 表示 Provider 的默认模型
+        指标: "响应"（完整响应的耗时）或 "首事件"（流式调用第一个事件到达的时间）
+    """
+    键 = (提供者, 模型, 指标)
+    with _表锁:
+        直方图 = _直方图表.get(键)
+        if 直方图 is None:
+            直方图 = _直方图表[键] = 延迟直方图()
+        return 直方图
+
+
+def 获取全部延迟统计() -> dict[str, dict]:
+    with _表锁:
+        return {
+            f"{提供者}/{模型 or '默认模型'}/{指标}": 直方图.获取统计()
+            for (提供者, 模型, 指标), 直方图 in _直方图表.items()
+        }
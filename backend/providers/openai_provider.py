@@ -12,12 +12,16 @@ GPT-4o 支持：
 """
 
 import json
-from typing import Optional
+from typing import Any, AsyncIterator, Optional
 
 from openai import AsyncOpenAI
 from loguru import logger
 
-from .base import LLM提供者基类, LLM响应, 工具调用, COMPUTER_USE_TOOLS, SYSTEM_PROMPT
+from .base import (
+    LLM提供者基类, LLM响应, 工具调用, 流式事件, COMPUTER_USE_TOOLS, SYSTEM_PROMPT, 整理用量
+)
+from .image_cost import OpenAI图片成本
+from .templates import 请求模板, 消息转换缓存, 参数模式表
 
 
 class OpenAI提供者(LLM提供者基类):
@@ -25,69 +29,49 @@ class OpenAI提供者(LLM提供者基类):
     OpenAI GPT-4o 提供者适配器
     """
     
-    def __init__(self, api_key: str, model: str = "gpt-4o"):
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gpt-4o",
+        图片细节: str = "high",
+        base_url: Optional[str] = None,
+        http_client: Optional[Any] = None
+    ):
         """
         初始化 OpenAI 客户端
         
         参数:
             api_key: OpenAI API 密钥
             model: 使用的模型，默认 gpt-4o（支持视觉）
+            图片细节: 截图的 detail 参数（"high" / "low" / "auto"），决定图片按多少令牌计费
+            base_url: 可选，自定义 API 地址（兼容 OpenAI 协议的服务或本地测试服务器）
+            http_client: 可选，自定义 HTTP 客户端（连接池上限、keep-alive，见 providers/registry.py）
         """
         super().__init__(api_key)
-        self.client = AsyncOpenAI(api_key=api_key)
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
         self.model = model
+        self.图片细节 = 图片细节
+        self.图片成本模型 = OpenAI图片成本(细节=图片细节)
+        # 系统提示词和工具定义每一步都一样：只编译一次；历史消息的转换结果按消息对象缓存（见 templates.py 的 `消息转换缓存`）
+        self._模板 = 请求模板.编译(
+            SYSTEM_PROMPT.format(model_name=model), self._转换工具定义(), 参数模式表(COMPUTER_USE_TOOLS)
+        )
+        self._消息缓存 = 消息转换缓存(self._转换消息)
         logger.info(f"✅ OpenAI 提供者已初始化，模型: {model}")
     
     async def 发送消息(
         self,
         对话历史: list[dict],
-        截图base64: Optional[str] = None
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
     ) -> LLM响应:
         """
         发送消息给 GPT-4o
         """
         try:
-            # 构建消息列表
-            system_content = SYSTEM_PROMPT.format(model_name=self.model)
-            messages = [{"role": "system", "content": system_content}]
-            
-            # 添加对话历史
-            for 消息 in 对话历史:
-                messages.append({
-                    "role": 消息["role"],
-                    "content": 消息["content"]
-                })
-            
-            # 如果有截图，添加到最后一条消息
-            if 截图base64:
-                # 创建包含图片的消息
-                messages.append({
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "这是当前屏幕截图，请根据截图内容和之前的指令决定下一步操作。"
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{截图base64}",
-                                "detail": "high"  # 高分辨率模式
-                            }
-                        }
-                    ]
-                })
-            
-            # 将我们的工具定义转换为 OpenAI 格式
-            tools = self._转换工具定义()
-            
             # 调用 API
             response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                tools=tools,
-                tool_choice="auto",  # 让模型自己决定是否调用工具
-                max_tokens=1024
+                **self._构建请求参数(对话历史, 截图base64, 截图媒体类型)
             )
             
             # 解析响应
@@ -97,6 +81,145 @@ class OpenAI提供者(LLM提供者基类):
             logger.error(f"OpenAI API 调用失败: {e}")
             raise
     
+    async def 流式发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> AsyncIterator[流式事件]:
+        """
+        流式发送消息给 GPT-4o
+        
+        OpenAI 按 index 逐段下发工具调用的参数：
+        出现下一个 index（或生成结束）时，上一个工具调用的参数就完整了。
+        """
+        结果 = LLM响应()
+        文本片段: list[str] = []
+        进行中: dict[int, dict] = {}   # index → {"id", "name", "arguments"}
+        已产出: set[int] = set()
+        
+        def 完成工具调用(index: int) -> 流式事件:
+            已产出.add(index)
+            片段 = 进行中[index]
+            调用 = self._模板.检查(
+                self._创建工具调用(片段["name"], 片段["arguments"], 片段["id"]), self.提供者名称
+            )
+            结果.工具调用列表.append(调用)
+            return 流式事件(类型="工具调用", 工具调用=调用)
+        
+        try:
+            stream = await self.client.chat.completions.create(
+                **self._构建请求参数(对话历史, 截图base64, 截图媒体类型),
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            async with stream:   # 提前结束（消费者中止、对冲落败）时也要关闭响应，连接才能回到连接池
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        结果.用量 = self._整理用量(chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    
+                    choice = chunk.choices[0]
+                    delta = choice.delta
+                    if delta.content:
+                        文本片段.append(delta.content)
+                        yield 流式事件(类型="文本", 文本=delta.content)
+                    
+                    for 片段 in delta.tool_calls or []:
+                        if 片段.index not in 进行中:
+                            # 新的工具调用开始：之前的工具调用都已经完整
+                            for index in sorted(进行中.keys() - 已产出):
+                                yield 完成工具调用(index)
+                            进行中[片段.index] = {"id": "", "name": "", "arguments": ""}
+                        当前 = 进行中[片段.index]
+                        当前["id"] = 片段.id or 当前["id"]
+                        if 片段.function is not None:
+                            当前["name"] += 片段.function.name or ""
+                            当前["arguments"] += 片段.function.arguments or ""
+                    
+                    if choice.finish_reason is not None:
+                        for index in sorted(进行中.keys() - 已产出):
+                            yield 完成工具调用(index)
+            
+            # 连接提前结束时，也把已经收到的工具调用交出去
+            for index in sorted(进行中.keys() - 已产出):
+                yield 完成工具调用(index)
+        
+        except Exception as e:
+            logger.error(f"OpenAI 流式调用失败: {e}")
+            raise
+        
+        结果.文本内容 = "".join(文本片段) or None
+        yield 流式事件(类型="完成", 响应=结果)
+    
+    async def 验证连接(self):
+        """列出模型，验证 API 密钥（同时预热连接池）"""
+        await self.client.models.list()
+    
+    async def 关闭(self):
+        await self.client.close()
+    
+    def _构建请求参数(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str],
+        截图媒体类型: str
+    ) -> dict:
+        """构建 chat.completions.create 的参数（流式和非流式共用）"""
+        # 系统提示词来自预编译的模板，历史消息只转换新增的几条
+        messages = [{"role": "system", "content": self._模板.系统提示词}]
+        messages.extend(self._消息缓存.转换全部(对话历史))
+        
+        # 如果有截图，添加到最后一条消息
+        if 截图base64:
+            # 创建包含图片的消息
+            messages.append({
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "这是当前屏幕截图，请根据截图内容和之前的指令决定下一步操作。"
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{截图媒体类型};base64,{截图base64}",
+                            "detail": self.图片细节  # high 为高分辨率模式
+                        }
+                    }
+                ]
+            })
+        
+        return {
+            "model": self.model,
+            "messages": messages,
+            "tools": self._模板.工具列表(),  # 初始化时已转换为 OpenAI 格式
+            "tool_choice": "auto",  # 让模型自己决定是否调用工具
+            "max_tokens": 1024
+        }
+    
+    def _转换消息(self, 消息: dict) -> dict:
+        """把一条通用格式的消息转换为 OpenAI 格式（结果会被缓存复用）"""
+        return {"role": 消息["role"], "content": self._转换内容(消息["content"])}
+    
+    def _转换内容(self, 内容):
+        """
+        把对话历史里的内容（文字，或文字/图片部分列表）转换为 OpenAI 格式
+        """
+        if isinstance(内容, str):
+            return 内容
+        return [
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{部分['media_type']};base64,{部分['data']}",
+                    "detail": self.图片细节
+                }
+            } if 部分["type"] == "image" else {"type": "text", "text": 部分["text"]}
+            for 部分 in 内容
+        ]
+    
     def _转换工具定义(self) -> list[dict]:
         """
         将我们的通用工具定义转换为 OpenAI 的 Function Calling 格式
@@ -122,6 +245,11 @@ class OpenAI提供者(LLM提供者基类):
         
         结果 = LLM响应(原始响应=response)
         
+        # 提取令牌用量
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            结果.用量 = self._整理用量(usage)
+        
         # 提取文本内容
         if message.content:
             结果.文本内容 = message.content
@@ -130,19 +258,31 @@ class OpenAI提供者(LLM提供者基类):
         if message.tool_calls:
             for tool_call in message.tool_calls:
                 func = tool_call.function
-                try:
-                    参数 = json.loads(func.arguments) if func.arguments else {}
-                except json.JSONDecodeError:
-                    参数 = {}
-                
-                结果.工具调用列表.append(工具调用(
-                    工具名称=func.name,
-                    参数=参数,
-                    工具调用ID=tool_call.id
+                结果.工具调用列表.append(self._模板.检查(
+                    self._创建工具调用(func.name, func.arguments, tool_call.id), self.提供者名称
                 ))
         
         return 结果
     
+    @staticmethod
+    def _整理用量(usage) -> Optional[dict[str, int]]:
+        """OpenAI 的前缀缓存是自动的，只报告命中的令牌数（prompt_tokens 里已经包含）"""
+        详情 = getattr(usage, "prompt_tokens_details", None)
+        return 整理用量(
+            getattr(usage, "prompt_tokens", None),
+            getattr(usage, "completion_tokens", None),
+            getattr(详情, "cached_tokens", None)
+        )
+    
+    @staticmethod
+    def _创建工具调用(名称: str, 参数JSON: Optional[str], 调用ID: str) -> 工具调用:
+        """把函数名和 JSON 参数字符串转换为工具调用"""
+        try:
+            参数 = json.loads(参数JSON) if 参数JSON else {}
+        except json.JSONDecodeError:
+            参数 = {}
+        return 工具调用(工具名称=名称, 参数=参数, 工具调用ID=调用ID)
+    
     @property
     def 提供者名称(self) -> str:
         return "OpenAI"
@@ -0,0 +1,64 @@
+"""
+============================================
+提示词缓存（Prompt Caching）
+============================================
+这个文件负责让每一步请求尽量命中服务端的提示词缓存。
+
+Agent 每一步发出的请求，开头的一大段都和上一步一样：
+工具定义、系统提示词、用户指令、早先几步的对话。
+服务端可以把这段前缀的计算结果缓存起来，下一步直接复用——
+首个令牌出来得更快，命中缓存的令牌也便宜得多（Anthropic 约为 1/10）。
+
+前提是"前缀"真的逐字节相同（类比：书签只能夹在没改过的那几页后面）：
+1. OpenAI / Gemini 自动缓存最长的相同前缀，我们只需要保证消息顺序稳定：
+   不变的部分（系统提示词、指令、旧步骤）在前，会变的部分（带截图的近几步、当前截图）在后
+2. Anthropic 需要显式标出缓存断点（cache_control），最多 4 个。这里用 3 个：
+   - 工具定义之后
+   - 系统提示词之后
+   - 历史里"下一步也不会变"的最后一条消息之后（见 `稳定前缀长度`）
+
+带截图的消息在之后几步会被换成文字占位符（见 history.py），
+所以历史的稳定前缀止于第一条带截图的消息。
+"""
+
+from typing import Any
+
+
+def 缓存标记() -> dict:
+    """Anthropic 的缓存断点（每次返回新字典，避免多个请求共用同一个对象）"""
+    return {"type": "ephemeral"}
+
+
+def _带图片(内容: Any) -> bool:
+    return not isinstance(内容, str) and any(部分["type"] == "image" for 部分 in 内容)
+
+
+def 稳定前缀长度(对话历史: list[dict]) -> int:
+    """
+    对话历史（通用格式）里，下一步请求仍然保持不变的前缀有几条消息
+
+    也就是第一条带截图的消息之前的消息数；没有带截图的消息时是整个历史。
+    """
+    for 序号, 消息 in enumerate(对话历史):
+        if _带图片(消息["content"]):
+            return 序号
+    return len(对话历史)
+
+
+def 加缓存断点(消息: dict) -> dict:
+    """
+    在一条 Anthropic 格式消息的最后一个内容块上标记缓存断点
+
+    返回副本，不修改原消息：原消息是消息转换缓存里共用的转换结果。
+    """
+    内容 = 消息["content"]
+    if isinstance(内容, str):
+        if not 内容:
+            return 消息  # 空文本块不能标记断点
+        块列表 = [{"type": "text", "text": 内容}]
+    elif 内容:
+        块列表 = list(内容)
+    else:
+        return 消息
+    块列表[-1] = {**块列表[-1], "cache_control": 缓存标记()}
+    return {**消息, "content": 块列表}
@@ -0,0 +1,364 @@
+"""
+============================================
+Provider 注册表（复用 HTTP 连接）
+============================================
+这个文件负责让多个任务共用同一个 Provider 客户端。
+
+以前每次 /api/chat 都会新建一个 `OpenAI提供者`，也就新建一个 HTTP 客户端：
+每个任务的第一次 LLM 调用都要重新做 DNS 解析、TCP 握手和 TLS 握手，
+白白多出几百毫秒；旧客户端也从来没有被关闭。
+
+现在的做法（类比：出租车停在站台等客，而不是每次都从车库开出来）：
+1. 按 (Provider 名称, 模型, API Key 指纹) 缓存 Provider 实例，
+   同一组配置的任务直接拿到"热"的客户端，连接池里的 keep-alive 连接可以直接复用
+2. 连接池上限和 keep-alive 时间可以配置（见 `连接配置`）
+3. 缓存有数量上限，被挤出去的客户端和应用退出时的所有客户端都会被正确关闭；
+   任务用 `占用` / `释放` 登记正在使用的 Provider，被挤出去时如果还有任务在用，
+   等最后一个任务释放之后才关闭
+4. 取出的 Provider 外面包一层限流调度（见 scheduler.py），
+   同一个 API Key 的所有任务共用一个调度器，一起排队、一起退避；
+   开启对冲时对冲包在调度里面（见 hedging.py）：拿到调度名额之后才开始计时，
+   对冲请求和原请求共用这一个名额，两个都失败（例如 429）时由调度器统一退避重试
+5. 开启录制 / 回放时在最外面再包一层（见 replay.py），回放命中的请求不占限流配额
+
+API Key 本身不会出现在缓存键里，只保存它的 SHA-256 指纹。
+
+用法：
+    提供者 = 全局提供者注册表.获取("openai", api_key)
+    全局提供者注册表.占用(提供者)
+    try:
+        ...
+    finally:
+        全局提供者注册表.释放(提供者)
+    await 全局提供者注册表.关闭全部()   # 在 生命周期 的关闭阶段调用
+"""
+
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from loguru import logger
+
+from .base import LLM提供者基类
+from .hedging import 对冲提供者, 对冲策略
+from .replay import 回放存储, 回放提供者, 回放配置
+from .router import 路由提供者
+from .scheduler import 调度提供者, 调度配置, 限流调度器
+
+
+@dataclass(frozen=True)
+class 连接配置:
+    """
+    HTTP 连接池设置（OpenAI / Anthropic 客户端使用）
+
+    可以用环境变量覆盖：
+        LLM_MAX_CONNECTIONS      最大连接数
+        LLM_MAX_KEEPALIVE        最大空闲（keep-alive）连接数
+        LLM_KEEPALIVE_EXPIRY     空闲连接保持的秒数
+        LLM_CONNECT_TIMEOUT      建立连接的超时（秒）
+        LLM_READ_TIMEOUT         等待响应的超时（秒）
+    """
+    最大连接数: int = 20
+    最大空闲连接数: int = 10
+    空闲保持秒数: float = 60.0
+    连接超时: float = 10.0
+    读取超时: float = 120.0
+
+    @classmethod
+    def 从环境变量(cls) -> "连接配置":
+        默认 = cls()
+        return cls(
+            最大连接数=int(os.environ.get("LLM_MAX_CONNECTIONS", 默认.最大连接数)),
+            最大空闲连接数=int(os.environ.get("LLM_MAX_KEEPALIVE", 默认.最大空闲连接数)),
+            空闲保持秒数=float(os.environ.get("LLM_KEEPALIVE_EXPIRY", 默认.空闲保持秒数)),
+            连接超时=float(os.environ.get("LLM_CONNECT_TIMEOUT", 默认.连接超时)),
+            读取超时=float(os.environ.get("LLM_READ_TIMEOUT", 默认.读取超时))
+        )
+
+
+def 创建HTTP客户端(sdk: Any, 配置: 连接配置) -> Any:
+    """
+    用 SDK 自带的 HTTP 客户端类型创建一个带连接池设置的异步客户端
+
+    openai 和 anthropic 都导出了 DefaultAsyncHttpxClient / Timeout / DEFAULT_CONNECTION_LIMITS，
+    直接用它们，不需要关心 SDK 底层用的是哪个版本的 httpx。
+    """
+    连接上限类型 = type(sdk.DEFAULT_CONNECTION_LIMITS)
+    return sdk.DefaultAsyncHttpxClient(
+        limits=连接上限类型(
+            max_connections=配置.最大连接数,
+            max_keepalive_connections=配置.最大空闲连接数,
+            keepalive_expiry=配置.空闲保持秒数
+        ),
+        timeout=sdk.Timeout(配置.读取超时, connect=配置.连接超时)
+    )
+
+
+def 密钥指纹(api_key: str) -> str:
+    """API Key 的 SHA-256 指纹（前 16 位），只用于区分缓存条目"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+# ============================================
+# 各 Provider 的构造方式
+# ============================================
+
+def _创建OpenAI(api_key: str, model: Optional[str], 配置: 连接配置) -> LLM提供者基类:
+    import openai
+    from .openai_provider import OpenAI提供者
+
+    选项 = {"model": model} if model else {}
+    return OpenAI提供者(api_key, http_client=创建HTTP客户端(openai, 配置), **选项)
+
+
+def _创建Anthropic(api_key: str, model: Optional[str], 配置: 连接配置) -> LLM提供者基类:
+    import anthropic
+    from .anthropic_provider import Anthropic提供者
+
+    选项 = {"model": model} if model else {}
+    return Anthropic提供者(api_key, http_client=创建HTTP客户端(anthropic, 配置), **选项)
+
+
+def _创建Gemini(api_key: str, model: Optional[str], 配置: 连接配置) -> LLM提供者基类:
+    # 每个 Gemini 实例按自己的密钥创建 gRPC 客户端（不走进程全局的 genai.configure），这里只负责复用实例
+    from .gemini_provider import Gemini提供者
+
+    选项 = {"model": model} if model else {}
+    return Gemini提供者(api_key, **选项)
+
+
+def _创建本地(api_key: str, model: Optional[str], 配置: 连接配置) -> LLM提供者基类:
+    import openai
+    from .local_provider import 本地提供者
+
+    return 本地提供者(
+        api_key,
+        model=model or os.environ.get("LOCAL_LLM_MODEL", 本地提供者.默认模型),
+        base_url=os.environ.get("LOCAL_LLM_BASE_URL", 本地提供者.默认地址),
+        最大并发=int(os.environ.get("LOCAL_LLM_MAX_CONCURRENCY", 4)),
+        批处理窗口=float(os.environ.get("LOCAL_LLM_BATCH_WINDOW_MS", 10)) / 1000,
+        http_client=创建HTTP客户端(openai, 配置)
+    )
+
+
+class 提供者注册表:
+    """
+    按 (Provider 名称, 模型, API Key 指纹) 缓存的 Provider 实例（LRU）
+
+    注意：所有方法都应该在同一个事件循环里调用（FastAPI 的主循环）。
+    """
+
+    def __init__(
+        self,
+        最大数量: int = 8,
+        配置: Optional[连接配置] = None,
+        调度: Optional[调度配置] = None,
+        启用调度: bool = True,
+        对冲: Optional[对冲策略] = None,
+        回放: Optional[回放配置] = None
+    ):
+        """
+        参数:
+            最大数量: 最多同时保留几个 Provider 实例，超出时关闭最久没用的
+            配置: HTTP 连接池设置，默认从环境变量读取
+            调度: 限流调度设置，默认从环境变量读取
+            启用调度: 是否给取出的 Provider 包一层限流调度
+            对冲: 对冲策略，None 时从环境变量读取（没有设置 LLM_HEDGE_PERCENTILE 就不对冲）
+            回放: 录制 / 回放设置，None 时从环境变量读取（没有设置 LLM_REPLAY_MODE 就不启用）
+        """
+        if 最大数量 < 1:
+            raise ValueError("最大数量必须 >= 1")
+
+        self.最大数量 = 最大数量
+        self.配置 = 配置 or 连接配置.从环境变量()
+        self.调度 = 调度 or 调度配置.从环境变量()
+        self.启用调度 = 启用调度
+        self.对冲 = 对冲 or 对冲策略.从环境变量()
+        self.回放 = 回放 or 回放配置.从环境变量()
+        self._回放存储: Optional[回放存储] = None   # 所有 Provider 共用一个录制文件，用到时才打开
+        # 调度器按 (Provider 名称, API Key 指纹) 共享：同一个 Key 的不同模型共用一份配额
+        self._调度器: dict[tuple[str, str], 限流调度器] = {}
+        self.工厂表: dict[str, Callable[[str, Optional[str], 连接配置], LLM提供者基类]] = {
+            "openai": _创建OpenAI,
+            "anthropic": _创建Anthropic,
+            "gemini": _创建Gemini,
+            "local": _创建本地,
+        }
+        self._实例: "OrderedDict[tuple, LLM提供者基类]" = OrderedDict()
+        self._路由: dict[tuple, 路由提供者] = {}
+        self._关闭任务: set[asyncio.Task] = set()
+        # 正在被任务使用的 Provider：id → 占用次数；被淘汰但还在用的等释放后再关闭
+        self._占用数: dict[int, int] = {}
+        self._待关闭: dict[int, LLM提供者基类] = {}
+        self.命中次数 = 0
+        self.创建次数 = 0
+        self.淘汰次数 = 0
+
+    def 注册(self, 名称: str, 工厂: Callable[[str, Optional[str], 连接配置], LLM提供者基类]):
+        """注册（或替换）一种 Provider 的构造方式"""
+        self.工厂表[名称] = 工厂
+
+    def 获取(self, 名称: str, api_key: str, model: Optional[str] = None) -> LLM提供者基类:
+        """
+        取出一个可以直接使用的 Provider（没有就创建）
+
+        参数:
+            名称: Provider 名称（openai / anthropic / gemini / local）
+            api_key: API 密钥
+            model: 模型名称，None 表示用 Provider 的默认模型
+
+        异常:
+            ValueError: 未知的 Provider 名称
+        """
+        名称 = 名称.lower().strip()
+        工厂 = self.工厂表.get(名称)
+        if 工厂 is None:
+            raise ValueError(f"未知的 Provider: {名称}（可选: {', '.join(self.工厂表)}）")
+
+        键 = (名称, model, 密钥指纹(api_key))
+        提供者 = self._实例.get(键)
+        if 提供者 is not None:
+            self._实例.move_to_end(键)
+            self.命中次数 += 1
+            logger.debug(f"♻️ 复用 {提供者.提供者名称} 客户端（{名称}/{model or '默认模型'}）")
+            return 提供者
+
+        提供者 = 工厂(api_key, model, self.配置)
+        if self.对冲 is not None:
+            # 对冲在调度里面：排队和退避的时间不算进延迟直方图，也不会触发对冲
+            提供者 = 对冲提供者(提供者, 策略=self.对冲)
+        if self.启用调度:
+            提供者 = 调度提供者(提供者, self.获取调度器(名称, api_key))
+        if self.回放 is not None and self.回放.模式 != "passthrough":
+            提供者 = 回放提供者(提供者, self.获取回放存储(), 模式=self.回放.模式)
+        self._实例[键] = 提供者
+        self.创建次数 += 1
+        logger.info(f"🔌 新建 {提供者.提供者名称} 客户端（{名称}/{model or '默认模型'}）")
+
+        while len(self._实例) > self.最大数量:
+            _, 被淘汰 = self._实例.popitem(last=False)
+            self.淘汰次数 += 1
+            if self._占用数.get(id(被淘汰)):
+                # 还有任务在用：从缓存里拿掉，等最后一个任务释放后再关闭
+                self._待关闭[id(被淘汰)] = 被淘汰
+            else:
+                self._后台关闭(被淘汰)
+        return 提供者
+
+    def 获取路由(self, 策略: str, 密钥表: dict[str, str]) -> 路由提供者:
+        """
+        取出一个在多个 Provider 之间路由的提供者（没有就创建）
+
+        同一组 (策略, Provider, API Key) 复用同一个路由，延迟和错误率统计跨任务保留。
+
+        参数:
+            策略: fastest / cheapest / sticky
+            密钥表: Provider 名称 → API Key（顺序就是 sticky 策略的默认优先级）
+
+        异常:
+            ValueError: 未知的策略或 Provider 名称
+        """
+        密钥表 = {名称.lower().strip(): api_key for 名称, api_key in 密钥表.items()}
+        键 = (策略, tuple((名称, 密钥指纹(api_key)) for 名称, api_key in 密钥表.items()))
+        路由 = self._路由.get(键)
+        if 路由 is None:
+            路由 = 路由提供者(
+                {名称: self.获取(名称, api_key) for 名称, api_key in 密钥表.items()},
+                策略=策略
+            )
+            self._路由[键] = 路由
+        else:
+            # 底层 Provider 可能已经被淘汰、关闭，换成注册表里当前的实例
+            路由.提供者表 = {名称: self.获取(名称, api_key) for 名称, api_key in 密钥表.items()}
+        return 路由
+
+    def 占用(self, 提供者: LLM提供者基类):
+        """
+        登记一个任务开始使用这个 Provider（路由提供者登记它包着的每一个）
+
+        被占用的 Provider 即使被挤出缓存也不会马上关闭，每次 `占用` 都要对应一次 `释放`。
+        """
+        for 成员 in self._成员(提供者):
+            self._占用数[id(成员)] = self._占用数.get(id(成员), 0) + 1
+
+    def 释放(self, 提供者: LLM提供者基类):
+        """任务用完了这个 Provider；已经被淘汰、又没人再用的在这里关闭"""
+        for 成员 in self._成员(提供者):
+            剩余 = self._占用数.get(id(成员), 0) - 1
+            if 剩余 > 0:
+                self._占用数[id(成员)] = 剩余
+                continue
+            self._占用数.pop(id(成员), None)
+            被淘汰 = self._待关闭.pop(id(成员), None)
+            if 被淘汰 is not None:
+                self._后台关闭(被淘汰)
+
+    @staticmethod
+    def _成员(提供者: LLM提供者基类) -> list[LLM提供者基类]:
+        if isinstance(提供者, 路由提供者):
+            return list(提供者.提供者表.values())
+        return [提供者]
+
+    def 获取调度器(self, 名称: str, api_key: str) -> 限流调度器:
+        """取出 (Provider, API Key) 共用的限流调度器（没有就创建）"""
+        键 = (名称, 密钥指纹(api_key))
+        调度器 = self._调度器.get(键)
+        if 调度器 is None:
+            调度器 = 限流调度器(名称, self.调度)
+            self._调度器[键] = 调度器
+        return 调度器
+
+    def 获取回放存储(self) -> 回放存储:
+        """取出共用的录制文件（没有就打开）"""
+        if self._回放存储 is None:
+            配置 = self.回放 or 回放配置()
+            self._回放存储 = 回放存储(配置.文件路径, 配置.最大字节数, 配置.截图半径)
+        return self._回放存储
+
+    def _后台关闭(self, 提供者: LLM提供者基类):
+        """在后台关闭一个已经没有任务在用的客户端"""
+        try:
+            事件循环 = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # 没有事件循环（如同步测试），交给垃圾回收
+        任务 = 事件循环.create_task(self._安全关闭(提供者))
+        self._关闭任务.add(任务)
+        任务.add_done_callback(self._关闭任务.discard)
+
+    @staticmethod
+    async def _安全关闭(提供者: LLM提供者基类):
+        try:
+            await 提供者.关闭()
+        except Exception as e:
+            logger.warning(f"⚠️ 关闭 {提供者.提供者名称} 客户端失败: {e}")
+
+    async def 关闭全部(self):
+        """关闭所有缓存的客户端（应用退出时调用）"""
+        实例列表 = list(self._实例.values()) + list(self._待关闭.values())
+        self._实例.clear()
+        self._待关闭.clear()
+        self._占用数.clear()
+        await asyncio.gather(
+            *(self._安全关闭(提供者) for 提供者 in 实例列表),
+            *list(self._关闭任务)
+        )
+        if 实例列表:
+            logger.info(f"🔌 已关闭 {len(实例列表)} 个 Provider 客户端")
+
+    def 获取统计(self) -> dict:
+        return {
+            "实例数": len(self._实例),
+            "命中次数": self.命中次数,
+            "创建次数": self.创建次数,
+            "淘汰次数": self.淘汰次数
+        }
+
+    def __len__(self) -> int:
+        return len(self._实例)
+
+
+# 全局 Provider 注册表实例（main.py 使用）
+全局提供者注册表 = 提供者注册表()
@@ -0,0 +1,408 @@
+"""
+============================================
+LLM 响应录制 / 回放缓存
+============================================
+这个文件负责让同一个任务可以"不联网、不花钱"地重跑。
+
+做基准测试和回归测试时，同样的任务每跑一次都要重新调用付费 API，
+而且每次的回复都可能不一样，结果没法直接比较。
+
+做法（类比：第一次把整盘棋的每一步记在棋谱上，之后照着棋谱复盘）：
+1. 每次调用按"这次请求的内容"算出一个键，分成两部分：
+   - 文字部分：系统提示词 + 工具定义 + 对话历史里的文字（再加上 Provider 名称和模型），要求完全相同。
+     屏幕差异摘要（"变化 0.3%，区域 ..."）和据此加上的临时提示每次运行都可能不一样
+     （时钟走了一格、光标闪了一下），先统一替换掉再算哈希
+   - 截图部分：历史里每张截图和当前截图的 256 位感知哈希（tools/image_hash.py 的差值哈希），
+     和录制时的截图逐张比较，汉明距离都在半径之内就算命中（和屏幕状态索引的做法一样）
+2. 三种模式：
+   - record：正常调用 Provider，把响应追加写入本地文件
+   - replay：只从文件里取响应，取不到就报错（保证整个任务完全不联网）
+   - passthrough：什么都不做，直接转发
+3. 文件是只追加的 JSON Lines，启动时读入内存建索引；同一个键出现多次时以最后一次为准
+4. 文件有大小上限，超过之后不再写入（只记警告，不影响任务本身）
+
+用环境变量开启（见 `回放配置`）：
+    LLM_REPLAY_MODE=record   LLM_REPLAY_FILE=replay/llm.jsonl
+"""
+
+import base64
+import hashlib
+import io
+import json
+import os
+import re
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Optional, Union
+
+from loguru import logger
+from PIL import Image
+
+from tools.image_hash import 差值哈希, 汉明距离
+
+from .base import COMPUTER_USE_TOOLS, SYSTEM_PROMPT, LLM提供者基类, LLM响应, 工具调用, 流式事件, 包装提供者基类, 模型名称
+
+
+回放模式列表 = ("record", "replay", "passthrough")
+
+
+class 回放未命中(LookupError):
+    """replay 模式下，文件里没有这次请求对应的响应"""
+
+
+@dataclass(frozen=True)
+class 回放配置:
+    """
+    录制 / 回放设置
+
+    可以用环境变量设置：
+        LLM_REPLAY_MODE       record / replay / passthrough，不设置表示不启用
+        LLM_REPLAY_FILE       缓存文件路径
+        LLM_REPLAY_MAX_MB     缓存文件大小上限（MB）
+        LLM_REPLAY_RADIUS     截图匹配的汉明距离半径（256 位哈希）
+    """
+    模式: str = "passthrough"
+    文件路径: str = "llm_replay.jsonl"
+    最大字节数: int = 200 * 1024 * 1024
+    截图半径: int = 8
+
+    def __post_init__(self):
+        if self.模式 not in 回放模式列表:
+            raise ValueError(f"未知的回放模式: {self.模式}（可选: {', '.join(回放模式列表)}）")
+
+    @classmethod
+    def 从环境变量(cls) -> Optional["回放配置"]:
+        模式 = os.environ.get("LLM_REPLAY_MODE", "").strip().lower()
+        if not 模式 or 模式 == "passthrough":
+            return None
+        return cls(
+            模式=模式,
+            文件路径=os.environ.get("LLM_REPLAY_FILE", cls.文件路径),
+            最大字节数=int(float(os.environ.get("LLM_REPLAY_MAX_MB", cls.最大字节数 / 1024 / 1024)) * 1024 * 1024),
+            截图半径=int(os.environ.get("LLM_REPLAY_RADIUS", cls.截图半径))
+        )
+
+
+# ============================================
+# 请求 → 键
+# ============================================
+
+def 图片哈希(base64数据: str, 哈希尺寸: int = 16) -> Optional[int]:
+    """
+    截图的感知哈希（tools/image_hash.py 的差值哈希，默认 256 位）
+
+    不是合法图片时（例如测试里的占位数据）返回 None，这时按内容精确匹配。
+    """
+    try:
+        with Image.open(io.BytesIO(base64.b64decode(base64数据))) as 图像:
+            return 差值哈希(图像, 哈希尺寸=哈希尺寸)
+    except Exception:
+        return None
+
+
+# 每次运行都可能不同的文字 → 替换成的内容。
+# 屏幕差异摘要见 tools/frame_diff.py 的 `差异结果.摘要`，临时提示见 agent_loop.py
+_易变文本 = [
+    (re.compile(r"变化 [\d.]+%，区域 (?:\(\d+,\d+,\d+x\d+\)(?:, )?)+(?: 等 \d+ 处)?|无可见变化"), "〈屏幕变化〉"),
+    (re.compile(r"注意：(?:上一步操作之后屏幕没有任何可见变化|当前屏幕和第 \d+ 步时几乎相同)[^\n]*\n?"), ""),
+]
+
+
+def 规范化文本(文本: str) -> str:
+    """去掉每次运行都可能不同的文字（屏幕差异摘要、据此加上的临时提示）"""
+    for 模式, 替换 in _易变文本:
+        文本 = 模式.sub(替换, 文本)
+    return 文本.strip()
+
+
+def _规范化内容(内容: Any, 截图哈希: list[int]) -> Any:
+    # 能算出感知哈希的图片只留一个占位，哈希按顺序收进 截图哈希；其余图片按内容哈希计入
+    if isinstance(内容, str):
+        return 规范化文本(内容)
+    if isinstance(内容, list):
+        return [_规范化内容(部分, 截图哈希) for 部分 in 内容]
+    if isinstance(内容, dict):
+        if 内容.get("type") == "image" and isinstance(内容.get("data"), str):
+            哈希 = 图片哈希(内容["data"])
+            if 哈希 is None:
+                return {"type": "image", "sha256": hashlib.sha256(内容["data"].encode("utf-8")).hexdigest()}
+            截图哈希.append(哈希)
+            return {"type": "image"}
+        return {键: _规范化内容(值, 截图哈希) for 键, 值 in 内容.items()}
+    return 内容
+
+
+@dataclass(frozen=True)
+class 请求键:
+    """
+    一次请求的键：文字部分要求完全相同，截图部分允许细微差别
+
+    文本键: 规范化之后的请求文字的 SHA-256
+    截图哈希: 历史里每张截图和当前截图的感知哈希（按出现顺序）
+    """
+    文本键: str
+    截图哈希: tuple[int, ...] = ()
+
+    def 距离(self, 截图哈希: tuple[int, ...], 半径: int) -> Optional[int]:
+        """和录制时的截图逐张比较：都在半径之内时返回总距离，否则返回 None"""
+        if len(截图哈希) != len(self.截图哈希):
+            return None
+        总距离 = 0
+        for 当前, 录制 in zip(self.截图哈希, 截图哈希):
+            距离 = 汉明距离(当前, 录制)
+            if 距离 > 半径:
+                return None
+            总距离 += 距离
+        return 总距离
+
+    def __str__(self) -> str:
+        return self.文本键[:12]
+
+
+def 计算请求键(
+    命名空间: str,
+    对话历史: list[dict],
+    截图base64: Optional[str] = None
+) -> 请求键:
+    """
+    一次请求的规范化键
+
+    参数:
+        命名空间: 区分不同 Provider / 模型的前缀，如 "OpenAI/gpt-4o"
+        对话历史: 发给 Provider 的对话历史（易变文字先规范化，图片按感知哈希计入）
+        截图base64: 当前截图（按感知哈希计入）
+    """
+    截图哈希: list[int] = []
+    历史 = []
+    for 消息 in 对话历史:
+        规范化 = _规范化内容(消息, 截图哈希)
+        if 规范化.get("content") != "":
+            历史.append(规范化)   # 只剩临时提示的消息整条去掉
+    请求 = {
+        "命名空间": 命名空间,
+        "系统提示词": SYSTEM_PROMPT,
+        "工具": COMPUTER_USE_TOOLS,
+        "历史": 历史,
+        "截图": _规范化内容({"type": "image", "data": 截图base64}, 截图哈希) if 截图base64 else None
+    }
+    文本 = json.dumps(请求, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return 请求键(hashlib.sha256(文本.encode("utf-8")).hexdigest(), tuple(截图哈希))
+
+
+# ============================================
+# 存储
+# ============================================
+
+def 序列化响应(响应: LLM响应) -> dict:
+    """LLM响应 → 可以写进 JSON 的字典（不保存原始响应）"""
+    return {
+        "文本内容": 响应.文本内容,
+        "工具调用列表": [asdict(调用) for 调用 in 响应.工具调用列表],
+        "用量": 响应.用量
+    }
+
+
+def 反序列化响应(数据: dict) -> LLM响应:
+    return LLM响应(
+        文本内容=数据.get("文本内容"),
+        工具调用列表=[工具调用(**调用) for 调用 in 数据.get("工具调用列表", [])],
+        用量=数据.get("用量")
+    )
+
+
+class 回放存储:
+    """
+    只追加的响应缓存文件（JSON Lines，一行一个 {"键", "截图", "响应", "时间"}）
+
+    "键"是请求文字的哈希，"截图"是各张截图感知哈希的十六进制。
+    同一个进程里的多个 Provider 可以共用一个存储（键里带着命名空间）。
+    """
+
+    def __init__(
+        self,
+        文件路径: str,
+        最大字节数: int = 回放配置.最大字节数,
+        截图半径: int = 回放配置.截图半径
+    ):
+        self.文件路径 = Path(文件路径)
+        self.最大字节数 = 最大字节数
+        self.截图半径 = 截图半径
+        # 文本键 → {截图哈希: 响应}；同一组截图后写入的覆盖先写入的
+        self._索引: dict[str, dict[tuple[int, ...], dict]] = {}
+        self._已满警告 = False
+        self._补换行 = False   # 文件最后一行不完整时，下一条记录要先换行
+        self.写入次数 = 0
+        self.拒绝写入次数 = 0
+        self._加载()
+
+    def _加载(self):
+        if not self.文件路径.exists():
+            return
+        损坏行数 = 0
+        with self.文件路径.open("r", encoding="utf-8") as 文件:
+            for 行 in 文件:
+                self._补换行 = not 行.endswith("\n")
+                try:
+                    条目 = json.loads(行)
+                    截图哈希 = tuple(int(值, 16) for 值 in 条目.get("截图", []))
+                    self._索引.setdefault(条目["键"], {})[截图哈希] = 条目["响应"]
+                except (ValueError, KeyError, TypeError):
+                    损坏行数 += 1  # 例如上次写到一半时进程被杀
+        logger.info(f"📼 载入 {len(self)} 条录制的 LLM 响应（{self.文件路径}）")
+        if 损坏行数:
+            logger.warning(f"⚠️ 跳过 {损坏行数} 行无法解析的录制数据")
+
+    @property
+    def 字节数(self) -> int:
+        return self.文件路径.stat().st_size if self.文件路径.exists() else 0
+
+    @staticmethod
+    def _转键(键: Union[请求键, str]) -> 请求键:
+        return 键 if isinstance(键, 请求键) else 请求键(键)
+
+    def 读取(self, 键: Union[请求键, str]) -> Optional[LLM响应]:
+        """
+        找文字完全相同、每张截图都在半径之内的录制响应
+
+        有多条候选时取总距离最小的；距离相同时取最后录制的。
+        """
+        键 = self._转键(键)
+        最佳数据, 最佳距离 = None, None
+        for 截图哈希, 数据 in self._索引.get(键.文本键, {}).items():
+            距离 = 键.距离(截图哈希, self.截图半径)
+            if 距离 is not None and (最佳距离 is None or 距离 <= 最佳距离):
+                最佳数据, 最佳距离 = 数据, 距离
+        return 反序列化响应(最佳数据) if 最佳数据 is not None else None
+
+    def 写入(self, 键: Union[请求键, str], 响应: LLM响应) -> bool:
+        """追加一条记录，超过大小上限时不写入并返回 False"""
+        键 = self._转键(键)
+        数据 = 序列化响应(响应)
+        行 = json.dumps({
+            "键": 键.文本键,
+            "截图": [format(哈希, "x") for 哈希 in 键.截图哈希],
+            "响应": 数据,
+            "时间": time.time()
+        }, ensure_ascii=False) + "\n"
+        行字节 = ("\n" if self._补换行 else "").encode("utf-8") + 行.encode("utf-8")
+
+        if self.字节数 + len(行字节) > self.最大字节数:
+            self.拒绝写入次数 += 1
+            if not self._已满警告:
+                self._已满警告 = True
+                logger.warning(
+                    f"⚠️ 录制文件已达到上限 {self.最大字节数 / 1024 / 1024:.0f}MB，"
+                    f"之后的响应不再写入（{self.文件路径}）"
+                )
+            return False
+
+        self.文件路径.parent.mkdir(parents=True, exist_ok=True)
+        with self.文件路径.open("ab") as 文件:
+            文件.write(行字节)  # 一行一次写入，进程中途退出最多损坏最后一行
+        self._补换行 = False
+        候选 = self._索引.setdefault(键.文本键, {})
+        候选.pop(键.截图哈希, None)   # 重新插入，让它排在最后（距离相同时后写入的优先）
+        候选[键.截图哈希] = 数据
+        self.写入次数 += 1
+        return True
+
+    def __contains__(self, 键: Union[请求键, str]) -> bool:
+        return self.读取(键) is not None
+
+    def __len__(self) -> int:
+        return sum(len(候选) for 候选 in self._索引.values())
+
+
+# ============================================
+# Provider
+# ============================================
+
+class 回放提供者(包装提供者基类):
+    """
+    按请求内容录制 / 回放 LLM 响应的 Provider
+
+    用法：
+        存储 = 回放存储("replay/llm.jsonl")
+        提供者 = 回放提供者(OpenAI提供者(key), 存储, 模式="record")    # 第一次：录制
+        提供者 = 回放提供者(OpenAI提供者(key), 存储, 模式="replay")    # 之后：不联网重跑
+    """
+
+    def __init__(self, 内部提供者: LLM提供者基类, 存储: 回放存储, 模式: str = "replay"):
+        """
+        参数:
+            内部提供者: 真正发请求的 Provider（replay 模式下不会被调用）
+            存储: 录制文件
+            模式: record / replay / passthrough
+        """
+        if 模式 not in 回放模式列表:
+            raise ValueError(f"未知的回放模式: {模式}（可选: {', '.join(回放模式列表)}）")
+        super().__init__(内部提供者)
+        self.存储 = 存储
+        self.模式 = 模式
+        模型 = 模型名称(内部提供者)
+        self.命名空间 = f"{内部提供者.提供者名称}/{模型}" if 模型 else 内部提供者.提供者名称
+        self.命中次数 = 0
+        self.未命中次数 = 0
+
+    def _取出(self, 键: 请求键) -> LLM响应:
+        响应 = self.存储.读取(键)
+        if 响应 is None:
+            self.未命中次数 += 1
+            raise 回放未命中(f"录制文件里没有这次请求的响应（{self.命名空间}，键 {键}）")
+        self.命中次数 += 1
+        logger.debug(f"📼 回放 {self.命名空间} 的响应（键 {键}）")
+        return 响应
+
+    def _录制(self, 键: 请求键, 响应: LLM响应):
+        if self.存储.写入(键, 响应):
+            logger.debug(f"📼 录制 {self.命名空间} 的响应（键 {键}）")
+
+    async def 发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> LLM响应:
+        if self.模式 == "passthrough":
+            return await self.内部提供者.发送消息(对话历史, 截图base64, 截图媒体类型)
+
+        键 = 计算请求键(self.命名空间, 对话历史, 截图base64)
+        if self.模式 == "replay":
+            return self._取出(键)
+
+        响应 = await self.内部提供者.发送消息(对话历史, 截图base64, 截图媒体类型)
+        self._录制(键, 响应)
+        return 响应
+
+    async def 流式发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> AsyncIterator[流式事件]:
+        if self.模式 == "replay":
+            # 回放的响应一次性产出（和基类默认的流式实现一样）
+            async for 事件 in LLM提供者基类.流式发送消息(self, 对话历史, 截图base64, 截图媒体类型):
+                yield 事件
+            return
+
+        键 = 计算请求键(self.命名空间, 对话历史, 截图base64) if self.模式 == "record" else None
+        async for 事件 in self.内部提供者.流式发送消息(对话历史, 截图base64, 截图媒体类型):
+            if 键 is not None and 事件.类型 == "完成" and 事件.响应 is not None:
+                self._录制(键, 事件.响应)
+            yield 事件
+
+    async def 验证连接(self):
+        if self.模式 != "replay":
+            await self.内部提供者.验证连接()
+
+    def 获取统计(self) -> dict:
+        return {
+            "模式": self.模式,
+            "条目数": len(self.存储),
+            "命中次数": self.命中次数,
+            "未命中次数": self.未命中次数,
+            "写入次数": self.存储.写入次数,
+            "拒绝写入次数": self.存储.拒绝写入次数
+        }
@@ -0,0 +1,252 @@
+"""
+============================================
+多 Provider 路由
+============================================
+这个文件负责在多个 Provider 之间挑选"这一步交给谁"。
+
+以前一个任务从头到尾只用 /api/config 里选的那一个 Provider：
+它变慢了、出错了，任务也只能跟着慢、跟着失败。
+
+路由提供者本身也是一个 `LLM提供者基类`，里面包着好几个 Provider，
+为每个 Provider 维护滚动统计（最近 100 次的 p50/p95 延迟、最近 20 次的错误率），
+每一步按策略排出候选顺序，第一个失败就换下一个（类比：导航软件按实时路况选路）：
+- fastest：选最近 p50 延迟最低的（还没有数据的 Provider 先试一次）
+- cheapest：选单价最低的
+- sticky：一直用同一个，直到它出错才切换到下一个（切换后就"粘"在新的上）
+
+不健康的 Provider（错误率过高，或连续失败后处于熔断期）排到最后，只在别的都失败时才用。
+
+任务中途换 Provider 也不会乱：
+- 对话历史本来就是和 Provider 无关的格式（见 history.py），各 Provider 自己转换
+- 工具调用统一整理：工具名小写、整数坐标不会变成 500.0、没有 ID 的补上唯一 ID
+"""
+
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+
+from loguru import logger
+
+from .base import LLM提供者基类, LLM响应, 工具调用, 流式事件
+from .metrics import 延迟直方图
+
+
+路由策略列表 = ("fastest", "cheapest", "sticky")
+
+# 默认模型的公开价格（美元 / 百万令牌：输入, 输出），只用于 cheapest 策略排序
+默认价格表: dict[str, tuple[float, float]] = {
+    "gemini": (0.10, 0.40),
+    "openai": (2.50, 10.00),
+    "anthropic": (3.00, 15.00),
+}
+
+
+@dataclass
+class 路由统计:
+    """一个 Provider 的滚动健康统计"""
+    延迟: 延迟直方图 = field(default_factory=lambda: 延迟直方图(窗口大小=100))
+    结果: deque = field(default_factory=lambda: deque(maxlen=20))   # True = 成功
+    连续失败: int = 0
+    熔断到: float = 0.0
+
+    @property
+    def 错误率(self) -> float:
+        return self.结果.count(False) / len(self.结果) if self.结果 else 0.0
+
+    def 记录(self, 成功: bool, 耗时: float, 熔断阈值: int, 熔断秒数: float):
+        self.结果.append(成功)
+        if 成功:
+            self.延迟.记录(耗时)
+            self.连续失败 = 0
+            return
+        self.连续失败 += 1
+        if self.连续失败 >= 熔断阈值:
+            self.熔断到 = time.monotonic() + 熔断秒数
+
+    def 健康(self, 最大错误率: float) -> bool:
+        if time.monotonic() < self.熔断到:
+            return False
+        return len(self.结果) < 5 or self.错误率 <= 最大错误率
+
+    def 获取统计(self) -> dict:
+        统计 = self.延迟.获取统计()
+        return {
+            "p50毫秒": 统计["p50毫秒"],
+            "p95毫秒": 统计["p95毫秒"],
+            "错误率": round(self.错误率, 3),
+            "熔断中": time.monotonic() < self.熔断到
+        }
+
+
+def _整理参数值(值):
+    # Gemini 的数字参数都是浮点数（500.0），统一成整数，和其他 Provider 一致
+    if isinstance(值, float) and 值.is_integer():
+        return int(值)
+    return 值
+
+
+def 统一工具调用(调用: 工具调用) -> 工具调用:
+    """把不同 Provider 返回的工具调用整理成相同的形式"""
+    return 工具调用(
+        工具名称=调用.工具名称.strip().lower(),
+        参数={键: _整理参数值(值) for 键, 值 in 调用.参数.items()},
+        工具调用ID=调用.工具调用ID or f"call_{uuid.uuid4().hex[:24]}"
+    )
+
+
+class 路由提供者(LLM提供者基类):
+    """
+    按策略把每一步路由到某个 Provider，失败时自动换下一个
+
+    用法：
+        路由 = 路由提供者({"openai": OpenAI提供者(k1), "gemini": Gemini提供者(k2)}, 策略="fastest")
+        agent = AgentLoop(提供者=路由)
+    """
+
+    def __init__(
+        self,
+        提供者表: dict[str, LLM提供者基类],
+        策略: str = "fastest",
+        价格表: Optional[dict[str, tuple[float, float]]] = None,
+        最大错误率: float = 0.5,
+        熔断阈值: int = 3,
+        熔断秒数: float = 30.0
+    ):
+        """
+        参数:
+            提供者表: 名称 → Provider（顺序就是 sticky 策略的默认优先级）
+            策略: fastest / cheapest / sticky
+            价格表: 名称 → (输入单价, 输出单价)，cheapest 策略使用，默认用公开价格
+            最大错误率: 最近的错误率超过这个值就视为不健康
+            熔断阈值 / 熔断秒数: 连续失败这么多次后，暂停使用这么多秒
+        """
+        if not 提供者表:
+            raise ValueError("至少需要一个 Provider")
+        if 策略 not in 路由策略列表:
+            raise ValueError(f"未知的路由策略: {策略}（可选: {', '.join(路由策略列表)}）")
+
+        super().__init__("")
+        self.提供者表 = dict(提供者表)
+        self.策略 = 策略
+        self.价格表 = {**默认价格表, **(价格表 or {})}
+        self.最大错误率 = 最大错误率
+        self.熔断阈值 = 熔断阈值
+        self.熔断秒数 = 熔断秒数
+        self.统计表 = {名称: 路由统计() for 名称 in self.提供者表}
+        self.当前 = next(iter(self.提供者表))   # sticky 策略正在使用的 Provider
+        self.切换次数 = 0
+
+        # 截图在选定 Provider 之前就编码好了，所以取所有 Provider 都能接受的设置
+        提供者列表 = list(self.提供者表.values())
+        self.图片字节预算 = min(提供者.图片字节预算 for 提供者 in 提供者列表)
+        self.支持的媒体类型 = frozenset.intersection(
+            *(提供者.支持的媒体类型 for 提供者 in 提供者列表)
+        ) or frozenset({"image/png"})
+        self.图片成本模型 = 提供者列表[0].图片成本模型
+
+    @property
+    def 提供者名称(self) -> str:
+        return f"路由({self.策略})"
+
+    def 候选顺序(self) -> list[str]:
+        """这一步依次尝试的 Provider 名称（健康的在前）"""
+        名称列表 = list(self.提供者表)
+        if self.策略 == "fastest":
+            # 没有延迟数据的排在最前，先探测一次
+            名称列表.sort(key=lambda 名称: (
+                self.统计表[名称].延迟.分位数(0.5) or 0.0,
+                self.统计表[名称].延迟.分位数(0.95) or 0.0
+            ))
+        elif self.策略 == "cheapest":
+            名称列表.sort(key=lambda 名称: self.价格表.get(名称, (float("inf"),) * 2))
+        else:
+            名称列表.remove(self.当前)
+            名称列表.insert(0, self.当前)
+
+        健康 = [名称 for 名称 in 名称列表 if self.统计表[名称].健康(self.最大错误率)]
+        return 健康 + [名称 for 名称 in 名称列表 if 名称 not in 健康]
+
+    def _记录(self, 名称: str, 成功: bool, 开始: float):
+        self.统计表[名称].记录(成功, time.perf_counter() - 开始, self.熔断阈值, self.熔断秒数)
+
+    def _选中(self, 名称: str):
+        if 名称 != self.当前:
+            self.切换次数 += 1
+            logger.info(f"🔀 路由切换: {self.当前} → {名称}（策略 {self.策略}）")
+            self.当前 = 名称
+
+    async def 发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> LLM响应:
+        最后异常: Optional[Exception] = None
+        for 名称 in self.候选顺序():
+            开始 = time.perf_counter()
+            try:
+                响应 = await self.提供者表[名称].发送消息(对话历史, 截图base64, 截图媒体类型)
+            except Exception as e:
+                self._记录(名称, False, 开始)
+                logger.warning(f"⚠️ {名称} 调用失败，尝试下一个 Provider: {e}")
+                最后异常 = e
+                continue
+            self._记录(名称, True, 开始)
+            self._选中(名称)
+            响应.工具调用列表 = [统一工具调用(调用) for 调用 in 响应.工具调用列表]
+            return 响应
+        raise 最后异常
+
+    async def 流式发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> AsyncIterator[流式事件]:
+        最后异常: Optional[Exception] = None
+        for 名称 in self.候选顺序():
+            开始 = time.perf_counter()
+            已产出 = False
+            统一后: dict[int, 工具调用] = {}  # 同一个工具调用对象只整理一次（"完成" 里要用同一个 ID）
+            try:
+                async for 事件 in self.提供者表[名称].流式发送消息(对话历史, 截图base64, 截图媒体类型):
+                    if 事件.类型 == "工具调用":
+                        事件 = 流式事件(类型="工具调用", 工具调用=self._统一(事件.工具调用, 统一后))
+                    elif 事件.类型 == "完成":
+                        事件.响应.工具调用列表 = [
+                            self._统一(调用, 统一后) for 调用 in 事件.响应.工具调用列表
+                        ]
+                    if not 已产出:
+                        已产出 = True
+                        self._选中(名称)
+                    yield 事件
+            except Exception as e:
+                self._记录(名称, False, 开始)
+                if 已产出:
+                    raise  # 已经交出去的事件收不回来，不能换 Provider 重来
+                logger.warning(f"⚠️ {名称} 调用失败，尝试下一个 Provider: {e}")
+                最后异常 = e
+                continue
+            self._记录(名称, True, 开始)
+            return
+        raise 最后异常
+
+    @staticmethod
+    def _统一(调用: 工具调用, 统一后: dict[int, 工具调用]) -> 工具调用:
+        if id(调用) not in 统一后:
+            统一后[id(调用)] = 统一工具调用(调用)
+        return 统一后[id(调用)]
+
+    async def 验证连接(self):
+        for 提供者 in self.提供者表.values():
+            await 提供者.验证连接()
+
+    def 获取统计(self) -> dict:
+        return {
+            "策略": self.策略,
+            "当前": self.当前,
+            "切换次数": self.切换次数,
+            "Provider": {名称: 统计.获取统计() for 名称, 统计 in self.统计表.items()}
+        }
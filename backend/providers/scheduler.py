@@ -0,0 +1,482 @@
+"""
+============================================
+限流调度器（令牌桶 + 自适应退避）
+============================================
+这个文件负责在 AgentLoop 和 Provider 之间"排队叫号"。
+
+以前 LLM 调用遇到 429（请求太频繁）或 529（服务过载），
+`_调用LLM` 只会记一条日志然后整个任务失败——哪怕等几秒重试就能成功。
+几个 Agent 共用一个 API Key 时更糟：它们会同时撞上限，又同时重试，再一起被拒。
+
+现在的做法（类比：银行窗口取号排队）：
+1. 每个 (Provider, API Key) 一个调度器，所有共用这个 Key 的请求都在这里排队
+   - 并发名额：同时在途的请求数有上限，多出来的按先来后到等待
+   - 令牌桶：按每分钟请求数平滑地放行（可以不设置，只在被限流后自动收紧）
+2. 请求被限流时，从异常里解析服务器给出的等待时间
+   （retry-after、retry-after-ms、x-ratelimit-reset-*、anthropic-ratelimit-*-reset、
+   Gemini 的 retry_delay），整个 Key 暂停到那个时间点，而不只是当前请求
+3. 没有给出等待时间时，用带随机抖动的指数退避（避免大家同一时刻一起重试）
+4. 被限流时把放行速率减半，之后连续成功再慢慢恢复（AIMD）
+
+只有"暂时性"错误（限流、过载、5xx、超时、连接断开）会重试；
+密钥错误、参数错误等会立刻抛出。
+
+用法：
+    调度器 = 限流调度器("openai", 调度配置.从环境变量())
+    提供者 = 调度提供者(OpenAI提供者(api_key), 调度器)
+"""
+
+import asyncio
+import email.utils
+import os
+import random
+import re
+import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from loguru import logger
+
+from .base import LLM提供者基类, LLM响应, 流式事件, 包装提供者基类
+
+
+结果类型 = TypeVar("结果类型")
+
+# 可以重试的 HTTP 状态码：超时、限流、服务端错误、Anthropic 的"过载"
+可重试状态码 = frozenset({408, 429, 500, 502, 503, 504, 529})
+限流状态码 = frozenset({429, 529})
+
+
+@dataclass(frozen=True)
+class 调度配置:
+    """
+    限流调度设置
+
+    可以用环境变量覆盖：
+        LLM_RPM              每个 API Key 每分钟最多发多少请求（0 表示不预设，只在被限流后自动收紧）
+        LLM_MAX_CONCURRENCY  每个 API Key 同时在途的请求数上限
+        LLM_MAX_RETRIES      暂时性错误最多重试几次
+    """
+    每分钟请求数: Optional[float] = None
+    最大并发: int = 4
+    最大重试次数: int = 6
+    基础退避: float = 0.5     # 指数退避的起点（秒）
+    最大退避: float = 30.0    # 指数退避的上限（秒，服务器明确给出的等待时间不受限制）
+    最低速率: float = 0.05    # 自适应收紧时的最低放行速率（每秒请求数）
+
+    @classmethod
+    def 从环境变量(cls) -> "调度配置":
+        默认 = cls()
+        每分钟请求数 = float(os.environ.get("LLM_RPM", "0"))
+        return cls(
+            每分钟请求数=每分钟请求数 if 每分钟请求数 > 0 else None,
+            最大并发=int(os.environ.get("LLM_MAX_CONCURRENCY", 默认.最大并发)),
+            最大重试次数=int(os.environ.get("LLM_MAX_RETRIES", 默认.最大重试次数))
+        )
+
+
+# ============================================
+# 从异常中解析限流信息
+# ============================================
+
+@dataclass(frozen=True)
+class 限流信息:
+    """一次暂时性失败的描述"""
+    状态码: Optional[int]
+    原因: str
+    等待秒数: Optional[float] = None    # 服务器要求的等待时间（没有给出时为 None）
+    剩余请求数: Optional[int] = None
+
+    @property
+    def 是限流(self) -> bool:
+        return self.状态码 in 限流状态码
+
+
+def 解析时长(文本: str) -> Optional[float]:
+    """
+    解析 OpenAI 风格的时长，如 "20ms"、"1.5s"、"6m0s"、"1h2m3s"
+
+    纯数字按秒处理。无法解析时返回 None。
+    """
+    文本 = 文本.strip()
+    try:
+        return float(文本)
+    except ValueError:
+        pass
+
+    片段 = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", 文本)
+    if not 片段 or "".join(数值 + 单位 for 数值, 单位 in 片段) != 文本:
+        return None
+    倍数 = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(数值) * 倍数[单位] for 数值, 单位 in 片段)
+
+
+def _解析时间点(文本: str, 现在: float) -> Optional[float]:
+    """解析 RFC 3339（Anthropic）或 HTTP 日期（retry-after），返回距离现在的秒数"""
+    try:
+        时间点 = datetime.fromisoformat(文本.strip().replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            时间点 = email.utils.parsedate_to_datetime(文本)
+        except (TypeError, ValueError):
+            return None
+    if 时间点.tzinfo is None:
+        时间点 = 时间点.replace(tzinfo=timezone.utc)
+    return max(0.0, 时间点.timestamp() - 现在)
+
+
+def _读取响应头(异常: BaseException) -> dict[str, str]:
+    """取出异常携带的 HTTP 响应头（键统一转成小写）"""
+    响应 = getattr(异常, "response", None)
+    头 = getattr(响应, "headers", None)
+    if not 头:
+        return {}
+    try:
+        return {str(键).lower(): str(值) for 键, 值 in 头.items()}
+    except AttributeError:
+        return {}
+
+
+def _状态码(异常: BaseException) -> Optional[int]:
+    # openai / anthropic: status_code；google.api_core: code（HTTPStatus）
+    for 属性 in ("status_code", "code"):
+        值 = getattr(异常, 属性, None)
+        if isinstance(值, int):
+            return int(值)
+    return None
+
+
+def 解析限流信息(异常: BaseException, 现在: Optional[float] = None) -> Optional[限流信息]:
+    """
+    判断一个异常是不是暂时性错误，并解析服务器给出的等待时间
+
+    返回:
+        限流信息；不是暂时性错误（应该立刻失败）时返回 None
+    """
+    现在 = time.time() if 现在 is None else 现在
+    状态码 = _状态码(异常)
+    类名 = type(异常).__name__
+    消息 = str(异常)
+
+    if 状态码 is not None:
+        if 状态码 not in 可重试状态码:
+            return None
+        原因 = f"HTTP {状态码}"
+    elif isinstance(异常, (asyncio.TimeoutError, ConnectionError)) or \
+            any(关键字 in 类名 for 关键字 in ("Timeout", "Connection", "Overloaded")):
+        原因 = 类名
+    else:
+        return None
+
+    头 = _读取响应头(异常)
+    等待秒数: Optional[float] = None
+    剩余请求数: Optional[int] = None
+
+    # 1. 明确的重试时间
+    if "retry-after-ms" in 头:
+        try:
+            等待秒数 = float(头["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if 等待秒数 is None and "retry-after" in 头:
+        等待秒数 = 解析时长(头["retry-after"])
+        if 等待秒数 is None:
+            等待秒数 = _解析时间点(头["retry-after"], 现在)
+
+    # 2. 配额用完时，等到配额重置
+    #    OpenAI: x-ratelimit-remaining-requests / x-ratelimit-reset-requests（时长，如 "6m0s"）
+    #    Anthropic: anthropic-ratelimit-requests-remaining / -reset（RFC 3339 时间点）
+    配额列表 = [
+        (类别, 头.get(f"x-ratelimit-remaining-{类别}"), 头.get(f"x-ratelimit-reset-{类别}"), 解析时长)
+        for 类别 in ("requests", "tokens")
+    ] + [
+        (类别, 头.get(f"anthropic-ratelimit-{类别}-remaining"), 头.get(f"anthropic-ratelimit-{类别}-reset"),
+         lambda 文本: _解析时间点(文本, 现在))
+        for 类别 in ("requests", "tokens", "input-tokens", "output-tokens")
+    ]
+    for 类别, 剩余文本, 重置文本, 解析 in 配额列表:
+        if 剩余文本 is None:
+            continue
+        try:
+            剩余 = int(float(剩余文本))
+        except ValueError:
+            continue
+        if 类别 == "requests":
+            剩余请求数 = 剩余
+        if 剩余 == 0 and 重置文本 is not None:
+            重置秒数 = 解析(重置文本)
+            if 重置秒数 is not None and (等待秒数 is None or 重置秒数 > 等待秒数):
+                等待秒数 = 重置秒数
+
+    # 3. Gemini 把建议的等待时间写在错误消息里
+    if 等待秒数 is None:
+        匹配 = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", 消息) or \
+            re.search(r"retry in (\d+(?:\.\d+)?)\s*s", 消息, re.IGNORECASE)
+        if 匹配:
+            等待秒数 = float(匹配.group(1))
+
+    return 限流信息(状态码=状态码, 原因=原因, 等待秒数=等待秒数, 剩余请求数=剩余请求数)
+
+
+# ============================================
+# 令牌桶和调度器
+# ============================================
+
+class 令牌桶:
+    """
+    平滑放行的令牌桶
+
+    速率为 None 时不限速。`预约()` 立刻扣掉一个令牌（可以扣成负数），
+    返回需要等待的秒数——这样排队的请求天然按先来后到放行。
+    """
+
+    def __init__(self, 速率: Optional[float], 容量: float = 1.0):
+        self.速率 = 速率
+        self.容量 = max(1.0, 容量)
+        self.令牌 = self.容量
+        self._上次 = time.monotonic()
+
+    def 设置速率(self, 速率: Optional[float]):
+        self._补充()
+        self.速率 = 速率
+
+    def _补充(self):
+        现在 = time.monotonic()
+        if self.速率 is not None:
+            self.令牌 = min(self.容量, self.令牌 + (现在 - self._上次) * self.速率)
+        else:
+            self.令牌 = self.容量
+        self._上次 = 现在
+
+    def 预约(self) -> float:
+        self._补充()
+        self.令牌 -= 1
+        if self.令牌 >= 0 or self.速率 is None:
+            return 0.0
+        return -self.令牌 / self.速率
+
+
+class 限流调度器:
+    """
+    一个 (Provider, API Key) 的请求调度器：排队、限速、暂时性错误自动重试
+
+    同一个调度器可以被多个 Agent 共享（见 `providers.registry`）。
+    """
+
+    def __init__(self, 名称: str, 配置: Optional[调度配置] = None):
+        self.名称 = 名称
+        self.配置 = 配置 or 调度配置()
+        速率 = self.配置.每分钟请求数 / 60 if self.配置.每分钟请求数 else None
+        self._令牌桶 = 令牌桶(速率, 容量=self.配置.最大并发)
+        self._暂停到 = 0.0            # time.monotonic() 时间点：整个 Key 暂停到这之后
+        self._最近请求: deque[float] = deque()
+        self._连续成功 = 0
+        # 每个事件循环一个并发名额（asyncio.Semaphore 不能跨事件循环使用）
+        self._名额表: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+        self.排队数 = 0
+        self.请求次数 = 0
+        self.限流次数 = 0
+        self.重试次数 = 0
+        self.失败次数 = 0
+        self.总等待秒数 = 0.0
+
+    @property
+    def 当前速率(self) -> Optional[float]:
+        """当前的放行速率（每秒请求数），None 表示不限速"""
+        return self._令牌桶.速率
+
+    def _获取名额(self) -> asyncio.Semaphore:
+        事件循环 = asyncio.get_running_loop()
+        名额 = self._名额表.get(事件循环)
+        if 名额 is None:
+            名额 = asyncio.Semaphore(self.配置.最大并发)
+            self._名额表[事件循环] = 名额
+        return 名额
+
+    async def _等待放行(self):
+        """等到 Key 的暂停结束、令牌桶放行"""
+        开始 = time.monotonic()
+        while (剩余 := self._暂停到 - time.monotonic()) > 0:
+            await asyncio.sleep(剩余)
+        if (等待 := self._令牌桶.预约()) > 0:
+            await asyncio.sleep(等待)
+
+        现在 = time.monotonic()
+        self.总等待秒数 += 现在 - 开始
+        self._最近请求.append(现在)
+        while self._最近请求 and self._最近请求[0] < 现在 - 60:
+            self._最近请求.popleft()
+        self.请求次数 += 1
+
+    def _最近速率(self) -> float:
+        """最近一分钟实际放行的速率（每秒请求数）"""
+        if not self._最近请求:
+            return self.配置.最低速率
+        时长 = max(1.0, time.monotonic() - self._最近请求[0])
+        return max(self.配置.最低速率, len(self._最近请求) / 时长)
+
+    def _记录成功(self):
+        """连续成功时逐步放宽被收紧的速率"""
+        self._连续成功 += 1
+        速率 = self._令牌桶.速率
+        if 速率 is None:
+            return
+        配置速率 = self.配置.每分钟请求数 / 60 if self.配置.每分钟请求数 else None
+        新速率 = 速率 * 1.1
+        if 配置速率 is not None and 新速率 >= 配置速率:
+            新速率 = 配置速率
+        elif 配置速率 is None and self._连续成功 >= 20:
+            新速率 = None  # 没有预设速率：稳定一段时间后取消限速
+        self._令牌桶.设置速率(新速率)
+
+    def _记录失败(self, 信息: 限流信息, 尝试: int) -> float:
+        """根据失败信息决定等待多久，并让整个 Key 暂停；返回等待秒数"""
+        self._连续成功 = 0
+        if 信息.等待秒数 is not None:
+            # 服务器给出了时间：照办，再加一点抖动，避免所有请求同一时刻一起重试
+            等待 = 信息.等待秒数 + random.uniform(0, self.配置.基础退避)
+        else:
+            # 完全抖动（full jitter）的指数退避
+            等待 = random.uniform(0, min(self.配置.最大退避, self.配置.基础退避 * 2 ** 尝试))
+
+        if 信息.是限流:
+            self.限流次数 += 1
+            # 乘性减小：按最近实际放行的速率减半。
+            # 同一批在途请求会接连被拒，只在暂停结束后的第一次限流时减速，避免一下子减到底
+            if time.monotonic() >= self._暂停到:
+                当前 = self._令牌桶.速率 or self._最近速率()
+                self._令牌桶.设置速率(max(self.配置.最低速率, 当前 / 2))
+            # 整个 Key 暂停，排队中的请求也一起等
+            self._暂停到 = max(self._暂停到, time.monotonic() + 等待)
+        return 等待
+
+    def _处理失败(self, 异常: Exception, 尝试: int) -> float:
+        """
+        暂时性错误：返回重试前还要等待的秒数；其他错误或重试次数用完：重新抛出
+
+        限流时整个 Key 已经暂停（`_等待放行` 会等），这里返回 0。
+        """
+        信息 = 解析限流信息(异常)
+        if 信息 is None:
+            raise 异常
+        if 尝试 >= self.配置.最大重试次数:
+            self.失败次数 += 1
+            logger.error(f"❌ {self.名称} 连续 {尝试 + 1} 次暂时性错误，放弃重试: {异常}")
+            raise 异常
+
+        等待 = self._记录失败(信息, 尝试)
+        self.重试次数 += 1
+        速率 = f"，放行速率降到 {self.当前速率 * 60:.1f} 次/分钟" if 信息.是限流 and self.当前速率 else ""
+        logger.warning(f"⏳ {self.名称} {信息.原因}，{等待:.1f} 秒后第 {尝试 + 1} 次重试{速率}")
+        return 0.0 if 信息.是限流 else 等待
+
+    @asynccontextmanager
+    async def _排队(self):
+        """领取并发名额（名额用完时按先来后到等待），然后等待放行"""
+        名额 = self._获取名额()
+        self.排队数 += 1
+        try:
+            await 名额.acquire()
+        finally:
+            self.排队数 -= 1
+        try:
+            await self._等待放行()
+            yield
+        finally:
+            名额.release()
+
+    async def 执行(self, 调用: Callable[[], Awaitable[结果类型]]) -> 结果类型:
+        """
+        排队执行一次调用，暂时性错误自动重试
+
+        参数:
+            调用: 每次尝试都会重新调用的无参协程函数
+        """
+        尝试 = 0
+        while True:
+            async with self._排队():
+                try:
+                    结果 = await 调用()
+                except Exception as e:
+                    等待 = self._处理失败(e, 尝试)
+                else:
+                    self._记录成功()
+                    return 结果
+            # 退避期间不占用并发名额
+            await asyncio.sleep(等待)
+            尝试 += 1
+
+    async def 执行流式(self, 创建流: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        排队执行一次流式调用
+
+        只有在收到第一个事件之前失败才会重试——已经交出去的事件收不回来。
+        """
+        尝试 = 0
+        while True:
+            async with self._排队():
+                已产出 = False
+                try:
+                    async for 事件 in 创建流():
+                        已产出 = True
+                        yield 事件
+                except Exception as e:
+                    if 已产出:
+                        raise
+                    等待 = self._处理失败(e, 尝试)
+                else:
+                    self._记录成功()
+                    return
+            await asyncio.sleep(等待)
+            尝试 += 1
+
+    def 获取统计(self) -> dict:
+        return {
+            "排队数": self.排队数,
+            "请求次数": self.请求次数,
+            "限流次数": self.限流次数,
+            "重试次数": self.重试次数,
+            "失败次数": self.失败次数,
+            "总等待秒数": round(self.总等待秒数, 2),
+            "当前速率(次/分钟)": round(self.当前速率 * 60, 1) if self.当前速率 else None
+        }
+
+
+class 调度提供者(包装提供者基类):
+    """
+    经过限流调度器的 Provider：用法和普通 Provider 完全一样
+
+    AgentLoop 拿到的是这个对象时，暂时性的限流不会再让任务失败。
+    """
+
+    def __init__(self, 内部提供者: LLM提供者基类, 调度器: 限流调度器):
+        super().__init__(内部提供者)
+        self.调度器 = 调度器
+
+    async def 发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> LLM响应:
+        return await self.调度器.执行(
+            lambda: self.内部提供者.发送消息(对话历史, 截图base64, 截图媒体类型)
+        )
+
+    async def 流式发送消息(
+        self,
+        对话历史: list[dict],
+        截图base64: Optional[str] = None,
+        截图媒体类型: str = "image/png"
+    ) -> AsyncIterator[流式事件]:
+        async for 事件 in self.调度器.执行流式(
+            lambda: self.内部提供者.流式发送消息(对话历史, 截图base64, 截图媒体类型)
+        ):
+            yield 事件
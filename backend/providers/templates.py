@@ -0,0 +1,238 @@
+"""
+============================================
+预编译的请求模板 + 消息转换缓存
+============================================
+这个文件负责让"构建一次请求"的开销不随任务步数增长。
+
+以前每一步都要：
+- 重新 `SYSTEM_PROMPT.format(...)`
+- 重新把 COMPUTER_USE_TOOLS 转换成各家的工具格式（Anthropic 每次都重新写一遍整个工具列表）
+- 把整个对话历史从头到尾重新转换成各家的消息格式
+
+而这些东西在一个任务里几乎不变：系统提示词和工具定义完全不变，
+历史里的旧消息也不会变，每一步只是在末尾多了几条。
+
+现在的做法（类比：印刷厂先把固定的版面做成模板，每次只填新的内容）：
+1. 每个 Provider 在初始化时编译一次 `请求模板`（不可变）：
+   系统提示词、工具定义、每个工具的参数校验器
+2. 每条消息的转换结果放进 `消息转换缓存`：
+   同一条消息（历史里的旧步骤）直接复用上次转换好的结果，
+   每一步只需要转换新增的几条消息
+
+对话历史管理器每一步都复用同一批消息对象，所以缓存按对象身份查找，
+查一次缓存只是一次字典查找加一次 `is` 比较，不会重新扫描几百 KB 的图片数据。
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Callable, Mapping
+
+from loguru import logger
+
+from .base import 工具调用
+
+
+# ============================================
+# 参数校验
+# ============================================
+
+def _是整数(值: Any) -> bool:
+    # JSON 里的 500.0 也算整数（Gemini 的数字参数都是浮点数）
+    if isinstance(值, bool):
+        return False
+    return isinstance(值, int) or (isinstance(值, float) and 值.is_integer())
+
+
+_类型检查: dict[str, Callable[[Any], bool]] = {
+    "integer": _是整数,
+    "number": lambda 值: isinstance(值, (int, float)) and not isinstance(值, bool),
+    "string": lambda 值: isinstance(值, str),
+    "boolean": lambda 值: isinstance(值, bool),
+    "object": lambda 值: isinstance(值, dict),
+}
+
+
+def _编译类型检查(模式: dict) -> Callable[[Any], bool]:
+    类型 = 模式.get("type")
+    if 类型 == "array":
+        元素检查 = _编译类型检查(模式.get("items", {}))
+        # Gemini 的数组参数是 protobuf 的重复字段，不是 list，按"可迭代、不是字符串和对象"判断
+        return lambda 值: (
+            not isinstance(值, (str, bytes, dict)) and hasattr(值, "__iter__")
+            and all(元素检查(元素) for 元素 in 值)
+        )
+    return _类型检查.get(类型, lambda 值: True)
+
+
+def 编译参数校验器(参数模式: dict) -> Callable[[dict], list[str]]:
+    """
+    把工具的 JSON Schema（type=object）编译成一个校验函数
+
+    只检查必填参数和参数类型（这是 LLM 最常出错的地方），
+    校验函数返回问题列表，空列表表示参数合法。
+    """
+    必填 = tuple(参数模式.get("required", ()))
+    属性检查 = {
+        名称: (_编译类型检查(子模式), 子模式.get("type", "any"))
+        for 名称, 子模式 in 参数模式.get("properties", {}).items()
+    }
+
+    def 校验(参数: dict) -> list[str]:
+        if not isinstance(参数, dict):
+            return ["参数不是对象"]
+        问题 = [f"缺少参数 {名称}" for 名称 in 必填 if 名称 not in 参数]
+        for 名称, 值 in 参数.items():
+            检查 = 属性检查.get(名称)
+            if 检查 is not None and not 检查[0](值):
+                问题.append(f"参数 {名称} 应为 {检查[1]}，实际是 {type(值).__name__}")
+        return 问题
+
+    return 校验
+
+
+# ============================================
+# 请求模板
+# ============================================
+
+@dataclass(frozen=True)
+class 请求模板:
+    """
+    一个 Provider 每次请求都相同的部分（初始化时编译一次）
+
+    用法：
+        模板 = 请求模板.编译(系统提示词, 工具定义=[...], 参数模式={"left_click": {...}})
+        请求 = {"system": 模板.系统提示词, "tools": 模板.工具列表(), ...}
+    """
+    系统提示词: str
+    工具定义: tuple = ()
+    参数校验器: Mapping[str, Callable[[dict], list[str]]] = field(
+        default_factory=lambda: MappingProxyType({})
+    )
+
+    @classmethod
+    def 编译(cls, 系统提示词: str, 工具定义: list[dict], 参数模式: dict[str, dict]) -> "请求模板":
+        """
+        参数:
+            系统提示词: 已经填好模型名的系统提示词
+            工具定义: 转换成对应 Provider 格式的工具列表
+            参数模式: 工具名 → 参数的 JSON Schema（用来编译校验器）
+        """
+        return cls(
+            系统提示词=系统提示词,
+            工具定义=tuple(工具定义),
+            参数校验器=MappingProxyType({
+                名称: 编译参数校验器(模式) for 名称, 模式 in 参数模式.items()
+            })
+        )
+
+    def 工具列表(self) -> list[dict]:
+        """发给 SDK 的工具列表（只复制外层列表，工具定义本身共用）"""
+        return list(self.工具定义)
+
+    def 校验(self, 调用: 工具调用) -> list[str]:
+        """检查一个工具调用的参数，返回问题列表"""
+        校验器 = self.参数校验器.get(调用.工具名称)
+        if 校验器 is None:
+            return [f"未知的工具 {调用.工具名称}"]
+        return 校验器(调用.参数)
+
+    def 检查(self, 调用: 工具调用, 提供者名称: str = "") -> 工具调用:
+        """校验工具调用，有问题时记一条警告（不修改、不拦截调用），返回调用本身"""
+        问题 = self.校验(调用)
+        if 问题:
+            logger.warning(f"⚠️ {提供者名称} 返回的 {调用.工具名称} 参数不符合定义: {'；'.join(问题)}")
+        return 调用
+
+
+# ============================================
+# 消息转换缓存
+# ============================================
+
+def _图片字节数(内容: Any) -> int:
+    if isinstance(内容, str):
+        return 0
+    return sum(len(部分.get("data") or "") for 部分 in 内容 if 部分["type"] == "image")
+
+
+class 消息转换缓存:
+    """
+    按消息对象缓存单条消息的转换结果（LRU）
+
+    对话历史管理器每一步都复用同一批消息对象（见 history.py 的 `历史步骤.消息`），
+    所以这里直接按对象身份查缓存：比较一次 `is` 就够了，不需要重新哈希消息内容。
+    缓存里保留着消息对象本身，对象不会被回收，id 也就不会被别的消息复用。
+    不是来自对话历史管理器的消息（每次都是新对象）只是不命中，结果仍然正确。
+
+    带截图的消息很大（几百 KB），所以除了条目数，还限制缓存里图片数据的总字节数：
+    被历史裁剪掉的旧截图不会一直留在缓存里。
+
+    约定：消息发给 Provider 之后不再原地修改；转换结果会在多次请求之间共用，
+    调用方也不能修改它们（需要修改时先复制）。
+    """
+
+    def __init__(
+        self,
+        转换函数: Callable[[dict], Any],
+        最大条目数: int = 4096,
+        最大图片字节数: int = 32 * 1024 * 1024
+    ):
+        """
+        参数:
+            转换函数: 把一条通用格式的消息转换成 Provider 格式
+            最大条目数: 最多缓存多少条消息
+            最大图片字节数: 缓存的消息里，图片数据（Base64）最多占多少字节
+        """
+        self.转换函数 = 转换函数
+        self.最大条目数 = 最大条目数
+        self.最大图片字节数 = 最大图片字节数
+        # id(消息) → (消息, 转换结果, 图片字节数)
+        self._缓存: "OrderedDict[int, tuple[dict, Any, int]]" = OrderedDict()
+        self._图片字节数 = 0
+        self.命中次数 = 0
+        self.转换次数 = 0
+
+    def 转换(self, 消息: dict) -> Any:
+        键 = id(消息)
+        条目 = self._缓存.get(键)
+        if 条目 is not None and 条目[0] is 消息:
+            self._缓存.move_to_end(键)
+            self.命中次数 += 1
+            return 条目[1]
+
+        结果 = self.转换函数(消息)
+        self.转换次数 += 1
+        图片字节数 = _图片字节数(消息["content"])
+        if 图片字节数 > self.最大图片字节数:
+            return 结果  # 单条就超出上限，不缓存
+        self._缓存[键] = (消息, 结果, 图片字节数)
+        self._图片字节数 += 图片字节数
+        while len(self._缓存) > self.最大条目数 or self._图片字节数 > self.最大图片字节数:
+            _, (_, _, 淘汰字节数) = self._缓存.popitem(last=False)
+            self._图片字节数 -= 淘汰字节数
+        return 结果
+
+    def 转换全部(self, 对话历史: list[dict]) -> list:
+        return [self.转换(消息) for 消息 in 对话历史]
+
+    def 清空(self):
+        self._缓存.clear()
+        self._图片字节数 = 0
+
+    def 获取统计(self) -> dict:
+        总数 = self.命中次数 + self.转换次数
+        return {
+            "条目数": len(self._缓存),
+            "图片字节数": self._图片字节数,
+            "命中次数": self.命中次数,
+            "转换次数": self.转换次数,
+            "命中率": round(self.命中次数 / 总数, 3) if 总数 else 0.0
+        }
+
+    def __len__(self) -> int:
+        return len(self._缓存)
+
+
+def 参数模式表(工具定义: list[dict], 模式字段: str = "parameters") -> dict[str, dict]:
+    """从工具列表里取出 工具名 → 参数 JSON Schema"""
+    return {工具["name"]: 工具.get(模式字段, {}) for 工具 in 工具定义}
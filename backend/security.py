@@ -208,5 +208,5 @@ def 验证提供者名称(provider: str) -> bool:
     返回:
         名称是否有效
     """
-    有效提供者 = {"openai", "gemini", "anthropic"}
+    有效提供者 = {"openai", "gemini", "anthropic", "local"}
     return provider.lower().strip() in 有效提供者
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""
+测试动作执行器：键鼠操作在专用线程里执行，停止信号能在中途打断
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+from unittest.mock import patch
+
+from tools.action_executor import 动作执行器
+from tools.computer import 全局文字输入引擎, 执行鼠标操作, 执行键盘操作
+
+
+@pytest.mark.asyncio
+@patch('tools.computer.pyautogui')
+async def test_long_typing_does_not_block_event_loop(mock_pyautogui):
+    执行器 = 动作执行器()
+    心跳 = []
+
+    async def 计时():
+        while True:
+            心跳.append(time.perf_counter())
+            await asyncio.sleep(0.01)
+
+    计时任务 = asyncio.create_task(计时())
+    结果 = await 执行器.执行(执行键盘操作, "type", {"text": "a" * 6}, threading.Event())
+    计时任务.cancel()
+    执行器.关闭()
+
+    assert 结果 == "已输入: aaaaaa"
+    assert mock_pyautogui.write.call_count == 6
+    # 输入期间（约 0.3 秒）事件循环一直在响应
+    assert len(心跳) >= 10
+    assert max(后 - 前 for 前, 后 in zip(心跳, 心跳[1:])) < 0.1
+
+
+# 200 个字符默认会先试 XTest 和剪贴板（有桌面环境时就不会逐字输入）；这里测的是逐字输入
+@patch.object(全局文字输入引擎, "优先方式", "paced")
+@patch('tools.computer.pyautogui')
+def test_stop_interrupts_typing_between_characters(mock_pyautogui):
+    执行器 = 动作执行器()
+    停止 = threading.Event()
+    future = 执行器.提交(执行键盘操作, "type", {"text": "x" * 200}, 停止)
+
+    time.sleep(0.12)
+    停止时刻 = time.perf_counter()
+    停止.set()
+    结果 = future.result(timeout=1)
+    执行器.关闭()
+
+    assert time.perf_counter() - 停止时刻 < 0.03
+    assert 结果.startswith("已停止：输入了 ")
+    assert 1 <= mock_pyautogui.write.call_count < 10
+
+    # 已经停止：后面排队的操作不再执行
+    assert 执行键盘操作("key", {"key_name": "enter"}, 停止) == "已停止，操作未执行"
+    mock_pyautogui.press.assert_not_called()
+
+
+@patch('tools.computer.pyautogui')
+def test_interruptible_mouse_move_reaches_target_or_stops(mock_pyautogui):
+    mock_pyautogui.position.return_value = (0, 0)
+    结果 = 执行鼠标操作("mouse_move", {"x": 200, "y": 300}, threading.Event())
+    assert 结果 == "已移动到 (200, 300)"
+    assert mock_pyautogui.moveTo.call_count == 20
+    mock_pyautogui.moveTo.assert_called_with(200, 300, _pause=False)
+
+    停止 = threading.Event()
+    threading.Timer(0.05, 停止.set).start()
+    结果 = 执行鼠标操作("mouse_move", {"x": 200, "y": 300}, 停止)
+    assert 结果.startswith("已停止")
+
+
+@pytest.mark.asyncio
+async def test_actions_run_in_order_on_one_thread():
+    执行器 = 动作执行器()
+    记录 = []
+
+    def 操作(序号):
+        time.sleep(0.01 * (3 - 序号))   # 先提交的更慢，也不会被后面的超过
+        记录.append((序号, threading.current_thread().name))
+        return 序号
+
+    结果 = await asyncio.gather(*(执行器.执行(操作, 序号) for 序号 in range(3)))
+    执行器.关闭()
+
+    assert 结果 == [0, 1, 2]
+    assert [序号 for 序号, _ in 记录] == [0, 1, 2]
+    assert len({线程 for _, 线程 in 记录}) == 1 and 记录[0][1].startswith("action")
+    assert 执行器.进行中数量 == 0
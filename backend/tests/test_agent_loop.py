@@ -1,6 +1,7 @@
 """
 测试 Agent 循环核心功能
 """
+import gc
 import pytest
 import asyncio
 from unittest.mock import AsyncMock, MagicMock, patch
@@ -15,7 +16,7 @@ class MockLLMProvider(LLM提供者基类):
         super().__init__(api_key)
         self.call_count = 0
 
-    async def 发送消息(self, 对话历史, 截图base64=None):
+    async def 发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
         self.call_count += 1
         # 模拟前两次调用返回工具调用，第三次返回空列表表示任务完成
         if self.call_count < 3:
@@ -74,7 +75,7 @@ async def test_agent_stops_when_no_tool_calls():
 
     # 创建一个总是返回空工具列表的模拟提供者
     class CompleteProvider(LLM提供者基类):
-        async def 发送消息(self, 对话历史, 截图base64=None):
+        async def 发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
             return LLM响应(文本内容="任务完成", 工具调用列表=[])
 
     complete_provider = CompleteProvider("test-key")
@@ -97,7 +98,7 @@ async def test_agent_respects_max_iterations():
             super().__init__(api_key)
             self.call_count = 0
 
-        async def 发送消息(self, 对话历史, 截图base64=None):
+        async def 发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
             self.call_count += 1
             return LLM响应(
                 文本内容="继续执行",
@@ -148,4 +149,212 @@ def test_broadcast_function():
         # 这里我们只测试广播函数是否被正确设置，不会实际运行任务
         await agent._广播("info", "测试消息")
 
-    asyncio.run(run_test())
\ No newline at end of file
+    asyncio.run(run_test())
+
+class _假截图:
+    """模拟 mss 返回的原始截图（BGRA）"""
+
+    def __init__(self, 宽: int, 高: int):
+        import os as _os
+        self.size = (宽, 高)
+        self.bgra = _os.urandom(宽 * 高 * 4)  # 随机噪声，PNG 压缩最慢
+
+
+@pytest.mark.asyncio
+async def test_observation_does_not_block_event_loop():
+    """处理一张 4K 合成截图时，事件循环仍能及时响应"""
+    from tools.observation import 观测执行器
+    from tools.screen import 全局截图缓存
+
+    全局截图缓存.清除缓存()
+    # 和 main.py 启动时一样把已有对象冻结到永久代。
+    # 跑完前面的测试后进程里有约 30 万个 GC 跟踪的对象，测量窗口里创建任务、Future 的分配
+    # 恰好让第 2 代计数到达阈值时，全量回收就在事件循环线程里扫描全部对象，停顿约 200ms。
+    # 服务端启动后冻结了这些对象，这里也一样；测试期间新建的对象照常回收，照常计入停顿。
+    gc.freeze()
+    try:
+        大截图 = _假截图(3840, 2160)
+        agent = AgentLoop(提供者=MockLLMProvider("test-key"), 观测执行器=观测执行器(模式="thread"))
+
+        最大间隔 = 0.0
+        完成 = asyncio.Event()
+
+        async def 心跳():
+            nonlocal 最大间隔
+            上次 = asyncio.get_running_loop().time()
+            while not 完成.is_set():
+                await asyncio.sleep(0.005)
+                现在 = asyncio.get_running_loop().time()
+                最大间隔 = max(最大间隔, 现在 - 上次)
+                上次 = 现在
+
+        with patch('tools.screen.全局截图会话.抓取', return_value=大截图):
+            心跳任务 = asyncio.create_task(心跳())
+            截图数据 = await agent._获取截图()
+            完成.set()
+            await 心跳任务
+
+        agent.观测执行器.关闭()
+    finally:
+        全局截图缓存.清除缓存()
+        gc.unfreeze()   # 断言失败也要解冻，否则后面的测试都在冻结的堆上跑
+
+    assert 截图数据
+    # 如果截图在事件循环里同步执行，这里的间隔会是几百毫秒
+    assert 最大间隔 < 0.1
+
+
+def test_unknown_observation_executor_env_falls_back_to_thread(monkeypatch):
+    """OBSERVATION_EXECUTOR 写错时只警告，不让 import tools 失败"""
+    from tools.observation import 默认执行器模式
+
+    monkeypatch.setenv("OBSERVATION_EXECUTOR", "Process")
+    assert 默认执行器模式() == "process"
+    monkeypatch.setenv("OBSERVATION_EXECUTOR", "threads")
+    assert 默认执行器模式() == "thread"
+
+
+@pytest.mark.asyncio
+async def test_observation_executor_bounded_queue():
+    """观测执行器同时处理的请求数不超过队列上限"""
+    import time
+    from tools.observation import 观测执行器
+
+    执行器 = 观测执行器(模式="thread", 队列上限=2)
+    峰值 = 0
+
+    def 慢任务():
+        time.sleep(0.01)
+        return True
+
+    async def 采样():
+        nonlocal 峰值
+        while True:
+            峰值 = max(峰值, 执行器.进行中数量)
+            await asyncio.sleep(0.001)
+
+    # 并发提交 6 个请求：排队 + 执行中的请求总数不超过 2
+    采样任务 = asyncio.create_task(采样())
+    结果 = await asyncio.gather(*[执行器.提交(慢任务) for _ in range(6)])
+    采样任务.cancel()
+
+    执行器.关闭()
+    assert all(结果)
+    assert 峰值 <= 2
+    assert 执行器.进行中数量 == 0
+
+    with pytest.raises(ValueError):
+        观测执行器(模式="gpu")
+
+
+@pytest.mark.asyncio
+async def test_agent_waits_when_screen_unchanged():
+    """操作后屏幕没变化时，先重新观察，而不是立刻把同样的画面发给 LLM"""
+    from tools.frame_diff import 瓦片差异检测器
+    from tools.observation import 观测结果
+    import numpy as np
+
+    检测器 = 瓦片差异检测器()
+    静止帧 = np.zeros((64, 64, 4), dtype=np.uint8)
+
+    async def 假观测():
+        return 观测结果(base64数据="abc", 宽=64, 高=64, 差异=检测器.比较(静止帧))
+
+    收到的历史 = []
+
+    class RecordingProvider(LLM提供者基类):
+        async def 发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
+            收到的历史.append(对话历史)
+            if len(收到的历史) == 1:
+                return LLM响应(工具调用列表=[工具调用(工具名称="unknown_tool", 参数={})])
+            return LLM响应(文本内容="完成")
+
+    agent = AgentLoop(提供者=RecordingProvider("test-key"), 无变化重试次数=2, 无变化重试间隔=0)
+    with patch.object(agent, '_获取截图', side_effect=假观测) as mock_capture, \
+         patch('agent_loop.asyncio.sleep', new=AsyncMock()):
+        await agent.执行任务("测试无变化")
+
+    # 第 1 步截图 1 次；第 2 步截图 1 次 + 重试 2 次
+    assert mock_capture.call_count == 4
+    assert agent.跳过调用次数 == 2
+    assert len(收到的历史) == 2
+    assert "没有任何可见变化" in 收到的历史[1][-1]["content"]
+    # 附加提示不会写入对话历史（历史里只有指令和第 1 步的记录）
+    assert len(agent.对话历史) == 4
+    assert all("没有任何可见变化" not in str(消息["content"]) for 消息 in agent.对话历史)
+
+
+def test_agent_detects_revisited_screen_state():
+    """屏幕先明显变化、又回到之前的样子时，能识别出是第几步见过的状态"""
+    from tools.observation import 观测结果
+
+    agent = AgentLoop(提供者=MockLLMProvider("test-key"))
+    状态A = int("0F" * 32, 16)
+    状态B = ~状态A & ((1 << 256) - 1)
+
+    def 观测(哈希):
+        return 观测结果(base64数据="", 宽=1, 高=1, 屏幕哈希=哈希)
+
+    assert agent._记录屏幕状态(观测(状态A), 1) is None
+    # 和上一步几乎一样（只差 1 位），不算回到旧状态
+    assert agent._记录屏幕状态(观测(状态A ^ 1), 2) is None
+    assert agent._记录屏幕状态(观测(状态B), 3) is None
+    assert agent._记录屏幕状态(观测(状态A ^ 2), 4) == 1
+    assert agent.重复状态次数 == 1
+
+
+def test_revisit_detection_ignores_similar_layouts():
+    """布局相同、只有几行内容不同的页面不算回到旧状态（64 位哈希会把它们当成同一屏）"""
+    import numpy as np
+    from tools.image_hash import 差值哈希, 汉明距离
+    from tools.observation import 观测结果, 屏幕哈希尺寸
+
+    def 页面(行宽):
+        图 = np.full((1080, 1920, 4), 240, np.uint8)
+        图[:60] = 50        # 标题栏
+        图[:, :300] = 200   # 侧边栏
+        for 行, 宽 in enumerate(行宽):
+            图[100 + 行 * 45:118 + 行 * 45, 340:340 + 宽, :3] = 30
+        return 图
+
+    列表 = [400 + 行 * 50 for 行 in range(20)]
+    另一列表 = [1500 - 行 * 50 for 行 in range(3)] + 列表[3:]
+    assert 汉明距离(差值哈希(页面(列表)), 差值哈希(页面(另一列表))) <= 4
+
+    agent = AgentLoop(提供者=MockLLMProvider("test-key"))
+
+    def 观测(图):
+        return 观测结果(base64数据="", 宽=1, 高=1, 屏幕哈希=差值哈希(图, 哈希尺寸=屏幕哈希尺寸))
+
+    设置页 = np.zeros((1080, 1920, 4), np.uint8)
+    设置页[::2, ::64] = 255
+    assert agent._记录屏幕状态(观测(页面(列表)), 1) is None
+    assert agent._记录屏幕状态(观测(设置页), 2) is None
+    assert agent._记录屏幕状态(观测(页面(另一列表)), 3) is None
+    assert agent._记录屏幕状态(观测(设置页), 4) == 2
+
+
+@pytest.mark.asyncio
+async def test_agent_uses_provider_cost_model_and_records_tokens():
+    """按提供者的成本模型选择截图分辨率，并累计预测/实际令牌数"""
+    from providers.image_cost import Gemini图片成本
+    from tools.observation import 观测结果
+
+    class UsageProvider(LLM提供者基类):
+        图片成本模型 = Gemini图片成本()
+
+        async def 发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
+            return LLM响应(文本内容="完成", 用量={"输入令牌": 900, "输出令牌": 10, "缓存读取令牌": 600})
+
+    agent = AgentLoop(提供者=UsageProvider("test-key"), 图片令牌预算=258)
+    assert agent.分辨率策略.预测令牌数(*agent.分辨率策略(1920, 1080)) <= 258
+
+    async def 假观测():
+        return 观测结果(base64数据="abc", 宽=384, 高=216, 预测令牌数=258)
+
+    with patch.object(agent, '_获取截图', side_effect=假观测):
+        await agent.执行任务("测试令牌")
+
+    assert agent.令牌统计 == {
+        "预测图片令牌": 258, "实际输入令牌": 900, "缓存读取令牌": 600, "缓存写入令牌": 0
+    }
@@ -161,4 +161,37 @@ def test_status_endpoint(client):
 
     data = response.json()
     assert "is_running" in data
-    assert data["is_running"] is False  # 初始状态应该是未运行
\ No newline at end of file
+    assert data["is_running"] is False  # 初始状态应该是未运行
+
+def test_endpoints_stay_responsive_during_slow_gemini_validation():
+    """验证 Gemini 配置很慢时，其他接口照常响应"""
+    import threading
+    import time
+
+    def 慢列表(**kwargs):
+        time.sleep(1.0)
+        yield "models/gemini"
+
+    健康检查耗时 = []
+    with TestClient(app) as client, \
+         patch('main.全局安全配置.获取配置', return_value={"provider": "gemini", "api_key": "k"}), \
+         patch('providers.gemini_provider.genai.list_models', side_effect=慢列表):
+        验证线程 = threading.Thread(target=lambda: client.post("/api/validate-config"))
+        验证线程.start()
+        time.sleep(0.2)  # 等验证请求进入 list_models
+        for _ in range(5):
+            开始 = time.perf_counter()
+            assert client.get("/api/health").status_code == 200
+            健康检查耗时.append(time.perf_counter() - 开始)
+        验证线程.join()
+
+    assert max(健康检查耗时) < 0.5
+
+
+def test_startup_freezes_long_lived_objects():
+    """启动后导入的模块对象被冻结，全量 GC 不再扫描它们；关闭时解冻"""
+    import gc
+
+    with TestClient(app):
+        assert gc.get_freeze_count() > 10000
+    assert gc.get_freeze_count() == 0
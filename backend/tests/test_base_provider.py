@@ -8,7 +8,7 @@ from providers.base import LLM提供者基类, 工具调用, LLM响应
 class MockProvider(LLM提供者基类):
     """用于测试的模拟提供者"""
 
-    async def 发送消息(self, 对话历史, 截图base64=None):
+    async def 发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
         # 模拟 API 调用返回
         return LLM响应(
             文本内容="这是一个模拟响应",
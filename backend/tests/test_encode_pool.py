@@ -0,0 +1,75 @@
+"""
+测试共享内存编码进程池
+"""
+import io
+import os
+import numpy as np
+from unittest.mock import MagicMock
+from PIL import Image
+from tools import screen
+from tools.encode_pool import 共享内存编码池
+from tools.encoder import 编码缓存
+from tools.screen import 缩放BGRA为RGB
+
+
+def _帧(宽=640, 高=480, 种子=0):
+    """带随机色块的 BGRA 帧"""
+    帧 = np.full((高, 宽, 4), 200, dtype=np.uint8)
+    rng = np.random.default_rng(种子)
+    for _ in range(10):
+        x, y = rng.integers(0, 宽 - 50), rng.integers(0, 高 - 50)
+        帧[y:y + 50, x:x + 50, :3] = rng.integers(0, 256, 3, dtype=np.uint8)
+    return 帧
+
+
+def test_pool_matches_in_process_encoding():
+    """进程池编码的结果和进程内缩放 + PNG 编码的像素完全一致"""
+    帧 = _帧()
+    with 共享内存编码池(工作进程数=1) as 编码池:
+        结果 = 编码池.编码帧(帧, 320, 320, 格式顺序=("PNG",))
+
+    期望 = 缩放BGRA为RGB(帧, 320, 320)
+    实际 = Image.open(io.BytesIO(结果.数据))
+    assert 结果.媒体类型 == "image/png"
+    assert 实际.size == 期望.size == 结果.尺寸
+    assert np.array_equal(np.asarray(实际.convert("RGB")), np.asarray(期望))
+
+
+def test_pool_grows_slots_and_releases_shared_memory():
+    """分辨率变大时换更大的槽位；关闭后共享内存被删除"""
+    编码池 = 共享内存编码池(工作进程数=1, 槽位数=1)
+    try:
+        小 = 编码池.编码帧(_帧(320, 240), 1024, 1024, 格式顺序=("PNG",))
+        大 = 编码池.编码帧(_帧(800, 600, 种子=1), 1024, 1024, 格式顺序=("PNG",))
+        assert 小.尺寸 == (320, 240)
+        assert 大.尺寸 == (800, 600)
+        名称 = 编码池._槽位[0].name
+        assert 编码池._槽位[0].size >= 800 * 600 * 4
+        assert 编码池.已编码帧数 == 2
+    finally:
+        编码池.关闭()
+
+    assert all(槽 is None for 槽 in 编码池._槽位)
+    if os.path.isdir("/dev/shm"):
+        assert not os.path.exists(f"/dev/shm/{名称}")
+
+
+def test_encode_screenshot_uses_backend_and_cache(monkeypatch):
+    """设置了编码后端时，截图交给后端编码，相同画面命中缓存"""
+    帧 = _帧()
+    截图 = MagicMock(size=(640, 480), raw=bytearray(帧.tobytes()))
+    后端 = MagicMock()
+    后端.编码帧.return_value = "编码结果"
+    缓存 = 编码缓存()
+    缓存.放入 = lambda 键, 结果: 缓存._条目.__setitem__(键, 结果)  # 假结果没有字节数据
+
+    monkeypatch.setattr(screen, "全局编码缓存", 缓存)
+    之前 = screen.设置编码后端(后端)
+    try:
+        assert screen.编码截图(截图, 1024, 1024) == "编码结果"
+        assert screen.编码截图(截图, 1024, 1024) == "编码结果"
+    finally:
+        screen.设置编码后端(之前)
+
+    assert 后端.编码帧.call_count == 1
+    assert 缓存.命中次数 == 1
@@ -0,0 +1,131 @@
+"""
+测试截图编码器
+"""
+import io
+import numpy as np
+import pytest
+from PIL import Image
+from tools.encoder import 编码图片, 按预算编码, 编码器, 编码器表, 注册编码器
+
+
+def _界面图():
+    """纯色块组成的"界面"截图：PNG 压缩效果很好"""
+    图片 = Image.new("RGB", (800, 600), (240, 240, 240))
+    图片.paste((30, 120, 200), (50, 50, 300, 120))
+    return 图片
+
+
+def _照片图():
+    """随机噪声模拟照片：PNG 会非常大"""
+    噪声 = np.random.default_rng(0).integers(0, 256, (600, 800, 3), dtype=np.uint8)
+    return Image.fromarray(噪声)
+
+
+@pytest.mark.parametrize("格式,媒体类型,PIL格式", [
+    ("PNG", "image/png", "PNG"),
+    ("PNG8", "image/png", "PNG"),
+    ("JPEG", "image/jpeg", "JPEG"),
+    ("WEBP", "image/webp", "WEBP"),
+])
+def test_builtin_encoders(格式, 媒体类型, PIL格式):
+    """内置编码器输出正确的格式和 MIME 类型"""
+    结果 = 编码图片(_界面图(), 格式, 质量=80)
+    assert 结果.媒体类型 == 媒体类型
+    assert Image.open(io.BytesIO(结果.数据)).format == PIL格式
+    assert 结果.尺寸 == (800, 600)
+
+
+def test_budget_prefers_lossless_when_it_fits():
+    """界面截图 PNG 就能放进预算时，保持无损"""
+    结果 = 按预算编码(_界面图(), 字节预算=500 * 1024)
+    assert 结果.格式 == "PNG"
+    assert 结果.质量 is None
+
+
+def test_budget_switches_to_lossy_format():
+    """照片类截图 PNG 超预算时，换成有损格式并找到能放下的质量"""
+    预算 = 200 * 1024
+    结果 = 按预算编码(_照片图(), 字节预算=预算)
+    assert 结果.格式 == "WEBP"
+    assert 结果.base64长度 <= 预算
+    assert len(结果.转base64()) == 结果.base64长度
+
+
+def test_budget_downscales_as_last_resort():
+    """所有格式在最低质量都放不下时，缩小图片再试"""
+    结果 = 按预算编码(_照片图(), 字节预算=60 * 1024, 格式顺序=("JPEG",))
+    assert 结果.尺寸[0] < 800
+    assert 结果.base64长度 <= 60 * 1024
+
+
+def test_unknown_format_and_plugin_registration():
+    """未知格式报错；可以注册自定义编码器"""
+    with pytest.raises(ValueError):
+        编码图片(_界面图(), "BMP")
+
+    注册编码器(编码器("BMP", "image/bmp", 有损=False, 编码=lambda 图, 质量: b"BM"))
+    try:
+        assert 编码图片(_界面图(), "BMP").媒体类型 == "image/bmp"
+    finally:
+        编码器表.pop("BMP")
+
+
+def test_encode_cache_hits_on_identical_content():
+    """内容相同的图片只编码一次；编码设置不同则分开缓存"""
+    from unittest.mock import patch
+    from tools import encoder
+    from tools.encoder import 编码缓存
+
+    缓存 = 编码缓存()
+    with patch.object(encoder, '按预算编码', wraps=encoder.按预算编码) as mock_encode:
+        第一次 = 缓存.获取或编码(_界面图(), 字节预算=500 * 1024)
+        第二次 = 缓存.获取或编码(_界面图(), 字节预算=500 * 1024)  # 新对象，相同内容
+        缓存.获取或编码(_界面图(), 字节预算=500 * 1024, 格式顺序=("WEBP",))
+
+    assert 第二次 is 第一次
+    assert mock_encode.call_count == 2
+    assert 缓存.命中次数 == 1
+    assert 缓存.未命中次数 == 2
+    assert 缓存.获取统计()["条目数"] == 2
+
+
+def test_encode_cache_evicts_by_byte_cap():
+    """总字节数超过上限时淘汰最久没用的条目"""
+    from tools.encoder import 编码缓存, 编码结果
+
+    缓存 = 编码缓存(字节上限=1000)
+    for i in range(4):
+        缓存.放入(i, 编码结果(数据=b"x" * 150, 格式="PNG", 媒体类型="image/png"))
+    # 每条 150 + 200（Base64）= 350 字节，最多放 2 条
+    assert len(缓存) == 2
+    assert 缓存.当前字节数 <= 1000
+    assert 缓存.淘汰次数 == 2
+    assert 缓存.获取(0) is None
+    assert 缓存.获取(3) is not None
+
+    # 单条超过上限的结果不缓存
+    缓存.放入("big", 编码结果(数据=b"x" * 2000, 格式="PNG", 媒体类型="image/png"))
+    assert 缓存.获取("big") is None
+
+
+def test_encode_screenshot_checks_cache_before_resizing(monkeypatch):
+    """进程内编码：按原始帧和编码设置查缓存，命中时不再缩放和转换格式"""
+    from unittest.mock import MagicMock, patch
+    from tools import screen
+    from tools.encoder import 编码缓存
+
+    帧 = np.random.default_rng(0).integers(0, 256, (480, 640, 4), dtype=np.uint8)
+    缓存 = 编码缓存()
+    monkeypatch.setattr(screen, "全局编码缓存", 缓存)
+    之前 = screen.设置编码后端(None)
+    try:
+        with patch.object(screen, '截图转图片', wraps=screen.截图转图片) as mock_resize:
+            第一次 = screen.编码截图(MagicMock(size=(640, 480), raw=bytearray(帧.tobytes())), 320, 320)
+            第二次 = screen.编码截图(MagicMock(size=(640, 480), raw=bytearray(帧.tobytes())), 320, 320)
+            screen.编码截图(MagicMock(size=(640, 480), raw=bytearray(帧.tobytes())), 160, 160)
+    finally:
+        screen.设置编码后端(之前)
+
+    assert 第二次 is 第一次
+    assert mock_resize.call_count == 2   # 第二次命中缓存；尺寸设置不同时重新缩放
+    assert 缓存.命中次数 == 1
@@ -0,0 +1,106 @@
+"""
+测试瓦片差异检测
+"""
+import numpy as np
+import pytest
+from tools.frame_diff import 瓦片差异检测器
+
+
+def _空白帧(宽=200, 高=100):
+    帧 = np.zeros((高, 宽, 4), dtype=np.uint8)
+    帧[..., 3] = 255
+    return 帧
+
+
+def test_first_frame_counts_as_changed():
+    """首帧没有参照，视为整屏变化"""
+    检测器 = 瓦片差异检测器(瓦片大小=32)
+    差异 = 检测器.比较(_空白帧())
+
+    assert 差异.首帧
+    assert not 差异.无变化
+    assert 差异.边界框列表 == [(0, 0, 200, 100)]
+
+
+def test_identical_frames_report_no_change():
+    """相同的两帧没有变化（Alpha 通道的差异被忽略）"""
+    检测器 = 瓦片差异检测器(瓦片大小=32)
+    检测器.比较(_空白帧())
+
+    第二帧 = _空白帧()
+    第二帧[..., 3] = 0
+    差异 = 检测器.比较(第二帧)
+
+    assert 差异.无变化
+    assert 差异.变化瓦片数 == 0
+    assert 差异.边界框列表 == []
+    assert 差异.摘要() == "无可见变化"
+
+
+def test_small_change_is_localised():
+    """小的变化只标记对应瓦片，并给出边界框"""
+    检测器 = 瓦片差异检测器(瓦片大小=32)
+    检测器.比较(_空白帧())
+
+    帧 = _空白帧()
+    帧[40, 70, 1] = 200  # 第 1 行、第 2 列的瓦片
+    差异 = 检测器.比较(帧)
+
+    assert not 差异.无变化
+    assert 差异.变化瓦片数 == 1
+    assert 差异.变化掩码[1, 2]
+    assert 差异.边界框列表 == [(64, 32, 32, 32)]
+
+
+def test_separate_regions_and_edge_tiles():
+    """不相邻的变化生成多个区域；边缘不足一个瓦片的部分也能检测"""
+    检测器 = 瓦片差异检测器(瓦片大小=32)
+    检测器.比较(_空白帧())
+
+    帧 = _空白帧()
+    帧[0:40, 0:40, 0] = 255     # 左上角，跨 2x2 个瓦片
+    帧[99, 199, 2] = 255         # 右下角边缘瓦片（只有 8x4 像素）
+    差异 = 检测器.比较(帧)
+
+    assert 差异.边界框列表 == [(0, 0, 64, 64), (192, 96, 8, 4)]
+    assert 差异.变化瓦片数 == 5
+
+
+def test_min_changed_pixels_threshold():
+    """最小变化像素可以过滤掉光标闪烁之类的极小变化"""
+    检测器 = 瓦片差异检测器(瓦片大小=32, 最小变化像素=4)
+    检测器.比较(_空白帧())
+
+    帧 = _空白帧()
+    帧[10, 10, 0] = 255
+    assert 检测器.比较(帧).无变化
+
+
+def test_resolution_change_resets_reference():
+    """分辨率变化时按首帧处理"""
+    检测器 = 瓦片差异检测器()
+    检测器.比较(_空白帧(200, 100))
+    assert 检测器.比较(_空白帧(100, 50)).首帧
+
+
+def test_rejects_non_bgra_input():
+    检测器 = 瓦片差异检测器()
+    with pytest.raises(ValueError):
+        检测器.比较(np.zeros((10, 10, 3), dtype=np.uint8))
+
+
+def test_merge_skipped_frame_keeps_changes_relative_to_older_frame():
+    """中间帧被丢弃时，两次差异合并后仍然反映"上上帧 → 当前帧"的变化"""
+    检测器 = 瓦片差异检测器(瓦片大小=32)
+    帧 = np.zeros((64, 64, 4), dtype=np.uint8)
+    检测器.比较(帧)
+    中间帧 = 帧.copy()
+    中间帧[0:8, 0:8, :3] = 255
+    第一次 = 检测器.比较(中间帧)
+    第二次 = 检测器.比较(中间帧.copy())   # 丢弃的中间帧之后屏幕没再变
+    assert 第二次.无变化
+
+    合并 = 第一次.合并(第二次)
+    assert not 合并.无变化
+    assert 合并.边界框列表 == [(0, 0, 32, 32)]
+    assert 第一次.合并(检测器.比较(np.zeros((32, 32, 4), np.uint8))).首帧
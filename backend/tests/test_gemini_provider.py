@@ -0,0 +1,117 @@
+"""
+测试 Gemini 提供者（异步调用、超时和取消）
+"""
+import asyncio
+import time
+import pytest
+from unittest.mock import MagicMock, patch
+from providers.gemini_provider import Gemini提供者
+
+
+def _文本响应(文本):
+    from types import SimpleNamespace as NS
+    return NS(
+        candidates=[NS(content=NS(parts=[NS(text=文本, function_call=None)]))],
+        usage_metadata=None
+    )
+
+
+@pytest.mark.asyncio
+async def test_gemini_send_message_does_not_block_event_loop():
+    """Gemini 思考期间，事件循环仍然可以处理其他任务"""
+    provider = Gemini提供者("test-key")
+
+    async def 慢生成(*args, **kwargs):
+        await asyncio.sleep(0.5)
+        return _文本响应("好的")
+
+    provider.model = MagicMock()
+    provider.model.generate_content_async = 慢生成
+    provider.model.generate_content.side_effect = AssertionError("不应该调用阻塞接口")
+
+    心跳次数 = 0
+
+    async def 心跳():
+        nonlocal 心跳次数
+        while True:
+            await asyncio.sleep(0.01)
+            心跳次数 += 1
+
+    心跳任务 = asyncio.create_task(心跳())
+    响应 = await provider.发送消息([{"role": "user", "content": "hi"}])
+    心跳任务.cancel()
+
+    assert 响应.文本内容 == "好的"
+    assert 心跳次数 >= 20
+
+
+@pytest.mark.asyncio
+async def test_gemini_timeout_and_cancellation():
+    """超时后抛出 TimeoutError，并取消还在进行的请求"""
+    provider = Gemini提供者("test-key", 超时=0.1)
+    已取消 = asyncio.Event()
+
+    async def 卡住(*args, **kwargs):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            已取消.set()
+            raise
+
+    provider.model = MagicMock()
+    provider.model.generate_content_async = 卡住
+
+    开始 = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        await provider.发送消息([{"role": "user", "content": "hi"}])
+    assert time.perf_counter() - 开始 < 1.0
+    assert 已取消.is_set()
+
+
+@pytest.mark.asyncio
+async def test_gemini_validation_runs_in_thread():
+    """list_models 是阻塞调用，要在线程池里执行"""
+    import threading
+    调用线程 = []
+
+    def 慢列表(**kwargs):
+        调用线程.append(threading.current_thread().name)
+        time.sleep(0.2)
+        yield "models/gemini"
+
+    provider = Gemini提供者("test-key")
+    with patch('providers.gemini_provider.genai.list_models', side_effect=慢列表):
+        await provider.验证连接()
+
+    assert 调用线程 and 调用线程[0].startswith("gemini")
+
+
+@pytest.mark.asyncio
+async def test_gemini_instances_keep_their_own_keys():
+    """注册表同时缓存不同密钥的实例时，每个实例的请求和验证都用自己的密钥"""
+    创建的客户端 = []
+
+    def 假客户端(client_options):
+        客户端 = MagicMock(密钥=client_options["api_key"])
+        创建的客户端.append(客户端)
+        return 客户端
+
+    甲 = Gemini提供者("key-a")
+    乙 = Gemini提供者("key-b")
+    收到的客户端 = []
+
+    def 假列表(client=None, **kwargs):
+        收到的客户端.append(client.密钥)
+        yield "models/gemini"
+
+    with patch('providers.gemini_provider.glm.GenerativeServiceAsyncClient', side_effect=假客户端), \
+         patch('providers.gemini_provider.glm.ModelServiceClient', side_effect=假客户端), \
+         patch('providers.gemini_provider.genai.list_models', side_effect=假列表):
+        甲._绑定客户端()
+        乙._绑定客户端()
+        await 乙.验证连接()
+        await 甲.验证连接()
+
+    assert 甲.model._async_client.密钥 == "key-a"
+    assert 乙.model._async_client.密钥 == "key-b"
+    assert 收到的客户端 == ["key-b", "key-a"]
@@ -0,0 +1,189 @@
+"""
+测试延迟直方图和对冲请求
+"""
+import asyncio
+import time
+import pytest
+from providers.base import LLM提供者基类, LLM响应, 流式事件
+from providers.hedging import 对冲提供者, 对冲策略
+from providers.metrics import 延迟直方图, 获取延迟直方图
+
+
+class 假提供者(LLM提供者基类):
+    """按预设的耗时列表依次返回（或抛出）的 Provider"""
+
+    def __init__(self, 名称, 耗时列表, 失败=False):
+        super().__init__("test-key")
+        self._名称 = 名称
+        self.耗时列表 = list(耗时列表)
+        self.失败 = 失败
+        self.被取消次数 = 0
+        self.调用次数 = 0
+
+    @property
+    def 提供者名称(self):
+        return self._名称
+
+    async def 发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
+        self.调用次数 += 1
+        耗时 = self.耗时列表.pop(0) if len(self.耗时列表) > 1 else self.耗时列表[0]
+        try:
+            await asyncio.sleep(耗时)
+        except asyncio.CancelledError:
+            self.被取消次数 += 1
+            raise
+        if self.失败:
+            raise RuntimeError(f"{self._名称} 出错")
+        return LLM响应(文本内容=self._名称)
+
+    async def 流式发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
+        响应 = await self.发送消息(对话历史)
+        yield 流式事件(类型="文本", 文本=响应.文本内容)
+        yield 流式事件(类型="完成", 响应=响应)
+
+
+def _策略(**选项):
+    return 对冲策略(**{"最小延迟": 0.05, "初始延迟": 0.1, "最少样本": 5, **选项})
+
+
+def test_histogram_percentiles_are_close():
+    直方图 = 延迟直方图(窗口大小=None)
+    for 毫秒 in range(1, 1001):
+        直方图.记录(毫秒 / 1000)
+
+    assert 直方图.分位数(0.5) == pytest.approx(0.5, rel=0.1)
+    assert 直方图.分位数(0.95) == pytest.approx(0.95, rel=0.1)
+    assert 直方图.获取统计()["次数"] == 1000
+    assert 延迟直方图().分位数(0.5) is None
+
+
+def test_histogram_rolling_window_forgets_old_samples():
+    直方图 = 延迟直方图(窗口大小=10)
+    for _ in range(10):
+        直方图.记录(5.0)
+    for _ in range(10):
+        直方图.记录(0.1)
+
+    assert 直方图.样本数 == 10
+    assert 直方图.分位数(0.99) == pytest.approx(0.1, rel=0.1)
+
+
+@pytest.mark.asyncio
+async def test_fast_call_is_not_hedged():
+    主 = 假提供者("快-主", [0.01])
+    提供者 = 对冲提供者(主, 策略=_策略())
+
+    响应 = await 提供者.发送消息([])
+
+    assert 响应.文本内容 == "快-主"
+    assert 提供者.对冲次数 == 0
+    assert 主.调用次数 == 1
+
+
+@pytest.mark.asyncio
+async def test_slow_call_is_hedged_and_loser_cancelled():
+    主 = 假提供者("慢-主", [1.0])
+    备 = 假提供者("快-备", [0.01])
+    提供者 = 对冲提供者(主, 备用提供者=备, 策略=_策略())
+
+    开始 = time.perf_counter()
+    响应 = await 提供者.发送消息([])
+
+    assert time.perf_counter() - 开始 < 0.5
+    assert 响应.文本内容 == "快-备"
+    assert 提供者.对冲次数 == 1
+    assert 提供者.对冲获胜次数 == 1
+    assert 主.被取消次数 == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_hedge_falls_back_to_primary():
+    主 = 假提供者("慢-主", [0.2])
+    备 = 假提供者("坏-备", [0.01], 失败=True)
+    提供者 = 对冲提供者(主, 备用提供者=备, 策略=_策略())
+
+    响应 = await 提供者.发送消息([])
+
+    assert 响应.文本内容 == "慢-主"
+    assert 提供者.对冲次数 == 1
+    assert 提供者.对冲获胜次数 == 0
+
+
+@pytest.mark.asyncio
+async def test_hedge_delay_follows_histogram_percentile():
+    主 = 假提供者("直方图-主", [0.01])
+    提供者 = 对冲提供者(主, 策略=_策略(分位数=0.9))
+    assert 提供者.对冲延迟() == 0.1  # 样本不够，用初始延迟
+
+    for _ in range(20):
+        获取延迟直方图("直方图-主").记录(0.3)
+    assert 提供者.对冲延迟() == pytest.approx(0.3, rel=0.1)
+
+
+@pytest.mark.asyncio
+async def test_histograms_are_keyed_by_provider_and_model():
+    """同名 Provider 的不同模型分开统计"""
+    快 = 假提供者("同名", [0.01])
+    快.model = "mini"
+    慢 = 假提供者("同名", [0.05])
+    慢.model = "large"
+
+    await 对冲提供者(快, 策略=_策略()).发送消息([])
+    await 对冲提供者(慢, 策略=_策略()).发送消息([])
+
+    assert 获取延迟直方图("同名", "mini").样本数 == 1
+    assert 获取延迟直方图("同名", "large").样本数 == 1
+    assert 获取延迟直方图("同名").样本数 == 0
+
+
+@pytest.mark.asyncio
+async def test_registry_times_only_the_call_not_the_scheduler_queue():
+    """对冲包在限流调度里面：排队等名额的时间不计入延迟直方图"""
+    from providers.registry import 提供者注册表
+    from providers.scheduler import 调度提供者, 调度配置
+
+    注册表 = 提供者注册表(调度=调度配置(最大并发=1), 对冲=_策略(初始延迟=10.0))
+    注册表.注册("fake", lambda api_key, model, 配置: 假提供者("排队", [0.1]))
+    提供者 = 注册表.获取("fake", "key")
+    assert isinstance(提供者, 调度提供者)
+    assert isinstance(提供者.内部提供者, 对冲提供者)
+
+    # 最大并发 1：第二个请求要排队 0.1 秒，但它真正的调用仍然只有 0.1 秒
+    await asyncio.gather(*(提供者.发送消息([]) for _ in range(3)))
+    直方图 = 获取延迟直方图("排队")
+    assert 直方图.样本数 == 3
+    assert 直方图.获取统计()["平均毫秒"] < 150
+
+
+@pytest.mark.asyncio
+async def test_stream_hedges_on_first_event():
+    主 = 假提供者("慢流-主", [1.0])
+    备 = 假提供者("快流-备", [0.01])
+    提供者 = 对冲提供者(主, 备用提供者=备, 策略=_策略())
+
+    事件列表 = [事件 async for 事件 in 提供者.流式发送消息([])]
+
+    assert [e.类型 for e in 事件列表] == ["文本", "完成"]
+    assert 事件列表[-1].响应.文本内容 == "快流-备"
+    assert 提供者.对冲获胜次数 == 1
+    assert 主.被取消次数 == 1
+
+
+@pytest.mark.asyncio
+async def test_hedging_cuts_tail_latency():
+    """十分之一的调用很慢：对冲之后最慢的一步明显变快"""
+    模式 = [0.6 if 序号 % 10 == 9 else 0.02 for 序号 in range(30)]
+
+    async def 跑(提供者):
+        耗时 = []
+        for _ in range(30):
+            开始 = time.perf_counter()
+            await 提供者.发送消息([])
+            耗时.append(time.perf_counter() - 开始)
+        return max(耗时)
+
+    不对冲 = await 跑(假提供者("尾延迟-A", 模式 + [0.02]))
+    对冲 = await 跑(对冲提供者(假提供者("尾延迟-B", 模式 + [0.02]), 策略=_策略(分位数=0.8)))
+
+    assert 不对冲 >= 0.6
+    assert 对冲 < 0.3
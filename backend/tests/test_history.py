@@ -0,0 +1,124 @@
+"""
+测试对话历史管理器
+"""
+import pytest
+from history import 对话历史管理器, 估算字节数, 格式化工具调用, 默认字节上限, 默认令牌上限
+
+
+def _记录若干步(历史, 步数, 图片大小=200_000):
+    for 步 in range(1, 步数 + 1):
+        历史.记录步骤(
+            步数=步,
+            屏幕摘要=f"变化 1.{步}%，区域 (0,0,100x40)",
+            截图base64="A" * 图片大小,
+            媒体类型="image/png",
+            回复=f"点击按钮\n[调用工具] {格式化工具调用('left_click', {'x': 步, 'y': 20})}",
+            动作摘要=格式化工具调用("left_click", {"x": 步, "y": 20}),
+            执行结果="left_click → 已点击",
+            图片令牌数=1000
+        )
+
+
+def _图片数(消息):
+    return sum(
+        1 for 单条 in 消息 if isinstance(单条["content"], list)
+        for 部分 in 单条["content"] if 部分["type"] == "image"
+    )
+
+
+def test_keeps_only_recent_images():
+    """只保留最近 N 张截图，更早的换成包含步数、操作和变化区域的占位符"""
+    历史 = 对话历史管理器(保留图片数=2)
+    历史.开始("打开计算器")
+    _记录若干步(历史, 4)
+
+    消息 = 历史.构建消息()
+    assert 消息[0] == {"role": "user", "content": "打开计算器"}
+    assert _图片数(消息) == 2
+
+    占位符 = [单条["content"] for 单条 in 消息 if "截图已省略" in str(单条["content"])]
+    assert len(占位符) == 2
+    assert "第 1 步" in 占位符[0]
+    assert "left_click(x=1, y=20)" in 占位符[0]
+    assert "区域 (0,0,100x40)" in 占位符[0]
+    # 最新的截图保留下来
+    assert 消息[-3]["content"][1]["data"] == "A" * 200_000
+
+
+def test_step_50_costs_about_the_same_as_step_5():
+    """旧步骤压缩成摘要后，请求大小不再随步数线性增长"""
+    def 第几步的大小(步数):
+        历史 = 对话历史管理器(保留图片数=2, 保留步骤数=5, 最多摘要步骤=10)
+        历史.开始("整理桌面")
+        _记录若干步(历史, 步数)
+        return 估算字节数(历史.构建消息())
+
+    assert 第几步的大小(50) < 第几步的大小(5) * 1.1
+
+
+def test_byte_ceiling_drops_oldest_images_first():
+    """超过字节上限时先丢截图，再压缩旧步骤"""
+    历史 = 对话历史管理器(保留图片数=3, 字节上限=250_000)
+    历史.开始("测试")
+    _记录若干步(历史, 5)
+
+    消息 = 历史.构建消息()
+    assert 估算字节数(消息) <= 250_000
+    assert _图片数(消息) == 1
+
+    历史.字节上限 = 500
+    消息 = 历史.构建消息()
+    assert _图片数(消息) == 0
+    assert "之前的步骤摘要" in 消息[1]["content"]
+
+
+def test_token_ceiling_uses_predicted_image_tokens():
+    历史 = 对话历史管理器(保留图片数=3, 令牌上限=2_500)
+    历史.开始("测试")
+    _记录若干步(历史, 3, 图片大小=10)
+    assert _图片数(历史.构建消息()) == 2
+
+
+def test_current_screenshot_counts_against_ceilings():
+    """本次附带的当前截图不在历史里，但要算进上限"""
+    历史 = 对话历史管理器(保留图片数=3, 字节上限=650_000)
+    历史.开始("测试")
+    _记录若干步(历史, 3)
+    assert _图片数(历史.构建消息()) == 3
+    assert _图片数(历史.构建消息("A" * 200_000)) == 2
+
+    历史 = 对话历史管理器(保留图片数=3, 令牌上限=3_500)
+    历史.开始("测试")
+    _记录若干步(历史, 3, 图片大小=10)
+    assert _图片数(历史.构建消息()) == 3
+    assert _图片数(历史.构建消息("A" * 10, 当前图片令牌数=1000)) == 2
+
+
+def test_ceilings_are_on_by_default():
+    历史 = 对话历史管理器()
+    assert 历史.字节上限 == 默认字节上限
+    assert 历史.令牌上限 == 默认令牌上限
+
+    # 截图很大时，默认上限也会把请求压到范围之内
+    历史 = 对话历史管理器(保留图片数=10)
+    历史.开始("测试")
+    _记录若干步(历史, 10, 图片大小=3 * 1024 * 1024)
+    消息 = 历史.构建消息("A" * 3 * 1024 * 1024)
+    assert 估算字节数(消息) + 3 * 1024 * 1024 <= 默认字节上限
+    assert _图片数(消息) == 1
+
+
+@pytest.mark.parametrize("模块,类名,图片键", [
+    ("providers.openai_provider", "OpenAI提供者", "image_url"),
+    ("providers.anthropic_provider", "Anthropic提供者", "source"),
+])
+def test_providers_convert_image_parts(模块, 类名, 图片键):
+    """各 Provider 把历史里的图片部分转换成自己的格式"""
+    import importlib
+    from history import 文本部分, 图片部分
+
+    provider = getattr(importlib.import_module(模块), 类名)("test-key")
+    内容 = provider._转换内容([文本部分("第 1 步"), 图片部分("abc", "image/webp")])
+    assert 内容[0] == {"type": "text", "text": "第 1 步"}
+    assert 图片键 in 内容[1]
+    assert provider._转换内容("纯文字") == "纯文字"
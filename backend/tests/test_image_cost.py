@@ -0,0 +1,74 @@
+"""
+测试图片令牌成本模型和分辨率策略
+"""
+import pytest
+from providers.image_cost import (
+    Anthropic图片成本, Gemini图片成本, OpenAI图片成本, 分辨率策略, 图片成本模型
+)
+
+
+@pytest.mark.parametrize("宽,高,令牌", [
+    (512, 512, 85 + 170 * 1),
+    (1024, 1024, 85 + 170 * 4),    # 短边缩到 768 → 768x768 → 2x2 块
+    (2048, 4096, 85 + 170 * 6),    # 先缩到 1024x2048，再到 768x1536 → 2x3 块
+    (1920, 1080, 85 + 170 * 6),    # 1365x768 → 3x2 块
+])
+def test_openai_tile_cost(宽, 高, 令牌):
+    assert OpenAI图片成本().预测令牌数(宽, 高) == 令牌
+    assert OpenAI图片成本(细节="low").预测令牌数(宽, 高) == 85
+
+
+def test_anthropic_pixel_cost_and_downscale():
+    模型 = Anthropic图片成本()
+    assert 模型.预测令牌数(1000, 750) == 1000
+    # 长边超过 1568 会先缩小，令牌数不超过约 1600
+    assert max(模型.实际尺寸(3840, 2160)) <= 1568
+    assert 模型.预测令牌数(3840, 2160) <= 1601
+
+
+def test_gemini_tile_cost():
+    模型 = Gemini图片成本()
+    assert 模型.预测令牌数(384, 200) == 258
+    assert 模型.预测令牌数(768, 768) == 258
+    assert 模型.预测令牌数(1920, 1080) == 258 * 3 * 2
+
+
+def test_strategy_defaults_to_fixed_cap():
+    """没有预算和可读性要求时，和以前一样限制在 1024x1024 以内"""
+    策略 = 分辨率策略(图片成本模型())
+    assert 策略(3840, 2160) == (1024, 576)
+    assert 策略(800, 600) == (800, 600)
+
+
+def test_strategy_picks_largest_size_within_budget():
+    策略 = 分辨率策略(Gemini图片成本(), 令牌预算=258 * 2)
+    宽, 高 = 策略(2560, 1440)
+    assert 策略.预测令牌数(宽, 高) <= 258 * 2
+    # 再大一点就会超出预算
+    assert 策略.预测令牌数(宽 + 10, 高 + 6) > 258 * 2
+
+
+def test_budget_wins_over_minimum_side():
+    """预算连最短边长都放不下时，按预算缩小而不是偷偷超出预算"""
+    策略 = 分辨率策略(Anthropic图片成本(), 令牌预算=20)
+    宽, 高 = 策略(2560, 1440)
+    assert max(宽, 高) < 策略.最短边长
+    assert 策略.预测令牌数(宽, 高) <= 20
+
+
+def test_strategy_never_exceeds_provider_downscale():
+    """预算很大时也不发送比 Provider 内部缩放后更大的图"""
+    策略 = 分辨率策略(Anthropic图片成本(), 令牌预算=100_000)
+    assert max(策略(3840, 2160)) <= 1568
+
+
+def test_strategy_picks_smallest_legible_size():
+    """文字需要至少 7px：原生 14px 的文字只能缩小一半"""
+    策略 = 分辨率策略(OpenAI图片成本(), 最小文字像素=7)
+    assert 策略(2560, 1440) == (1280, 720)
+
+    # 同时有预算时，预算优先
+    策略 = 分辨率策略(OpenAI图片成本(), 最小文字像素=7, 令牌预算=85 + 170 * 2)
+    宽, 高 = 策略(2560, 1440)
+    assert 宽 < 1280
+    assert 策略.预测令牌数(宽, 高) <= 85 + 170 * 2
@@ -0,0 +1,83 @@
+"""
+测试感知哈希和屏幕状态索引
+"""
+import numpy as np
+import pytest
+from PIL import Image
+from tools.image_hash import 平均哈希, 差值哈希, 感知哈希, 汉明距离, 屏幕状态索引
+
+
+def _渐变帧(宽=640, 高=360):
+    """生成一张带有结构的 BGRA 测试帧"""
+    x = np.linspace(0, 255, 宽, dtype=np.float32)
+    y = np.linspace(0, 255, 高, dtype=np.float32)[:, None]
+    帧 = np.zeros((高, 宽, 4), dtype=np.uint8)
+    帧[..., 0] = x
+    帧[..., 1] = y
+    帧[..., 2] = (x + y) / 2
+    帧[100:200, 300:500, :3] = 255
+    return 帧
+
+
+@pytest.mark.parametrize("哈希函数", [平均哈希, 差值哈希, 感知哈希])
+def test_hash_sizes(哈希函数):
+    """哈希尺寸 8 → 64 位，16 → 256 位"""
+    帧 = _渐变帧()
+    assert 哈希函数(帧).bit_length() <= 64
+    assert 哈希函数(帧, 哈希尺寸=16).bit_length() <= 256
+    assert 哈希函数(帧, 哈希尺寸=16).bit_length() > 64
+
+
+@pytest.mark.parametrize("哈希函数", [平均哈希, 差值哈希, 感知哈希])
+def test_similar_images_have_close_hashes(哈希函数):
+    """轻微变化的图像哈希接近，完全不同的图像哈希相差很远"""
+    帧 = _渐变帧()
+    轻微变化 = 帧.copy()
+    轻微变化[10:20, 10:20, :3] = 0
+
+    完全不同 = np.random.default_rng(1).integers(0, 256, 帧.shape, dtype=np.uint8)
+
+    assert 汉明距离(哈希函数(帧), 哈希函数(轻微变化)) <= 4
+    assert 汉明距离(哈希函数(帧), 哈希函数(完全不同)) > 10
+
+
+def test_pil_and_bgra_inputs_agree():
+    """PIL RGB 图像和对应的 BGRA 数组得到相近的哈希"""
+    帧 = _渐变帧()
+    图像 = Image.fromarray(np.ascontiguousarray(帧[..., 2::-1]))
+    assert 汉明距离(差值哈希(帧), 差值哈希(图像)) <= 2
+
+
+def test_state_index_radius_lookup():
+    """索引能找到汉明半径内的状态，找不到半径外的状态"""
+    索引 = 屏幕状态索引(哈希位数=64, 半径=4)
+    基准 = 0x0123456789ABCDEF
+    索引.添加(基准, 1)
+    索引.添加(基准 ^ 0xFFFF0000FFFF0000, 2)
+
+    命中 = 索引.最近(基准 ^ 0b1011)  # 差 3 位
+    assert 命中 == (3, 基准, [1])
+    assert (基准 ^ 0b11111) not in 索引  # 差 5 位，超出半径
+    assert 索引.查找(基准, 半径=0) == [(0, 基准, [1])]
+    assert len(索引) == 2
+
+    索引.清空()
+    assert 索引.最近(基准) is None
+
+
+def test_state_index_finds_all_neighbours():
+    """鸽巢分段保证：半径内的所有状态都能被找到"""
+    rng = np.random.default_rng(7)
+    索引 = 屏幕状态索引(哈希位数=64, 半径=5)
+    基准 = int(rng.integers(0, 2**63))
+    邻居 = set()
+    for 步 in range(50):
+        位 = rng.choice(64, size=int(rng.integers(1, 6)), replace=False)
+        哈希 = 基准
+        for b in 位:
+            哈希 ^= 1 << int(b)
+        索引.添加(哈希, 步)
+        邻居.add(哈希)
+
+    找到 = {哈希 for _, 哈希, _ in 索引.查找(基准)}
+    assert 找到 == {h for h in 邻居 if 汉明距离(h, 基准) <= 5}
@@ -0,0 +1,220 @@
+"""
+测试本地模型 Provider（对着一个本地的 OpenAI 兼容替身服务器）
+"""
+import asyncio
+import json
+import pytest
+from providers.local_provider import 本地提供者, 微批调度器, 文本工具调用过滤器, 解析文本工具调用
+
+
+class 替身服务器:
+    """
+    最小的 OpenAI 兼容服务：/v1/chat/completions（支持 stream）
+
+    回复 = 函数(请求体) → 助手消息 dict（content / tool_calls）
+    """
+
+    def __init__(self, 回复, 耗时=0.0):
+        self.回复 = 回复
+        self.耗时 = 耗时
+        self.请求列表: list[dict] = []
+        self.进行中 = 0
+        self.最大进行中 = 0
+        self.到达时间: list[float] = []
+
+    async def _处理(self, reader, writer):
+        try:
+            while True:
+                头 = await reader.readuntil(b"\r\n\r\n")
+                长度 = next(
+                    (int(行.split(b":")[1]) for 行 in 头.split(b"\r\n")
+                     if 行.lower().startswith(b"content-length")),
+                    0
+                )
+                请求 = json.loads(await reader.readexactly(长度))
+                self.请求列表.append(请求)
+                self.到达时间.append(asyncio.get_running_loop().time())
+                self.进行中 += 1
+                self.最大进行中 = max(self.最大进行中, self.进行中)
+                try:
+                    await asyncio.sleep(self.耗时)
+                    消息 = self.回复(请求)
+                finally:
+                    self.进行中 -= 1
+                if 请求.get("stream"):
+                    await self._流式回复(writer, 消息)
+                else:
+                    self._写入(writer, b"application/json", json.dumps({
+                        "id": "chatcmpl-1", "object": "chat.completion", "created": 0,
+                        "model": 请求["model"],
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", **消息}}],
+                        "usage": {"prompt_tokens": 50, "completion_tokens": 5, "total_tokens": 55}
+                    }).encode())
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    @staticmethod
+    def _写入(writer, 类型, 正文):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: " + 类型 + b"\r\n"
+            b"Content-Length: " + str(len(正文)).encode() + b"\r\n\r\n" + 正文
+        )
+
+    async def _流式回复(self, writer, 消息):
+        def 块(delta, finish=None):
+            return "data: " + json.dumps({
+                "id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0, "model": "m",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]
+            }) + "\n\n"
+
+        正文 = ""
+        if 消息.get("content"):
+            for 字 in 消息["content"]:
+                正文 += 块({"content": 字})
+        for 序号, 调用 in enumerate(消息.get("tool_calls", [])):
+            正文 += 块({"tool_calls": [{"index": 序号, **调用}]})
+        正文 += 块({}, "stop") + "data: [DONE]\n\n"
+        self._写入(writer, b"text/event-stream", 正文.encode())
+
+    async def __aenter__(self):
+        self.服务器 = await asyncio.start_server(self._处理, "127.0.0.1", 0)
+        端口 = self.服务器.sockets[0].getsockname()[1]
+        self.地址 = f"http://127.0.0.1:{端口}/v1"
+        return self
+
+    async def __aexit__(self, *异常):
+        self.服务器.close()
+        await self.服务器.wait_closed()
+
+
+def _工具调用(名称, 参数, 调用ID="call_x"):
+    return {"id": 调用ID, "type": "function",
+            "function": {"name": 名称, "arguments": json.dumps(参数)}}
+
+
+@pytest.mark.asyncio
+async def test_sends_inline_image_and_parses_tool_calls():
+    async with 替身服务器(lambda 请求: {"content": None, "tool_calls": [
+        _工具调用("left_click", {"x": 10, "y": 20})
+    ]}) as 服务器:
+        提供者 = 本地提供者(model="qwen-vl", base_url=服务器.地址)
+        响应 = await 提供者.发送消息([{"role": "user", "content": "点一下"}], "QUJD", "image/jpeg")
+        await 提供者.关闭()
+
+    assert 响应.工具调用列表[0].工具名称 == "left_click"
+    assert 响应.工具调用列表[0].参数 == {"x": 10, "y": 20}
+    assert 响应.用量 == {"输入令牌": 50, "输出令牌": 5}
+
+    请求 = 服务器.请求列表[0]
+    assert 请求["model"] == "qwen-vl"
+    assert 请求["tools"][0]["type"] == "function"
+    图片 = 请求["messages"][-1]["content"][1]["image_url"]["url"]
+    assert 图片 == "data:image/jpeg;base64,QUJD"
+
+
+@pytest.mark.asyncio
+async def test_tool_calls_written_in_text_are_extracted():
+    文本 = '好的，我来点击。\n<tool_call>{"name": "left_click", "arguments": {"x": 1, "y": 2}}</tool_call>'
+    async with 替身服务器(lambda 请求: {"content": 文本}) as 服务器:
+        提供者 = 本地提供者(base_url=服务器.地址)
+        响应 = await 提供者.发送消息([])
+        事件列表 = [事件 async for 事件 in 提供者.流式发送消息([])]
+        await 提供者.关闭()
+
+    assert 响应.文本内容 == "好的，我来点击。"
+    assert 响应.工具调用列表[0].参数 == {"x": 1, "y": 2}
+    assert 响应.工具调用列表[0].工具调用ID.startswith("call_")
+
+    工具事件 = [e for e in 事件列表 if e.类型 == "工具调用"]
+    assert len(工具事件) == 1
+    assert 事件列表[-1].响应.工具调用列表 == [工具事件[0].工具调用]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("文本,可见文字", [
+    ('好的，我来点击。\n<tool_call>{"name": "left_click", "arguments": {"x": 1, "y": 2}}</tool_call>', "好的，我来点击。\n"),
+    ('先点一下：```json\n{"name": "left_click", "arguments": {"x": 1, "y": 2}}\n```完成', "先点一下：完成"),
+    ('{"name": "left_click", "arguments": {"x": 1, "y": 2}}', ""),
+])
+async def test_streamed_text_hides_tool_call_markup(文本, 可见文字):
+    """写在文本里的工具调用不作为文字推出去，只产出一次工具调用事件"""
+    async with 替身服务器(lambda 请求: {"content": 文本}) as 服务器:
+        提供者 = 本地提供者(base_url=服务器.地址)
+        事件列表 = [事件 async for 事件 in 提供者.流式发送消息([])]
+        await 提供者.关闭()
+
+    assert "".join(e.文本 for e in 事件列表 if e.类型 == "文本") == 可见文字
+    assert [e.工具调用.参数 for e in 事件列表 if e.类型 == "工具调用"] == [{"x": 1, "y": 2}]
+
+
+def test_markup_filter_releases_text_that_is_not_a_tool_call():
+    过滤器 = 文本工具调用过滤器()
+    文本 = "示例：```python\nprint(1)\n``` 和 <tool_call>不是 JSON</tool_call>，结尾 <tool_"
+    输出 = "".join(过滤器.喂入(字) for 字 in 文本) + 过滤器.结束(已解析出工具调用=False)
+    assert 输出 == 文本
+
+    过滤器 = 文本工具调用过滤器()
+    assert 过滤器.喂入("{没有工具}") == ""
+    assert 过滤器.结束(已解析出工具调用=False) == "{没有工具}"
+
+
+def test_text_tool_call_formats():
+    调用, 剩余 = 解析文本工具调用('{"name": "type", "arguments": "{\\"text\\": \\"hi\\"}"}')
+    assert 调用[0].工具名称 == "type" and 调用[0].参数 == {"text": "hi"} and 剩余 is None
+
+    调用, 剩余 = 解析文本工具调用('```json\n{"name": "scroll", "parameters": {"direction": "down"}}\n```')
+    assert 调用[0].参数 == {"direction": "down"}
+
+    调用, 剩余 = 解析文本工具调用("任务已经完成 {没有工具}")
+    assert 调用 == [] and 剩余 == "任务已经完成 {没有工具}"
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit_and_micro_batching():
+    """6 个 Agent 同时发请求：最多 3 个同时在服务器上，同时到达的请求成批放行"""
+    async with 替身服务器(lambda 请求: {"content": "ok"}, 耗时=0.05) as 服务器:
+        提供者 = 本地提供者(base_url=服务器.地址, 最大并发=3, 批处理窗口=0.02)
+        结果 = await asyncio.gather(*(提供者.发送消息([]) for _ in range(6)))
+        await 提供者.关闭()
+
+    assert [r.文本内容 for r in 结果] == ["ok"] * 6
+    assert 服务器.最大进行中 == 3
+    统计 = 提供者.获取统计()
+    assert 统计["请求数"] == 6
+    assert 统计["最大批量"] == 3
+    assert 统计["批次数"] <= 4
+
+
+@pytest.mark.asyncio
+async def test_batcher_releases_slot_when_cancelled():
+    调度器 = 微批调度器(最大并发=1, 批处理窗口=0)
+
+    async def 占用(秒数):
+        async with 调度器.槽位():
+            await asyncio.sleep(秒数)
+
+    长任务 = asyncio.create_task(占用(0.05))
+    排队任务 = asyncio.create_task(占用(0))
+    await asyncio.sleep(0.01)
+    排队任务.cancel()
+    await 长任务
+
+    # 被取消的请求没有占住名额，后面的请求照常放行
+    await asyncio.wait_for(占用(0), timeout=1)
+    assert 调度器.请求数 == 2
+
+
+def test_registry_builds_local_provider_from_environment(monkeypatch):
+    from providers.registry import 提供者注册表
+
+    monkeypatch.setenv("LOCAL_LLM_BASE_URL", "http://127.0.0.1:1234/v1")
+    monkeypatch.setenv("LOCAL_LLM_MODEL", "llava")
+    monkeypatch.setenv("LOCAL_LLM_MAX_CONCURRENCY", "2")
+    提供者 = 提供者注册表(启用调度=False).获取("local", "none")
+
+    assert isinstance(提供者, 本地提供者)
+    assert 提供者.model == "llava"
+    assert 提供者.批处理.最大并发 == 2
+    assert str(提供者.client.base_url).startswith("http://127.0.0.1:1234/v1")
@@ -98,4 +98,52 @@ async def test_tool_conversion():
     assert tools[0]["type"] == "function"
     assert "function" in tools[0]
     assert "name" in tools[0]["function"]
-    assert "parameters" in tools[0]["function"]
\ No newline at end of file
+    assert "parameters" in tools[0]["function"]
+
+@pytest.mark.asyncio
+@patch('providers.openai_provider.AsyncOpenAI')
+async def test_openai_send_message_uses_media_type(mock_openai_class):
+    """截图的 MIME 类型会写进 data URL"""
+    mock_client = AsyncMock()
+    mock_response = AsyncMock()
+    mock_choice = AsyncMock()
+    mock_message = AsyncMock()
+    mock_message.content = "ok"
+    mock_message.tool_calls = None
+    mock_choice.message = mock_message
+    mock_response.choices = [mock_choice]
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
+    mock_openai_class.return_value = mock_client
+
+    provider = OpenAI提供者("test-key")
+    await provider.发送消息(
+        [{"role": "user", "content": "hello"}],
+        截图base64="abc",
+        截图媒体类型="image/webp"
+    )
+
+    messages = mock_client.chat.completions.create.call_args.kwargs["messages"]
+    assert messages[-1]["content"][1]["image_url"]["url"] == "data:image/webp;base64,abc"
+
+
+@pytest.mark.asyncio
+@patch('providers.openai_provider.AsyncOpenAI')
+async def test_openai_detail_and_usage(mock_openai_class):
+    """detail 参数可配置，响应里的令牌用量会被解析出来"""
+    from unittest.mock import MagicMock
+    mock_client = AsyncMock()
+    mock_response = MagicMock()
+    mock_response.choices[0].message.content = "ok"
+    mock_response.choices[0].message.tool_calls = None
+    mock_response.usage.prompt_tokens = 1234
+    mock_response.usage.completion_tokens = 56
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
+    mock_openai_class.return_value = mock_client
+
+    provider = OpenAI提供者("test-key", 图片细节="low")
+    响应 = await provider.发送消息([{"role": "user", "content": "hello"}], 截图base64="abc")
+
+    messages = mock_client.chat.completions.create.call_args.kwargs["messages"]
+    assert messages[-1]["content"][1]["image_url"]["detail"] == "low"
+    assert provider.图片成本模型.预测令牌数(1920, 1080) == 85
+    assert 响应.用量 == {"输入令牌": 1234, "输出令牌": 56}
@@ -0,0 +1,149 @@
+"""
+测试操作节奏和操作合并
+"""
+import asyncio
+
+import pytest
+from unittest.mock import patch
+
+from providers.base import LLM提供者基类, LLM响应, 工具调用, 流式事件
+from tools.computer import 执行鼠标操作, 执行键盘操作
+from tools.pacing import 合并分组, 合并工具调用, 获取节奏
+
+
+def _名称和参数(调用列表):
+    return [(调用.工具名称, 调用.参数) for 调用 in 调用列表]
+
+
+def test_coalesce_redundant_primitives():
+    原列表 = [
+        工具调用("mouse_move", {"x": 10, "y": 20}, "a"),
+        工具调用("left_click", {"x": 10, "y": 20}, "b"),
+        工具调用("scroll", {"amount": -3}),
+        工具调用("scroll", {"amount": -2}),
+        工具调用("mouse_move", {"x": 5, "y": 5}),
+        工具调用("double_click", {}),
+        工具调用("type", {"text": "hello "}),
+        工具调用("type", {"text": "world"}),
+    ]
+    合并后 = 合并工具调用(原列表)
+    assert _名称和参数(合并后) == [
+        ("left_click", {"x": 10, "y": 20}),
+        ("scroll", {"amount": -5}),
+        ("double_click", {"x": 5, "y": 5}),
+        ("type", {"text": "hello world"}),
+    ]
+    assert 合并后[0].工具调用ID == "b"
+    assert 原列表[5].参数 == {}   # 原来的对象没有被修改
+
+
+def test_coalesce_keeps_calls_that_would_change_behavior():
+    原列表 = [
+        工具调用("mouse_move", {"x": 10, "y": 20}),
+        工具调用("mouse_move", {"x": 30, "y": 40}),   # 中间位置可能要触发悬停
+        工具调用("left_click", {"x": 50, "y": 60}),   # 点击别的位置
+        工具调用("scroll", {"amount": 1, "x": 1, "y": 1}),
+        工具调用("scroll", {"amount": 1}),             # 滚动位置不同
+        工具调用("key", {"key_name": "enter"}),
+        工具调用("key", {"key_name": "enter"}),
+    ]
+    assert _名称和参数(合并工具调用(原列表)) == _名称和参数(原列表)
+
+
+def test_coalesce_only_merges_well_typed_values():
+    # 数字字符串、缺省的滚动量照常相加
+    assert _名称和参数(合并工具调用([工具调用("scroll", {"amount": "3"}), 工具调用("scroll", {})])) == [
+        ("scroll", {"amount": 3})
+    ]
+    # 不是数字的滚动量、不是字符串的文字不合并，原样交给执行时报错
+    for 原列表 in (
+        [工具调用("scroll", {"amount": None}), 工具调用("scroll", {"amount": "down"})],
+        [工具调用("type", {"text": "a"}), 工具调用("type", {"text": None})],
+    ):
+        assert _名称和参数(合并工具调用(原列表)) == _名称和参数(原列表)
+
+    分组 = 合并分组([工具调用("mouse_move", {"x": 1, "y": 2}), 工具调用("left_click", {}), 工具调用("key", {})])
+    assert [(调用.工具名称, [原始.工具名称 for 原始 in 来源]) for 调用, 来源 in 分组] == [
+        ("left_click", ["mouse_move", "left_click"]),
+        ("key", ["key"]),
+    ]
+
+
+@patch('tools.computer.pyautogui')
+def test_pacing_profiles(mock_pyautogui):
+    with pytest.raises(ValueError, match="human"):
+        获取节奏("warp")
+    assert 获取节奏(None).名称 == "default"
+
+    执行鼠标操作("mouse_move", {"x": 1, "y": 2}, 节奏=获取节奏("turbo"))
+    mock_pyautogui.moveTo.assert_called_once_with(1, 2, duration=0.0)
+    assert mock_pyautogui.PAUSE == 0.0
+
+    执行键盘操作("type", {"text": "hi"}, 节奏=获取节奏("human"))
+    mock_pyautogui.write.assert_called_once_with("hi", interval=0.08)
+    assert mock_pyautogui.PAUSE == 0.15
+
+    # 默认节奏和以前一样
+    执行键盘操作("key", {"key_name": "enter"})
+    assert mock_pyautogui.PAUSE == 0.1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("流式", [True, False])
+async def test_agent_executes_coalesced_calls(流式):
+    from agent_loop import AgentLoop
+    from tools.observation import 观测结果
+
+    调用 = [
+        工具调用("mouse_move", {"x": 10, "y": 20}),
+        工具调用("left_click", {}),
+        工具调用("scroll", {"amount": 2}),
+        工具调用("scroll", {"amount": 2}),
+    ]
+
+    class 提供者(LLM提供者基类):
+        次数 = 0
+
+        async def 发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
+            self.次数 += 1
+            return LLM响应(工具调用列表=list(调用) if self.次数 == 1 else [])
+
+        async def 流式发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
+            self.次数 += 1
+            结果 = LLM响应()
+            if self.次数 == 1:
+                for 一个 in 调用:
+                    await asyncio.sleep(0.02)   # 每个工具调用单独到达
+                    结果.工具调用列表.append(一个)
+                    yield 流式事件(类型="工具调用", 工具调用=一个)
+            yield 流式事件(类型="完成", 响应=结果)
+
+    已执行 = []
+
+    async def 假执行(工具):
+        已执行.append((工具.工具名称, 工具.参数))
+        return "ok"
+
+    async def 假观测():
+        return 观测结果(base64数据="abc", 宽=1, 高=1)
+
+    agent = AgentLoop(提供者=提供者("test-key"), 最大循环次数=3, 流式=流式, 流水线=False)
+    with patch.object(agent, '_获取截图', side_effect=假观测), \
+         patch.object(agent, '_执行工具', side_effect=假执行), \
+         patch.object(agent, '_等待界面稳定', return_value=0.0):
+        await agent.执行任务("测试合并")
+
+    assert 已执行[0] == ("left_click", {"x": 10, "y": 20})
+    if not 流式:
+        # 流式模式下两次滚动是分开到达的，执行第一次时第二次还没来
+        assert 已执行 == [("left_click", {"x": 10, "y": 20}), ("scroll", {"amount": 4})]
+    assert agent.获取步骤统计()["合并操作次数"] >= 1
+
+    # 历史里的动作摘要和执行结果按实际执行的操作一一对应，回复仍是 LLM 原本的调用
+    第一步 = agent.历史.步骤列表[0]
+    动作列表 = 第一步.动作摘要.split("；")
+    结果行 = 第一步.执行结果.split("\n")
+    assert len(动作列表) == len(结果行) == len(已执行)
+    assert 动作列表[0].startswith("left_click") and "10" in 动作列表[0]
+    assert 结果行[0] == "left_click（由 mouse_move + left_click 合并） → ok"
+    assert 第一步.回复.count("[调用工具]") == len(调用)
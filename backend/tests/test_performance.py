@@ -1,6 +1,8 @@
 """
 性能测试模块
 """
+import os
+import sys
 import time
 import pytest
 from unittest.mock import patch
@@ -120,4 +122,445 @@ def test_performance_comparison_flags():
     assert '使用缓存' in params
     assert '快速缩放' in params
 
-    print("✅ 截图函数参数验证通过")
\ No newline at end of file
+    print("✅ 截图函数参数验证通过")
+
+@pytest.mark.slow
+@pytest.mark.skipif(not os.environ.get("DISPLAY") and sys.platform.startswith("linux"),
+                    reason="需要图形环境（可用 Xvfb :99 -screen 0 3840x2160x24）")
+def test_capture_session_benchmark():
+    """
+    截图基准：每次新建 mss 连接 vs 复用截图会话
+
+    分别测量 1080p 和 4K 区域的纯截图耗时（不含缩放和编码）。
+    区域会被裁剪到主显示器大小以内。
+    """
+    import mss
+    from tools.screen import 截图会话
+
+    会话 = 截图会话()
+    主屏 = 会话.获取显示器(1)
+    次数 = 20
+
+    for 名称, (宽, 高) in {"1080p": (1920, 1080), "4K": (3840, 2160)}.items():
+        区域 = {
+            "left": 主屏["left"],
+            "top": 主屏["top"],
+            "width": min(宽, 主屏["width"]),
+            "height": min(高, 主屏["height"]),
+        }
+
+        开始 = time.perf_counter()
+        for _ in range(次数):
+            with mss.mss() as sct:
+                _ = sct.monitors
+                sct.grab(区域)
+        每次新建 = (time.perf_counter() - 开始) / 次数
+
+        开始 = time.perf_counter()
+        for _ in range(次数):
+            会话.抓取(区域)
+        复用会话 = (time.perf_counter() - 开始) / 次数
+
+        print(f"\n📊 {名称} ({区域['width']}x{区域['height']}): "
+              f"每次新建 {每次新建 * 1000:.1f}ms → 复用会话 {复用会话 * 1000:.1f}ms")
+        assert 复用会话 <= 每次新建 * 1.5
+
+    会话.关闭()
+
+
+# 在子进程里测量一次 4K 帧转换的峰值内存，两条路径互不干扰
+_转换基准脚本 = """
+import os, resource, sys, time
+import numpy as np
+from PIL import Image
+sys.path.insert(0, {backend!r})
+from tools.screen import 缩放BGRA为RGB
+
+def 峰值内存KB():
+    # Linux 的 ru_maxrss 会继承父进程（pytest）的峰值，优先读 VmHWM
+    try:
+        with open("/proc/self/status") as f:
+            for 行 in f:
+                if 行.startswith("VmHWM:"):
+                    return int(行.split()[1])
+    except OSError:
+        pass
+    峰值 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return 峰值 // 1024 if sys.platform == "darwin" else 峰值
+
+# 分块填充随机数据，避免生成测试帧本身把峰值内存抬高
+宽, 高 = {size}
+缓冲区 = bytearray(宽 * 高 * 4)
+for i in range(0, len(缓冲区), 1 << 20):
+    缓冲区[i:i + (1 << 20)] = os.urandom(min(1 << 20, len(缓冲区) - i))
+基线 = 峰值内存KB()
+
+def 转换():
+    if {path!r} == "old":
+        图片 = Image.frombytes("RGB", (宽, 高), bytes(缓冲区), "raw", "BGRX")
+        return 图片.resize((1024, 1024 * 高 // 宽), Image.Resampling.BILINEAR)
+    视图 = np.frombuffer(缓冲区, dtype=np.uint8).reshape(高, 宽, 4)
+    return 缩放BGRA为RGB(视图, 1024, 1024)
+
+耗时 = []
+for _ in range(5):
+    开始 = time.process_time()
+    转换()
+    耗时.append(time.process_time() - 开始)
+
+print(min(耗时), 峰值内存KB() - 基线)
+"""
+
+
+@pytest.mark.slow
+@pytest.mark.skipif(sys.platform == "win32", reason="需要 resource 模块")
+def test_bgra_fast_path_memory_and_cpu():
+    """
+    4K / 1080p 帧转换：原路径（frombytes 全分辨率 RGB + resize） vs 快速路径（先缩小后转换）
+
+    比较每帧 CPU 时间和峰值内存增量（各自在独立子进程中测量）。
+    """
+    import subprocess
+
+    backend目录 = os.path.join(os.path.dirname(__file__), '..')
+    for 名称, 尺寸 in (("4K", (3840, 2160)), ("1080p", (1920, 1080))):
+        结果 = {}
+        for 路径 in ("old", "fast"):
+            代码 = _转换基准脚本.format(backend=backend目录, path=路径, size=尺寸)
+            输出 = subprocess.run(
+                [sys.executable, "-c", 代码], capture_output=True, text=True, check=True
+            ).stdout.split()
+            结果[路径] = (float(输出[0]), int(输出[1]))
+
+
+        for 路径, (cpu, 峰值增量) in 结果.items():
+            print(f"\n📊 {名称} {路径}: CPU {cpu * 1000:.1f}ms，峰值内存增量 {峰值增量 / 1024:.1f}MB")
+
+        assert 结果["fast"][1] < 结果["old"][1]
+        if 名称 == "4K":
+            assert 结果["fast"][0] < 结果["old"][0]
+        else:
+            # 1080p → 1024 不到 2 倍，省下的主要是全分辨率中间图的内存，CPU 时间相当
+            assert 结果["fast"][0] < 结果["old"][0] * 1.1
+
+
+@pytest.mark.slow
+def test_encode_pool_throughput():
+    """
+    共享内存编码进程池：1 / 2 / 4 个工作进程时每秒能编码多少帧（2560x1440 → 1280 宽 PNG）
+    """
+    import numpy as np
+    from tools.encode_pool import 共享内存编码池
+
+    rng = np.random.default_rng(0)
+    帧列表 = []
+    for 种子 in range(4):
+        # 色块 + 少量噪声：接近真实界面截图的压缩难度
+        帧 = np.full((1440, 2560, 4), 230, dtype=np.uint8)
+        for _ in range(40):
+            x, y = rng.integers(0, 2400), rng.integers(0, 1300)
+            帧[y:y + 140, x:x + 160, :3] = rng.integers(0, 256, 3, dtype=np.uint8)
+        帧[::7, ::5, :3] = rng.integers(0, 256, (206, 512, 3), dtype=np.uint8)
+        帧列表.append(帧)
+
+    帧数 = 24
+    每秒帧数 = {}
+    for 工作进程数 in (1, 2, 4):
+        with 共享内存编码池(工作进程数=工作进程数) as 编码池:
+            编码池.编码帧(帧列表[0], 1280, 1280, 格式顺序=("PNG",))  # 预热：启动工作进程
+
+            开始 = time.perf_counter()
+            任务 = [
+                编码池.提交帧(帧列表[i % len(帧列表)], 1280, 1280, 格式顺序=("PNG",))
+                for i in range(帧数)
+            ]
+            for 未来 in 任务:
+                assert 未来.result().尺寸 == (1280, 720)
+            每秒帧数[工作进程数] = 帧数 / (time.perf_counter() - 开始)
+
+        print(f"\n📊 {工作进程数} 个编码进程: {每秒帧数[工作进程数]:.1f} 帧/秒")
+
+    # 多核机器上更多进程应该更快；单核机器上至少不能明显变慢
+    if (os.cpu_count() or 1) >= 2:
+        assert 每秒帧数[2] > 每秒帧数[1] * 1.2
+    else:
+        assert 每秒帧数[2] > 每秒帧数[1] * 0.7
+
+
+@pytest.mark.slow
+def test_request_build_cost_with_long_history():
+    """
+    历史越来越长时，构建一次请求的开销，以及整个请求的耗时（对着本地替身服务器，不含模型推理时间）
+
+    对比：每一步把整个历史重新转换一遍（旧做法）/ 只转换新增的消息，旧消息复用缓存
+    """
+    import asyncio
+    import base64
+    import json
+    from history import 对话历史管理器
+    from providers.openai_provider import OpenAI提供者
+    from providers.templates import 消息转换缓存
+
+    回复 = json.dumps({
+        "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "m",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "ok"}}]
+    }).encode()
+
+    async def 处理(reader, writer):
+        try:
+            while True:
+                头 = await reader.readuntil(b"\r\n\r\n")
+                长度 = next(int(行.split(b":")[1]) for 行 in 头.split(b"\r\n")
+                          if 行.lower().startswith(b"content-length"))
+                await reader.readexactly(长度)
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: " + str(len(回复)).encode() + b"\r\n\r\n" + 回复)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    async def 测量请求(提供者, 消息, 截图, 次数=5) -> float:
+        await 提供者.发送消息(消息, 截图)  # 预热连接和缓存
+        开始 = time.perf_counter()
+        for _ in range(次数):
+            await 提供者.发送消息(消息, 截图)
+        return (time.perf_counter() - 开始) / 次数 * 1000
+
+    def 测量构建(提供者, 消息, 截图, 次数=20) -> float:
+        提供者._构建请求参数(消息, 截图, "image/png")
+        开始 = time.perf_counter()
+        for _ in range(次数):
+            提供者._构建请求参数(消息, 截图, "image/png")
+        return (time.perf_counter() - 开始) / 次数 * 1000
+
+    async def 运行() -> dict:
+        服务器 = await asyncio.start_server(处理, "127.0.0.1", 0)
+        地址 = f"http://127.0.0.1:{服务器.sockets[0].getsockname()[1]}/v1"
+        截图 = base64.b64encode(os.urandom(200_000)).decode()
+        结果 = {}
+        for 步数 in (10, 50, 200):
+            历史 = 对话历史管理器(保留图片数=2, 保留步骤数=步数)
+            历史.开始("打开计算器")
+            for 序号 in range(1, 步数 + 1):
+                历史.记录步骤(序号, "变化 3%", 截图, "image/png",
+                            "我将点击按钮\n[调用工具] left_click(500, 300)", "left_click", "已点击")
+            消息 = 历史.构建消息()
+
+            新 = OpenAI提供者("test-key", base_url=地址)
+            旧 = OpenAI提供者("test-key", base_url=地址)
+            旧._消息缓存 = 消息转换缓存(旧._转换消息, 最大条目数=0)   # 不缓存：每次都从头转换
+
+            结果[步数] = (测量构建(旧, 消息, 截图), 测量构建(新, 消息, 截图))
+            整个请求 = (await 测量请求(旧, 消息, 截图), await 测量请求(新, 消息, 截图))
+            print(f"\n📊 {步数} 步历史: 构建请求 {结果[步数][0]:.2f}ms → {结果[步数][1]:.2f}ms；"
+                  f"整个请求（含 SDK）{整个请求[0]:.1f}ms → {整个请求[1]:.1f}ms")
+            await 新.关闭()
+            await 旧.关闭()
+        服务器.close()
+        await 服务器.wait_closed()
+        return 结果
+
+    结果 = asyncio.run(运行())
+    旧耗时, 新耗时 = 结果[200]
+    assert 新耗时 < 旧耗时
+
+
+@pytest.mark.slow
+def test_settle_detection_vs_fixed_sleep():
+    """
+    操作后的等待：固定 0.5 秒 vs 屏幕稳定检测（模拟几种响应速度不同的界面）
+
+    "浪费"指截图时界面还没画完（LLM 看到半成品，只能多花一次调用）。
+    """
+    import numpy as np
+    from tools.settle import 屏幕稳定检测器
+
+    场景 = {                      # (开始响应, 渲染时长) 秒
+        "按钮": (0.01, 0.03),
+        "菜单": (0.05, 0.15),
+        "启动应用": (0.3, 0.5),
+        "加载网页": (0.1, 1.0),
+    }
+
+    def 模拟采样(开始, 响应, 渲染):
+        计数 = [0]
+
+        def 采样():
+            计数[0] += 1
+            已过 = time.perf_counter() - 开始
+            if 已过 < 响应:
+                return np.zeros((45, 80), np.uint8)
+            if 已过 < 响应 + 渲染:
+                return np.full((45, 80), 60 + 计数[0] % 2 * 100, np.uint8)
+            return np.full((45, 80), 250, np.uint8)
+        return 采样
+
+    固定耗时, 检测耗时, 固定浪费, 检测浪费 = [], [], 0, 0
+    for 名称, (响应, 渲染) in 场景.items():
+        完成时刻 = 响应 + 渲染
+        固定耗时.append(0.5)
+        固定浪费 += 完成时刻 > 0.5
+
+        开始 = time.perf_counter()
+        检测器 = 屏幕稳定检测器(采样函数=模拟采样(开始, 响应, 渲染))
+        检测器.等待稳定(np.zeros((45, 80), np.uint8))
+        耗时 = time.perf_counter() - 开始
+        检测耗时.append(耗时)
+        检测浪费 += 耗时 < 完成时刻
+        print(f"\n📊 {名称}: 固定等待 500ms / 稳定检测 {耗时 * 1000:.0f}ms（界面 {完成时刻 * 1000:.0f}ms 画完）")
+
+    print(f"\n📊 平均等待: 固定 {sum(固定耗时) / len(场景) * 1000:.0f}ms / "
+          f"检测 {sum(检测耗时) / len(场景) * 1000:.0f}ms；"
+          f"截图过早: 固定 {固定浪费}/{len(场景)} / 检测 {检测浪费}/{len(场景)}")
+    assert 检测浪费 == 0
+    assert 检测耗时[0] < 0.5 and 检测耗时[1] < 0.5
+
+
+@pytest.mark.slow
+@pytest.mark.asyncio
+async def test_pipeline_steps_per_minute():
+    """
+    每分钟能走几步：串行 vs 流水线（模拟 LLM：第 0.1 秒给出工具调用，0.6 秒说完）
+
+    模拟的界面 0.1 秒画完，截图 + 编码 0.08 秒。
+    """
+    import asyncio
+    import numpy as np
+    from agent_loop import AgentLoop
+    from providers.base import LLM提供者基类, LLM响应, 工具调用, 流式事件
+    from tools.observation import 观测结果
+    from tools.settle import 屏幕稳定检测器
+
+    步数 = 6
+
+    class 模拟LLM(LLM提供者基类):
+        调用次数 = 0
+
+        async def 发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
+            raise NotImplementedError
+
+        async def 流式发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
+            self.调用次数 += 1
+            结果 = LLM响应()
+            if self.调用次数 <= 步数:
+                await asyncio.sleep(0.1)
+                调用 = 工具调用("left_click", {})
+                结果.工具调用列表.append(调用)
+                yield 流式事件(类型="工具调用", 工具调用=调用)
+                await asyncio.sleep(0.5)
+            yield 流式事件(类型="完成", 响应=结果)
+
+    async def 假观测():
+        await asyncio.sleep(0.08)
+        return 观测结果(base64数据="abc", 宽=1, 高=1)
+
+    async def 假执行(工具):
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    async def 运行(流水线):
+        开始时刻 = [time.perf_counter()]
+
+        def 采样():   # 每次操作之后 0.1 秒内画面在变
+            return np.full((8, 8), 0 if time.perf_counter() - 开始时刻[0] > 0.1 else 100, np.uint8)
+
+        agent = AgentLoop(
+            提供者=模拟LLM("test-key"), 最大循环次数=步数 + 1, 流水线=流水线,
+            稳定检测器=屏幕稳定检测器(采样间隔=0.01, 等待变化超时=0.05, 采样函数=采样)
+        )
+
+        async def 执行并记时(工具):
+            开始时刻[0] = time.perf_counter()
+            return await 假执行(工具)
+
+        with patch.object(agent, '_获取截图', side_effect=假观测), \
+             patch.object(agent, '_执行工具', side_effect=执行并记时):
+            开始 = time.perf_counter()
+            await agent.执行任务("基准测试")
+        return 步数 / (time.perf_counter() - 开始) * 60
+
+    串行 = await 运行(False)
+    流水线 = await 运行(True)
+    print(f"\n📊 串行 {串行:.0f} 步/分钟 → 流水线 {流水线:.0f} 步/分钟（{流水线 / 串行:.2f}x）")
+    assert 流水线 > 串行
+
+
+@pytest.mark.slow
+@pytest.mark.skipif(not os.environ.get("DISPLAY") or not sys.platform.startswith("linux"),
+                    reason="需要 X11 显示（可用 Xvfb :99 -screen 0 1920x1080x24）")
+def test_text_input_chars_per_second():
+    """
+    每种文字输入方式每秒能输入多少字符（在本地 Xvfb 上运行，没有焦点窗口时按键发给根窗口）
+    """
+    import threading
+    from tools.computer import 全局文字输入引擎
+
+    文字 = ("The quick brown fox jumps over the lazy dog. " * 50)[:2000]
+    结果 = {}
+    for 名称, 方式 in 全局文字输入引擎.输入方式表.items():
+        # 匀速输入每个字符至少 0.05 秒，只测 100 个字符
+        样本 = 文字[:100] if 名称 == "paced" else 文字
+        if not 方式.可用(样本):
+            print(f"\n📊 {名称}: 当前环境不可用，跳过")
+            continue
+        开始 = time.perf_counter()
+        已输入 = 方式.输入(样本, threading.Event())
+        耗时 = time.perf_counter() - 开始
+        结果[名称] = 已输入 / 耗时
+        print(f"\n📊 {名称}: {已输入} 个字符 {耗时 * 1000:.0f}ms → {结果[名称]:.0f} 字符/秒")
+
+    assert "paced" in 结果
+    if "xtest" in 结果:
+        assert 结果["xtest"] > 结果["paced"] * 10
+
+
+@pytest.mark.slow
+def test_multi_action_turn_pacing_and_coalescing():
+    """
+    一步里有多个操作时的执行耗时：逐个执行 vs 合并后执行 vs turbo 节奏
+
+    模拟的 pyautogui 按真实的停顿计时：每次调用之后停 PAUSE 秒，移动要滑动 duration 秒。
+    """
+    from types import SimpleNamespace
+    from providers.base import 工具调用
+    from tools.computer import 执行鼠标操作, 执行键盘操作
+    from tools.pacing import 合并工具调用, 获取节奏
+
+    def 停顿(秒=0.0):
+        time.sleep(秒 + 模拟.PAUSE)
+
+    模拟 = SimpleNamespace(
+        PAUSE=0.1, FailSafeException=RuntimeError,
+        moveTo=lambda x, y, duration=0.0, **_: 停顿(duration),
+        click=lambda *a, **k: 停顿(), rightClick=lambda *a, **k: 停顿(), doubleClick=lambda *a, **k: 停顿(),
+        scroll=lambda *a, **k: 停顿(), press=lambda *a, **k: 停顿(), hotkey=lambda *a, **k: 停顿(),
+        write=lambda 文字, interval=0.0, **_: 停顿(len(文字) * interval),
+        position=lambda: (0, 0),
+    )
+    这一步 = [
+        工具调用("mouse_move", {"x": 100, "y": 200}),
+        工具调用("left_click", {"x": 100, "y": 200}),
+        工具调用("type", {"text": "hello"}),
+        工具调用("mouse_move", {"x": 300, "y": 400}),
+        工具调用("double_click", {}),
+        工具调用("scroll", {"amount": -3}),
+        工具调用("scroll", {"amount": -3}),
+        工具调用("scroll", {"amount": -3}),
+    ]
+
+    def 执行(调用列表, 节奏):
+        开始 = time.perf_counter()
+        for 调用 in 调用列表:
+            函数 = 执行键盘操作 if 调用.工具名称 in ("type", "key", "hotkey") else 执行鼠标操作
+            函数(调用.工具名称, 调用.参数, None, 节奏)
+        return time.perf_counter() - 开始
+
+    with patch('tools.computer.pyautogui', 模拟):
+        逐个 = 执行(这一步, 获取节奏("default"))
+        合并 = 执行(合并工具调用(这一步), 获取节奏("default"))
+        极速 = 执行(合并工具调用(这一步), 获取节奏("turbo"))
+
+    print(f"\n📊 {len(这一步)} 个操作: 逐个执行 {逐个 * 1000:.0f}ms → "
+          f"合并后 {len(合并工具调用(这一步))} 个 {合并 * 1000:.0f}ms → turbo {极速 * 1000:.0f}ms")
+    assert 合并 < 逐个 * 0.6
+    assert 极速 < 0.05
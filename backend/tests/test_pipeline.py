@@ -0,0 +1,155 @@
+"""
+测试流水线化的 Agent 循环（提前准备观测 + 新鲜度守卫）
+"""
+import asyncio
+import time
+
+import numpy as np
+import pytest
+from unittest.mock import patch
+
+from pipeline import 动作时钟, 观测预取
+from providers.base import LLM提供者基类, LLM响应, 工具调用, 流式事件
+from tools.settle import 屏幕稳定检测器
+
+
+class 延迟提供者(LLM提供者基类):
+    """
+    流式提供者：按 (时刻, 工具名) 依次产出工具调用，总延迟 秒后结束
+
+    最后一次调用（第 步数 次）不再返回工具调用，任务结束。
+    """
+
+    def __init__(self, 工具时刻: list[tuple[float, str]], 总延迟: float, 步数: int):
+        super().__init__("test-key")
+        self.工具时刻 = 工具时刻
+        self.总延迟 = 总延迟
+        self.步数 = 步数
+        self.收到的截图: list[tuple[str, float]] = []
+
+    async def 发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
+        raise NotImplementedError
+
+    async def 流式发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
+        self.收到的截图.append((截图base64, time.perf_counter()))
+        结果 = LLM响应()
+        if len(self.收到的截图) < self.步数:
+            开始 = time.perf_counter()
+            for 时刻, 名称 in self.工具时刻:
+                await asyncio.sleep(max(0.0, 开始 + 时刻 - time.perf_counter()))
+                调用 = 工具调用(名称, {})
+                结果.工具调用列表.append(调用)
+                yield 流式事件(类型="工具调用", 工具调用=调用)
+            await asyncio.sleep(max(0.0, 开始 + self.总延迟 - time.perf_counter()))
+        yield 流式事件(类型="完成", 响应=结果)
+
+
+def _准备代理(提供者, 流水线=True):
+    from agent_loop import AgentLoop
+    from tools.observation import 观测结果
+
+    截图记录: dict[str, float] = {}   # 截图内容 → 开始截图的时刻
+    动作结束: list[float] = []
+
+    async def 假观测():
+        名称 = f"obs-{len(截图记录)}"
+        截图记录[名称] = time.perf_counter()
+        await asyncio.sleep(0.02)
+        return 观测结果(base64数据=名称, 宽=1, 高=1)
+
+    async def 假执行(工具):
+        await asyncio.sleep(0.01)
+        动作结束.append(time.perf_counter())
+        return "ok"
+
+    agent = AgentLoop(
+        提供者=提供者, 最大循环次数=10, 流水线=流水线,
+        稳定检测器=屏幕稳定检测器(
+            采样间隔=0.005, 等待变化超时=0.02, 采样函数=lambda: np.zeros((8, 8), np.uint8)
+        )
+    )
+    return agent, 假观测, 假执行, 截图记录, 动作结束
+
+
+@pytest.mark.asyncio
+async def test_prefetch_is_fresh_or_discarded():
+    时钟 = 动作时钟()
+    次数 = []
+
+    async def 准备(作废信号):
+        次数.append(1)
+        await asyncio.sleep(0.01)
+        return len(次数)
+
+    预取 = 观测预取(时钟, 准备)
+    预取.启动()
+    预取.启动()                       # 已经有新鲜的预取：不会重复准备
+    assert await 预取.取用() == 1
+
+    预取.启动()
+    时钟.开始动作()                   # 新操作开始：之前的预取过期
+    预取.启动()                       # 操作进行中不预取
+    时钟.结束动作()
+    assert await 预取.取用() is None
+    assert await 预取.取出过期结果() == [2]
+    assert 预取.获取统计() == {"命中次数": 1, "作废次数": 1}
+
+
+@pytest.mark.asyncio
+async def test_observation_is_never_older_than_last_action():
+    """第二个工具调用来得很晚：先准备好的观测必须作废，LLM 拿到的截图晚于最后一个操作"""
+    提供者 = 延迟提供者([(0.02, "left_click"), (0.25, "type")], 总延迟=0.3, 步数=3)
+    agent, 假观测, 假执行, 截图记录, 动作结束 = _准备代理(提供者)
+
+    with patch.object(agent, '_获取截图', side_effect=假观测), \
+         patch.object(agent, '_执行工具', side_effect=假执行):
+        await agent.执行任务("测试新鲜度")
+
+    assert len(提供者.收到的截图) == 3
+    for 截图, 调用时刻 in 提供者.收到的截图[1:]:
+        # 调用 LLM 之前执行完的最后一个操作，结束在这张截图开始之前
+        最后动作 = max(结束 for 结束 in 动作结束 if 结束 < 调用时刻)
+        assert 最后动作 <= 截图记录[截图]
+    统计 = agent.获取步骤统计()
+    assert 统计["预取作废次数"] >= 2
+    assert 统计["预取命中次数"] == 2
+
+
+@pytest.mark.asyncio
+async def test_pipeline_overlaps_observation_with_generation():
+    """工具调用早早就到了：下一步的观测在 LLM 说完之前就准备好了"""
+    async def 运行(流水线):
+        提供者 = 延迟提供者([(0.02, "left_click")], 总延迟=0.2, 步数=4)
+        agent, 假观测, 假执行, _, _ = _准备代理(提供者, 流水线)
+        with patch.object(agent, '_获取截图', side_effect=假观测), \
+             patch.object(agent, '_执行工具', side_effect=假执行):
+            开始 = time.perf_counter()
+            await agent.执行任务("测试重叠")
+        间隔 = [后[1] - 前[1] for 前, 后 in zip(提供者.收到的截图, 提供者.收到的截图[1:])]
+        return 间隔, time.perf_counter() - 开始
+
+    流水线间隔, _ = await 运行(True)
+    串行间隔, _ = await 运行(False)
+    # 流水线：两次 LLM 调用之间几乎只有 LLM 本身的 0.2 秒；串行还要加上等待和截图
+    assert max(流水线间隔) < 0.24
+    assert min(串行间隔) > 0.22
+
+
+@pytest.mark.asyncio
+async def test_failing_executor_does_not_hang_bounded_queue():
+    """执行阶段出错后，排满的有界队列不会让 LLM 流和这一步一直卡住"""
+    提供者 = 延迟提供者([(0.01 * 序号, "left_click") for 序号 in range(1, 6)], 总延迟=0.1, 步数=2)
+    agent, 假观测, 假执行, _, _ = _准备代理(提供者)
+    agent.动作队列上限 = 1
+
+    def 出错(批次):
+        raise TypeError("unsupported operand type(s) for +: 'NoneType' and 'int'")
+
+    with patch.object(agent, '_获取截图', side_effect=假观测), \
+         patch.object(agent, '_执行工具', side_effect=假执行), \
+         patch.object(agent, '_合并', side_effect=出错):
+        await asyncio.wait_for(agent.执行任务("测试执行出错"), timeout=3)
+
+    # 这一步照常写进历史（带着错误），任务继续到 LLM 不再返回工具调用
+    assert len(提供者.收到的截图) == 2
+    assert not agent.正在运行
@@ -0,0 +1,109 @@
+"""
+测试提示词缓存：Anthropic 的缓存断点、缓存令牌统计、历史前缀的稳定性
+"""
+import json
+from types import SimpleNamespace as NS
+
+from history import 对话历史管理器
+from providers.anthropic_provider import Anthropic提供者
+from providers.openai_provider import OpenAI提供者
+from providers.prompt_cache import 稳定前缀长度, 加缓存断点
+
+
+def _历史(步数, **参数):
+    历史 = 对话历史管理器(**参数)
+    历史.开始("整理桌面上的文件")
+    for 序号 in range(1, 步数 + 1):
+        历史.记录步骤(序号, "变化 3%", f"图片{序号}", "image/png", f"回复 {序号}", "left_click", "已点击")
+    return 历史
+
+
+def _断点位置(请求体) -> list[str]:
+    位置 = []
+    if any("cache_control" in 工具 for 工具 in 请求体["tools"][:-1]):
+        位置.append("中间的工具")
+    if "cache_control" in 请求体["tools"][-1]:
+        位置.append("工具")
+    if isinstance(请求体["system"], list) and "cache_control" in 请求体["system"][-1]:
+        位置.append("系统提示词")
+    for 序号, 消息 in enumerate(请求体["messages"]):
+        if "cache_control" in json.dumps(消息["content"]):
+            位置.append(序号)
+    return 位置
+
+
+def test_anthropic_marks_tools_system_and_stable_history():
+    提供者 = Anthropic提供者("test-key")
+    消息 = _历史(5, 保留图片数=2).构建消息()
+    请求体 = 提供者._构建请求参数(消息, "当前截图", "image/png")
+
+    # 第 4、5 步带截图，断点在第 3 步的执行结果之后（第 1 + 3*3 - 1 = 9 条）
+    assert 稳定前缀长度(消息) == 10
+    assert _断点位置(请求体) == ["工具", "系统提示词", 9]
+    assert 请求体["messages"][9]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+
+    # 缓存里共用的转换结果没有被改动
+    再来一次 = 提供者._构建请求参数(消息, "当前截图", "image/png")
+    assert 提供者._消息缓存.转换(消息[9]) == {"role": "user", "content": "[执行结果]\n已点击"}
+    assert _断点位置(再来一次) == ["工具", "系统提示词", 9]
+
+
+def test_anthropic_prompt_cache_can_be_disabled():
+    提供者 = Anthropic提供者("test-key", 启用提示缓存=False)
+    请求体 = 提供者._构建请求参数(_历史(3).构建消息(), None, "image/png")
+    assert _断点位置(请求体) == []
+    assert isinstance(请求体["system"], str)
+
+
+def test_breakpoint_copies_message():
+    原消息 = {"role": "user", "content": [{"type": "text", "text": "a"}, {"type": "text", "text": "b"}]}
+    新消息 = 加缓存断点(原消息)
+    assert "cache_control" in 新消息["content"][1]
+    assert "cache_control" not in 原消息["content"][1]
+    assert 加缓存断点({"role": "user", "content": ""}) == {"role": "user", "content": ""}
+
+
+def test_cache_token_usage_is_reported():
+    # Claude：input_tokens 不含缓存部分，整理后的输入令牌是三者之和
+    响应 = NS(content=[], usage=NS(
+        input_tokens=100, output_tokens=20, cache_read_input_tokens=800, cache_creation_input_tokens=200
+    ))
+    assert Anthropic提供者("test-key")._解析响应(响应).用量 == {
+        "输入令牌": 1100, "输出令牌": 20, "缓存读取令牌": 800, "缓存写入令牌": 200
+    }
+
+    # OpenAI：prompt_tokens 已经包含命中缓存的部分
+    用量 = OpenAI提供者._整理用量(NS(
+        prompt_tokens=1000, completion_tokens=30, prompt_tokens_details=NS(cached_tokens=768)
+    ))
+    assert 用量 == {"输入令牌": 1000, "输出令牌": 30, "缓存读取令牌": 768}
+    assert OpenAI提供者._整理用量(NS(prompt_tokens=10, completion_tokens=1, prompt_tokens_details=None)) == {
+        "输入令牌": 10, "输出令牌": 1
+    }
+
+
+def test_history_prefix_stays_stable_between_steps():
+    """下一步的请求以上一步的稳定前缀开头（同一批对象），摘要每 摘要步长 步才变一次"""
+    历史 = _历史(0, 保留图片数=2, 保留步骤数=4, 摘要步长=4)
+    上一步 = None
+    前缀变化次数 = 0
+    for 序号 in range(1, 31):
+        历史.记录步骤(序号, "变化 3%", f"图片{序号}", "image/png", f"回复 {序号}", "left_click", "已点击")
+        消息 = 历史.构建消息()
+        if 上一步 is not None:
+            稳定 = 上一步[:稳定前缀长度(上一步)]
+            if not all(新 is 旧 for 新, 旧 in zip(消息, 稳定)):
+                前缀变化次数 += 1
+        上一步 = 消息
+
+    # 第 5 步开始有步骤被压缩：第 8、12、…、28 步各压缩一批，一共 6 次
+    assert 前缀变化次数 == 6
+    # 完整对话保留 4 ~ 7 步
+    assert 4 * 3 <= len(上一步) - 2 <= 7 * 3
+
+
+def test_summary_step_does_not_block_ceiling_trimming():
+    历史 = _历史(6, 保留图片数=0, 保留步骤数=4, 摘要步长=4, 字节上限=400)
+    消息 = 历史.构建消息()
+    assert "之前的步骤摘要" in 消息[1]["content"]
+    assert len(消息) < 2 + 6 * 3
@@ -0,0 +1,167 @@
+"""
+测试 Provider 注册表（客户端复用、淘汰和关闭）
+"""
+import asyncio
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from providers.registry import 提供者注册表, 连接配置, 创建HTTP客户端, 密钥指纹
+
+
+def _假工厂(创建记录):
+    def 工厂(api_key, model, 配置):
+        提供者 = MagicMock()
+        提供者.提供者名称 = "假提供者"
+        提供者.关闭 = AsyncMock()
+        创建记录.append((api_key, model))
+        return 提供者
+    return 工厂
+
+
+def test_registry_reuses_provider_for_same_config():
+    """同一组 (Provider, 模型, API Key) 拿到的是同一个实例"""
+    创建记录 = []
+    注册表 = 提供者注册表()
+    注册表.注册("openai", _假工厂(创建记录))
+
+    第一个 = 注册表.获取("openai", "key-a")
+    assert 注册表.获取("OpenAI ", "key-a") is 第一个
+    assert 注册表.获取("openai", "key-b") is not 第一个
+    assert 注册表.获取("openai", "key-a", model="gpt-4o-mini") is not 第一个
+
+    assert len(创建记录) == 3
+    assert 注册表.获取统计()["命中次数"] == 1
+
+
+def test_registry_does_not_store_raw_api_key():
+    """缓存键里只有 API Key 的指纹"""
+    注册表 = 提供者注册表()
+    注册表.注册("openai", _假工厂([]))
+    注册表.获取("openai", "sk-secret-value")
+
+    键 = next(iter(注册表._实例))
+    assert "sk-secret-value" not in 键
+    assert 键[2] == 密钥指纹("sk-secret-value")
+
+
+def test_registry_rejects_unknown_provider():
+    with pytest.raises(ValueError):
+        提供者注册表().获取("unknown", "key")
+
+
+@pytest.mark.asyncio
+async def test_registry_closes_evicted_and_all_clients():
+    """超出数量上限时关闭最久没用的客户端，关闭全部时关闭剩下的"""
+    注册表 = 提供者注册表(最大数量=2, 启用调度=False)
+    注册表.注册("openai", _假工厂([]))
+
+    a = 注册表.获取("openai", "a")
+    b = 注册表.获取("openai", "b")
+    注册表.获取("openai", "a")          # a 变成最近使用
+    c = 注册表.获取("openai", "c")      # 淘汰 b
+
+    await asyncio.sleep(0)
+    b.关闭.assert_awaited_once()
+    a.关闭.assert_not_awaited()
+    assert 注册表.淘汰次数 == 1
+
+    await 注册表.关闭全部()
+    a.关闭.assert_awaited_once()
+    c.关闭.assert_awaited_once()
+    assert len(注册表) == 0
+
+
+@pytest.mark.asyncio
+async def test_registry_defers_closing_evicted_provider_in_use():
+    """被挤出缓存的 Provider 还有任务在用时，等最后一个任务释放后才关闭"""
+    注册表 = 提供者注册表(最大数量=1, 启用调度=False)
+    注册表.注册("openai", _假工厂([]))
+
+    a = 注册表.获取("openai", "a")
+    注册表.占用(a)
+    注册表.占用(a)                      # 两个任务在用
+    注册表.获取("openai", "b")          # 淘汰 a
+
+    await asyncio.sleep(0)
+    a.关闭.assert_not_awaited()
+    注册表.释放(a)
+    await asyncio.sleep(0)
+    a.关闭.assert_not_awaited()
+    注册表.释放(a)                      # 最后一个任务用完
+    await asyncio.sleep(0)
+    a.关闭.assert_awaited_once()
+
+    # 没被淘汰的 Provider 释放后照常留在缓存里
+    b = 注册表.获取("openai", "b")
+    注册表.占用(b)
+    注册表.释放(b)
+    await 注册表.关闭全部()
+    b.关闭.assert_awaited_once()
+
+
+def test_connection_config_reads_environment(monkeypatch):
+    monkeypatch.setenv("LLM_MAX_CONNECTIONS", "5")
+    monkeypatch.setenv("LLM_KEEPALIVE_EXPIRY", "12.5")
+    配置 = 连接配置.从环境变量()
+    assert 配置.最大连接数 == 5
+    assert 配置.空闲保持秒数 == 12.5
+    assert 配置.最大空闲连接数 == 连接配置().最大空闲连接数
+
+
+@pytest.mark.asyncio
+async def test_http_client_keeps_connection_alive_between_calls():
+    """对着本地服务器连续调用两次：第二次复用第一次建立的连接"""
+    import openai
+    from providers.openai_provider import OpenAI提供者
+
+    连接数 = 0
+
+    async def 处理(reader, writer):
+        nonlocal 连接数
+        连接数 += 1
+        try:
+            while True:
+                头 = await reader.readuntil(b"\r\n\r\n")
+                长度 = next(
+                    (int(行.split(b":")[1]) for 行 in 头.split(b"\r\n")
+                     if 行.lower().startswith(b"content-length")),
+                    0
+                )
+                await reader.readexactly(长度)
+                正文 = json.dumps({"object": "list", "data": []}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: " + str(len(正文)).encode() + b"\r\n\r\n" + 正文
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    服务器 = await asyncio.start_server(处理, "127.0.0.1", 0)
+    端口 = 服务器.sockets[0].getsockname()[1]
+    async with 服务器:
+        provider = OpenAI提供者(
+            "test-key",
+            base_url=f"http://127.0.0.1:{端口}/v1",
+            http_client=创建HTTP客户端(openai, 连接配置())
+        )
+        await provider.验证连接()
+        await provider.验证连接()
+        await provider.关闭()
+
+    assert 连接数 == 1
+
+
+def test_registry_wraps_providers_with_shared_scheduler():
+    """同一个 API Key 的不同模型共用一个限流调度器"""
+    from providers.scheduler import 调度提供者
+
+    注册表 = 提供者注册表()
+    注册表.注册("openai", _假工厂([]))
+    a = 注册表.获取("openai", "key", model="m1")
+    b = 注册表.获取("openai", "key", model="m2")
+    c = 注册表.获取("openai", "other-key")
+
+    assert isinstance(a, 调度提供者)
+    assert a.调度器 is b.调度器
+    assert a.调度器 is not c.调度器
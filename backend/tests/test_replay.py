@@ -0,0 +1,200 @@
+"""
+测试 LLM 响应录制 / 回放缓存
+"""
+import base64
+import io
+import json
+import pytest
+from PIL import Image
+from providers.base import LLM提供者基类, LLM响应, 工具调用
+from providers.replay import 回放提供者, 回放存储, 回放未命中, 计算请求键, 图片哈希
+from history import 图片部分, 文本部分
+
+
+class 计数提供者(LLM提供者基类):
+    """每次调用都返回不同回复的 Provider（模拟真实 LLM 的不确定性）"""
+
+    def __init__(self):
+        super().__init__("test-key")
+        self.model = "test-model"
+        self.调用次数 = 0
+
+    async def 发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
+        self.调用次数 += 1
+        return LLM响应(
+            文本内容=f"第 {self.调用次数} 次",
+            工具调用列表=[工具调用("left_click", {"x": self.调用次数, "y": 2}, "call_1")],
+            用量={"输入令牌": 100, "输出令牌": 10}
+        )
+
+
+def _截图(窗口位置=(8, 8), 质量=None) -> str:
+    图像 = Image.new("RGB", (64, 64), (40, 40, 40))
+    图像.paste((230, 230, 230), (*窗口位置, 窗口位置[0] + 24, 窗口位置[1] + 16))  # 一个"窗口"
+    缓冲 = io.BytesIO()
+    if 质量:
+        图像.save(缓冲, format="JPEG", quality=质量)
+    else:
+        图像.save(缓冲, format="PNG")
+    return base64.b64encode(缓冲.getvalue()).decode()
+
+
+def _历史(截图):
+    return [
+        {"role": "user", "content": "打开计算器"},
+        {"role": "user", "content": [文本部分("第 1 步"), 图片部分(截图)]},
+        {"role": "assistant", "content": "[调用工具] left_click(500, 300)"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_record_then_replay_without_network(tmp_path):
+    路径 = tmp_path / "llm.jsonl"
+    截图 = _截图()
+
+    内部 = 计数提供者()
+    录制 = 回放提供者(内部, 回放存储(路径), 模式="record")
+    原始 = await 录制.发送消息(_历史(截图), 截图)
+    assert 内部.调用次数 == 1
+
+    # 新的进程：从文件重新加载，内部 Provider 不会被调用
+    新内部 = 计数提供者()
+    回放 = 回放提供者(新内部, 回放存储(路径), 模式="replay")
+    for _ in range(3):
+        响应 = await 回放.发送消息(_历史(截图), 截图)
+        assert 响应.文本内容 == 原始.文本内容
+        assert 响应.工具调用列表 == 原始.工具调用列表
+        assert 响应.用量 == 原始.用量
+    assert 新内部.调用次数 == 0
+    assert 回放.获取统计()["命中次数"] == 3
+
+
+@pytest.mark.asyncio
+async def test_replay_miss_raises(tmp_path):
+    回放 = 回放提供者(计数提供者(), 回放存储(tmp_path / "llm.jsonl"), 模式="replay")
+    with pytest.raises(回放未命中):
+        await 回放.发送消息([{"role": "user", "content": "没录过"}])
+    assert 回放.未命中次数 == 1
+
+
+@pytest.mark.asyncio
+async def test_passthrough_neither_reads_nor_writes(tmp_path):
+    路径 = tmp_path / "llm.jsonl"
+    内部 = 计数提供者()
+    提供者 = 回放提供者(内部, 回放存储(路径), 模式="passthrough")
+    await 提供者.发送消息([])
+    await 提供者.发送消息([])
+    assert 内部.调用次数 == 2
+    assert not 路径.exists()
+
+
+def test_key_uses_perceptual_hash_of_screenshots():
+    PNG = _截图()
+    JPEG = _截图(质量=90)
+    另一张 = _截图(窗口位置=(32, 40))
+    assert PNG != JPEG
+
+    # 截图不进文本键，只按感知哈希比较：换个编码格式还在半径之内，窗口挪了位置就超出
+    键 = 计算请求键("OpenAI", _历史(PNG), PNG)
+    assert len(键.截图哈希) == 2
+    assert 键.文本键 == 计算请求键("OpenAI", _历史(JPEG), JPEG).文本键 == 计算请求键("OpenAI", _历史(PNG), 另一张).文本键
+    assert 键.距离(计算请求键("OpenAI", _历史(JPEG), JPEG).截图哈希, 半径=8) is not None
+    assert 键.距离(计算请求键("OpenAI", _历史(PNG), 另一张).截图哈希, 半径=8) is None
+    assert 键.文本键 != 计算请求键("Gemini", _历史(PNG), PNG).文本键
+    assert 图片哈希("不是图片") is None
+
+
+def _带时钟的截图(分钟: int) -> str:
+    """右下角有一个时钟的屏幕，每分钟变几个像素"""
+    图像 = Image.open(io.BytesIO(base64.b64decode(_截图())))
+    图像.paste((230, 230, 230), (56, 60, 56 + 分钟 % 6, 62))
+    缓冲 = io.BytesIO()
+    图像.save(缓冲, format="PNG")
+    return base64.b64encode(缓冲.getvalue()).decode()
+
+
+@pytest.mark.asyncio
+async def test_replay_tolerates_small_screen_and_summary_changes(tmp_path):
+    路径 = tmp_path / "llm.jsonl"
+
+    def 历史(截图, 变化摘要):
+        return [
+            {"role": "user", "content": "打开计算器"},
+            {"role": "user", "content": [文本部分(f"第 1 步的屏幕（{变化摘要}）"), 图片部分(截图)]},
+            {"role": "assistant", "content": "[调用工具] left_click(500, 300)"},
+        ]
+
+    录制 = 回放提供者(计数提供者(), 回放存储(路径), 模式="record")
+    原始 = await 录制.发送消息(历史(_带时钟的截图(1), "变化 0.4%，区域 (56,60,1x2)"), _带时钟的截图(1))
+
+    # 重跑时时钟走了几格，差异摘要的数字也不一样，还带上了一条临时提示
+    重跑历史 = 历史(_带时钟的截图(3), "变化 0.9%，区域 (56,60,3x2), (8,8,24x16) 等 2 处")
+    重跑历史.append({"role": "user", "content": "注意：上一步操作之后屏幕没有任何可见变化，操作可能没有生效。"})
+    回放 = 回放提供者(计数提供者(), 回放存储(路径), 模式="replay")
+    assert (await 回放.发送消息(重跑历史, _带时钟的截图(3))).文本内容 == 原始.文本内容
+
+    # 画面明显不同（窗口挪了位置）就不能拿录制的响应凑数
+    with pytest.raises(回放未命中):
+        await 回放.发送消息(重跑历史, _截图(窗口位置=(32, 40)))
+
+
+@pytest.mark.asyncio
+async def test_stream_records_and_replays(tmp_path):
+    路径 = tmp_path / "llm.jsonl"
+    录制 = 回放提供者(计数提供者(), 回放存储(路径), 模式="record")
+    录制事件 = [事件 async for 事件 in 录制.流式发送消息([])]
+
+    回放 = 回放提供者(计数提供者(), 回放存储(路径), 模式="replay")
+    回放事件 = [事件 async for 事件 in 回放.流式发送消息([])]
+
+    assert [e.类型 for e in 回放事件] == [e.类型 for e in 录制事件] == ["文本", "工具调用", "完成"]
+    assert 回放事件[-1].响应.文本内容 == "第 1 次"
+
+
+@pytest.mark.asyncio
+async def test_size_limit_stops_appending(tmp_path):
+    路径 = tmp_path / "llm.jsonl"
+    存储 = 回放存储(路径, 最大字节数=600)
+    提供者 = 回放提供者(计数提供者(), 存储, 模式="record")
+
+    for 序号 in range(10):
+        await 提供者.发送消息([{"role": "user", "content": f"第 {序号} 条"}])
+
+    assert 路径.stat().st_size <= 600
+    assert 存储.写入次数 >= 1
+    assert 存储.拒绝写入次数 == 10 - 存储.写入次数
+
+
+def test_store_is_append_only_and_skips_torn_lines(tmp_path):
+    路径 = tmp_path / "llm.jsonl"
+    存储 = 回放存储(路径)
+    存储.写入("k", LLM响应(文本内容="旧"))
+    存储.写入("k", LLM响应(文本内容="新"))
+    with 路径.open("a", encoding="utf-8") as 文件:
+        文件.write('{"键": "半')  # 写到一半被中断
+
+    行列表 = 路径.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(行)["响应"]["文本内容"] for 行 in 行列表[:2]] == ["旧", "新"]
+
+    重新加载 = 回放存储(路径)
+    assert len(重新加载) == 1
+    assert 重新加载.读取("k").文本内容 == "新"
+
+    # 不完整的那一行之后还能继续追加
+    重新加载.写入("k2", LLM响应(文本内容="接着写"))
+    assert 回放存储(路径).读取("k2").文本内容 == "接着写"
+
+
+def test_registry_wraps_providers_when_replay_enabled(tmp_path):
+    from providers.registry import 提供者注册表
+    from providers.replay import 回放配置
+
+    注册表 = 提供者注册表(启用调度=False, 回放=回放配置(模式="replay", 文件路径=str(tmp_path / "llm.jsonl")))
+    注册表.注册("openai", lambda key, model, 配置: 计数提供者())
+    提供者 = 注册表.获取("openai", "k1")
+    assert isinstance(提供者, 回放提供者)
+    assert 提供者.命名空间 == "计数提供者/test-model"
+    assert 注册表.获取("openai", "k2").存储 is 提供者.存储
+
+    with pytest.raises(ValueError):
+        回放配置(模式="random")
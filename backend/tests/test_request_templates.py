@@ -0,0 +1,94 @@
+"""
+测试预编译的请求模板和消息转换缓存
+"""
+from history import 对话历史管理器, 图片部分, 文本部分
+from providers.base import 工具调用, COMPUTER_USE_TOOLS
+from providers.templates import 请求模板, 消息转换缓存, 编译参数校验器, 参数模式表
+
+
+def _历史(步数, 保留步骤数=8):
+    历史 = 对话历史管理器(保留图片数=2, 保留步骤数=保留步骤数)
+    历史.开始("打开计算器")
+    for 序号 in range(1, 步数 + 1):
+        历史.记录步骤(序号, "变化 3%", f"图片{序号}", "image/png", f"回复 {序号}", "left_click", "已点击")
+    return 历史
+
+
+def test_argument_validator_checks_required_and_types():
+    校验 = 编译参数校验器({
+        "type": "object",
+        "properties": {
+            "x": {"type": "integer"},
+            "keys": {"type": "array", "items": {"type": "string"}}
+        },
+        "required": ["x"]
+    })
+    assert 校验({"x": 5}) == []
+    assert 校验({"x": 5.0}) == []            # Gemini 的整数是浮点数
+    assert 校验({"x": 5, "keys": ("ctrl", "c")}) == []
+    assert len(校验({})) == 1
+    assert len(校验({"x": "5", "keys": [1]})) == 2
+    assert 校验({"x": True}) != []
+
+
+def test_template_is_compiled_once_and_validates_tool_calls():
+    模板 = 请求模板.编译("系统", COMPUTER_USE_TOOLS, 参数模式表(COMPUTER_USE_TOOLS))
+    assert 模板.工具列表() == COMPUTER_USE_TOOLS
+    assert 模板.工具列表() is not 模板.工具列表()   # 每次给 SDK 的是新列表，模板本身不会被改
+    assert 模板.校验(工具调用("left_click", {"x": 1, "y": 2})) == []
+    assert 模板.校验(工具调用("hotkey", {})) == ["缺少参数 keys"]
+    assert 模板.校验(工具调用("fly", {})) == ["未知的工具 fly"]
+
+
+def test_history_reuses_message_objects_between_steps():
+    历史 = _历史(3)
+    第一次 = 历史.构建消息()
+    历史.记录步骤(4, "无变化", "图片4", "image/png", "回复 4", "type", "已输入")
+    第二次 = 历史.构建消息()
+
+    assert 第二次[0] is 第一次[0]
+    # 第 2 步的截图被挤掉（只保留 2 张）：只有它的屏幕消息换成占位版本
+    assert 第二次[4] is not 第一次[4]
+    assert "截图已省略" in 第二次[4]["content"]
+    相同 = [序号 for 序号 in range(len(第一次)) if 第二次[序号] is 第一次[序号]]
+    assert 相同 == [0, 1, 2, 3, 5, 6, 7, 8, 9]
+
+
+def test_conversion_cache_only_converts_new_messages():
+    转换次数 = []
+    缓存 = 消息转换缓存(lambda 消息: 转换次数.append(1) or {"converted": 消息["content"]})
+    历史 = _历史(5, 保留步骤数=100)
+
+    缓存.转换全部(历史.构建消息())
+    首次 = len(转换次数)
+    历史.记录步骤(6, "变化", "图片6", "image/png", "回复 6", "left_click", "已点击")
+    结果 = 缓存.转换全部(历史.构建消息())
+
+    # 新增一步 = 3 条新消息；第 4 步的截图被挤掉，它的屏幕消息换成占位版本（1 条）
+    assert len(转换次数) - 首次 == 4
+    assert [r["converted"] for r in 结果] == [m["content"] for m in 历史.构建消息()]
+
+    # 不是同一个对象的消息不会命中（内容相同也重新转换，结果一样正确）
+    缓存.转换({"role": "user", "content": "打开计算器"})
+    assert len(转换次数) - 首次 == 5
+
+
+def test_conversion_cache_limits_image_bytes():
+    缓存 = 消息转换缓存(lambda 消息: 消息, 最大图片字节数=250)
+    for 序号 in range(5):
+        缓存.转换({"role": "user", "content": [文本部分("屏幕"), 图片部分("A" * 100)]})
+    assert len(缓存) == 2
+    assert 缓存.获取统计()["图片字节数"] == 200
+
+
+def test_providers_build_requests_from_cached_conversions():
+    from providers.anthropic_provider import Anthropic提供者
+    from providers.openai_provider import OpenAI提供者
+
+    历史 = _历史(4).构建消息()
+    for 提供者 in (OpenAI提供者("test-key"), Anthropic提供者("test-key")):
+        第一次 = 提供者._构建请求参数(历史, "当前截图", "image/png")
+        第二次 = 提供者._构建请求参数(历史, "当前截图", "image/png")
+        assert 第一次 == 第二次
+        assert 提供者._消息缓存.获取统计()["命中次数"] == len(历史)
+        assert 第二次["tools"] == list(提供者._模板.工具定义)
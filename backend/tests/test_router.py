@@ -0,0 +1,148 @@
+"""
+测试多 Provider 路由（策略、故障切换、工具调用统一）
+"""
+import asyncio
+import pytest
+from unittest.mock import patch
+from providers.base import LLM提供者基类, LLM响应, 工具调用
+from providers.router import 路由提供者, 统一工具调用
+
+
+class 假提供者(LLM提供者基类):
+    def __init__(self, 名称, 耗时=0.0, 失败=False, 工具=None, 媒体类型=None):
+        super().__init__("test-key")
+        self._名称 = 名称
+        self.耗时 = 耗时
+        self.失败 = 失败
+        self.工具 = 工具 or []
+        self.调用次数 = 0
+        if 媒体类型:
+            self.支持的媒体类型 = frozenset(媒体类型)
+
+    @property
+    def 提供者名称(self):
+        return self._名称
+
+    async def 发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
+        self.调用次数 += 1
+        await asyncio.sleep(self.耗时)
+        if self.失败:
+            raise RuntimeError(f"{self._名称} 出错")
+        return LLM响应(文本内容=self._名称, 工具调用列表=[工具调用(**工具) for 工具 in self.工具])
+
+
+@pytest.mark.asyncio
+async def test_fastest_policy_prefers_lower_latency():
+    慢 = 假提供者("慢", 耗时=0.05)
+    快 = 假提供者("快", 耗时=0.0)
+    路由 = 路由提供者({"慢": 慢, "快": 快}, 策略="fastest")
+
+    for _ in range(6):
+        await 路由.发送消息([])
+
+    # 两个都被探测过，之后都走快的
+    assert 慢.调用次数 == 1
+    assert 快.调用次数 == 5
+    assert 路由.候选顺序()[0] == "快"
+    assert 路由.获取统计()["Provider"]["慢"]["p50毫秒"] >= 40
+
+
+@pytest.mark.asyncio
+async def test_failover_and_unhealthy_provider_ranked_last():
+    坏 = 假提供者("坏", 失败=True)
+    好 = 假提供者("好")
+    路由 = 路由提供者({"坏": 坏, "好": 好}, 策略="sticky", 熔断阈值=3, 熔断秒数=60)
+
+    for _ in range(3):
+        响应 = await 路由.发送消息([])
+        assert 响应.文本内容 == "好"
+
+    # sticky：出错一次就切换并"粘"在新的 Provider 上
+    assert 坏.调用次数 == 1
+    assert 路由.当前 == "好"
+    assert 路由.切换次数 == 1
+
+    好.失败 = True
+    with pytest.raises(RuntimeError):
+        await 路由.发送消息([])
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_moves_failing_provider_to_the_end():
+    坏 = 假提供者("坏", 失败=True)
+    好 = 假提供者("好")
+    路由 = 路由提供者({"坏": 坏, "好": 好}, 策略="cheapest",
+                     价格表={"坏": (0.1, 0.1), "好": (1.0, 1.0)}, 熔断阈值=2)
+
+    await 路由.发送消息([])
+    await 路由.发送消息([])
+    assert 路由.候选顺序() == ["好", "坏"]   # 便宜但在熔断期
+    await 路由.发送消息([])
+    assert 坏.调用次数 == 2
+
+
+@pytest.mark.asyncio
+async def test_cheapest_policy_uses_price_table():
+    路由 = 路由提供者({
+        "openai": 假提供者("openai"),
+        "gemini": 假提供者("gemini"),
+        "anthropic": 假提供者("anthropic"),
+    }, 策略="cheapest")
+    assert 路由.候选顺序() == ["gemini", "openai", "anthropic"]
+    assert (await 路由.发送消息([])).文本内容 == "gemini"
+
+
+def test_tool_calls_are_normalized_across_providers():
+    Gemini风格 = 工具调用(工具名称="Left_Click", 参数={"x": 500.0, "y": 300.0, "text": "a"}, 工具调用ID="")
+    统一 = 统一工具调用(Gemini风格)
+    assert 统一.工具名称 == "left_click"
+    assert 统一.参数 == {"x": 500, "y": 300, "text": "a"}
+    assert isinstance(统一.参数["x"], int)
+    assert 统一.工具调用ID.startswith("call_")
+
+    OpenAI风格 = 工具调用(工具名称="type", 参数={"text": "hi"}, 工具调用ID="call_abc")
+    assert 统一工具调用(OpenAI风格).工具调用ID == "call_abc"
+
+
+@pytest.mark.asyncio
+async def test_stream_fails_over_and_keeps_tool_call_ids_consistent():
+    坏 = 假提供者("坏", 失败=True)
+    好 = 假提供者("好", 工具=[{"工具名称": "left_click", "参数": {"x": 1.0, "y": 2.0}}])
+    路由 = 路由提供者({"坏": 坏, "好": 好}, 策略="sticky")
+
+    事件列表 = [事件 async for 事件 in 路由.流式发送消息([])]
+
+    工具事件 = [e for e in 事件列表 if e.类型 == "工具调用"]
+    完成 = 事件列表[-1].响应
+    assert 工具事件[0].工具调用.参数 == {"x": 1, "y": 2}
+    assert 工具事件[0].工具调用.工具调用ID == 完成.工具调用列表[0].工具调用ID
+    assert 路由.当前 == "好"
+
+
+def test_router_uses_settings_every_provider_accepts():
+    路由 = 路由提供者({
+        "a": 假提供者("a", 媒体类型={"image/png", "image/webp"}),
+        "b": 假提供者("b", 媒体类型={"image/png", "image/jpeg"}),
+    })
+    assert 路由.支持的媒体类型 == frozenset({"image/png"})
+
+    with pytest.raises(ValueError):
+        路由提供者({"a": 假提供者("a")}, 策略="random")
+
+
+def test_registry_reuses_router_and_chat_rejects_unknown_policy():
+    from fastapi.testclient import TestClient
+    from main import app
+    from providers.registry import 提供者注册表
+
+    注册表 = 提供者注册表()
+    注册表.注册("openai", lambda key, model, 配置: 假提供者("openai"))
+    注册表.注册("gemini", lambda key, model, 配置: 假提供者("gemini"))
+    路由 = 注册表.获取路由("fastest", {"openai": "k1", "gemini": "k2"})
+    assert 注册表.获取路由("fastest", {"openai": "k1", "gemini": "k2"}) is 路由
+    assert list(路由.提供者表) == ["openai", "gemini"]
+
+    with TestClient(app) as client, \
+         patch('main.全局安全配置.获取配置', return_value={"provider": "openai", "api_key": "k"}):
+        响应 = client.post("/api/chat", json={"message": "hi", "routing": "random"})
+    assert 响应.status_code == 400
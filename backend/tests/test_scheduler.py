@@ -0,0 +1,211 @@
+"""
+测试限流调度器（响应头解析、退避重试、共享 Key 排队）
+"""
+import asyncio
+import time
+import pytest
+from types import SimpleNamespace as NS
+from unittest.mock import AsyncMock, MagicMock
+from providers.base import LLM响应, 流式事件
+from providers.scheduler import (
+    令牌桶, 调度提供者, 调度配置, 限流调度器, 解析时长, 解析限流信息
+)
+
+
+class 假API错误(Exception):
+    """模仿 openai / anthropic 的 APIStatusError：有 status_code 和 response.headers"""
+
+    def __init__(self, 状态码, 头=None, 消息="error"):
+        super().__init__(消息)
+        self.status_code = 状态码
+        self.response = NS(headers=头 or {})
+
+
+def _快速配置(**选项):
+    return 调度配置(基础退避=0.01, 最大退避=0.05, **选项)
+
+
+def test_parse_openai_style_durations():
+    assert 解析时长("20ms") == pytest.approx(0.02)
+    assert 解析时长("1.5s") == 1.5
+    assert 解析时长("6m0s") == 360
+    assert 解析时长("1h2m3s") == 3723
+    assert 解析时长("7") == 7
+    assert 解析时长("soon") is None
+
+
+def test_parse_retry_after_headers():
+    assert 解析限流信息(假API错误(429, {"Retry-After-Ms": "250"})).等待秒数 == 0.25
+    assert 解析限流信息(假API错误(429, {"retry-after": "3"})).等待秒数 == 3
+
+    HTTP日期 = "Wed, 21 Oct 2015 07:28:05 GMT"
+    现在 = 1445412480.0  # 同一天 07:28:00
+    assert 解析限流信息(假API错误(503, {"retry-after": HTTP日期}), 现在=现在).等待秒数 == 5
+
+
+def test_parse_openai_and_anthropic_quota_headers():
+    信息 = 解析限流信息(假API错误(429, {
+        "x-ratelimit-remaining-requests": "0",
+        "x-ratelimit-reset-requests": "1m30s",
+        "x-ratelimit-remaining-tokens": "5000",
+        "x-ratelimit-reset-tokens": "10ms",
+    }))
+    assert 信息.等待秒数 == 90
+    assert 信息.剩余请求数 == 0
+    assert 信息.是限流
+
+    现在 = 1700000000.0
+    信息 = 解析限流信息(假API错误(429, {
+        "anthropic-ratelimit-requests-remaining": "12",
+        "anthropic-ratelimit-input-tokens-remaining": "0",
+        "anthropic-ratelimit-input-tokens-reset": "2023-11-14T22:13:40Z",
+    }), 现在=现在)
+    assert 信息.等待秒数 == pytest.approx(20)
+    assert 信息.剩余请求数 == 12
+
+
+def test_parse_gemini_and_non_transient_errors():
+    Gemini错误 = Exception("429 Resource has been exhausted. retry_delay {\n  seconds: 7\n}")
+    Gemini错误.code = 429
+    assert 解析限流信息(Gemini错误).等待秒数 == 7
+
+    assert 解析限流信息(假API错误(529)).是限流          # Anthropic 过载
+    assert 解析限流信息(asyncio.TimeoutError()) is not None
+    assert 解析限流信息(假API错误(401)) is None         # 密钥错误不重试
+    assert 解析限流信息(ValueError("bad")) is None
+
+
+def test_token_bucket_spaces_requests():
+    桶 = 令牌桶(速率=10, 容量=1)
+    等待列表 = [桶.预约() for _ in range(4)]
+    assert 等待列表[0] == 0
+    assert 等待列表[1:] == pytest.approx([0.1, 0.2, 0.3], abs=0.01)
+    assert 令牌桶(速率=None).预约() == 0
+
+
+@pytest.mark.asyncio
+async def test_transient_throttling_is_retried_not_failed():
+    """两次 429 之后成功：调用方只看到成功的响应"""
+    内部 = MagicMock()
+    内部.发送消息 = AsyncMock(side_effect=[
+        假API错误(429, {"retry-after-ms": "20"}),
+        假API错误(529),
+        LLM响应(文本内容="ok"),
+    ])
+    调度器 = 限流调度器("openai", _快速配置())
+    提供者 = 调度提供者(内部, 调度器)
+
+    响应 = await 提供者.发送消息([{"role": "user", "content": "hi"}])
+
+    assert 响应.文本内容 == "ok"
+    assert 内部.发送消息.await_count == 3
+    assert 调度器.限流次数 == 2
+    assert 调度器.失败次数 == 0
+    # 被限流后放行速率被收紧
+    assert 调度器.当前速率 is not None
+
+
+@pytest.mark.asyncio
+async def test_non_transient_errors_and_exhausted_retries_raise():
+    内部 = MagicMock()
+    内部.发送消息 = AsyncMock(side_effect=假API错误(401))
+    提供者 = 调度提供者(内部, 限流调度器("openai", _快速配置()))
+    with pytest.raises(假API错误):
+        await 提供者.发送消息([])
+    assert 内部.发送消息.await_count == 1
+
+    内部.发送消息 = AsyncMock(side_effect=假API错误(500))
+    调度器 = 限流调度器("openai", _快速配置(最大重试次数=2))
+    with pytest.raises(假API错误):
+        await 调度提供者(内部, 调度器).发送消息([])
+    assert 内部.发送消息.await_count == 3
+    assert 调度器.失败次数 == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_retries_only_before_first_event():
+    调用次数 = 0
+
+    async def 流(*参数):
+        nonlocal 调用次数
+        调用次数 += 1
+        if 调用次数 == 1:
+            raise 假API错误(429, {"retry-after-ms": "10"})
+        yield 流式事件(类型="文本", 文本="hi")
+        if 调用次数 == 2:
+            raise 假API错误(500)
+
+    内部 = MagicMock()
+    内部.流式发送消息 = 流
+    提供者 = 调度提供者(内部, 限流调度器("openai", _快速配置()))
+
+    事件列表 = []
+    with pytest.raises(假API错误):
+        async for 事件 in 提供者.流式发送消息([]):
+            事件列表.append(事件)
+
+    # 第一次在产出前失败 → 重试；第二次已经产出了事件 → 不再重试
+    assert 调用次数 == 2
+    assert [e.文本 for e in 事件列表] == ["hi"]
+
+
+@pytest.mark.asyncio
+async def test_agents_sharing_a_key_queue_within_concurrency_limit():
+    在途 = 0
+    最大在途 = 0
+
+    async def 发送(*参数):
+        nonlocal 在途, 最大在途
+        在途 += 1
+        最大在途 = max(最大在途, 在途)
+        await asyncio.sleep(0.02)
+        在途 -= 1
+        return LLM响应(文本内容="ok")
+
+    调度器 = 限流调度器("openai", _快速配置(最大并发=2))
+    提供者列表 = []
+    for _ in range(6):
+        内部 = MagicMock()
+        内部.发送消息 = 发送
+        提供者列表.append(调度提供者(内部, 调度器))
+
+    结果 = await asyncio.gather(*(p.发送消息([]) for p in 提供者列表))
+
+    assert len(结果) == 6
+    assert 最大在途 == 2
+    assert 调度器.排队数 == 0
+
+
+@pytest.mark.asyncio
+async def test_sustained_load_under_provider_limit_has_no_failed_tasks():
+    """
+    模拟一个每 0.2 秒只接受 3 个请求的 Provider：
+    6 个 Agent 同时各发 3 次请求，全部成功，并且收紧后的速率减少了被拒次数
+    """
+    窗口 = []
+    拒绝次数 = 0
+
+    async def 发送(*参数):
+        nonlocal 拒绝次数
+        现在 = time.monotonic()
+        窗口[:] = [t for t in 窗口 if t > 现在 - 0.2]
+        if len(窗口) >= 3:
+            拒绝次数 += 1
+            raise 假API错误(429, {"retry-after-ms": "50"})
+        窗口.append(现在)
+        return LLM响应(文本内容="ok")
+
+    调度器 = 限流调度器("openai", _快速配置(最大并发=4, 最大重试次数=20, 最低速率=5))
+    内部 = MagicMock()
+    内部.发送消息 = 发送
+    提供者 = 调度提供者(内部, 调度器)
+
+    async def 一个Agent():
+        for _ in range(3):
+            await 提供者.发送消息([])
+
+    await asyncio.wait_for(asyncio.gather(*(一个Agent() for _ in range(6))), timeout=30)
+
+    assert 调度器.失败次数 == 0
+    assert 调度器.请求次数 - 调度器.重试次数 == 18
+    assert 拒绝次数 < 18
@@ -12,6 +12,7 @@ def test_provider_validation():
     assert 验证提供者名称("OpenAI") is True  # 测试大小写不敏感
     assert 验证提供者名称("gemini") is True
     assert 验证提供者名称("anthropic") is True
+    assert 验证提供者名称("local") is True
     assert 验证提供者名称("invalid_provider") is False
     assert 验证提供者名称("") is False
 
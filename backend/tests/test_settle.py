@@ -0,0 +1,121 @@
+"""
+测试屏幕稳定检测（操作之后等界面画完再截图）
+"""
+import threading
+import time
+
+import numpy as np
+import pytest
+from unittest.mock import patch
+
+from providers.base import LLM提供者基类, LLM响应, 工具调用
+from tools.settle import 屏幕稳定检测器
+
+
+def _帧(亮度: int) -> np.ndarray:
+    return np.full((48, 64), 亮度, dtype=np.uint8)
+
+
+class 模拟界面:
+    """操作之后 响应延迟 秒开始变化，持续渲染 渲染时长 秒，然后停在最终画面"""
+
+    def __init__(self, 响应延迟: float, 渲染时长: float):
+        self.响应延迟 = 响应延迟
+        self.渲染时长 = 渲染时长
+        self.开始 = time.perf_counter()
+        self.采样次数 = 0
+
+    def __call__(self) -> np.ndarray:
+        已过 = time.perf_counter() - self.开始
+        self.采样次数 += 1
+        if 已过 < self.响应延迟:
+            return _帧(0)
+        if 已过 < self.响应延迟 + self.渲染时长:
+            return _帧(20 + self.采样次数 % 2 * 100)  # 每次采样都不一样
+        return _帧(250)
+
+
+def _检测器(采样函数, **参数):
+    return 屏幕稳定检测器(采样间隔=0.005, 连续稳定次数=3, 采样函数=采样函数, **参数)
+
+
+def test_fast_ui_returns_as_soon_as_it_settles():
+    检测器 = _检测器(模拟界面(0.0, 0.02))
+    结果 = 检测器.等待稳定(_帧(0))
+    assert 结果.稳定 and 结果.有变化
+    assert 结果.耗时 < 0.2
+
+
+def test_slow_ui_waits_for_change_then_stability():
+    界面 = 模拟界面(0.1, 0.3)
+    结果 = _检测器(界面, 超时=2.0).等待稳定(_帧(0))
+    assert 结果.稳定 and 结果.有变化
+    assert 结果.耗时 >= 0.4
+    assert 界面()[0, 0] == 250   # 返回时已经是最终画面
+
+
+def test_unchanged_screen_waits_at_most_change_timeout():
+    结果 = _检测器(lambda: _帧(0), 等待变化超时=0.1).等待稳定(_帧(0))
+    assert 结果.稳定 and not 结果.有变化
+    assert 0.1 <= 结果.耗时 < 0.3
+
+    # 没有基准帧：不等变化，画面不动就返回
+    assert _检测器(lambda: _帧(0)).等待稳定().耗时 < 0.1
+
+
+def test_animation_times_out_and_blinking_cursor_is_ignored():
+    计数 = iter(range(10_000))
+    结果 = _检测器(lambda: _帧(next(计数) % 2 * 100), 超时=0.1).等待稳定()
+    assert not 结果.稳定
+
+    def 闪烁光标():
+        帧 = _帧(250)
+        帧[10, 10] = next(计数) % 2 * 255   # 3072 个像素里只变 1 个
+        return 帧
+
+    结果 = _检测器(闪烁光标, 超时=1.0).等待稳定(_帧(0))
+    assert 结果.稳定 and 结果.耗时 < 0.2
+
+
+def test_stop_signal_and_sampling_failure_return_immediately():
+    停止 = threading.Event()
+    停止.set()
+    assert _检测器(lambda: _帧(0)).等待稳定(_帧(0), 停止).耗时 < 0.05
+
+    def 失败():
+        raise RuntimeError("没有显示服务")
+
+    结果 = _检测器(失败).等待稳定(_帧(0))
+    assert 结果.采样次数 == 0 and not 结果.稳定
+
+
+@pytest.mark.asyncio
+async def test_agent_reports_step_time_and_wasted_steps():
+    from agent_loop import AgentLoop
+    from tools.frame_diff import 瓦片差异检测器
+    from tools.observation import 观测结果
+
+    差异检测 = 瓦片差异检测器()
+
+    async def 假观测():
+        # 屏幕一直不变：第 2 步起每一步都是浪费的
+        return 观测结果(base64数据="abc", 宽=64, 高=64, 差异=差异检测.比较(np.zeros((64, 64, 4), np.uint8)))
+
+    class 点击提供者(LLM提供者基类):
+        async def 发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
+            return LLM响应(工具调用列表=[工具调用("unknown_tool", {})])
+
+    agent = AgentLoop(
+        提供者=点击提供者("test-key"), 最大循环次数=3, 无变化重试次数=0, 流式=False,
+        稳定检测器=_检测器(lambda: _帧(0), 等待变化超时=0.02)
+    )
+    with patch.object(agent, '_获取截图', side_effect=假观测):
+        await agent.执行任务("测试统计")
+
+    统计 = agent.获取步骤统计()
+    assert 统计["步数"] == 3
+    assert 统计["浪费步数"] == 2
+    assert 统计["浪费步骤比例"] == pytest.approx(0.667, abs=0.001)
+    assert 0.02 <= 统计["平均稳定等待"] < 0.2
+    assert len(agent.稳定等待耗时) == 2   # 第 1 步之前没有操作，不需要等
+    assert 统计["平均步骤耗时"] > 0
@@ -0,0 +1,247 @@
+"""
+测试流式响应和工具调用的提前执行
+"""
+import asyncio
+import json
+import time
+import pytest
+from types import SimpleNamespace as NS
+from unittest.mock import AsyncMock, MagicMock, patch
+from providers.base import LLM响应, 工具调用
+
+
+def _块(delta, finish_reason=None, usage=None):
+    return {
+        "id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0, "model": "mock",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+        "usage": usage
+    }
+
+
+def _工具片段(index, 参数片段, 名称=None):
+    片段 = {"index": index, "function": {"arguments": 参数片段}}
+    if 名称:
+        片段.update(id=f"call_{index}", type="function")
+        片段["function"]["name"] = 名称
+    return {"tool_calls": [片段]}
+
+
+class _假流:
+    """模拟 SDK 的 AsyncStream：可以异步迭代，也可以用 async with 关闭响应"""
+
+    def __init__(self, 事件列表):
+        self.事件列表 = 事件列表
+        self.已关闭 = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *异常):
+        self.已关闭 = True
+
+    async def __aiter__(self):
+        for 事件 in self.事件列表:
+            yield 事件
+
+
+async def _启动模拟服务器(慢速间隔: float):
+    """
+    本地模拟的 OpenAI 流式接口：
+    第一个工具调用很快就完整了，之后服务器"思考"一段时间才发送第二个工具调用
+    """
+    async def 处理(reader, writer):
+        # 读完请求头和请求体
+        头 = await reader.readuntil(b"\r\n\r\n")
+        长度 = next(
+            (int(行.split(b":")[1]) for 行 in 头.split(b"\r\n") if 行.lower().startswith(b"content-length")),
+            0
+        )
+        await reader.readexactly(长度)
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n"
+        )
+
+        async def 发送(数据):
+            writer.write(f"data: {json.dumps(数据)}\n\n".encode())
+            await writer.drain()
+
+        await 发送(_块(_工具片段(0, '{"x": 10, ', "left_click")))
+        await 发送(_块(_工具片段(0, '"y": 20}')))
+        await 发送(_块(_工具片段(1, "", "type")))   # 新的 index：第一个工具调用已经完整
+        await asyncio.sleep(慢速间隔)
+        await 发送(_块(_工具片段(1, '{"text": "hi"}')))
+        await 发送(_块({}, finish_reason="tool_calls"))
+        await 发送(_块(None, usage={"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120}))
+        writer.write(b"data: [DONE]\n\n")
+        await writer.drain()
+        writer.close()
+
+    服务器 = await asyncio.start_server(处理, "127.0.0.1", 0)
+    return 服务器, 服务器.sockets[0].getsockname()[1]
+
+
+@pytest.mark.asyncio
+async def test_openai_stream_dispatches_tool_calls_early():
+    """对着本地模拟服务器测量：第一个工具调用在整段生成结束前就已经可以执行"""
+    from providers.openai_provider import OpenAI提供者
+
+    服务器, 端口 = await _启动模拟服务器(慢速间隔=0.6)
+    async with 服务器:
+        provider = OpenAI提供者("test-key", model="mock", base_url=f"http://127.0.0.1:{端口}/v1")
+        开始 = time.perf_counter()
+        事件列表 = []
+        async for 事件 in provider.流式发送消息([{"role": "user", "content": "hi"}]):
+            事件列表.append((time.perf_counter() - 开始, 事件))
+
+    工具事件 = [(t, e) for t, e in 事件列表 if e.类型 == "工具调用"]
+    完成时间, 完成事件 = 事件列表[-1]
+
+    assert [e.工具调用.工具名称 for _, e in 工具事件] == ["left_click", "type"]
+    assert 工具事件[0][1].工具调用.参数 == {"x": 10, "y": 20}
+    assert 工具事件[0][1].工具调用.工具调用ID == "call_0"
+    # 首个操作的时间明显早于整段生成结束
+    assert 工具事件[0][0] < 完成时间 - 0.4
+    assert 完成事件.类型 == "完成"
+    assert len(完成事件.响应.工具调用列表) == 2
+    assert 完成事件.响应.用量 == {"输入令牌": 100, "输出令牌": 20}
+
+
+@pytest.mark.asyncio
+async def test_agent_starts_first_action_before_generation_ends():
+    """AgentLoop 在流式模式下边接收边执行，并记录首个操作的耗时"""
+    from agent_loop import AgentLoop
+    from providers.openai_provider import OpenAI提供者
+    from tools.observation import 观测结果
+
+    服务器, 端口 = await _启动模拟服务器(慢速间隔=0.6)
+    async with 服务器:
+        provider = OpenAI提供者("test-key", model="mock", base_url=f"http://127.0.0.1:{端口}/v1")
+        agent = AgentLoop(提供者=provider, 最大循环次数=1)
+
+        执行时刻 = []
+
+        async def 假执行(工具):
+            执行时刻.append(time.perf_counter())
+            return "ok"
+
+        async def 假观测():
+            return 观测结果(base64数据="abc", 宽=1, 高=1)
+
+        with patch.object(agent, '_获取截图', side_effect=假观测), \
+             patch.object(agent, '_执行工具', side_effect=假执行):
+            await agent.执行任务("测试流式")
+
+    assert len(执行时刻) == 2
+    assert len(agent.首个动作耗时) == 1
+    # 第一个操作在服务器还在"思考"第二个工具调用时就已经执行了
+    assert 执行时刻[1] - 执行时刻[0] > 0.4
+    assert agent.首个动作耗时[0] < 0.4
+
+
+@pytest.mark.asyncio
+@patch('providers.anthropic_provider.anthropic.AsyncAnthropic')
+async def test_anthropic_stream_emits_tool_call_on_block_stop(mock_anthropic_class):
+    """Claude 的 tool_use 块在 content_block_stop 时产出"""
+    from providers.anthropic_provider import Anthropic提供者
+
+    事件 = [
+        NS(type="message_start", message=NS(usage=NS(input_tokens=50))),
+        NS(type="content_block_start", index=0, content_block=NS(type="tool_use", id="tu_1", name="left_click")),
+        NS(type="content_block_delta", index=0, delta=NS(type="input_json_delta", partial_json='{"x": 1,')),
+        NS(type="content_block_delta", index=0, delta=NS(type="input_json_delta", partial_json=' "y": 2}')),
+        NS(type="content_block_stop", index=0),
+        NS(type="content_block_start", index=1, content_block=NS(type="text")),
+        NS(type="content_block_delta", index=1, delta=NS(type="text_delta", text="点击了")),
+        NS(type="content_block_stop", index=1),
+        NS(type="message_delta", usage=NS(output_tokens=7)),
+        NS(type="message_stop"),
+    ]
+
+    事件流 = _假流(事件)
+    mock_client = MagicMock()
+    mock_client.beta.messages.create = AsyncMock(return_value=事件流)
+    mock_anthropic_class.return_value = mock_client
+
+    provider = Anthropic提供者("test-key")
+    结果 = [e async for e in provider.流式发送消息([{"role": "user", "content": "hi"}])]
+
+    assert [e.类型 for e in 结果] == ["工具调用", "文本", "完成"]
+    assert 结果[0].工具调用 == 工具调用(工具名称="left_click", 参数={"x": 1, "y": 2}, 工具调用ID="tu_1")
+    assert 结果[-1].响应.文本内容 == "点击了"
+    assert 结果[-1].响应.用量 == {"输入令牌": 50, "输出令牌": 7}
+    assert mock_client.beta.messages.create.call_args.kwargs["stream"] is True
+    assert 事件流.已关闭
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("提供者名", ["openai", "anthropic"])
+async def test_stream_closed_when_consumer_stops_early(提供者名):
+    """消费者提前停止（例如对冲落败的请求被取消）时，SDK 的响应流也被关闭，连接回到连接池"""
+    工具块 = _块(_工具片段(0, '{"x": 1, "y": 2}', "left_click"))
+    if 提供者名 == "openai":
+        from openai.types.chat import ChatCompletionChunk
+        from providers.openai_provider import OpenAI提供者
+        流 = _假流([ChatCompletionChunk.model_validate(工具块), ChatCompletionChunk.model_validate(_块({}, "tool_calls"))])
+        provider = OpenAI提供者("test-key")
+        provider.client = MagicMock()
+        provider.client.chat.completions.create = AsyncMock(return_value=流)
+    else:
+        from providers.anthropic_provider import Anthropic提供者
+        流 = _假流([
+            NS(type="content_block_start", index=0, content_block=NS(type="tool_use", id="tu_1", name="left_click")),
+            NS(type="content_block_stop", index=0),
+            NS(type="message_stop"),
+        ])
+        provider = Anthropic提供者("test-key")
+        provider.client = MagicMock()
+        provider.client.beta.messages.create = AsyncMock(return_value=流)
+
+    生成器 = provider.流式发送消息([{"role": "user", "content": "hi"}])
+    第一个 = await 生成器.__anext__()
+    assert 第一个.类型 == "工具调用"
+    assert not 流.已关闭
+    await 生成器.aclose()
+    assert 流.已关闭
+
+
+@pytest.mark.asyncio
+async def test_gemini_stream_emits_function_calls_per_chunk():
+    from providers.gemini_provider import Gemini提供者
+
+    def 数据块(*parts, usage=None):
+        return NS(candidates=[NS(content=NS(parts=list(parts)))], usage_metadata=usage)
+
+    块列表 = [
+        数据块(NS(text="", function_call=NS(name="key", args={"key_name": "enter"}))),
+        数据块(NS(text="完成", function_call=None),
+              usage=NS(prompt_token_count=30, candidates_token_count=4)),
+    ]
+
+    async def 异步流():
+        for 块 in 块列表:
+            yield 块
+
+    provider = Gemini提供者("test-key")
+    provider.model = MagicMock()
+    provider.model.generate_content_async = AsyncMock(return_value=异步流())
+
+    结果 = [e async for e in provider.流式发送消息([{"role": "user", "content": "hi"}])]
+
+    assert [e.类型 for e in 结果] == ["工具调用", "文本", "完成"]
+    assert 结果[0].工具调用.参数 == {"key_name": "enter"}
+    assert 结果[-1].响应.用量 == {"输入令牌": 30, "输出令牌": 4}
+
+
+@pytest.mark.asyncio
+async def test_default_stream_wraps_send_message():
+    """没有实现流式的 Provider 也能用：默认实现一次性产出所有事件"""
+    from providers.base import LLM提供者基类
+
+    class 简单提供者(LLM提供者基类):
+        async def 发送消息(self, 对话历史, 截图base64=None, 截图媒体类型="image/png"):
+            return LLM响应(文本内容="好", 工具调用列表=[工具调用(工具名称="key", 参数={})])
+
+    结果 = [e async for e in 简单提供者("k").流式发送消息([])]
+    assert [e.类型 for e in 结果] == ["文本", "工具调用", "完成"]
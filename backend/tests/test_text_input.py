@@ -0,0 +1,96 @@
+"""
+测试文字输入引擎：按长度和内容选择输入方式、不可用时换下一种、剪贴板恢复
+"""
+import threading
+
+import pytest
+from unittest.mock import patch
+
+from tools.computer import 执行键盘操作
+from tools.text_input import 剪贴板粘贴, 匀速输入, 文字输入引擎, 输入方式, 输入方式不可用
+
+
+class 记录方式(输入方式):
+    """记录输入了什么的假输入方式"""
+
+    def __init__(self, 名称, 只支持ASCII=True, 可用=True, 输入时不可用=False):
+        self.名称 = 名称
+        self.只支持ASCII = 只支持ASCII
+        self._可用 = 可用
+        self.输入时不可用 = 输入时不可用
+        self.记录: list[str] = []
+
+    def 可用(self, 文字):
+        return self._可用 and (文字.isascii() or not self.只支持ASCII)
+
+    def 输入(self, 文字, 停止信号=None, 间隔=None):
+        if self.输入时不可用:
+            raise 输入方式不可用("没有 X 服务器")
+        self.记录.append(文字)
+        return len(文字)
+
+
+def _引擎(**参数):
+    方式 = [记录方式("xtest"), 记录方式("clipboard", 只支持ASCII=False), 记录方式("paced")]
+    for 名称, 设置 in 参数.pop("方式设置", {}).items():
+        for 一种 in 方式:
+            if 一种.名称 == 名称:
+                vars(一种).update(设置)
+    return 文字输入引擎(方式, **参数)
+
+
+def test_choice_by_length_and_content():
+    引擎 = _引擎(短文本上限=10)
+    assert 引擎.选择("hello").名称 == "paced"
+    assert 引擎.选择("x" * 11).名称 == "xtest"
+    assert 引擎.选择("你好，世界").名称 == "clipboard"
+
+    # 没有图形环境：长文字改用剪贴板
+    引擎 = _引擎(短文本上限=10, 方式设置={"xtest": {"_可用": False}})
+    assert 引擎.选择("x" * 2000).名称 == "clipboard"
+
+    # 会丢按键的程序：固定优先匀速输入
+    assert _引擎(优先方式="paced").选择("x" * 2000).名称 == "paced"
+
+
+def test_falls_back_when_method_turns_out_unavailable():
+    引擎 = _引擎(短文本上限=0, 方式设置={"xtest": {"输入时不可用": True}})
+    assert 引擎.输入("long text") == ("clipboard", 9)
+    assert 引擎.输入方式表["clipboard"].记录 == ["long text"]
+
+    引擎 = _引擎(方式设置={"clipboard": {"_可用": False}})
+    with pytest.raises(输入方式不可用, match="pyperclip"):
+        引擎.输入("中文")
+
+
+def test_clipboard_paste_restores_previous_content():
+    class 假剪贴板:
+        内容 = "用户原来复制的内容"
+        历史: list[str] = []
+
+        def copy(self, 文字):
+            self.内容 = 文字
+            self.历史.append(文字)
+
+        def paste(self):
+            return self.内容
+
+    剪贴板 = 假剪贴板()
+    粘贴时内容 = []
+    方式 = 剪贴板粘贴(lambda: 粘贴时内容.append(剪贴板.内容), 恢复延迟=0, 剪贴板=剪贴板)
+
+    assert 方式.输入("你好") == 2
+    assert 粘贴时内容 == ["你好"]
+    assert 剪贴板.内容 == "用户原来复制的内容"
+
+
+@patch('tools.computer.pyautogui')
+def test_type_uses_engine_and_keeps_short_text_paced(mock_pyautogui):
+    引擎 = 文字输入引擎([记录方式("xtest"), 匀速输入(lambda 文字, 间隔, 停止: len(文字))], 短文本上限=32)
+    with patch('tools.computer.全局文字输入引擎', 引擎):
+        assert 执行键盘操作("type", {"text": "a" * 100}, threading.Event()) == "已输入: " + "a" * 20 + "..."
+    assert 引擎.输入方式表["xtest"].记录 == ["a" * 100]
+
+    # 默认引擎：短 ASCII 仍然是 write(文字, interval=0.05)
+    执行键盘操作("type", {"text": "hi"})
+    mock_pyautogui.write.assert_called_once_with("hi", interval=0.05)
@@ -117,4 +117,90 @@ def test_invalid_operations():
 
     # 测试无效的键盘操作
     result = 执行键盘操作("invalid_operation", {})
-    assert isinstance(result, str)
\ No newline at end of file
+    assert isinstance(result, str)
+
+def _构造假mss():
+    """构造一个记录打开次数的假 mss 句柄"""
+    假句柄 = MagicMock()
+    假句柄.monitors = [
+        {"left": 0, "top": 0, "width": 3840, "height": 1080},
+        {"left": 0, "top": 0, "width": 1920, "height": 1080},
+        {"left": 1920, "top": 0, "width": 1920, "height": 1080},
+    ]
+    return 假句柄
+
+
+def test_screen_session_reuses_handle():
+    """截图会话只打开一次 mss 句柄，并缓存显示器信息"""
+    from tools.screen import 截图会话
+
+    假句柄 = _构造假mss()
+    with patch('tools.screen.mss.mss', return_value=假句柄) as mock_mss:
+        会话 = 截图会话()
+        会话.抓取(显示器编号=1)
+        会话.抓取(显示器编号=2)
+        assert 会话.获取显示器(1)["width"] == 1920
+        assert len(会话.显示器列表()) == 3
+
+        assert mock_mss.call_count == 1
+        assert 会话.探测次数 == 1
+        assert 假句柄.grab.call_count == 2
+
+
+def test_screen_session_reprobes_after_grab_error():
+    """截图出错（显示器热插拔）时重新探测并重试一次"""
+    from mss.exception import ScreenShotError
+    from tools.screen import 截图会话
+
+    旧句柄 = _构造假mss()
+    旧句柄.grab.side_effect = ScreenShotError("monitor gone")
+    新句柄 = _构造假mss()
+    新句柄.grab.return_value = "frame"
+
+    with patch('tools.screen.mss.mss', side_effect=[旧句柄, 新句柄]):
+        会话 = 截图会话()
+        assert 会话.抓取() == "frame"
+        assert 会话.探测次数 == 2
+        旧句柄.close.assert_called_once()
+
+
+def test_bgra_fast_path_downscales_and_swaps_channels():
+    """快速路径：先整数倍降采样，再把 BGRA 转成 RGB"""
+    import numpy as np
+    from tools.screen import 缩放BGRA为RGB
+
+    帧 = np.zeros((2160, 3840, 4), dtype=np.uint8)
+    帧[..., 0] = 10    # B
+    帧[..., 1] = 20    # G
+    帧[..., 2] = 30    # R
+    帧[..., 3] = 255
+
+    图片 = 缩放BGRA为RGB(帧, 1024, 1024)
+    assert 图片.mode == "RGB"
+    assert 图片.size == (1024, 576)
+    assert 图片.getpixel((100, 100)) == (30, 20, 10)
+
+    # 不需要缩小时保持原尺寸
+    小帧 = np.ascontiguousarray(帧[:100, :200])
+    assert 缩放BGRA为RGB(小帧, 1024, 1024).size == (200, 100)
+
+
+def test_bgra_fast_path_matches_reference():
+    """快速路径和原来的 frombytes + resize 路径结果基本一致"""
+    import numpy as np
+    from PIL import Image
+    from tools.screen import 缩放BGRA为RGB
+
+    y, x = np.mgrid[0:1080, 0:1920]
+    帧 = np.zeros((1080, 1920, 4), dtype=np.uint8)
+    帧[..., 0] = (x // 8) % 256
+    帧[..., 1] = (y // 8) % 256
+    帧[..., 2] = ((x + y) // 16) % 256
+
+    参考 = Image.frombytes("RGB", (1920, 1080), 帧.tobytes(), "raw", "BGRX")
+    参考 = 参考.resize((960, 540), Image.Resampling.BOX)
+    快速 = 缩放BGRA为RGB(帧, 960, 960)
+
+    差值 = np.abs(np.asarray(参考, dtype=int) - np.asarray(快速, dtype=int))
+    assert 快速.size == 参考.size
+    assert 差值.max() <= 1
@@ -1,8 +1,19 @@
 """
 tools 包初始化
+
+computer.py 会导入 pyautogui，没有显示器的机器上一导入就失败；
+它导出的名字在第一次用到时才导入，这样只用到哈希、编码等模块时（例如回放）不需要图形环境。
 """
 from .screen import 截取屏幕, 获取屏幕尺寸, 获取所有显示器
-from .computer import 执行鼠标操作, 执行键盘操作, 获取鼠标位置
+from .encoder import 编码器, 编码结果, 编码图片, 按预算编码, 注册编码器, 编码缓存
+from .encode_pool import 共享内存编码池
+from .frame_diff import 瓦片差异检测器, 差异结果
+from .image_hash import 平均哈希, 差值哈希, 感知哈希, 汉明距离, 屏幕状态索引
+from .observation import 观测执行器, 观测结果, 生成观测
+from .settle import 屏幕稳定检测器, 稳定结果
+from .action_executor import 动作执行器
+from .text_input import 文字输入引擎, 输入方式, 输入方式不可用
+from .pacing import 操作节奏, 节奏表, 获取节奏, 合并工具调用
 
 __all__ = [
     "截取屏幕",
@@ -10,5 +21,41 @@ __all__ = [
     "获取所有显示器",
     "执行鼠标操作",
     "执行键盘操作",
-    "获取鼠标位置"
+    "获取鼠标位置",
+    "编码器",
+    "编码结果",
+    "编码图片",
+    "按预算编码",
+    "注册编码器",
+    "编码缓存",
+    "共享内存编码池",
+    "瓦片差异检测器",
+    "差异结果",
+    "平均哈希",
+    "差值哈希",
+    "感知哈希",
+    "汉明距离",
+    "屏幕状态索引",
+    "观测执行器",
+    "观测结果",
+    "生成观测",
+    "屏幕稳定检测器",
+    "稳定结果",
+    "动作执行器",
+    "文字输入引擎",
+    "输入方式",
+    "输入方式不可用",
+    "操作节奏",
+    "节奏表",
+    "获取节奏",
+    "合并工具调用"
 ]
+
+_computer导出 = {"执行鼠标操作", "执行键盘操作", "获取鼠标位置"}
+
+
+def __getattr__(名称: str):
+    if 名称 in _computer导出:
+        from . import computer
+        return getattr(computer, 名称)
+    raise AttributeError(f"module 'tools' has no attribute {名称!r}")
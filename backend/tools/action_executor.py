@@ -0,0 +1,90 @@
+"""
+============================================
+动作执行器（键鼠操作在专用线程里执行）
+============================================
+这个文件负责把"动手"这件事从事件循环里搬出去。
+
+为什么需要它？
+pyautogui 的操作都是同步阻塞的：
+- `moveTo(duration=0.3)` 要滑动 0.3 秒
+- `write(interval=0.05)` 每个字符之间停 0.05 秒，输入 200 个字就是 10 秒
+- 每次调用之后还有 `pyautogui.PAUSE` 的固定停顿
+
+以前这些操作直接在事件循环里执行，一个很长的 `type` 操作期间，
+FastAPI 无法响应任何 HTTP 请求，WebSocket 日志也发不出去——连 /api/stop 都要排队。
+
+现在所有键鼠操作都提交到一个专用线程，事件循环只 await 结果：
+- 只有一个工作线程：键鼠输入必须严格按顺序，不能两个操作交错
+- 提交后拿到的是 future，可以 await，也可以在线程里同步等待
+- 停止信号作为参数传给操作本身，操作在每个基本事件（一个字符、一小段移动）之间检查，
+  /api/stop 几毫秒内就能打断正在进行的输入，而不是等整段文字打完
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from loguru import logger
+
+
+class 动作执行器:
+    """
+    专用的键鼠操作线程
+
+    用法：
+        执行器 = 动作执行器()
+        结果 = await 执行器.执行(执行键盘操作, "type", {"text": "你好"}, 停止信号)
+        future = 执行器.提交(执行鼠标操作, "left_click", {}, 停止信号)   # concurrent.futures.Future
+    """
+
+    def __init__(self):
+        self._执行器: Optional[ThreadPoolExecutor] = None
+        self._锁 = threading.Lock()
+        self.进行中数量 = 0  # 已提交（排队或执行中）的操作数
+
+    def _获取执行器(self) -> ThreadPoolExecutor:
+        """懒加载线程：只有第一次提交操作时才创建"""
+        with self._锁:
+            if self._执行器 is None:
+                self._执行器 = ThreadPoolExecutor(max_workers=1, thread_name_prefix="action")
+                logger.info("🖐️ 动作执行器已启动")
+            return self._执行器
+
+    def 提交(self, 函数: Callable[..., Any], *参数) -> Future:
+        """把一个同步的键鼠操作提交到专用线程，立即返回 future"""
+        执行器 = self._获取执行器()
+        with self._锁:
+            self.进行中数量 += 1
+        try:
+            future = 执行器.submit(函数, *参数)
+        except Exception:
+            self._完成(None)
+            raise
+        future.add_done_callback(self._完成)
+        return future
+
+    def _完成(self, _future: Optional[Future]):
+        with self._锁:
+            self.进行中数量 -= 1
+
+    async def 执行(self, 函数: Callable[..., Any], *参数) -> Any:
+        """
+        提交操作并等待结果（不阻塞事件循环）
+
+        等待的协程被取消时，还没开始的操作会被取消；
+        已经开始的操作要靠停止信号打断。
+        """
+        return await asyncio.wrap_future(self.提交(函数, *参数))
+
+    def 关闭(self, 等待: bool = True):
+        """关闭执行器（应用退出时调用），排队中的操作不再执行"""
+        with self._锁:
+            执行器, self._执行器 = self._执行器, None
+        if 执行器 is not None:
+            执行器.shutdown(wait=等待, cancel_futures=True)
+            logger.info("🖐️ 动作执行器已关闭")
+
+
+# 全局动作执行器实例
+全局动作执行器 = 动作执行器()
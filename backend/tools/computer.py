@@ -9,15 +9,21 @@
 安全措施：
 1. pyautogui 内置 "Fail-Safe"：鼠标移到屏幕左上角会触发异常
 2. 所有操作都有日志记录
-3. 每个操作前会检查全局停止信号
+3. 每个操作前会检查停止信号；输入文字、移动鼠标这类持续较久的操作，
+   在每个字符、每一小段移动之间都会再检查一次（见 tools/action_executor.py）
 
 注意：macOS 需要在"系统偏好设置 → 安全性与隐私 → 辅助功能"中授权！
 """
 
-from typing import Any
+import os
+import threading
+from typing import Any, Optional
 import pyautogui
 from loguru import logger
 
+from .pacing import 操作节奏, 默认节奏
+from .text_input import XTest连发, 剪贴板粘贴, 匀速输入, 文字输入引擎
+
 
 # ============================================
 # 安全配置
@@ -26,33 +32,52 @@ from loguru import logger
 # 启用 Fail-Safe：鼠标移到屏幕左上角 (0, 0) 会触发 pyautogui.FailSafeException
 pyautogui.FAILSAFE = True
 
-# 设置每次操作之间的延迟（秒），防止操作太快
-pyautogui.PAUSE = 0.1
+# 设置每次操作之间的延迟（秒），防止操作太快（每个操作开始前会按操作节奏重新设置，见 tools/pacing.py）
+pyautogui.PAUSE = 默认节奏.操作间隔
+
+# 可打断的鼠标移动每一小段的时长（秒）
+移动分段时长 = 0.015
 
 
 # ============================================
 # 鼠标操作
 # ============================================
 
-def 执行鼠标操作(操作类型: str, 参数: dict[str, Any]) -> str:
+def 执行鼠标操作(
+    操作类型: str,
+    参数: dict[str, Any],
+    停止信号: Optional[threading.Event] = None,
+    节奏: Optional[操作节奏] = None
+) -> str:
     """
     执行鼠标操作
     
     参数:
         操作类型: "mouse_move", "left_click", "right_click", "double_click", "scroll"
         参数: 操作参数字典
+        停止信号: 设置后不再执行；鼠标移动会在每一小段之间检查
+        节奏: 操作的快慢，默认和以前一样（停顿 0.1 秒，滑动 0.3 秒）
     
     返回:
         操作结果描述
     """
+    if 停止信号 is not None and 停止信号.is_set():
+        return "已停止，操作未执行"
+    节奏 = 节奏 or 默认节奏
+    
     try:
+        pyautogui.PAUSE = 节奏.操作间隔
         x = 参数.get("x")
         y = 参数.get("y")
         
         if 操作类型 == "mouse_move":
             if x is None or y is None:
                 return "错误：缺少坐标参数"
-            pyautogui.moveTo(x, y, duration=0.3)
+            if 停止信号 is None:
+                pyautogui.moveTo(x, y, duration=节奏.移动时长)
+            elif not _分段移动(x, y, 节奏.移动时长, 停止信号):
+                logger.info(f"🛑 鼠标移动到 ({x}, {y}) 时被停止")
+                return f"已停止：没有移动到 ({x}, {y})"
             logger.info(f"🖱️ 鼠标移动到 ({x}, {y})")
             return f"已移动到 ({x}, {y})"
         
@@ -112,36 +137,43 @@ def 执行鼠标操作(操作类型: str, 参数: dict[str, Any]) -> str:
 # 键盘操作
 # ============================================
 
-def 执行键盘操作(操作类型: str, 参数: dict[str, Any]) -> str:
+def 执行键盘操作(
+    操作类型: str,
+    参数: dict[str, Any],
+    停止信号: Optional[threading.Event] = None,
+    节奏: Optional[操作节奏] = None
+) -> str:
     """
     执行键盘操作
     
     参数:
         操作类型: "type", "key", "hotkey"
         参数: 操作参数字典
+        停止信号: 设置后不再执行；输入文字时每个字符之间检查
+        节奏: 操作的快慢，默认和以前一样（停顿 0.1 秒，打字间隔 0.05 秒）
     
     返回:
         操作结果描述
     """
+    if 停止信号 is not None and 停止信号.is_set():
+        return "已停止，操作未执行"
+    节奏 = 节奏 or 默认节奏
+    
     try:
+        pyautogui.PAUSE = 节奏.操作间隔
         if 操作类型 == "type":
             文字 = 参数.get("text", "")
             if not 文字:
                 return "错误：没有提供要输入的文字"
             
-            # pyautogui.write() 不支持中文，需要使用 pyperclip + hotkey
-            # 但为了简单起见，我们先尝试直接输入
-            # 如果是纯 ASCII，直接用 write
-            if 文字.isascii():
-                pyautogui.write(文字, interval=0.05)
-            else:
-                # 对于非 ASCII（如中文），使用剪贴板
-                import pyperclip
-                pyperclip.copy(文字)
-                pyautogui.hotkey("command" if _是mac系统() else "ctrl", "v")
+            # 短 ASCII 逐字输入；长文字用 XTest 连发或剪贴板粘贴；中文等非 ASCII 用剪贴板
+            方式, 已输入 = 全局文字输入引擎.输入(文字, 停止信号, 节奏.打字间隔, 节奏.优先输入方式)
+            if 已输入 < len(文字):
+                logger.info(f"🛑 输入文字被停止（{已输入}/{len(文字)} 个字符）")
+                return f"已停止：输入了 {已输入}/{len(文字)} 个字符"
             
             显示文字 = 文字[:20] + "..." if len(文字) > 20 else 文字
-            logger.info(f"⌨️ 输入文字: {显示文字}")
+            logger.info(f"⌨️ 输入文字（{方式}）: {显示文字}")
             return f"已输入: {显示文字}"
         
         elif 操作类型 == "key":
@@ -185,6 +217,55 @@ def _是mac系统() -> bool:
     return platform.system() == "Darwin"
 
 
+def _匀速输入(文字: str, 间隔: float, 停止信号: Optional[threading.Event]) -> int:
+    """匀速输入：没有停止信号时整段交给 pyautogui.write，有停止信号时逐字输入"""
+    if 停止信号 is None:
+        pyautogui.write(文字, interval=间隔)
+        return len(文字)
+    return _逐字输入(文字, 间隔, 停止信号)
+
+
+def _粘贴():
+    pyautogui.hotkey("command" if _是mac系统() else "ctrl", "v")
+
+
+def _逐字输入(文字: str, 间隔: float, 停止信号: threading.Event) -> int:
+    """
+    一个字符一个字符地输入，每个字符之间检查停止信号
+
+    字符之间的间隔用 `停止信号.wait` 代替 sleep，收到停止信号会立刻醒来。
+
+    返回:
+        实际输入的字符数
+    """
+    for 序号, 字符 in enumerate(文字):
+        if 停止信号.is_set():
+            return 序号
+        pyautogui.write(字符, _pause=False)
+        if 停止信号.wait(间隔):
+            return 序号 + 1
+    return len(文字)
+
+
+def _分段移动(x: int, y: int, 时长: float, 停止信号: threading.Event) -> bool:
+    """
+    把一次平滑移动拆成很多小段（效果和 `moveTo(duration=...)` 的匀速移动一样），每段之间检查停止信号
+
+    返回:
+        是否移动到了目标位置
+    """
+    起点x, 起点y = pyautogui.position()
+    段数 = max(1, round(时长 / 移动分段时长))
+    for 序号 in range(1, 段数 + 1):
+        if 停止信号.is_set():
+            return False
+        比例 = 序号 / 段数
+        pyautogui.moveTo(round(起点x + (x - 起点x) * 比例), round(起点y + (y - 起点y) * 比例), _pause=False)
+        if 序号 < 段数 and 停止信号.wait(时长 / 段数):
+            return False
+    return True
+
+
 def _标准化键名(键名: str) -> str:
     """
     将常见的键名别名转换为 pyautogui 接受的格式
@@ -231,3 +312,16 @@ def 获取鼠标位置() -> tuple[int, int]:
     """获取当前鼠标位置"""
     pos = pyautogui.position()
     return (pos.x, pos.y)
+
+
+# ============================================
+# 文字输入引擎
+# ============================================
+
+# TEXT_INPUT=xtest/clipboard/paced 固定优先使用某种输入方式，auto（默认）按文字自动选择
+_优先输入方式 = os.environ.get("TEXT_INPUT", "auto").lower()
+
+全局文字输入引擎 = 文字输入引擎(
+    [XTest连发(), 剪贴板粘贴(_粘贴), 匀速输入(_匀速输入)],
+    优先方式=None if _优先输入方式 == "auto" else _优先输入方式
+)
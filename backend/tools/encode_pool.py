@@ -0,0 +1,213 @@
+"""
+============================================
+共享内存编码进程池
+============================================
+这个文件负责把"压缩截图"这件最吃 CPU 的事交给独立的进程去做。
+
+为什么需要它？
+PNG/WebP 压缩一张大图要几十到几百毫秒，而且全程持有 GIL，
+和 uvicorn 抢的是同一个解释器。观测执行器虽然把它搬出了事件循环，
+但只要还在同一个进程里，其他 Python 线程照样要等。
+
+直接用 ProcessPoolExecutor 也不行：每一帧的原始像素（4K 约 33 MB）
+都要 pickle 一遍、经过管道再 unpickle，复制的开销比压缩本身还大。
+
+现在的做法（类比：几个打包工人共用几张工作台）：
+1. 池里预先准备几个"槽位"，每个槽位是一块 `multiprocessing.shared_memory`
+2. 主进程把 mss 的原始 BGRA 缓冲区直接复制进一个空闲槽位（一次 memcpy）
+3. 只把槽位名字和帧尺寸发给工作进程——像素数据完全不经过 pickle
+4. 工作进程零拷贝地映射这块内存，缩放、编码，只把压缩后的字节传回来
+
+槽位用完之前，新的帧会等待空位（天然的背压）。
+
+用法：
+    编码池 = 共享内存编码池(工作进程数=2)
+    设置编码后端(编码池)          # 截图流水线改用进程池编码
+    ...
+    编码池.关闭()
+"""
+
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+from .encoder import 按预算编码, 编码结果, 默认格式顺序
+from .screen import 截图转BGRA数组, 缩放BGRA为RGB
+
+
+# ============================================
+# 工作进程一侧
+# ============================================
+
+# 工作进程里已经映射的槽位：槽位序号 → 共享内存
+_已映射槽位: dict[int, shared_memory.SharedMemory] = {}
+
+
+def _映射共享内存(槽位序号: int, 名称: str) -> shared_memory.SharedMemory:
+    """
+    在工作进程里映射主进程创建的共享内存（同一槽位只映射一次）
+
+    这块内存归主进程所有：映射时不能让本进程的 resource_tracker 登记它，
+    否则工作进程退出时会把它当成"泄漏"删掉。
+    """
+    共享 = _已映射槽位.get(槽位序号)
+    if 共享 is not None and 共享.name == 名称:
+        return 共享
+    if 共享 is not None:
+        共享.close()  # 主进程换了一块更大的内存
+
+    原登记函数 = resource_tracker.register
+    resource_tracker.register = lambda *参数, **选项: None
+    try:
+        共享 = shared_memory.SharedMemory(name=名称)
+    finally:
+        resource_tracker.register = 原登记函数
+
+    _已映射槽位[槽位序号] = 共享
+    return 共享
+
+
+def _工作进程编码(
+    槽位序号: int,
+    名称: str,
+    宽: int,
+    高: int,
+    最大宽度: int,
+    最大高度: int,
+    快速缩放: bool,
+    字节预算: Optional[int],
+    格式顺序: tuple[str, ...]
+) -> 编码结果:
+    """在工作进程里运行：共享内存中的 BGRA 帧 → 缩放 → 按预算编码"""
+    共享 = _映射共享内存(槽位序号, 名称)
+    帧 = np.ndarray((高, 宽, 4), dtype=np.uint8, buffer=共享.buf)
+    try:
+        图片 = 缩放BGRA为RGB(帧, 最大宽度, 最大高度, 快速缩放)
+    finally:
+        del 帧  # 不再引用共享内存，槽位才能被安全地替换
+    return 按预算编码(图片, 字节预算, 格式顺序)
+
+
+# ============================================
+# 主进程一侧
+# ============================================
+
+class 共享内存编码池:
+    """
+    通过共享内存接收原始帧、返回压缩字节的编码进程池
+
+    可以作为截图流水线的编码后端（见 `tools.screen.设置编码后端`）。
+    """
+
+    def __init__(self, 工作进程数: int = 2, 槽位数: Optional[int] = None):
+        """
+        参数:
+            工作进程数: 编码进程数量
+            槽位数: 共享内存槽位数量（同时在途的帧数上限），默认是工作进程数的 2 倍，
+                    这样一个进程编码时，下一帧已经在槽位里等着了
+        """
+        if 工作进程数 < 1:
+            raise ValueError("工作进程数必须 >= 1")
+
+        self.工作进程数 = 工作进程数
+        self.槽位数 = 槽位数 or 工作进程数 * 2
+        self._槽位: list[Optional[shared_memory.SharedMemory]] = [None] * self.槽位数
+        self._空闲槽位: "queue.Queue[int]" = queue.Queue()
+        for 序号 in range(self.槽位数):
+            self._空闲槽位.put(序号)
+        self._执行器: Optional[ProcessPoolExecutor] = None
+        self._锁 = threading.Lock()
+        self.已编码帧数 = 0
+
+    def _获取执行器(self) -> ProcessPoolExecutor:
+        """懒加载进程池：只有第一帧到来时才启动工作进程"""
+        with self._锁:
+            if self._执行器 is None:
+                self._执行器 = ProcessPoolExecutor(max_workers=self.工作进程数)
+                logger.info(
+                    f"🏭 编码进程池已启动（{self.工作进程数} 个进程，{self.槽位数} 个共享内存槽位）"
+                )
+            return self._执行器
+
+    def _准备槽位(self, 序号: int, 字节数: int) -> shared_memory.SharedMemory:
+        """确保槽位足够大，不够就换一块新的共享内存（分辨率变大时才会发生）"""
+        共享 = self._槽位[序号]
+        if 共享 is None or 共享.size < 字节数:
+            if 共享 is not None:
+                共享.close()
+                共享.unlink()
+            共享 = shared_memory.SharedMemory(create=True, size=字节数)
+            self._槽位[序号] = 共享
+        return 共享
+
+    def 提交帧(
+        self,
+        帧: np.ndarray,
+        最大宽度: int = 1024,
+        最大高度: int = 1024,
+        快速缩放: bool = True,
+        字节预算: Optional[int] = None,
+        格式顺序: Sequence[str] = 默认格式顺序
+    ) -> "Future[编码结果]":
+        """
+        把一帧 BGRA 数组复制进空闲槽位并交给工作进程编码
+
+        所有槽位都在使用时会阻塞，直到有槽位空出来。
+        返回的 Future 完成后，槽位自动归还。
+        """
+        if 帧.ndim != 3 or 帧.shape[2] != 4 or 帧.dtype != np.uint8:
+            raise ValueError(f"需要 (高, 宽, 4) 的 uint8 BGRA 数组，收到 {帧.shape} {帧.dtype}")
+
+        高, 宽 = 帧.shape[:2]
+        执行器 = self._获取执行器()
+        序号 = self._空闲槽位.get()
+        try:
+            共享 = self._准备槽位(序号, 帧.nbytes)
+            np.ndarray(帧.shape, dtype=np.uint8, buffer=共享.buf)[...] = 帧
+            未来 = 执行器.submit(
+                _工作进程编码, 序号, 共享.name, 宽, 高,
+                最大宽度, 最大高度, 快速缩放, 字节预算, tuple(格式顺序)
+            )
+        except BaseException:
+            self._空闲槽位.put(序号)
+            raise
+
+        未来.add_done_callback(lambda _: self._归还槽位(序号))
+        return 未来
+
+    def _归还槽位(self, 序号: int):
+        self.已编码帧数 += 1
+        self._空闲槽位.put(序号)
+
+    def 编码帧(self, 帧: np.ndarray, *参数, **选项) -> 编码结果:
+        """同步编码一帧（参数同 `提交帧`）"""
+        return self.提交帧(帧, *参数, **选项).result()
+
+    def 编码截图(self, 截图, *参数, **选项) -> 编码结果:
+        """同步编码一张 mss 截图（参数同 `提交帧`）"""
+        return self.编码帧(截图转BGRA数组(截图), *参数, **选项)
+
+    def 关闭(self, 等待: bool = True):
+        """关闭进程池并释放所有共享内存"""
+        with self._锁:
+            执行器, self._执行器 = self._执行器, None
+        if 执行器 is not None:
+            执行器.shutdown(wait=等待, cancel_futures=True)
+            logger.info(f"🏭 编码进程池已关闭（共编码 {self.已编码帧数} 帧）")
+
+        for 序号, 共享 in enumerate(self._槽位):
+            if 共享 is not None:
+                共享.close()
+                共享.unlink()
+                self._槽位[序号] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *异常信息):
+        self.关闭()
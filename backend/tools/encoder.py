@@ -0,0 +1,327 @@
+"""
+============================================
+截图编码器（按字节预算选择格式和质量）
+============================================
+这个文件负责把截图"打包"成发给 LLM 的图片数据。
+
+以前永远用 PNG：界面截图没问题，但遇到照片、渐变背景，
+一张图就有好几 MB，Base64 之后每次调用都要上传这么多数据。
+
+现在的策略（类比：寄快递先试原样装箱，超重了再压缩）：
+1. 先试无损格式（PNG，可选调色板 PNG），文字最清晰
+2. 超出预算时换有损格式（WebP、JPEG），用二分法找到"刚好放得下"的最高质量
+3. 质量降到最低还是太大，就把图片再缩小一点重试
+
+编码器是可插拔的：用 `注册编码器()` 可以加入新的格式。
+
+屏幕没变化时，同一张图没必要再压缩一遍：
+`编码缓存` 按"图片内容哈希 + 编码设置"缓存编码结果（LRU，有总字节上限），
+重复的观测只需要算一次哈希。
+"""
+
+import base64
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Hashable, Optional, Sequence
+
+from PIL import Image
+from loguru import logger
+
+
+@dataclass(frozen=True)
+class 编码器:
+    """
+    一种图片格式的编码器
+
+    编码函数接收 (图片, 质量)，返回编码后的字节；无损格式会忽略质量参数。
+    """
+    名称: str
+    媒体类型: str
+    有损: bool
+    编码: Callable[[Image.Image, int], bytes]
+
+
+@dataclass
+class 编码结果:
+    """编码后的图片数据"""
+    数据: bytes
+    格式: str                    # 编码器名称，如 "PNG"、"WEBP"
+    媒体类型: str                # MIME 类型，如 "image/png"
+    质量: Optional[int] = None   # 有损格式使用的质量，无损格式为 None
+    尺寸: tuple[int, int] = (0, 0)
+    _base64: Optional[str] = field(default=None, repr=False, compare=False)
+
+    @property
+    def base64长度(self) -> int:
+        """Base64 编码后的长度（也就是实际发送的字节数）"""
+        return 4 * ((len(self.数据) + 2) // 3)
+
+    def 转base64(self) -> str:
+        """返回 Base64 字符串（只计算一次，缓存命中时直接复用）"""
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.数据).decode("utf-8")
+        return self._base64
+
+
+# ============================================
+# 内置编码器
+# ============================================
+
+def _保存(图片: Image.Image, 格式: str, **选项) -> bytes:
+    缓冲区 = io.BytesIO()
+    图片.save(缓冲区, format=格式, **选项)
+    return 缓冲区.getvalue()
+
+
+def _编码PNG(图片: Image.Image, 质量: int) -> bytes:
+    return _保存(图片, "PNG")
+
+
+def _编码调色板PNG(图片: Image.Image, 质量: int) -> bytes:
+    # 界面截图颜色通常不多，量化到 256 色后 PNG 会小很多
+    调色板图 = 图片.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+    return _保存(调色板图, "PNG")
+
+
+def _编码JPEG(图片: Image.Image, 质量: int) -> bytes:
+    return _保存(图片.convert("RGB"), "JPEG", quality=质量)
+
+
+def _编码WEBP(图片: Image.Image, 质量: int) -> bytes:
+    return _保存(图片, "WEBP", quality=质量, method=4)
+
+
+编码器表: dict[str, 编码器] = {}
+
+
+def 注册编码器(新编码器: 编码器):
+    """注册（或替换）一种编码器"""
+    编码器表[新编码器.名称] = 新编码器
+
+
+注册编码器(编码器("PNG", "image/png", 有损=False, 编码=_编码PNG))
+注册编码器(编码器("PNG8", "image/png", 有损=False, 编码=_编码调色板PNG))
+注册编码器(编码器("JPEG", "image/jpeg", 有损=True, 编码=_编码JPEG))
+注册编码器(编码器("WEBP", "image/webp", 有损=True, 编码=_编码WEBP))
+
+# 默认的格式尝试顺序：无损优先，其次是压缩率更高的 WebP
+默认格式顺序 = ("PNG", "WEBP", "JPEG")
+
+
+def 编码图片(图片: Image.Image, 格式: str = "PNG", 质量: int = 85) -> 编码结果:
+    """用指定编码器编码一张图片"""
+    if 格式 not in 编码器表:
+        raise ValueError(f"未知的图片格式: {格式}（可选: {', '.join(编码器表)}）")
+
+    编码器实例 = 编码器表[格式]
+    return 编码结果(
+        数据=编码器实例.编码(图片, 质量),
+        格式=格式,
+        媒体类型=编码器实例.媒体类型,
+        质量=质量 if 编码器实例.有损 else None,
+        尺寸=图片.size
+    )
+
+
+def 按预算编码(
+    图片: Image.Image,
+    字节预算: Optional[int] = None,
+    格式顺序: Sequence[str] = 默认格式顺序,
+    最低质量: int = 40,
+    最高质量: int = 90,
+    最多缩小次数: int = 3
+) -> 编码结果:
+    """
+    选择能放进字节预算（按 Base64 长度计算）的最佳格式和质量
+
+    参数:
+        图片: 要编码的图片
+        字节预算: Base64 之后的最大字节数，None 表示不限制（直接用第一个格式）
+        格式顺序: 按优先级排列的编码器名称
+        最低质量 / 最高质量: 有损格式的质量搜索范围
+        最多缩小次数: 所有格式都放不下时，每次把图片缩小到 80% 再试
+
+    返回:
+        编码结果；实在放不下时返回尝试过的最小结果
+    """
+    可用格式 = [格式 for 格式 in 格式顺序 if 格式 in 编码器表]
+    if not 可用格式:
+        raise ValueError(f"没有可用的图片格式: {list(格式顺序)}")
+
+    if 字节预算 is None:
+        return 编码图片(图片, 可用格式[0], 最高质量)
+
+    最小结果: Optional[编码结果] = None
+    for 缩小次数 in range(最多缩小次数 + 1):
+        for 格式 in 可用格式:
+            结果 = _尝试格式(图片, 格式, 字节预算, 最低质量, 最高质量)
+            if 结果.base64长度 <= 字节预算:
+                if 缩小次数 or 格式 != 可用格式[0]:
+                    logger.debug(
+                        f"🗜️ 截图编码为 {格式}（质量 {结果.质量}，{图片.width}x{图片.height}）: "
+                        f"{结果.base64长度 / 1024:.0f}KB ≤ 预算 {字节预算 / 1024:.0f}KB"
+                    )
+                return 结果
+            if 最小结果 is None or 结果.base64长度 < 最小结果.base64长度:
+                最小结果 = 结果
+
+        if 缩小次数 < 最多缩小次数:
+            新尺寸 = (max(1, int(图片.width * 0.8)), max(1, int(图片.height * 0.8)))
+            图片 = 图片.resize(新尺寸, Image.Resampling.BILINEAR)
+
+    logger.warning(f"⚠️ 截图无法压缩到预算 {字节预算 / 1024:.0f}KB 以内，使用最小的结果")
+    return 最小结果
+
+
+def _尝试格式(
+    图片: Image.Image,
+    格式: str,
+    字节预算: int,
+    最低质量: int,
+    最高质量: int
+) -> 编码结果:
+    """
+    用一种格式尝试编码：无损格式只编码一次；
+    有损格式二分查找能放进预算的最高质量（找不到就返回最低质量的结果）
+    """
+    if not 编码器表[格式].有损:
+        return 编码图片(图片, 格式)
+
+    结果 = 编码图片(图片, 格式, 最高质量)
+    if 结果.base64长度 <= 字节预算:
+        return 结果
+
+    最佳: Optional[编码结果] = None
+    低, 高 = 最低质量, 最高质量 - 1
+    while 低 <= 高:
+        中 = (低 + 高) // 2
+        结果 = 编码图片(图片, 格式, 中)
+        if 结果.base64长度 <= 字节预算:
+            最佳 = 结果
+            低 = 中 + 1
+        else:
+            高 = 中 - 1
+
+    return 最佳 or 编码图片(图片, 格式, 最低质量)
+
+
+# ============================================
+# 编码结果缓存
+# ============================================
+
+def 内容哈希(数据, 描述: str = "") -> bytes:
+    """
+    计算一段像素数据的哈希（SHA-256 取前 128 位）
+
+    数据可以是 bytes、bytearray、memoryview 或连续的 NumPy 数组（不会复制）。
+    描述（格式、尺寸等）也会参与哈希，避免不同形状的数据撞车。
+    比重新做一次 PNG/WebP 压缩便宜得多。
+    用 SHA-256 是因为常见 CPU 都有硬件指令：4K 原始帧（33MB）约 28ms，BLAKE2b 要 60ms 以上。
+    """
+    摘要 = hashlib.sha256()
+    摘要.update(描述.encode())
+    摘要.update(数据)
+    return 摘要.digest()[:16]
+
+
+def 图片内容哈希(图片: Image.Image) -> bytes:
+    """计算图片像素内容的哈希（1024 宽的截图只要几毫秒）"""
+    return 内容哈希(图片.tobytes(), f"{图片.mode}:{图片.width}x{图片.height}")
+
+
+class 编码缓存:
+    """
+    编码结果的 LRU 缓存
+
+    键是 (图片内容哈希, 编码设置)，值是编码结果（连同已经算好的 Base64）。
+    所有缓存结果的总字节数超过上限时，从最久没用的开始淘汰。
+    """
+
+    def __init__(self, 字节上限: int = 32 * 1024 * 1024):
+        self.字节上限 = 字节上限
+        self._条目: "OrderedDict[Hashable, 编码结果]" = OrderedDict()
+        self._锁 = threading.Lock()
+        self.当前字节数 = 0
+        self.命中次数 = 0
+        self.未命中次数 = 0
+        self.淘汰次数 = 0
+
+    @staticmethod
+    def _条目大小(结果: 编码结果) -> int:
+        # 原始字节 + Base64 字符串（缓存命中时两者都会被复用）
+        return len(结果.数据) + 结果.base64长度
+
+    def 获取(self, 键: Hashable) -> Optional[编码结果]:
+        with self._锁:
+            结果 = self._条目.get(键)
+            if 结果 is None:
+                self.未命中次数 += 1
+                return None
+            self._条目.move_to_end(键)
+            self.命中次数 += 1
+            return 结果
+
+    def 放入(self, 键: Hashable, 结果: 编码结果):
+        大小 = self._条目大小(结果)
+        if 大小 > self.字节上限:
+            return  # 单条就超过上限，不缓存
+
+        结果.转base64()  # 预先算好 Base64，命中时直接复用
+        with self._锁:
+            旧结果 = self._条目.pop(键, None)
+            if 旧结果 is not None:
+                self.当前字节数 -= self._条目大小(旧结果)
+            self._条目[键] = 结果
+            self.当前字节数 += 大小
+
+            while self.当前字节数 > self.字节上限:
+                _, 被淘汰 = self._条目.popitem(last=False)
+                self.当前字节数 -= self._条目大小(被淘汰)
+                self.淘汰次数 += 1
+
+    def 获取或编码(
+        self,
+        图片: Image.Image,
+        字节预算: Optional[int] = None,
+        格式顺序: Sequence[str] = 默认格式顺序,
+        **选项
+    ) -> 编码结果:
+        """
+        先查缓存，没有再调用 `按预算编码`，并把结果放进缓存
+        """
+        键 = (图片内容哈希(图片), 字节预算, tuple(格式顺序), tuple(sorted(选项.items())))
+        return self.获取或计算(键, lambda: 按预算编码(图片, 字节预算, 格式顺序, **选项))
+
+    def 获取或计算(self, 键: Hashable, 计算: Callable[[], 编码结果]) -> 编码结果:
+        """先查缓存，没有再调用 `计算()`（例如交给编码进程池），并把结果放进缓存"""
+        结果 = self.获取(键)
+        if 结果 is None:
+            结果 = 计算()
+            self.放入(键, 结果)
+        return 结果
+
+    def 清空(self):
+        with self._锁:
+            self._条目.clear()
+            self.当前字节数 = 0
+
+    def 获取统计(self) -> dict:
+        总次数 = self.命中次数 + self.未命中次数
+        return {
+            "条目数": len(self._条目),
+            "当前字节数": self.当前字节数,
+            "命中次数": self.命中次数,
+            "未命中次数": self.未命中次数,
+            "淘汰次数": self.淘汰次数,
+            "命中率": f"{(self.命中次数 / 总次数 * 100) if 总次数 else 0:.1f}%"
+        }
+
+    def __len__(self) -> int:
+        return len(self._条目)
+
+
+# 全局编码缓存实例（观测流水线使用）
+全局编码缓存 = 编码缓存()
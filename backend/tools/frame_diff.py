@@ -0,0 +1,224 @@
+"""
+============================================
+瓦片差异检测（脏区域检测）
+============================================
+这个文件负责回答一个问题："和上一帧相比，屏幕哪里变了？"
+
+以前的 `智能截图缓存` 把整张图缩成 32x32 再算一个全局哈希，
+只能回答"变没变"，而且缩放本身就很慢，小的变化还可能被抹掉。
+
+现在的做法（类比：把屏幕切成一块块瓷砖，逐块对比）：
+1. 直接在 mss 返回的原始 BGRA 缓冲区上工作，不做任何缩放和格式转换
+2. 把每个像素当作一个 uint32 来比较（一次比较 4 个通道），忽略 Alpha
+3. 按 32x32 的瓦片统计变化像素数，得到"变化瓦片掩码"
+4. 把相邻的变化瓦片合并成矩形区域（边界框）
+
+这样 Agent 就能区分：
+- "屏幕完全没变"（上一步操作可能还没生效）
+- "只有区域 R 变了"（比如一个按钮的高亮、一个输入框里的文字）
+"""
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+
+# BGRA 打包成 uint32 后，低 24 位是 BGR，高 8 位是 Alpha（小端序）
+_颜色掩码 = np.uint32(0x00FFFFFF)
+
+
+@dataclass
+class 差异结果:
+    """
+    一次帧比较的结果
+
+    边界框使用原始帧的像素坐标: (left, top, width, height)
+    """
+    变化掩码: np.ndarray                     # 形状为 (瓦片行数, 瓦片列数) 的布尔数组
+    瓦片大小: int
+    帧尺寸: tuple[int, int]                  # (宽, 高)
+    边界框列表: list[tuple[int, int, int, int]] = field(default_factory=list)
+    首帧: bool = False                        # 没有上一帧可比较时为 True
+
+    @property
+    def 变化瓦片数(self) -> int:
+        return int(self.变化掩码.sum())
+
+    @property
+    def 总瓦片数(self) -> int:
+        return int(self.变化掩码.size)
+
+    @property
+    def 变化比例(self) -> float:
+        """变化瓦片占全部瓦片的比例（0.0 ~ 1.0）"""
+        if self.总瓦片数 == 0:
+            return 0.0
+        return self.变化瓦片数 / self.总瓦片数
+
+    @property
+    def 无变化(self) -> bool:
+        """和上一帧相比没有任何可见变化（首帧永远视为有变化）"""
+        return not self.首帧 and self.变化瓦片数 == 0
+
+    def 合并(self, 之后: "差异结果") -> "差异结果":
+        """
+        把两次连续比较合成一次（上上帧 → 当前帧 的变化，按瓦片取并集）
+
+        中间那一帧被丢弃时使用（例如流水线里作废的预取观测），
+        这样"屏幕有没有变化"仍然是相对于 LLM 上一次看到的画面。
+        """
+        if self.首帧 or 之后.首帧 or self.变化掩码.shape != 之后.变化掩码.shape:
+            return self if self.首帧 else 之后
+        变化掩码 = self.变化掩码 | 之后.变化掩码
+        宽, 高 = 之后.帧尺寸
+        return 差异结果(
+            变化掩码=变化掩码,
+            瓦片大小=之后.瓦片大小,
+            帧尺寸=之后.帧尺寸,
+            边界框列表=瓦片差异检测器(之后.瓦片大小)._合并区域(变化掩码, 宽, 高)
+        )
+
+    def 摘要(self, 最多区域数: int = 3) -> str:
+        """生成一句简短的中文描述，用于日志和对话历史"""
+        if self.首帧:
+            return "首帧"
+        if self.无变化:
+            return "无可见变化"
+
+        区域描述 = ", ".join(
+            f"({x},{y},{w}x{h})" for x, y, w, h in self.边界框列表[:最多区域数]
+        )
+        if len(self.边界框列表) > 最多区域数:
+            区域描述 += f" 等 {len(self.边界框列表)} 处"
+        return f"变化 {self.变化比例 * 100:.1f}%，区域 {区域描述}"
+
+
+class 瓦片差异检测器:
+    """
+    基于瓦片的帧差异检测器
+
+    用法：
+        检测器 = 瓦片差异检测器(瓦片大小=32)
+        差异 = 检测器.比较(帧)   # 帧: (高, 宽, 4) 的 uint8 BGRA 数组
+        if 差异.无变化: ...
+
+    注意：检测器会保留上一帧的引用（不复制），调用方不要原地修改传入的数组。
+    """
+
+    def __init__(self, 瓦片大小: int = 32, 最小变化像素: int = 1):
+        """
+        参数:
+            瓦片大小: 瓦片边长（像素）
+            最小变化像素: 一个瓦片里至少有多少像素变化才算"变化瓦片"，
+                          调大可以忽略光标闪烁之类的极小变化
+        """
+        if 瓦片大小 < 1:
+            raise ValueError("瓦片大小必须 >= 1")
+        self.瓦片大小 = 瓦片大小
+        self.最小变化像素 = max(1, 最小变化像素)
+        self._上一帧: Optional[np.ndarray] = None
+
+    def 重置(self):
+        """丢弃上一帧，下一次比较会被当作首帧"""
+        self._上一帧 = None
+
+    def 比较(self, 帧: np.ndarray) -> 差异结果:
+        """
+        把当前帧和上一帧比较，并把当前帧记为"上一帧"
+
+        参数:
+            帧: (高, 宽, 4) 的 uint8 BGRA 数组（可以是 mss 缓冲区的零拷贝视图）
+        """
+        if 帧.ndim != 3 or 帧.shape[2] != 4 or 帧.dtype != np.uint8:
+            raise ValueError(f"需要 (高, 宽, 4) 的 uint8 BGRA 数组，收到 {帧.shape} {帧.dtype}")
+
+        高, 宽 = 帧.shape[:2]
+        瓦片 = self.瓦片大小
+        行数 = -(-高 // 瓦片)
+        列数 = -(-宽 // 瓦片)
+
+        上一帧 = self._上一帧
+        self._上一帧 = 帧
+
+        if 上一帧 is None or 上一帧.shape != 帧.shape:
+            # 首帧（或分辨率变了）：整屏都算变化
+            return 差异结果(
+                变化掩码=np.ones((行数, 列数), dtype=bool),
+                瓦片大小=瓦片,
+                帧尺寸=(宽, 高),
+                边界框列表=[(0, 0, 宽, 高)],
+                首帧=True
+            )
+
+        变化像素 = self._逐像素比较(上一帧, 帧)
+        变化掩码 = self._按瓦片统计(变化像素, 行数, 列数) >= self.最小变化像素
+
+        return 差异结果(
+            变化掩码=变化掩码,
+            瓦片大小=瓦片,
+            帧尺寸=(宽, 高),
+            边界框列表=self._合并区域(变化掩码, 宽, 高)
+        )
+
+    @staticmethod
+    def _逐像素比较(上一帧: np.ndarray, 帧: np.ndarray) -> np.ndarray:
+        """返回 (高, 宽) 的布尔数组，True 表示该像素的 BGR 有变化"""
+        if 上一帧.flags.c_contiguous and 帧.flags.c_contiguous:
+            # 每个像素当作一个 uint32 比较：一次比较 4 个通道
+            旧 = 上一帧.view(np.uint32)[..., 0]
+            新 = 帧.view(np.uint32)[..., 0]
+            return ((旧 ^ 新) & _颜色掩码) != 0
+        return np.any(上一帧[..., :3] != 帧[..., :3], axis=2)
+
+    def _按瓦片统计(self, 变化像素: np.ndarray, 行数: int, 列数: int) -> np.ndarray:
+        """统计每个瓦片里的变化像素数，返回 (行数, 列数) 的整数数组"""
+        瓦片 = self.瓦片大小
+        高, 宽 = 变化像素.shape
+        补高 = 行数 * 瓦片 - 高
+        补宽 = 列数 * 瓦片 - 宽
+        if 补高 or 补宽:
+            # 边缘不足一个瓦片的部分补 False
+            变化像素 = np.pad(变化像素, ((0, 补高), (0, 补宽)))
+        return 变化像素.reshape(行数, 瓦片, 列数, 瓦片).sum(axis=(1, 3), dtype=np.int32)
+
+    def _合并区域(self, 变化掩码: np.ndarray, 宽: int, 高: int) -> list[tuple[int, int, int, int]]:
+        """
+        把相邻（8 连通）的变化瓦片合并成矩形区域
+
+        只遍历变化的瓦片，所以屏幕基本不变时几乎没有开销。
+        """
+        瓦片 = self.瓦片大小
+        行数, 列数 = 变化掩码.shape
+        已访问 = np.zeros_like(变化掩码)
+        区域列表 = []
+
+        for 起始行, 起始列 in zip(*np.nonzero(变化掩码)):
+            if 已访问[起始行, 起始列]:
+                continue
+
+            最小行 = 最大行 = 起始行
+            最小列 = 最大列 = 起始列
+            队列 = deque([(起始行, 起始列)])
+            已访问[起始行, 起始列] = True
+
+            while 队列:
+                行, 列 = 队列.popleft()
+                最小行, 最大行 = min(最小行, 行), max(最大行, 行)
+                最小列, 最大列 = min(最小列, 列), max(最大列, 列)
+                for 邻行 in range(max(行 - 1, 0), min(行 + 2, 行数)):
+                    for 邻列 in range(max(列 - 1, 0), min(列 + 2, 列数)):
+                        if 变化掩码[邻行, 邻列] and not 已访问[邻行, 邻列]:
+                            已访问[邻行, 邻列] = True
+                            队列.append((邻行, 邻列))
+
+            左 = int(最小列) * 瓦片
+            上 = int(最小行) * 瓦片
+            右 = min((int(最大列) + 1) * 瓦片, 宽)
+            下 = min((int(最大行) + 1) * 瓦片, 高)
+            区域列表.append((左, 上, 右 - 左, 下 - 上))
+
+        # 面积大的区域排在前面，摘要里优先展示
+        区域列表.sort(key=lambda 框: 框[2] * 框[3], reverse=True)
+        return 区域列表
@@ -0,0 +1,234 @@
+"""
+============================================
+感知哈希（NumPy 向量化实现）
+============================================
+这个文件给"一张屏幕截图"计算一个很短的指纹（64 或 256 位整数）。
+
+和 MD5 这种普通哈希不同，感知哈希有一个很好的性质：
+两张图越像，它们的哈希就越像——可以用"汉明距离"（有多少位不同）来衡量相似度。
+（类比：MD5 是身份证号，差一点就完全不同；感知哈希是"长相描述"，像的人描述也像）
+
+提供三种经典算法：
+- 平均哈希 (aHash)：缩小后和平均亮度比较，最快
+- 差值哈希 (dHash)：比较相邻像素的明暗，对整体亮度变化不敏感
+- 感知哈希 (pHash)：对低频 DCT 系数取中位数，最稳健
+
+在此基础上，`屏幕状态索引` 可以在 O(1) 时间内回答：
+"这个屏幕状态之前见过吗？"——用来发现 Agent 在原地绕圈。
+"""
+
+from functools import lru_cache
+from typing import Any, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+
+图像输入 = Union[np.ndarray, Image.Image]
+
+# 降采样前先把图像间隔取样到大约这个宽度，避免在 4K 原图上做浮点运算
+_取样目标边长 = 256
+
+
+# ============================================
+# 预处理：任意输入 → 小尺寸灰度矩阵
+# ============================================
+
+def _转灰度(图像: 图像输入) -> np.ndarray:
+    """
+    把输入转换为 float32 灰度矩阵
+
+    支持：
+    - (高, 宽, 4) 的 BGRA 数组（mss 原始缓冲区）
+    - (高, 宽, 3) 的 RGB 数组
+    - (高, 宽) 的灰度数组
+    - PIL Image
+    """
+    if isinstance(图像, Image.Image):
+        图像 = np.asarray(图像.convert("L"))
+
+    if 图像.ndim == 2:
+        # 灰度图也先间隔取样，保证大图的计算量有上限
+        步长 = max(1, min(图像.shape) // _取样目标边长)
+        return 图像[::步长, ::步长].astype(np.float32)
+
+    # 先间隔取样（只是视图，不复制），再转浮点，4K 原图也只处理几万个像素
+    步长 = max(1, min(图像.shape[:2]) // _取样目标边长)
+    小图 = 图像[::步长, ::步长].astype(np.float32)
+
+    if 图像.shape[2] == 4:
+        蓝, 绿, 红 = 小图[..., 0], 小图[..., 1], 小图[..., 2]   # BGRA
+    else:
+        红, 绿, 蓝 = 小图[..., 0], 小图[..., 1], 小图[..., 2]   # RGB
+    return 0.299 * 红 + 0.587 * 绿 + 0.114 * 蓝
+
+
+def _区域平均缩放(灰度: np.ndarray, 宽: int, 高: int) -> np.ndarray:
+    """
+    按区域平均把灰度矩阵缩放到 (高, 宽)
+
+    用 np.add.reduceat 一次算出所有块的和，相当于面积插值。
+    """
+    原高, 原宽 = 灰度.shape
+    if 原高 < 高 or 原宽 < 宽:
+        # 图比目标还小：用最近邻放大，保证每个格子都有值
+        行 = (np.arange(高) * 原高 // 高)
+        列 = (np.arange(宽) * 原宽 // 宽)
+        return 灰度[np.ix_(行, 列)]
+
+    行边界 = (np.arange(高) * 原高) // 高
+    列边界 = (np.arange(宽) * 原宽) // 宽
+    行高 = np.diff(np.append(行边界, 原高))
+    列宽 = np.diff(np.append(列边界, 原宽))
+
+    块和 = np.add.reduceat(np.add.reduceat(灰度, 行边界, axis=0), 列边界, axis=1)
+    return 块和 / np.outer(行高, 列宽)
+
+
+def _打包(位: np.ndarray) -> int:
+    """把布尔矩阵按行优先打包成一个 Python 整数"""
+    return int.from_bytes(np.packbits(位.ravel()).tobytes(), "big")
+
+
+@lru_cache(maxsize=4)
+def _DCT矩阵(n: int) -> np.ndarray:
+    """n 点 DCT-II 的正交变换矩阵"""
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    矩阵 = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    矩阵[0] /= np.sqrt(2)
+    return 矩阵.astype(np.float32)
+
+
+# ============================================
+# 三种哈希
+# ============================================
+
+def 平均哈希(图像: 图像输入, 哈希尺寸: int = 8) -> int:
+    """
+    aHash：缩小到 N×N，每个像素和平均值比较
+
+    返回 N*N 位整数（N=8 → 64 位，N=16 → 256 位）
+    """
+    小图 = _区域平均缩放(_转灰度(图像), 哈希尺寸, 哈希尺寸)
+    return _打包(小图 > 小图.mean())
+
+
+def 差值哈希(图像: 图像输入, 哈希尺寸: int = 8) -> int:
+    """
+    dHash：缩小到 N×(N+1)，比较每行相邻两个像素谁更亮
+
+    返回 N*N 位整数
+    """
+    小图 = _区域平均缩放(_转灰度(图像), 哈希尺寸 + 1, 哈希尺寸)
+    return _打包(小图[:, 1:] > 小图[:, :-1])
+
+
+def 感知哈希(图像: 图像输入, 哈希尺寸: int = 8, 放大倍数: int = 4) -> int:
+    """
+    pHash：缩小到 (N*放大倍数)²，做二维 DCT，取左上角 N×N 的低频系数和中位数比较
+
+    返回 N*N 位整数
+    """
+    边长 = 哈希尺寸 * 放大倍数
+    小图 = _区域平均缩放(_转灰度(图像), 边长, 边长)
+    dct = _DCT矩阵(边长)
+    低频 = (dct @ 小图 @ dct.T)[:哈希尺寸, :哈希尺寸]
+    return _打包(低频 > np.median(低频))
+
+
+def 汉明距离(哈希a: int, 哈希b: int) -> int:
+    """两个哈希之间不同的位数"""
+    return (哈希a ^ 哈希b).bit_count()
+
+
+# ============================================
+# 屏幕状态索引
+# ============================================
+
+class 屏幕状态索引:
+    """
+    按感知哈希索引屏幕状态，支持"汉明距离 ≤ 半径"的近似查找
+
+    原理（多段索引 / 鸽巢原理）：
+    把 64 位哈希切成 (半径 + 1) 段。如果两个哈希最多差 `半径` 位，
+    那么至少有一段是完全相同的。所以只要为每一段建一个字典，
+    查找时逐段查字典、再验证候选的汉明距离即可——不需要遍历所有历史状态。
+
+    用法：
+        索引 = 屏幕状态索引(哈希位数=64, 半径=4)
+        索引.添加(哈希, 第几步)
+        命中 = 索引.最近(新哈希)   # (距离, 哈希, 数据) 或 None
+    """
+
+    def __init__(self, 哈希位数: int = 64, 半径: int = 4):
+        if 半径 < 0 or 半径 >= 哈希位数:
+            raise ValueError("半径必须在 [0, 哈希位数) 之间")
+
+        self.哈希位数 = 哈希位数
+        self.半径 = 半径
+
+        # 把哈希切成 (半径 + 1) 段，每段的 (起始位, 位数)
+        段数 = 半径 + 1
+        基本长度, 余数 = divmod(哈希位数, 段数)
+        self._分段: list[tuple[int, int]] = []
+        起始 = 0
+        for i in range(段数):
+            长度 = 基本长度 + (1 if i < 余数 else 0)
+            self._分段.append((起始, 长度))
+            起始 += 长度
+
+        self._段表: list[dict[int, set[int]]] = [{} for _ in range(段数)]
+        self._数据: dict[int, list[Any]] = {}
+
+    def _切段(self, 哈希: int):
+        for 序号, (起始, 长度) in enumerate(self._分段):
+            yield 序号, (哈希 >> 起始) & ((1 << 长度) - 1)
+
+    def 添加(self, 哈希: int, 数据: Any = None):
+        """记录一个屏幕状态（同一哈希可以关联多条数据）"""
+        if 哈希 not in self._数据:
+            self._数据[哈希] = []
+            for 序号, 段值 in self._切段(哈希):
+                self._段表[序号].setdefault(段值, set()).add(哈希)
+        self._数据[哈希].append(数据)
+
+    def 查找(self, 哈希: int, 半径: Optional[int] = None) -> list[tuple[int, int, list[Any]]]:
+        """
+        查找汉明距离不超过半径的所有已知状态
+
+        返回:
+            [(距离, 哈希, 数据列表), ...]，按距离从近到远排序
+        """
+        半径 = self.半径 if 半径 is None else min(半径, self.半径)
+
+        # 半径为 0 时只需要查一次字典
+        if 半径 == 0:
+            return [(0, 哈希, list(self._数据[哈希]))] if 哈希 in self._数据 else []
+
+        候选: set[int] = set()
+        for 序号, 段值 in self._切段(哈希):
+            候选 |= self._段表[序号].get(段值, set())
+
+        结果 = []
+        for 已知哈希 in 候选:
+            距离 = 汉明距离(哈希, 已知哈希)
+            if 距离 <= 半径:
+                结果.append((距离, 已知哈希, list(self._数据[已知哈希])))
+        结果.sort(key=lambda 项: 项[0])
+        return 结果
+
+    def 最近(self, 哈希: int) -> Optional[tuple[int, int, list[Any]]]:
+        """返回半径内最相近的已知状态，没有则返回 None"""
+        结果 = self.查找(哈希)
+        return 结果[0] if 结果 else None
+
+    def 清空(self):
+        self._段表 = [{} for _ in self._分段]
+        self._数据.clear()
+
+    def __len__(self) -> int:
+        return len(self._数据)
+
+    def __contains__(self, 哈希: int) -> bool:
+        return bool(self.查找(哈希))
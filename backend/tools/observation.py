@@ -0,0 +1,204 @@
+"""
+============================================
+观测流水线（截图 → 缩放 → 编码）
+============================================
+这个文件负责把"看一眼屏幕"这件事从事件循环里搬出去。
+
+为什么需要它？
+截图、缩放、图片编码、Base64 都是同步的 CPU 密集操作。
+一张 4K 截图在事件循环里处理要好几百毫秒，这段时间里
+FastAPI 无法响应 /api/status、/api/health，WebSocket 日志也发不出去。
+
+现在整条观测流水线在一个专用执行器里运行：
+- 线程模式（默认）：开销最小，适合大多数情况
+- 进程模式：彻底避开 GIL，适合超大分辨率
+
+执行器前面有一个有界队列：同时排队的观测请求超过上限时，
+新的请求会等待，而不是无限堆积。
+
+通过环境变量 OBSERVATION_EXECUTOR=thread/process 选择默认模式。
+"""
+
+import asyncio
+import os
+import time
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Sequence
+
+from loguru import logger
+
+from .encoder import 默认格式顺序
+from .frame_diff import 差异结果, 瓦片差异检测器
+from .image_hash import 差值哈希
+from .screen import 全局截图会话, 截图转BGRA数组, 编码截图
+
+
+@dataclass
+class 观测结果:
+    """
+    一次观测（截图）的结果
+
+    这个对象会在进程之间传递，所以只包含可以序列化的简单字段。
+    """
+    base64数据: str     # 编码后的图片（Base64）
+    宽: int             # 发送给 LLM 的图片宽度
+    高: int             # 发送给 LLM 的图片高度
+    耗时: float = 0.0   # 整条流水线的耗时（秒）
+    媒体类型: str = "image/png"      # 图片的 MIME 类型（由编码器决定）
+    差异: Optional[差异结果] = None  # 和上一次观测相比的变化（未检测时为 None）
+    屏幕哈希: Optional[int] = None   # 256 位感知哈希（差值哈希），用于识别重复的屏幕状态
+    预测令牌数: Optional[int] = None # 按 Provider 成本模型预测的图片令牌数（没有分辨率策略时为 None）
+
+
+# 观测流水线专用的差异检测器（执行器只有一个工作者，所以不需要加锁）
+全局瓦片检测器 = 瓦片差异检测器(瓦片大小=32)
+
+# 屏幕哈希取 16×16 = 256 位：64 位的哈希太粗，布局相同、只有几行内容不同的两个页面
+# 常常只差几位，会被当成"回到了之前的屏幕"
+屏幕哈希尺寸 = 16
+屏幕哈希位数 = 屏幕哈希尺寸 * 屏幕哈希尺寸
+
+
+def 生成观测(
+    最大宽度: int = 1024,
+    最大高度: int = 1024,
+    快速缩放: bool = True,
+    检测变化: bool = True,
+    字节预算: Optional[int] = None,
+    格式顺序: Sequence[str] = 默认格式顺序,
+    分辨率策略: Optional[Callable[[int, int], tuple[int, int]]] = None
+) -> Optional[观测结果]:
+    """
+    同步执行整条观测流水线：截图 → 差异检测/感知哈希 → 缩放 → 编码 → Base64
+
+    字节预算和格式顺序决定编码方式：默认 PNG，超出预算时换成 WebP/JPEG。
+    分辨率策略（见 `providers.image_cost.分辨率策略`）根据屏幕尺寸返回
+    (最大宽度, 最大高度)，设置后会代替固定的最大宽度/高度，并预测图片令牌数。
+
+    这个函数会在执行器（线程或子进程）里运行，不要在事件循环里直接调用。
+
+    注意：这里故意不使用 0.5 秒的截图缓存——Agent 每次观测都必须看到
+    动作执行之后的真实屏幕，"屏幕有没有变"交给差异检测来判断。
+
+    返回:
+        观测结果，截图失败时返回 None
+    """
+    开始时间 = time.perf_counter()
+
+    try:
+        截图 = 全局截图会话.抓取()
+    except Exception as e:
+        logger.error(f"截图失败: {e}")
+        return None
+
+    # 差异检测和感知哈希都直接在原始 BGRA 缓冲区上进行（零拷贝）
+    原始帧 = 截图转BGRA数组(截图)
+    差异 = 全局瓦片检测器.比较(原始帧) if 检测变化 else None
+    屏幕哈希 = 差值哈希(原始帧, 哈希尺寸=屏幕哈希尺寸)
+
+    if 分辨率策略 is not None:
+        最大宽度, 最大高度 = 分辨率策略(*截图.size)
+
+    # 画面和上次一样时直接复用编码结果，只需要算一次哈希；
+    # 设置了编码后端（共享内存进程池）时，缩放和压缩都在编码进程里完成
+    编码 = 编码截图(截图, 最大宽度, 最大高度, 快速缩放, 字节预算, 格式顺序)
+
+    return 观测结果(
+        base64数据=编码.转base64(),
+        宽=编码.尺寸[0],
+        高=编码.尺寸[1],
+        耗时=time.perf_counter() - 开始时间,
+        差异=差异,
+        屏幕哈希=屏幕哈希,
+        媒体类型=编码.媒体类型,
+        预测令牌数=分辨率策略.预测令牌数(*编码.尺寸) if 分辨率策略 is not None else None
+    )
+
+
+class 观测执行器:
+    """
+    专用的观测执行器（带有界队列）
+
+    用法：
+        执行器 = 观测执行器(模式="thread", 队列上限=2)
+        结果 = await 执行器.提交(生成观测, 1024, 1024)
+    """
+
+    def __init__(self, 模式: str = "thread", 队列上限: int = 2):
+        """
+        参数:
+            模式: "thread"（线程）或 "process"（进程）
+            队列上限: 同时排队 + 执行中的观测请求上限
+        """
+        if 模式 not in ("thread", "process"):
+            raise ValueError(f"未知的执行器模式: {模式}（可选 thread / process）")
+        if 队列上限 < 1:
+            raise ValueError("队列上限必须 >= 1")
+
+        self.模式 = 模式
+        self.队列上限 = 队列上限
+        self._执行器: Optional[Executor] = None
+        self.进行中数量 = 0  # 已进入队列（排队或执行中）的请求数
+        # 每个事件循环一个信号量（asyncio.Semaphore 不能跨事件循环使用）
+        self._名额表: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _获取执行器(self) -> Executor:
+        """懒加载执行器：只有第一次提交时才创建线程/进程"""
+        if self._执行器 is None:
+            # 只用一个工作者：截图会话和截图缓存都是单例，串行执行最稳定
+            if self.模式 == "process":
+                self._执行器 = ProcessPoolExecutor(max_workers=1)
+            else:
+                self._执行器 = ThreadPoolExecutor(max_workers=1, thread_name_prefix="observation")
+            logger.info(f"📷 观测执行器已启动（模式: {self.模式}，队列上限: {self.队列上限}）")
+        return self._执行器
+
+    def _获取名额(self) -> asyncio.Semaphore:
+        事件循环 = asyncio.get_running_loop()
+        名额 = self._名额表.get(事件循环)
+        if 名额 is None:
+            名额 = asyncio.Semaphore(self.队列上限)
+            self._名额表[事件循环] = 名额
+        return 名额
+
+    async def 提交(self, 函数: Callable[..., Any], *参数) -> Any:
+        """
+        把一个同步函数提交到执行器，并等待结果
+
+        队列已满时会先等待空位，不会阻塞事件循环。
+        """
+        async with self._获取名额():
+            self.进行中数量 += 1
+            try:
+                事件循环 = asyncio.get_running_loop()
+                return await 事件循环.run_in_executor(self._获取执行器(), 函数, *参数)
+            finally:
+                self.进行中数量 -= 1
+
+    def 关闭(self, 等待: bool = True):
+        """关闭执行器（应用退出时调用）"""
+        if self._执行器 is not None:
+            self._执行器.shutdown(wait=等待, cancel_futures=True)
+            self._执行器 = None
+            logger.info("📷 观测执行器已关闭")
+
+
+def 默认执行器模式() -> str:
+    """
+    读取 OBSERVATION_EXECUTOR
+
+    这个值在 import 时就要用到，写错了也不能让整个 tools 包导入失败，所以只警告并退回线程模式。
+    """
+    模式 = os.environ.get("OBSERVATION_EXECUTOR", "thread").strip().lower()
+    if 模式 not in ("thread", "process"):
+        logger.warning(f"⚠️ 未知的 OBSERVATION_EXECUTOR={模式!r}（可选 thread / process），改用 thread")
+        return "thread"
+    return 模式
+
+
+# 全局观测执行器实例（线程 / 进程要到第一次提交时才创建）
+全局观测执行器 = 观测执行器(模式=默认执行器模式())
@@ -0,0 +1,127 @@
+"""
+============================================
+操作节奏与操作合并
+============================================
+这个文件负责"动手的快慢"和"能不能少动几次手"。
+
+1. 操作节奏
+   以前鼠标、键盘的速度都是写死的全局常量：
+   每次 pyautogui 调用之后停 0.1 秒（`pyautogui.PAUSE`）、鼠标滑动 0.3 秒、打字每个字符 0.05 秒。
+   现在换成几个有名字的节奏，每个任务可以选一个：
+   - human：慢一点、像真人，文字全部逐字输入（适合会检测机器人的网站、会丢按键的程序）
+   - default：和以前完全一样
+   - turbo：不停顿、不滑动、不等待，只适合本机自动化和测试环境
+
+2. 操作合并
+   LLM 经常先 `mouse_move` 到一个位置，再在同一位置 `left_click`，
+   或者连续发好几个 `scroll`。这些操作合并成一次注入，结果一样，却省掉了滑动和停顿：
+   - mouse_move(x, y) + 同一位置（或不带坐标）的点击 → 在 (x, y) 点击
+   - 连续的 scroll（位置相同）→ 一次滚动，滚动量相加
+   - 连续的 type → 一次输入
+   连续的 mouse_move 不合并：中间位置可能要触发悬停（例如展开多级菜单）。
+"""
+
+from dataclasses import dataclass, replace
+from typing import Any, Optional, Sequence
+
+
+@dataclass(frozen=True)
+class 操作节奏:
+    """一组控制键鼠操作快慢的参数"""
+    名称: str
+    操作间隔: float                 # 每次 pyautogui 调用之后的停顿（秒），即 pyautogui.PAUSE
+    移动时长: float                 # 鼠标平滑移动到目标位置用的秒数
+    打字间隔: float                 # 逐字输入时字符之间的秒数
+    优先输入方式: Optional[str] = None   # 见 tools/text_input.py，None 表示按文字自动选择
+
+
+节奏表: dict[str, 操作节奏] = {
+    "human": 操作节奏("human", 操作间隔=0.15, 移动时长=0.5, 打字间隔=0.08, 优先输入方式="paced"),
+    "default": 操作节奏("default", 操作间隔=0.1, 移动时长=0.3, 打字间隔=0.05),
+    "turbo": 操作节奏("turbo", 操作间隔=0.0, 移动时长=0.0, 打字间隔=0.0),
+}
+
+默认节奏 = 节奏表["default"]
+
+
+def 获取节奏(名称: Optional[str]) -> 操作节奏:
+    """按名称取操作节奏，None 返回默认节奏"""
+    if 名称 is None:
+        return 默认节奏
+    if 名称 not in 节奏表:
+        raise ValueError(f"未知的操作节奏: {名称}（可选: {', '.join(节奏表)}）")
+    return 节奏表[名称]
+
+
+# ============================================
+# 操作合并
+# ============================================
+
+_点击操作 = {"left_click", "right_click", "double_click"}
+
+
+def _坐标(参数: dict[str, Any]) -> tuple[Any, Any]:
+    return 参数.get("x"), 参数.get("y")
+
+
+def _滚动量(参数: dict[str, Any]) -> Optional[int]:
+    """滚动量（缺省为 0）；不是数字时返回 None，这样的调用不合并，原样交给执行时报错"""
+    值 = 参数.get("amount")
+    if 值 is None:
+        return 0
+    if isinstance(值, bool):
+        return None
+    try:
+        return int(值)
+    except (TypeError, ValueError):
+        return None
+
+
+def _合并两个(前, 后):
+    """能合并时返回合并后的工具调用，否则返回 None"""
+    前名, 后名 = 前.工具名称.lower(), 后.工具名称.lower()
+
+    if 前名 == "mouse_move" and 后名 in _点击操作:
+        x, y = _坐标(前.参数)
+        if x is None or y is None or _坐标(后.参数) not in ((None, None), (x, y)):
+            return None
+        return replace(后, 参数={**后.参数, "x": x, "y": y})
+
+    if 前名 == 后名 == "scroll" and _坐标(前.参数) == _坐标(后.参数):
+        前量, 后量 = _滚动量(前.参数), _滚动量(后.参数)
+        if 前量 is None or 后量 is None:
+            return None
+        return replace(后, 参数={**后.参数, "amount": 前量 + 后量})
+
+    if 前名 == 后名 == "type":
+        前文字, 后文字 = 前.参数.get("text"), 后.参数.get("text")
+        if not isinstance(前文字, str) or not isinstance(后文字, str):
+            return None
+        return replace(后, 参数={**后.参数, "text": 前文字 + 后文字})
+
+    return None
+
+
+def 合并分组(调用列表: Sequence) -> list[tuple[Any, list]]:
+    """
+    合并相邻的冗余操作（只合并结果完全相同的组合，见文件开头），并记下每个操作由哪些原始调用合并而来
+
+    参数:
+        调用列表: `providers.base.工具调用` 列表（原列表和其中的对象都不会被修改）
+
+    返回:
+        [(合并后的工具调用, [原始工具调用, ...]), ...]
+    """
+    结果: list[tuple[Any, list]] = []
+    for 调用 in 调用列表:
+        合并后 = _合并两个(结果[-1][0], 调用) if 结果 else None
+        if 合并后 is not None:
+            结果[-1] = (合并后, 结果[-1][1] + [调用])
+        else:
+            结果.append((调用, [调用]))
+    return 结果
+
+
+def 合并工具调用(调用列表: Sequence) -> list:
+    """合并相邻的冗余操作，只返回合并后的工具调用列表（见 `合并分组`）"""
+    return [调用 for 调用, _ in 合并分组(调用列表)]
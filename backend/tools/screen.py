@@ -11,6 +11,9 @@
 1. 添加缓存机制，避免在短时间内重复截图
 2. 优化缩放算法，平衡质量和速度
 3. 使用更快的缩放方法
+4. 长期持有 mss 句柄和显示器几何信息，不再每次截图都重连显示服务
+5. 零拷贝读取 mss 缓冲区，先整数倍降采样再转换通道
+6. 编码可以交给共享内存进程池（见 `设置编码后端`），压缩不再占用本进程的 GIL
 
 截图后会自动缩放到合适的尺寸，因为：
 1. 原始截图太大（4K 屏幕可能有数 MB）
@@ -18,12 +21,18 @@
 3. 缩小后能加快传输和处理速度
 """
 
+import os
+import threading
 import time
-from typing import Optional
+from typing import Optional, Sequence
 import mss
+import numpy as np
+from mss.exception import ScreenShotError
 from PIL import Image
 from loguru import logger
 
+from .encoder import 全局编码缓存, 内容哈希, 按预算编码, 编码结果, 默认格式顺序
+
 
 class 截图缓存:
     """
@@ -57,6 +66,109 @@ class 截图缓存:
 全局截图缓存 = 截图缓存()
 
 
+class 截图会话:
+    """
+    长期持有的截图会话（线程安全）
+
+    以前每次截图都要 `with mss.mss()`：重新连接 X 服务器 / 创建设备上下文，
+    再重新查询一遍显示器布局。这些开销每一步都要付一次。
+
+    现在整个进程只打开一次 mss 句柄，并缓存显示器几何信息：
+    - 所有访问都经过同一把锁，可以在任意线程调用
+    - 只有在截图出错（通常意味着显示器被插拔）或调用 `标记显示器变更()` 时才重新探测
+    - 进程 fork 之后会自动重建句柄（子进程不能复用父进程的连接）
+    """
+
+    def __init__(self):
+        self._锁 = threading.RLock()
+        self._句柄 = None
+        self._句柄进程号: Optional[int] = None
+        self._显示器列表: list[dict] = []
+        self.探测次数 = 0
+
+    def _确保句柄(self):
+        """打开（或在 fork 后重新打开）mss 句柄，并探测显示器"""
+        if self._句柄 is not None and self._句柄进程号 == os.getpid():
+            return self._句柄
+
+        self._句柄 = mss.mss()
+        self._句柄进程号 = os.getpid()
+        self._探测显示器()
+        return self._句柄
+
+    def _探测显示器(self):
+        """查询显示器布局并缓存"""
+        self._显示器列表 = [dict(m) for m in self._句柄.monitors]
+        self.探测次数 += 1
+        logger.debug(f"🖥️ 已探测到 {len(self._显示器列表) - 1} 个显示器")
+
+    def _关闭句柄(self):
+        if self._句柄 is not None and self._句柄进程号 == os.getpid():
+            try:
+                self._句柄.close()
+            except Exception:
+                pass
+        self._句柄 = None
+        self._句柄进程号 = None
+        self._显示器列表 = []
+
+    def 标记显示器变更(self):
+        """
+        通知会话显示器布局已变化（热插拔、分辨率切换）
+
+        下一次访问时会重新打开句柄并探测显示器。
+        """
+        with self._锁:
+            self._关闭句柄()
+
+    def 显示器列表(self) -> list[dict]:
+        """
+        返回缓存的显示器列表（与 mss 相同：下标 0 是所有屏幕的合并区域）
+        """
+        with self._锁:
+            self._确保句柄()
+            return [dict(m) for m in self._显示器列表]
+
+    def 获取显示器(self, 显示器编号: int = 1) -> dict:
+        """返回指定显示器的几何信息，编号越界时回退到主屏幕"""
+        with self._锁:
+            self._确保句柄()
+            if 显示器编号 >= len(self._显示器列表) or 显示器编号 < 0:
+                显示器编号 = 1  # 默认主屏幕
+            return dict(self._显示器列表[显示器编号])
+
+    def 抓取(self, 区域: Optional[dict] = None, 显示器编号: int = 1):
+        """
+        抓取一帧原始截图（mss ScreenShot 对象，BGRA 格式）
+
+        参数:
+            区域: 要截取的区域 {"left", "top", "width", "height"}，
+                  为 None 时截取整个显示器
+            显示器编号: 区域为 None 时使用的显示器
+        """
+        with self._锁:
+            for 尝试 in range(2):
+                句柄 = self._确保句柄()
+                目标 = 区域 if 区域 is not None else self.获取显示器(显示器编号)
+                try:
+                    return 句柄.grab(目标)
+                except ScreenShotError:
+                    if 尝试 == 1:
+                        raise
+                    # 截图失败通常是显示器被拔掉或分辨率变了：重新探测后再试一次
+                    logger.warning("⚠️ 截图失败，可能发生了显示器热插拔，正在重新探测...")
+                    self._关闭句柄()
+
+    def 关闭(self):
+        """释放 mss 句柄"""
+        with self._锁:
+            self._关闭句柄()
+
+
+# 全局截图会话实例（整个进程共享一个）
+全局截图会话 = 截图会话()
+
+
 def 截取屏幕(
     显示器编号: int = 1,
     最大宽度: int = 1280,
@@ -79,9 +191,9 @@ def 截取屏幕(
 
     原理：
     1. mss 库直接读取显卡缓冲区（非常快）
-    2. 获取的是原始 BGRA 数据
-    3. 转换为 RGB 格式的 PIL Image
-    4. 按比例缩放到目标尺寸
+    2. 获取的是原始 BGRA 数据（零拷贝包装成 NumPy 数组）
+    3. 先按整数倍降采样到接近目标尺寸
+    4. 再转换为 RGB 格式的 PIL Image，并微调到目标尺寸
     """
     try:
         # 检查缓存
@@ -90,73 +202,134 @@ def 截取屏幕(
             if 缓存截图 is not None:
                 return 缓存截图.copy()  # 返回副本，避免外部修改缓存
 
-        with mss.mss() as sct:
-            # 获取显示器信息
-            # monitors[0] 是所有屏幕的合并，monitors[1] 是主屏幕
-            if 显示器编号 >= len(sct.monitors):
-                显示器编号 = 1  # 默认主屏幕
+        # 截图（复用全局会话，不再每次重新连接显示服务）
+        截图 = 全局截图会话.抓取(显示器编号=显示器编号)
+        图片 = 截图转图片(截图, 最大宽度, 最大高度, 快速缩放)
 
-            监视器 = sct.monitors[显示器编号]
+        # 如果启用了缓存，保存到缓存
+        if 使用缓存:
+            全局截图缓存.设置截图(图片)
 
-            # 截图
-            截图 = sct.grab(监视器)
+        return 图片
 
-            # 转换为 PIL Image（mss 输出是 BGRA，需要转 RGB）
-            图片 = Image.frombytes("RGB", 截图.size, 截图.bgra, "raw", "BGRX")
+    except Exception as e:
+        logger.error(f"截图失败: {e}")
+        return None
 
-            # 获取原始尺寸
-            原宽, 原高 = 图片.size
 
-            # 计算缩放比例（保持宽高比）
-            宽度比 = 最大宽度 / 原宽
-            高度比 = 最大高度 / 原高
-            缩放比 = min(宽度比, 高度比, 1.0)  # 不放大，只缩小
+def 截图转BGRA数组(截图) -> np.ndarray:
+    """
+    把 mss 截图包装成 (高, 宽, 4) 的 uint8 BGRA 数组
 
-            if 缩放比 < 1.0:
-                新宽 = int(原宽 * 缩放比)
-                新高 = int(原高 * 缩放比)
-                # 根据参数选择缩放质量
-                缩放算法 = Image.Resampling.BILINEAR if 快速缩放 else Image.Resampling.LANCZOS
-                图片 = 图片.resize((新宽, 新高), 缩放算法)
-                logger.debug(f"截图已缩放: {原宽}x{原高} → {新宽}x{新高}")
+    直接引用 mss 的缓冲区，不复制像素数据。
+    """
+    宽, 高 = 截图.size
+    缓冲区 = getattr(截图, "raw", None)
+    if 缓冲区 is None:
+        缓冲区 = 截图.bgra
+    return np.frombuffer(缓冲区, dtype=np.uint8).reshape(高, 宽, 4)
 
-            # 如果启用了缓存，保存到缓存
-            if 使用缓存:
-                全局截图缓存.设置截图(图片)
 
-            return 图片
+def 缩放BGRA为RGB(
+    帧: np.ndarray,
+    最大宽度: int,
+    最大高度: int,
+    快速缩放: bool = True
+) -> Image.Image:
+    """
+    把 BGRA 数组按比例缩小到目标尺寸以内，并转换为 RGB 的 PIL Image
 
-    except Exception as e:
-        logger.error(f"截图失败: {e}")
-        return None
+    快速路径（先缩小、后转换）：
+    1. 把 BGRA 缓冲区零拷贝地包装成一张 "RGBX" 图像（通道顺序暂时不管，X 被忽略）
+    2. 直接在这个视图上缩放到目标尺寸（`reducing_gap` 让 Pillow 先做整数倍的盒式降采样，
+       再对小图做插值，1920x1080 → 1024 这种不到 2 倍的缩放也不会产生全分辨率的中间图）
+    3. 在小图上交换 R/B 通道得到 RGB
+
+    需要缩小时，全分辨率的 RGB 图像从来不会被创建：
+    4K 截图不再需要先复制出 33 MB 的 bytes、再转出 24 MB 的 RGB 图。
+    """
+    原高, 原宽 = 帧.shape[:2]
+    if not 帧.flags.c_contiguous:
+        帧 = np.ascontiguousarray(帧)
 
+    # 计算缩放比例（保持宽高比）
+    缩放比 = min(最大宽度 / 原宽, 最大高度 / 原高, 1.0)  # 不放大，只缩小
+    新宽 = max(1, int(原宽 * 缩放比))
+    新高 = max(1, int(原高 * 缩放比))
 
-class 截图缓存:
+    视图 = Image.frombuffer("RGBX", (原宽, 原高), 帧, "raw", "RGBX", 0, 1)
+
+    if 视图.size != (新宽, 新高):
+        # 根据参数选择缩放质量；reducing_gap 越小越快，3.0 时和直接 LANCZOS 几乎看不出区别
+        if 快速缩放:
+            视图 = 视图.resize((新宽, 新高), Image.Resampling.BILINEAR, reducing_gap=2.0)
+        else:
+            视图 = 视图.resize((新宽, 新高), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        logger.debug(f"截图已缩放: {原宽}x{原高} → {新宽}x{新高}")
+
+    蓝, 绿, 红, _ = 视图.split()
+    图片 = Image.merge("RGB", (红, 绿, 蓝))
+
+    return 图片
+
+
+def 截图转图片(
+    截图,
+    最大宽度: int,
+    最大高度: int,
+    快速缩放: bool = True
+) -> Image.Image:
     """
-    截图缓存类，避免在短时间内重复截图
+    把 mss 截图转换为 RGB 的 PIL Image，并按比例缩小到目标尺寸以内
+
+    直接在 mss 缓冲区上工作（零拷贝），先缩小再转换通道。
     """
-    def __init__(self, 缓存超时: float = 0.5):  # 0.5秒缓存
-        self.上次截图时间 = 0
-        self.缓存截图: Optional[Image.Image] = None
-        self.缓存超时 = 缓存超时
+    return 缩放BGRA为RGB(截图转BGRA数组(截图), 最大宽度, 最大高度, 快速缩放)
 
-    def 获取截图(self) -> Optional[Image.Image]:
-        """获取缓存的截图或返回None"""
-        当前时间 = time.time()
-        if (self.缓存截图 is not None and
-            当前时间 - self.上次截图时间 < self.缓存超时):
-            return self.缓存截图
-        return None
 
-    def 设置截图(self, 截图: Image.Image):
-        """设置缓存截图"""
-        self.缓存截图 = 截图
-        self.上次截图时间 = time.time()
+# 截图编码后端：None 表示在当前进程里缩放和编码；
+# 也可以换成 `tools.encode_pool.共享内存编码池`，把压缩交给独立进程
+_编码后端 = None
 
-    def 清除缓存(self):
-        """清除缓存"""
-        self.缓存截图 = None
-        self.上次截图时间 = 0
+
+def 设置编码后端(后端):
+    """
+    设置截图编码后端（需要提供 `编码帧(帧, 最大宽度, 最大高度, 快速缩放, 字节预算, 格式顺序)`）
+
+    返回之前的后端，传 None 恢复为进程内编码。
+    """
+    global _编码后端
+    之前, _编码后端 = _编码后端, 后端
+    logger.info(f"🗜️ 截图编码后端: {type(后端).__name__ if 后端 is not None else '进程内'}")
+    return 之前
+
+
+def 编码截图(
+    截图,
+    最大宽度: int,
+    最大高度: int,
+    快速缩放: bool = True,
+    字节预算: Optional[int] = None,
+    格式顺序: Sequence[str] = 默认格式顺序
+) -> 编码结果:
+    """
+    把 mss 截图缩放并编码成发给 LLM 的图片
+
+    画面没变时直接复用编码缓存里的结果：按原始帧的内容哈希和编码设置查缓存，
+    命中时缩放、格式转换和压缩都省掉（编码后端连共享内存都不用写）
+    """
+    帧 = 截图转BGRA数组(截图)
+    键 = (
+        内容哈希(帧, f"BGRA:{帧.shape[1]}x{帧.shape[0]}"),
+        最大宽度, 最大高度, 快速缩放, 字节预算, tuple(格式顺序)
+    )
+    if _编码后端 is None:
+        return 全局编码缓存.获取或计算(
+            键, lambda: 按预算编码(截图转图片(截图, 最大宽度, 最大高度, 快速缩放), 字节预算, 格式顺序)
+        )
+    return 全局编码缓存.获取或计算(
+        键, lambda: _编码后端.编码帧(帧, 最大宽度, 最大高度, 快速缩放, 字节预算, 格式顺序)
+    )
 
 
 def 获取屏幕尺寸() -> tuple[int, int]:
@@ -167,9 +340,8 @@ def 获取屏幕尺寸() -> tuple[int, int]:
         (宽度, 高度) 元组
     """
     try:
-        with mss.mss() as sct:
-            监视器 = sct.monitors[1]  # 主屏幕
-            return (监视器["width"], 监视器["height"])
+        监视器 = 全局截图会话.获取显示器(1)  # 主屏幕
+        return (监视器["width"], 监视器["height"])
     except Exception as e:
         logger.error(f"获取屏幕尺寸失败: {e}")
         return (1920, 1080)  # 默认值
@@ -183,18 +355,17 @@ def 获取所有显示器() -> list[dict]:
         显示器信息列表，每个元素包含 left, top, width, height
     """
     try:
-        with mss.mss() as sct:
-            return [
-                {
-                    "index": i,
-                    "left": m["left"],
-                    "top": m["top"],
-                    "width": m["width"],
-                    "height": m["height"]
-                }
-                for i, m in enumerate(sct.monitors)
-                if i > 0  # 跳过 monitors[0]（合并屏幕）
-            ]
+        return [
+            {
+                "index": i,
+                "left": m["left"],
+                "top": m["top"],
+                "width": m["width"],
+                "height": m["height"]
+            }
+            for i, m in enumerate(全局截图会话.显示器列表())
+            if i > 0  # 跳过 monitors[0]（合并屏幕）
+        ]
     except Exception as e:
         logger.error(f"获取显示器列表失败: {e}")
         return []
@@ -7,19 +7,20 @@
 主要改进：
 1. 基于内容差异的智能缓存
 2. 自适应缓存超时
-3. 区域变化检测
+3. 区域变化检测（基于瓦片差异，能定位到具体哪块区域变了）
 4. 性能监控
 """
 
 import time
-import hashlib
 import asyncio
 from typing import Optional, Tuple, Dict
-import mss
-import numpy as np
 from PIL import Image
 from loguru import logger
 
+from .frame_diff import 差异结果, 瓦片差异检测器
+from .image_hash import 差值哈希
+from .screen import 全局截图会话, 截图转BGRA数组
+
 
 class 智能截图缓存:
     """
@@ -29,6 +30,8 @@ class 智能截图缓存:
         self.上次截图时间 = 0
         self.缓存截图: Optional[Image.Image] = None
         self.缓存哈希: Optional[str] = None
+        self.差异检测器 = 瓦片差异检测器(瓦片大小=32)
+        self.最近差异: Optional[差异结果] = None  # 最近一次截图的变化区域
         self.基础超时 = 基础超时  # 基础缓存超时
         self.最大超时 = 最大超时  # 最大缓存超时
         self.自适应超时 = 基础超时  # 当前使用的超时
@@ -40,17 +43,8 @@ class 智能截图缓存:
         }
 
     def 计算图像哈希(self, 图像: Image.Image) -> str:
-        """计算图像的感知哈希，用于检测变化"""
-        # 缩小图像以加速哈希计算
-        小图像 = 图像.resize((32, 32), Image.Resampling.LANCZOS).convert('L')
-        像素数据 = np.array(小图像)
-
-        # 计算均值
-        均值 = np.mean(像素数据)
-
-        # 生成哈希
-        哈希 = ''.join(['1' if 像素 > 均值 else '0' for 像素 in 像素数据.flatten()])
-        return hashlib.md5(哈希.encode()).hexdigest()[:16]
+        """计算图像的感知哈希（256 位差值哈希），用于检测变化"""
+        return f"{差值哈希(图像, 哈希尺寸=16):064x}"
 
     def 获取截图(self, 强制刷新: bool = False) -> Optional[Tuple[Image.Image, bool]]:
         """
@@ -70,17 +64,27 @@ class 智能截图缓存:
 
         return None, False
 
-    def 设置截图(self, 截图: Image.Image) -> Tuple[bool, float]:
+    def 设置截图(
+        self,
+        截图: Image.Image,
+        差异: Optional[差异结果] = None
+    ) -> Tuple[bool, float]:
         """
         设置缓存截图，返回 (是否有变化, 处理时间)
+
+        如果调用方已经在原始帧上做过瓦片差异检测，就直接使用检测结果；
+        否则退回到全局哈希比较（只能判断"变没变"，无法定位区域）。
         """
         开始时间 = time.time()
-        新哈希 = self.计算图像哈希(截图)
-        有变化 = True
+        self.最近差异 = 差异
+        if 差异 is not None:
+            新哈希 = None
+            有变化 = not 差异.无变化
+        else:
+            新哈希 = self.计算图像哈希(截图)
+            有变化 = self.缓存哈希 is None or 新哈希 != self.缓存哈希
 
-        # 比较哈希值
-        if self.缓存哈希 is not None and 新哈希 == self.缓存哈希:
-            有变化 = False
+        if not 有变化:
             self.无变化次数 += 1
 
             # 自适应调整超时时间
@@ -115,6 +119,8 @@ class 智能截图缓存:
         """清除缓存"""
         self.缓存截图 = None
         self.缓存哈希 = None
+        self.最近差异 = None
+        self.差异检测器.重置()
         self.上次截图时间 = 0
         self.无变化次数 = 0
         self.自适应超时 = self.基础超时
@@ -157,57 +163,48 @@ async def 截取屏幕智能(
         # 执行实际截图
         开始时间 = time.time()
 
-        with mss.mss() as sct:
-            # 获取显示器信息
-            if 显示器编号 >= len(sct.monitors):
-                显示器编号 = 1
-
-            监视器 = sct.monitors[显示器编号]
-
-            # 截取屏幕
-            截图数据 = sct.grab({
-                "left": 监视器["left"],
-                "top": 监视器["top"],
-                "width": 监视器["width"],
-                "height": 监视器["height"]
-            })
-
-            # 转换为 PIL Image
-            截图图像 = Image.frombytes("RGB", 截图数据.size, 截图_data.bgra, "raw", "BGRX")
-
-            # 缩放图像
-            if 截图图像.width > 最大宽度 or 截图图像.height > 最大高度:
-                # 计算缩放比例
-                宽度比例 = 最大宽度 / 截图图像.width
-                高度比例 = 最大高度 / 截图图像.height
-                缩放比例 = min(宽度比例, 高度比例)
-
-                新宽度 = int(截图图像.width * 缩放比例)
-                新高度 = int(截图图像.height * 缩放比例)
-
-                # 使用高质量缩放
-                截图图像 = 截图图像.resize(
-                    (新宽度, 新高度),
-                    Image.Resampling.LANCZOS
-                )
-
-            # 更新缓存
-            if 检测变化:
-                有变化, 处理时间 = 全局智能缓存.设置截图(截图图像)
-                if 有变化:
-                    logger.debug("🖼️ 检测到屏幕内容变化")
-                else:
-                    logger.debug("📸 屏幕内容未变化")
-
-            总时间 = time.time() - 开始时间
-            logger.debug(f"⏱️ 截图耗时: {总_time:.3f}s")
-
-            # 每100次截图输出性能统计
-            if 全局智能缓存.性能统计["总截图次数"] % 100 == 0:
-                统计 = 全局智能缓存.获取性能统计()
-                logger.info(f"📊 截图性能统计: {统计}")
-
-            return 截图图像
+        # 复用全局截图会话（不再每次重新连接显示服务）
+        截图数据 = 全局截图会话.抓取(显示器编号=显示器编号)
+
+        # 在原始 BGRA 缓冲区上做瓦片差异检测（缩放之前，不会丢失小的变化）
+        差异 = 全局智能缓存.差异检测器.比较(截图转BGRA数组(截图数据)) if 检测变化 else None
+
+        # 转换为 PIL Image
+        截图图像 = Image.frombytes("RGB", 截图数据.size, 截图数据.bgra, "raw", "BGRX")
+
+        # 缩放图像
+        if 截图图像.width > 最大宽度 or 截图图像.height > 最大高度:
+            # 计算缩放比例
+            宽度比例 = 最大宽度 / 截图图像.width
+            高度比例 = 最大高度 / 截图图像.height
+            缩放比例 = min(宽度比例, 高度比例)
+
+            新宽度 = int(截图图像.width * 缩放比例)
+            新高度 = int(截图图像.height * 缩放比例)
+
+            # 使用高质量缩放
+            截图图像 = 截图图像.resize(
+                (新宽度, 新高度),
+                Image.Resampling.LANCZOS
+            )
+
+        # 更新缓存
+        if 检测变化:
+            有变化, 处理时间 = 全局智能缓存.设置截图(截图图像, 差异)
+            if 有变化:
+                logger.debug(f"🖼️ 检测到屏幕内容变化: {差异.摘要()}")
+            else:
+                logger.debug("📸 屏幕内容未变化")
+
+        总时间 = time.time() - 开始时间
+        logger.debug(f"⏱️ 截图耗时: {总时间:.3f}s")
+
+        # 每100次截图输出性能统计
+        if 全局智能缓存.性能统计["总截图次数"] % 100 == 0:
+            统计 = 全局智能缓存.获取性能统计()
+            logger.info(f"📊 截图性能统计: {统计}")
+
+        return 截图图像
 
     except Exception as e:
         logger.error(f"❌ 截图失败: {e}")
@@ -0,0 +1,157 @@
+"""
+============================================
+屏幕稳定检测（代替操作后的固定等待）
+============================================
+这个文件负责判断"操作之后，界面是不是已经画完了"。
+
+以前每一步执行完操作都固定 `sleep(0.5)` 再截图：
+- 快的界面（点个按钮、输入几个字）几十毫秒就画完了，剩下的时间都在白等
+- 慢的界面（启动应用、加载网页）0.5 秒还没画完，截到的是半成品，
+  LLM 只能回一句"请稍等"，白白多花一次调用
+
+现在的做法（类比：等水烧开不是看钟，而是看水面有没有停止翻腾）：
+1. 操作之前先记一张低分辨率的"基准帧"
+2. 操作之后高频采样低分辨率帧（每次只取几万个像素，几毫秒）：
+   - 先等画面和基准帧不一样（界面开始响应）
+   - 再等画面连续 K 次采样都不变（界面画完了）
+3. 到了超时还在变化（比如有动画）就不再等；
+   一直没有变化（操作可能没生效）则最多等 `等待变化超时` 秒，和以前的固定等待一样长
+
+光标闪烁、很小的动画（几个像素）不算变化，见 `允许变化比例`。
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import numpy as np
+from loguru import logger
+
+from .screen import 全局截图会话, 截图转BGRA数组
+
+
+@dataclass
+class 稳定结果:
+    """一次等待的结果"""
+    稳定: bool          # 画面是否在超时前停止变化
+    有变化: bool        # 和基准帧相比画面有没有变化（没有基准帧时为 False）
+    耗时: float         # 等待的秒数
+    采样次数: int
+
+
+def 采样屏幕(采样宽度: int = 256) -> np.ndarray:
+    """
+    抓一帧并降采样成很小的灰度图（直接在 BGRA 缓冲区上跨步取样，不做缩放）
+
+    只取绿色通道：人眼对绿色最敏感，用它近似亮度足够判断"画面变没变"。
+    """
+    帧 = 截图转BGRA数组(全局截图会话.抓取())
+    步长 = max(1, 帧.shape[1] // 采样宽度)
+    return 帧[::步长, ::步长, 1].copy()
+
+
+class 屏幕稳定检测器:
+    """
+    等待屏幕在操作之后稳定下来
+
+    用法：
+        检测器 = 屏幕稳定检测器()
+        基准 = 检测器.采样()
+        ...执行操作...
+        结果 = 检测器.等待稳定(基准, 停止信号)   # 同步阻塞，在线程里调用
+    """
+
+    def __init__(
+        self,
+        采样间隔: float = 0.03,
+        连续稳定次数: int = 3,
+        超时: float = 3.0,
+        等待变化超时: float = 0.5,
+        像素阈值: int = 12,
+        允许变化比例: float = 0.002,
+        采样函数: Optional[Callable[[], np.ndarray]] = None
+    ):
+        """
+        参数:
+            采样间隔: 两次采样之间的秒数
+            连续稳定次数: 连续几次采样的画面都相同才算稳定
+            超时: 最多等待的秒数（有动画的界面永远不会"稳定"）
+            等待变化超时: 画面一直和基准帧一样时，最多等待的秒数
+            像素阈值: 亮度差超过多少才算这个像素变了（忽略压缩、抗锯齿带来的细微差别）
+            允许变化比例: 变化像素占比不超过这个值就算"没变"（光标闪烁、小动画）
+            采样函数: 返回一帧低分辨率灰度图，默认 `采样屏幕`
+        """
+        if 连续稳定次数 < 2:
+            raise ValueError("连续稳定次数必须 >= 2")
+        self.采样间隔 = 采样间隔
+        self.连续稳定次数 = 连续稳定次数
+        self.超时 = 超时
+        self.等待变化超时 = 等待变化超时
+        self.像素阈值 = 像素阈值
+        self.允许变化比例 = 允许变化比例
+        self.采样函数 = 采样函数 or 采样屏幕
+
+    def 采样(self) -> Optional[np.ndarray]:
+        """采一帧；截图失败时返回 None（调用方照常继续，只是没法判断稳定）"""
+        try:
+            return self.采样函数()
+        except Exception as e:
+            logger.debug(f"稳定检测采样失败: {e}")
+            return None
+
+    def 相同(self, 甲: np.ndarray, 乙: np.ndarray) -> bool:
+        """两帧是否可以看成同一个画面"""
+        if 甲.shape != 乙.shape:
+            return False  # 分辨率变了
+        差 = np.abs(甲.astype(np.int16) - 乙.astype(np.int16))
+        return np.count_nonzero(差 > self.像素阈值) <= self.允许变化比例 * 差.size
+
+    def 等待稳定(
+        self,
+        基准: Optional[np.ndarray] = None,
+        停止信号: Optional[threading.Event] = None
+    ) -> 稳定结果:
+        """
+        阻塞到画面稳定（或超时、或收到停止信号）
+
+        参数:
+            基准: 操作之前的画面；为 None 时不等待变化，只等画面不再变
+            停止信号: 设置后立刻返回
+        """
+        开始 = time.perf_counter()
+        上一帧 = self.采样()
+        if 上一帧 is None:
+            return 稳定结果(False, False, time.perf_counter() - 开始, 0)
+
+        采样次数 = 1
+        有变化 = 基准 is not None and not self.相同(上一帧, 基准)
+        相同次数 = 1
+
+        while True:
+            已等待 = time.perf_counter() - 开始
+            if 停止信号 is not None and 停止信号.is_set():
+                return 稳定结果(False, 有变化, 已等待, 采样次数)
+
+            if 相同次数 >= self.连续稳定次数:
+                if 有变化 or 基准 is None:
+                    return 稳定结果(True, 有变化, 已等待, 采样次数)
+                if 已等待 >= self.等待变化超时:
+                    return 稳定结果(True, False, 已等待, 采样次数)
+            if 已等待 >= self.超时:
+                logger.debug(f"⏳ 屏幕 {self.超时:.1f} 秒内没有稳定下来（可能有动画）")
+                return 稳定结果(False, 有变化, 已等待, 采样次数)
+
+            time.sleep(self.采样间隔)
+            帧 = self.采样()
+            if 帧 is None:
+                return 稳定结果(False, 有变化, time.perf_counter() - 开始, 采样次数)
+            采样次数 += 1
+
+            if self.相同(帧, 上一帧):
+                相同次数 += 1
+            else:
+                相同次数 = 1
+            if not 有变化 and 基准 is not None and not self.相同(帧, 基准):
+                有变化 = True
+            上一帧 = 帧
@@ -0,0 +1,328 @@
+"""
+============================================
+文字输入引擎（按长度和内容选择输入方式）
+============================================
+这个文件负责 `type` 操作"怎么把字打进去"。
+
+以前只有两种方式：
+- ASCII 用 `pyautogui.write(文字, interval=0.05)`，2000 个字符的表单要打 100 秒
+- 非 ASCII（中文等）复制到剪贴板再粘贴，而且会覆盖用户原来的剪贴板内容
+
+现在有三种可插拔的输入方式，引擎按文字的长度和内容挑选（类比：寄一封信走平邮，
+寄一箱书走快递，寄易碎品走专人配送）：
+1. 匀速输入（paced）：一个字符一个字符地打，字符之间有间隔。
+   最像真人，适合短文字和会丢按键的输入框
+2. XTest 连发（xtest）：通过 X11 的 XTest 扩展直接注入按键事件，字符之间不等待，
+   每批字符同步一次。只支持 Linux（X11/Xvfb）和键盘上能直接打出来的 ASCII 字符
+3. 剪贴板粘贴（clipboard）：复制到剪贴板，按一次粘贴快捷键，然后恢复原来的剪贴板内容。
+   任何文字都能用，长度不影响耗时
+
+默认规则：短 ASCII 文字用匀速输入；长文字依次尝试 XTest 连发 → 剪贴板粘贴 → 匀速输入。
+环境变量 TEXT_INPUT=xtest/clipboard/paced 可以固定优先使用某一种（auto 表示自动选择）。
+
+输入方式发现自己用不了（没有图形环境、缺少依赖、有打不出来的字符）时，
+会在发出任何按键之前抛出 `输入方式不可用`，引擎接着尝试下一种，不会重复输入。
+"""
+
+import os
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Iterable, Optional, Sequence
+
+from loguru import logger
+
+
+class 输入方式不可用(RuntimeError):
+    """当前环境或这段文字不能用这种方式输入（还没有发出任何按键）"""
+
+
+class 输入方式(ABC):
+    """
+    一种文字输入方式
+
+    子类需要设置 `名称`，并实现 `可用()` 和 `输入()`。
+    """
+
+    名称: str = ""
+
+    @abstractmethod
+    def 可用(self, 文字: str) -> bool:
+        """这段文字在当前环境下能不能用这种方式输入"""
+
+    @abstractmethod
+    def 输入(self, 文字: str, 停止信号: Optional[threading.Event] = None, 间隔: Optional[float] = None) -> int:
+        """
+        输入文字（同步阻塞，在动作执行器的线程里调用）
+
+        参数:
+            间隔: 逐字输入时字符之间的秒数，None 表示用这种方式自己的默认值（不逐字输入的方式忽略它）
+
+        返回:
+            实际输入的字符数（收到停止信号时可能少于文字长度）
+        """
+
+
+# ============================================
+# 内置输入方式
+# ============================================
+
+class 匀速输入(输入方式):
+    """
+    一个字符一个字符地输入，字符之间固定间隔
+
+    具体怎么按键由 `输入函数(文字, 间隔, 停止信号) -> 已输入字符数` 决定（见 tools/computer.py）。
+    """
+
+    名称 = "paced"
+
+    def __init__(self, 输入函数: Callable[[str, float, Optional[threading.Event]], int], 间隔: float = 0.05):
+        self.输入函数 = 输入函数
+        self.间隔 = 间隔
+
+    def 可用(self, 文字: str) -> bool:
+        return 文字.isascii()
+
+    def 输入(self, 文字: str, 停止信号: Optional[threading.Event] = None, 间隔: Optional[float] = None) -> int:
+        return self.输入函数(文字, self.间隔 if 间隔 is None else 间隔, 停止信号)
+
+
+class XTest连发(输入方式):
+    """
+    通过 XTest 扩展直接向 X 服务器注入按键事件
+
+    字符之间不等待，每 `每批字符数` 个字符调用一次 `sync()`（也在这时检查停止信号）。
+    X 连接只在动作执行器的线程里使用，第一次输入时才建立。
+    """
+
+    名称 = "xtest"
+
+    # 不能直接用字符编码当 keysym 的控制字符
+    _特殊键 = {"\n": 0xFF0D, "\t": 0xFF09}   # XK_Return, XK_Tab
+    _Shift键 = 0xFFE1                        # XK_Shift_L
+
+    def __init__(self, 每批字符数: int = 64):
+        self.每批字符数 = 每批字符数
+        self._显示 = None
+        self._连接失败: Optional[str] = None
+        self._键码缓存: dict[str, tuple[int, bool]] = {}
+
+    def _连接(self):
+        if self._显示 is not None:
+            return self._显示
+        if self._连接失败 is None:
+            self._连接失败 = self._尝试连接()
+        if self._连接失败:
+            raise 输入方式不可用(self._连接失败)
+        return self._显示
+
+    def _尝试连接(self) -> str:
+        """建立 X 连接，返回失败原因（成功时返回空字符串）"""
+        if not sys.platform.startswith("linux") or not os.environ.get("DISPLAY"):
+            return "XTest 只能在 X11 图形环境下使用"
+        try:
+            from Xlib import display
+        except ImportError:
+            return "XTest 输入需要 python-xlib"
+        try:
+            显示 = display.Display()
+        except Exception as e:
+            return f"无法连接 X 服务器: {e}"
+        if not 显示.has_extension("XTEST"):
+            显示.close()
+            return "X 服务器不支持 XTEST 扩展"
+        self._显示 = 显示
+        self._Shift键码 = 显示.keysym_to_keycode(self._Shift键)
+        logger.info(f"⌨️ XTest 输入已连接 {os.environ.get('DISPLAY')}")
+        return ""
+
+    def _键码(self, 字符: str) -> tuple[int, bool]:
+        """字符 → (键码, 是否需要按住 Shift)"""
+        if 字符 in self._键码缓存:
+            return self._键码缓存[字符]
+        显示 = self._连接()
+        if 字符 in self._特殊键:
+            keysym = self._特殊键[字符]
+        elif " " <= 字符 <= "~":
+            keysym = ord(字符)   # 可打印 ASCII 的 keysym 就是字符编码
+        else:
+            raise 输入方式不可用(f"XTest 打不出字符 {字符!r}")
+        键码 = 显示.keysym_to_keycode(keysym)
+        if not 键码:
+            raise 输入方式不可用(f"当前键盘布局里没有字符 {字符!r}")
+        结果 = (键码, 显示.keycode_to_keysym(键码, 0) != keysym)
+        self._键码缓存[字符] = 结果
+        return 结果
+
+    def 可用(self, 文字: str) -> bool:
+        if not 文字.isascii():
+            return False
+        try:
+            for 字符 in set(文字):
+                self._键码(字符)
+        except 输入方式不可用:
+            return False
+        return True
+
+    def 输入(self, 文字: str, 停止信号: Optional[threading.Event] = None, 间隔: Optional[float] = None) -> int:
+        from Xlib import X
+        from Xlib.ext import xtest
+
+        # 先把所有字符换成键码：有打不出来的字符时，一个键都还没按
+        键码列表 = [self._键码(字符) for 字符 in 文字]
+        显示 = self._显示
+        for 起点 in range(0, len(键码列表), self.每批字符数):
+            if 停止信号 is not None and 停止信号.is_set():
+                return 起点
+            for 键码, 按住Shift in 键码列表[起点:起点 + self.每批字符数]:
+                if 按住Shift:
+                    xtest.fake_input(显示, X.KeyPress, self._Shift键码)
+                xtest.fake_input(显示, X.KeyPress, 键码)
+                xtest.fake_input(显示, X.KeyRelease, 键码)
+                if 按住Shift:
+                    xtest.fake_input(显示, X.KeyRelease, self._Shift键码)
+            显示.sync()
+        return len(文字)
+
+
+class 剪贴板粘贴(输入方式):
+    """
+    复制到剪贴板后按一次粘贴快捷键，结束后恢复原来的剪贴板内容
+
+    粘贴是一次性的操作，中途不能被停止信号打断。
+    """
+
+    名称 = "clipboard"
+
+    def __init__(self, 粘贴函数: Callable[[], None], 恢复延迟: float = 0.15, 剪贴板=None):
+        """
+        参数:
+            粘贴函数: 按下粘贴快捷键（Ctrl+V / Command+V）
+            恢复延迟: 按下快捷键后等多久再恢复剪贴板。
+                目标程序收到快捷键后才去读剪贴板，恢复得太早会粘贴出原来的内容
+            剪贴板: 提供 copy()/paste() 的对象，默认使用 pyperclip
+        """
+        self.粘贴函数 = 粘贴函数
+        self.恢复延迟 = 恢复延迟
+        self._剪贴板 = 剪贴板
+
+    def _获取剪贴板(self):
+        if self._剪贴板 is None:
+            try:
+                import pyperclip
+            except ImportError:
+                raise 输入方式不可用("剪贴板输入需要 pyperclip")
+            self._剪贴板 = pyperclip
+        return self._剪贴板
+
+    def 可用(self, 文字: str) -> bool:
+        try:
+            self._获取剪贴板()
+        except 输入方式不可用:
+            return False
+        return True
+
+    def 输入(self, 文字: str, 停止信号: Optional[threading.Event] = None, 间隔: Optional[float] = None) -> int:
+        剪贴板 = self._获取剪贴板()
+        try:
+            原内容 = 剪贴板.paste()
+        except Exception as e:
+            # 没有剪贴板服务（例如缺少 xclip）：这时也没法复制，交给下一种方式
+            raise 输入方式不可用(f"无法读取剪贴板: {e}")
+
+        剪贴板.copy(文字)
+        try:
+            self.粘贴函数()
+            time.sleep(self.恢复延迟)
+        finally:
+            剪贴板.copy(原内容)
+        return len(文字)
+
+
+# ============================================
+# 引擎
+# ============================================
+
+class 文字输入引擎:
+    """
+    按文字的长度和内容选择输入方式
+
+    用法：
+        引擎 = 文字输入引擎([XTest连发(), 剪贴板粘贴(粘贴), 匀速输入(逐字输入)])
+        方式, 已输入 = 引擎.输入("hello", 停止信号)
+    """
+
+    def __init__(
+        self,
+        输入方式列表: Iterable[输入方式],
+        短文本上限: int = 32,
+        长文本顺序: Sequence[str] = ("xtest", "clipboard", "paced"),
+        优先方式: Optional[str] = None
+    ):
+        """
+        参数:
+            输入方式列表: 可以使用的输入方式
+            短文本上限: 不超过这么多字符的 ASCII 文字用匀速输入
+            长文本顺序: 其他文字依次尝试的输入方式
+            优先方式: 总是先尝试这种方式（例如会丢按键的程序固定用 "paced"）
+        """
+        self.输入方式表: dict[str, 输入方式] = {}
+        for 方式 in 输入方式列表:
+            self.注册(方式)
+        self.短文本上限 = 短文本上限
+        self.长文本顺序 = tuple(长文本顺序)
+        self.优先方式 = 优先方式
+
+    def 注册(self, 方式: 输入方式):
+        """注册（或替换）一种输入方式"""
+        self.输入方式表[方式.名称] = 方式
+
+    def _候选(self, 文字: str, 优先方式: Optional[str] = None) -> list[str]:
+        顺序 = list(self.长文本顺序)
+        if 文字.isascii() and len(文字) <= self.短文本上限:
+            顺序.insert(0, "paced")
+        if 优先方式 or self.优先方式:
+            顺序.insert(0, 优先方式 or self.优先方式)
+        return [名称 for 名称 in dict.fromkeys(顺序) if 名称 in self.输入方式表]
+
+    @staticmethod
+    def _没有可用方式(文字: str) -> str:
+        return "没有可用的文字输入方式" + ("" if 文字.isascii() else "（非 ASCII 文字需要 pyperclip）")
+
+    def 选择(self, 文字: str, 优先方式: Optional[str] = None) -> 输入方式:
+        """返回这段文字第一个可用的输入方式"""
+        for 名称 in self._候选(文字, 优先方式):
+            方式 = self.输入方式表[名称]
+            if 方式.可用(文字):
+                return 方式
+        raise 输入方式不可用(self._没有可用方式(文字))
+
+    def 输入(
+        self,
+        文字: str,
+        停止信号: Optional[threading.Event] = None,
+        间隔: Optional[float] = None,
+        优先方式: Optional[str] = None
+    ) -> tuple[str, int]:
+        """
+        输入文字；选中的方式在发出按键之前发现不可用时，换下一种
+
+        参数:
+            间隔: 逐字输入时字符之间的秒数（见 `输入方式.输入`）
+            优先方式: 这一次先尝试的输入方式（代替引擎的 `优先方式`）
+
+        返回:
+            (使用的输入方式名称, 实际输入的字符数)
+        """
+        原因 = self._没有可用方式(文字)
+        for 名称 in self._候选(文字, 优先方式):
+            方式 = self.输入方式表[名称]
+            if not 方式.可用(文字):
+                continue
+            try:
+                return 名称, 方式.输入(文字, 停止信号, 间隔)
+            except 输入方式不可用 as e:
+                原因 = str(e)
+                logger.debug(f"⌨️ 输入方式 {名称} 不可用（{e}），尝试下一种")
+        raise 输入方式不可用(原因)
@@ -107,7 +107,7 @@ interface 消息 {
 }
 
 interface 配置 {
-  provider: "openai" | "gemini" | "anthropic";
+  provider: "openai" | "gemini" | "anthropic" | "local";
   apiKey: string;
 }
 
@@ -394,6 +394,7 @@ const 连接WebSocket = useCallback(() => {
                       <SelectItem value="openai">OpenAI (GPT-4o)</SelectItem>
                       <SelectItem value="gemini">Google Gemini</SelectItem>
                       <SelectItem value="anthropic">Anthropic Claude</SelectItem>
+                      <SelectItem value="local">Local (OpenAI-compatible)</SelectItem>
                     </SelectContent>
                   </Select>
                 </div>